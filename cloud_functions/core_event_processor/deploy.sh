@@ -2,6 +2,11 @@
 
 # Deployment script for core event processor Cloud Function
 
+# Deploy from this directory, with the shared event package and schemas staged next to main.py
+cd "$(dirname "$0")"
+rm -rf salon_events pubsub_schemas
+cp -r ../../salon_events ../../pubsub_schemas .
+
 # Set variables
 PROJECT_ID="your-gcp-project-id"
 FUNCTION_NAME="core-event-processor"
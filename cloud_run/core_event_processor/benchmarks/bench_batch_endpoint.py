@@ -0,0 +1,81 @@
+"""
+Benchmark: events/sec through the Cloud Run processor, one push request per
+event (/process-event) vs. batches (/process-events).
+
+Run from cloud_run/core_event_processor:
+
+    PYTHONPATH=../.. python -m benchmarks.bench_batch_endpoint
+    PYTHONPATH=../.. python -m benchmarks.bench_batch_endpoint --events 20000 --batch-sizes 10,100,1000
+
+Requests go through Flask's test client, so the numbers include request
+parsing, routing and JSON handling but not the network round trip a real
+push pays on top, per request. Deduplication is off and logging is at
+WARNING so the handlers themselves cost next to nothing.
+"""
+
+import argparse
+import base64
+import logging
+import os
+import time
+
+os.environ.setdefault("EVENT_DEDUP_BACKEND", "off")
+
+from salon_events import build_event, encode_event  # noqa: E402
+from main import app  # noqa: E402
+
+
+def make_messages(n):
+    return [
+        {
+            "messageId": str(i),
+            "data": base64.b64encode(encode_event(build_event(
+                "booking_created", "1", "default", {"booking_id": f"b{i}", "customer_id": "c1"}
+            ))).decode("ascii"),
+        }
+        for i in range(n)
+    ]
+
+
+def single(client, messages):
+    for message in messages:
+        response = client.post("/process-event", json={"message": message, "subscription": "bench"})
+        assert response.status_code == 204, response.data
+    return len(messages)
+
+
+def batched(client, messages, size):
+    requests = 0
+    for start in range(0, len(messages), size):
+        response = client.post("/process-events", json={"messages": messages[start:start + size]})
+        assert response.status_code == 200, response.data
+        assert all(result["ack"] for result in response.get_json()["results"])
+        requests += 1
+    return requests
+
+
+def main(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    client = app.test_client()
+    messages = make_messages(args.events)
+    runs = [("/process-event", lambda: single(client, messages))]
+    for size in args.batch_sizes:
+        runs.append((f"/process-events x{size}", lambda size=size: batched(client, messages, size)))
+
+    header = f"{'endpoint':<22} {'events':>8} {'requests':>9} {'events/s':>10} {'us/event':>9}"
+    print(header)
+    print("-" * len(header))
+    for label, run in runs:
+        start = time.perf_counter()
+        requests = run()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<22} {args.events:>8} {requests:>9} {args.events / elapsed:>10.0f} "
+              f"{elapsed / args.events * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[10, 100, 1000])
+    main(parser.parse_args())
@@ -1,8 +1,11 @@
-import json
 import logging
-from typing import Dict, Any
+import os
 from flask import Flask, request
 
+from salon_events import DuplicateInFlight, EventValidationError
+from salon_events.core_processor import processor
+from salon_events.processing import EVENT_BATCH_MAX_MESSAGES
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,89 +17,70 @@ def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Dispatch counters and the dedup hit rate"""
+    return processor.stats()
+
 @app.route("/process-event", methods=["POST"])
 def process_event():
     """Endpoint to process Pub/Sub push messages"""
     try:
         # Get the Pub/Sub message
         envelope = request.get_json()
-        
+
         # Validate the envelope
         if not envelope:
             return {"error": "No Pub/Sub message received"}, 400
-        
+
         if "message" not in envelope:
             return {"error": "Invalid Pub/Sub message format"}, 400
-        
+
         # Extract the message data
         message = envelope["message"]
         if "data" not in message:
             return {"error": "No data in Pub/Sub message"}, 400
-        
-        # Decode and parse the message data
-        message_data = json.loads(message["data"])
-        
-        # Extract event details
-        event_type = message_data.get('type')
-        event_version = message_data.get('version')
-        correlation_id = message_data.get('correlation_id')
-        payload = message_data.get('payload', {})
-        
-        logger.info(f"Processing {event_type} v{event_version} event (correlation_id: {correlation_id})")
-        
-        # Process based on event type
-        if event_type == 'booking_created':
-            process_booking_created(payload, correlation_id)
-        elif event_type == 'customer_updated':
-            process_customer_updated(payload, correlation_id)
-        else:
-            logger.warning(f"Unknown event type: {event_type}")
-            
-        logger.info(f"Successfully processed event {event_type} (correlation_id: {correlation_id})")
-        
-        return ("", 204)  # Return 204 No Content for successful processing
-        
+
+        # Decode the base64 message data, JSON or compact, validate it against the envelope schema and run its handler
+        try:
+            processor.process_message(message["data"], message.get("messageId"), message.get("attributes"))
+        except EventValidationError as e:
+            logger.error(f"Invalid event in message {message.get('messageId')}: {e}")
+            return {"error": f"Invalid event: {e}"}, 400
+        except DuplicateInFlight as e:
+            # Any non-2xx response has Pub/Sub redeliver the message later
+            logger.info(str(e))
+            return {"error": str(e)}, 409
+
+        return ("", 204)  # Return 204 No Content for successful processing, duplicates included
+
     except Exception as e:
         logger.error(f"Error processing event: {e}", exc_info=True)
         return {"error": str(e)}, 500
 
-def process_booking_created(payload: Dict[str, Any], correlation_id: str):
-    """Process a booking created event"""
-    booking_id = payload.get('booking_id')
-    customer_id = payload.get('customer_id')
-    timestamp = payload.get('timestamp')
-    
-    logger.info(f"Booking created: {booking_id} for customer {customer_id} at {timestamp}")
-    
-    # Here you would implement the business logic for handling a booking creation
-    # This might include:
-    # - Sending notifications
-    # - Updating analytics
-    # - Triggering other workflows
-    # - etc.
-    
-    # Example: Send a notification
-    send_booking_notification(booking_id, customer_id)
-
-def process_customer_updated(payload: Dict[str, Any], correlation_id: str):
-    """Process a customer updated event"""
-    customer_id = payload.get('customer_id')
-    action = payload.get('action')
-    timestamp = payload.get('timestamp')
-    
-    logger.info(f"Customer {customer_id} updated with action {action} at {timestamp}")
-    
-    # Here you would implement the business logic for handling a customer update
-    # This might include:
-    # - Updating customer data in other systems
-    # - Sending notifications
-    # - Triggering other workflows
-    # - etc.
-
-def send_booking_notification(booking_id: str, customer_id: str):
-    """Send a notification about a booking creation"""
-    # This is a placeholder for the actual notification logic
-    logger.info(f"Sending notification for booking {booking_id} to customer {customer_id}")
+@app.route("/process-events", methods=["POST"])
+def process_events():
+    """
+    Endpoint to process a batch of Pub/Sub messages, e.g. from a bridge that
+    pulls a backlog and pushes it here.
+
+    Accepts {"messages": [...]} with Pub/Sub messages, or {"receivedMessages":
+    [...]} as returned by a pull, and returns a result per message, in order,
+    telling the caller which to ack and which to nack.
+    """
+    body = request.get_json(silent=True) or {}
+    messages = body.get("messages", body.get("receivedMessages"))
+    if not isinstance(messages, list):
+        return {"error": "Expected a list of messages or receivedMessages"}, 400
+    if len(messages) > EVENT_BATCH_MAX_MESSAGES:
+        return {"error": f"At most {EVENT_BATCH_MAX_MESSAGES} messages per request"}, 413
+    if not all(isinstance(message, dict) for message in messages):
+        return {"error": "Invalid Pub/Sub message format"}, 400
+
+    results = processor.process_batch(messages)
+    acked = sum(1 for result in results if result["ack"])
+    logger.info(f"Processed batch of {len(results)} messages ({acked} acked, {len(results) - acked} nacked)")
+    return {"results": results}
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
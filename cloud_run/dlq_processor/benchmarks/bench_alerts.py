@@ -0,0 +1,104 @@
+"""
+Benchmark: emails, SMTP connections and time per message for a poison
+message burst through the DLQ processor, with one alert per message vs.
+aggregated digests.
+
+Run from cloud_run/dlq_processor:
+
+    PYTHONPATH=../.. python -m benchmarks.bench_alerts
+    PYTHONPATH=../.. python -m benchmarks.bench_alerts --events 20000 --groups 5
+
+The burst is ``--events`` dead-lettered events of ``--groups`` event types
+(at most 5), so as many digests, pushed to /process-dlq-message through Flask's
+test client. Alerts go to the local SMTP stand-in (salon_events.fake_smtp),
+so the SMTP numbers leave out the network round trips and TLS handshakes a
+real server adds per connection.
+
+"per message" is what the processor did for each message, with its email
+placeholder filled in: log the message as indented JSON and send an email
+on a connection of its own. It is timed without the request handling,
+which "digest" includes: each message pushed to the endpoint and recorded
+in the aggregator, and the digests sent with one flush at the end.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import smtplib
+import time
+
+from salon_events.fake_smtp import FakeSMTPServer
+
+server = FakeSMTPServer().start()
+os.environ.update(SMTP_SERVER=server.host, SMTP_PORT=str(server.port), SMTP_STARTTLS="false",
+                  ALERT_WINDOW_SECONDS="3600", DLQ_STORE_PATH=":memory:")
+
+from salon_events import build_event, encode_event  # noqa: E402
+from main import aggregator, app  # noqa: E402
+
+
+EVENT_TYPES = ["booking_created", "booking_updated", "booking_cancelled", "customer_created", "customer_updated"]
+
+
+def make_messages(n, groups):
+    return [
+        {
+            "messageId": str(i),
+            "data": base64.b64encode(encode_event(build_event(EVENT_TYPES[i % groups], "1", f"tenant-{i % 50}", {
+                "booking_id": f"b{i}", "service_id": "service_123", "customer_name": "John Doe",
+                "date": "2025-08-07", "time": "10:00",
+            }))).decode("ascii"),
+            "attributes": {"CloudPubSubDeadLetterSourceSubscription": "core-api-v1-events",
+                           "CloudPubSubDeadLetterSourceDeliveryCount": "5"},
+        }
+        for i in range(n)
+    ]
+
+
+def per_message(messages):
+    """One email per message on its own connection, after logging it as indented JSON"""
+    logger = logging.getLogger("bench")
+    for message in messages:
+        data = json.loads(base64.b64decode(message["data"]))
+        logger.error(f"Failed message details: {json.dumps(data, indent=2)}")
+        logger.error(f"Message attributes: {json.dumps(message['attributes'], indent=2)}")
+        smtp = smtplib.SMTP(server.host, server.port)
+        smtp.sendmail("dlq-processor@localhost", ["admin@example.com"],
+                      f"Subject: ALERT: Failed Event Processing\r\n\r\n{json.dumps(data, indent=2)}")
+        smtp.quit()
+
+
+def digest(client, messages):
+    for message in messages:
+        response = client.post("/process-dlq-message", json={"message": message, "subscription": "bench"})
+        assert response.status_code == 204, response.data
+    aggregator.flush()
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)
+    client = app.test_client()
+    messages = make_messages(args.events, args.groups)
+
+    header = f"{'alerts':<12} {'messages':>9} {'emails':>7} {'connections':>12} {'msgs/s':>8} {'us/msg':>8}"
+    print(header)
+    print("-" * len(header))
+    for label, run in (("per message", lambda: per_message(messages)), ("digest", lambda: digest(client, messages))):
+        emails, connections = len(server.messages), server.connections
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<12} {args.events:>9} {len(server.messages) - emails:>7} "
+              f"{server.connections - connections:>12} {args.events / elapsed:>8.0f} "
+              f"{elapsed / args.events * 1e6:>8.1f}")
+    aggregator.close()
+    server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=3, choices=range(1, len(EVENT_TYPES) + 1))
+    main(parser.parse_args())
@@ -3,10 +3,20 @@
 # Exit on any error
 set -e
 
+# Deploy from this directory, with the shared event package and schemas staged next to main.py
+cd "$(dirname "$0")"
+rm -rf salon_events pubsub_schemas
+cp -r ../../salon_events ../../pubsub_schemas .
+
 # Set variables
 PROJECT_ID="salon-autonomous-ai-467811"
 SERVICE_NAME="dlq-processor"
 REGION="asia-south1"
+# Filestore share holding the parked message store, and the service account
+# Pub/Sub push subscriptions authenticate as
+FILESTORE_IP="10.0.0.2"
+FILESTORE_SHARE="/dlq"
+PUSH_SERVICE_ACCOUNT="dlq-push@$PROJECT_ID.iam.gserviceaccount.com"
 
 # Build the Docker image
 echo "Building Docker image..."
@@ -16,8 +26,18 @@ docker build -t gcr.io/$PROJECT_ID/$SERVICE_NAME .
 echo "Pushing Docker image to GCR..."
 docker push gcr.io/$PROJECT_ID/$SERVICE_NAME
 
-# Deploy the service to Cloud Run
+# Deploy the service to Cloud Run. Alert digests are sent by a background
+# thread between requests, so the CPU must stay allocated, and one instance
+# keeps every parked message in one store, on a Filestore volume so they
+# survive restarts. SQLite on NFS is only safe with a single writer: the
+# store uses a rollback journal there (WAL needs a local disk) and relies on
+# NFS locks only for the brief overlap of two revisions during a rollout.
+# The DLQ endpoints can replay messages, so only callers granted
+# roles/run.invoker may reach the service.
 echo "Deploying service to Cloud Run..."
-gcloud run deploy $SERVICE_NAME   --image gcr.io/$PROJECT_ID/$SERVICE_NAME   --platform managed   --region $REGION   --allow-unauthenticated   --set-env-vars ALERT_EMAIL=admin@example.com,SMTP_SERVER=smtp.example.com,SMTP_PORT=587,SMTP_USER=user@example.com,SMTP_PASSWORD=password
+gcloud run deploy $SERVICE_NAME   --image gcr.io/$PROJECT_ID/$SERVICE_NAME   --platform managed   --region $REGION   --no-allow-unauthenticated   --no-cpu-throttling   --max-instances 1   --execution-environment gen2   --add-volume name=dlq-store,type=nfs,location=$FILESTORE_IP:$FILESTORE_SHARE   --add-volume-mount volume=dlq-store,mount-path=/mnt/dlq   --set-env-vars ALERT_WINDOW_SECONDS=60,PROJECT_ID=$PROJECT_ID,DLQ_STORE_PATH=/mnt/dlq/dlq.sqlite3,ALERT_EMAIL=admin@example.com,SMTP_SERVER=smtp.example.com,SMTP_PORT=587,SMTP_USER=user@example.com,SMTP_PASSWORD=password
+
+# Let the push subscriptions deliver dead-lettered messages
+gcloud run services add-iam-policy-binding $SERVICE_NAME   --region $REGION   --member serviceAccount:$PUSH_SERVICE_ACCOUNT   --role roles/run.invoker
 
 echo "Deployment completed successfully!"
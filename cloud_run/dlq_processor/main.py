@@ -1,11 +1,23 @@
-import json
+import atexit
+import base64
+import binascii
 import logging
-from typing import Dict, Any
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Mapping, Optional, Tuple
 from flask import Flask, request
-from google.cloud import pubsub_v1
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+
+from salon_events import EventValidationError, decode_event, loads, message_encoding
+from salon_events.alerts import AlertAggregator, SMTPDigestSender
+from salon_events.dlq import (
+    DLQ_QUERY_MAX_LIMIT,
+    DLQFilter,
+    DLQReplayer,
+    ParkedMessage,
+    SQLiteDLQStore,
+    decode_cursor,
+    encode_cursor,
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,12 +31,33 @@ SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.example.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
 SMTP_USER = os.environ.get("SMTP_USER", "user@example.com")
 SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "password")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true").lower() == "true"
+PROJECT_ID = os.environ.get("PROJECT_ID", "your-gcp-project-id")
+
+# Failures are grouped by (type, version, error signature) and sent as one
+# digest per group every ALERT_WINDOW_SECONDS, over one SMTP connection
+aggregator = AlertAggregator(SMTPDigestSender(
+    SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, recipients=[ALERT_EMAIL], starttls=SMTP_STARTTLS,
+))
+aggregator.start()
+atexit.register(aggregator.close)
+
+# Failed messages are parked in an indexed store until they are replayed to
+# their original topics, at DLQ_REPLAY_RATE messages per second. Fails at
+# startup unless DLQ_STORE_PATH names a database on a durable volume
+store = SQLiteDLQStore()
+replayer = DLQReplayer(store, None, PROJECT_ID)
 
 @app.route("/", methods=["GET"])
 def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Alert aggregation counters and parked message counts"""
+    return {"alerts": aggregator.stats(), "parked": store.stats()}
+
 @app.route("/process-dlq-message", methods=["POST"])
 def process_dlq_message():
     """Endpoint to process Pub/Sub DLQ messages"""
@@ -44,27 +77,33 @@ def process_dlq_message():
         if "data" not in message:
             return {"error": "No data in Pub/Sub message"}, 400
 
-        # Decode and parse the message data
-        message_data = json.loads(message["data"])
+        # Decode the base64 message data, JSON or compact; a message may have
+        # been dead-lettered because it is not a valid event
+        attributes = message.get("attributes") or {}
+        message_id = message.get("messageId")
+        raw, message_data, error = read_failed_message(message["data"], attributes)
 
         # Extract event details
         event_type = message_data.get('type')
         event_version = message_data.get('version')
         correlation_id = message_data.get('correlation_id')
-        payload = message_data.get('payload', {})
+        subscription = attributes.get("CloudPubSubDeadLetterSourceSubscription")
+        delivery_count = attributes.get("CloudPubSubDeadLetterSourceDeliveryCount")
 
-        logger.warning(f"Processing DLQ message for {event_type} v{event_version} event (correlation_id: {correlation_id})")
+        logger.warning(f"Processing DLQ message {message_id} for {event_type} v{event_version} event "
+                       f"(correlation_id: {correlation_id}, subscription: {subscription}, "
+                       f"delivery attempts: {delivery_count})")
 
-        # Log the failed message for debugging
-        log_failed_message(message_data, message.get("attributes", {}))
+        # Count the failure towards its group's alert digest
+        aggregator.record(
+            event_type, event_version, error or f"failed processing in {subscription or 'unknown subscription'}",
+            message_id=message_id, tenant_id=message_data.get('tenant_id'), subscription=subscription,
+            delivery_attempt=int(delivery_count) if delivery_count and delivery_count.isdigit() else None,
+            sample={"message_id": message_id, "attributes": attributes, "data": message_data},
+        )
 
-        # Send alert for the failed message
-        send_alert(message_data, correlation_id)
-
-        # For manual intervention, we could store the message in a database
-        # or send it to another topic for manual processing
-        # This is a placeholder for that functionality
-        store_for_manual_intervention(message_data, correlation_id)
+        # Park the message for manual intervention and replay
+        store_for_manual_intervention(raw, attributes, message_data, message_id, message.get("orderingKey"), error)
 
         logger.info(f"Successfully processed DLQ message for event {event_type} (correlation_id: {correlation_id})")
 
@@ -74,74 +113,151 @@ def process_dlq_message():
         logger.error(f"Error processing DLQ message: {e}", exc_info=True)
         return {"error": str(e)}, 500
 
-def log_failed_message(message_data: Dict[str, Any], attributes: Dict[str, str]):
-    """Log the failed message for debugging purposes"""
-    logger.error(f"Failed message details: {json.dumps(message_data, indent=2)}")
-    logger.error(f"Message attributes: {json.dumps(attributes, indent=2)}")
+def read_failed_message(data: str, attributes: Dict[str, str]) -> Tuple[bytes, Dict[str, Any], Optional[str]]:
+    """
+    Decode a dead-lettered message's data.
 
-def send_alert(message_data: Dict[str, Any], correlation_id: str):
-    """Send an alert about the failed message"""
+    Returns:
+        The raw data, the event and None; or for data that is not a valid
+        event, whatever could be read of it and the validation error
+    """
     try:
-        event_type = message_data.get('type', 'Unknown')
-        event_version = message_data.get('version', 'Unknown')
-        tenant_id = message_data.get('tenant_id', 'Unknown')
-
-        subject = f"ALERT: Failed Event Processing - {event_type} v{event_version}"
-        body = f"""
-A message has failed to process after maximum retry attempts and has been moved to the Dead Letter Queue.
-
-Event Type: {event_type}
-Event Version: {event_version}
-Tenant ID: {tenant_id}
-Correlation ID: {correlation_id}
-
-Please investigate this issue as soon as possible.
-
-Message payload:
-{json.dumps(message_data, indent=2)}
-        """
-
-        # Send email alert (in a real implementation, you would use a proper email service)
-        logger.info(f"Sending alert for failed message: {subject}")
-        # send_email_alert(subject, body)
-
-        # In a production environment, you might also send alerts to:
-        # - Slack/Teams channels
-        # - PagerDuty
-        # - Cloud Monitoring alerts
-
-    except Exception as e:
-        logger.error(f"Error sending alert: {e}", exc_info=True)
-
-def store_for_manual_intervention(message_data: Dict[str, Any], correlation_id: str):
-    """Store the failed message for manual intervention"""
-    # In a real implementation, you would store this in a database
-    # or send it to another topic for manual processing
-    logger.info(f"Storing message for manual intervention (correlation_id: {correlation_id})")
-
-    # Example: Send to a manual intervention topic
-    # publish_to_manual_intervention_topic(message_data, correlation_id)
-
-def send_email_alert(subject: str, body: str):
-    """Send an email alert (placeholder implementation)"""
-    # This is a placeholder for the actual email sending logic
-    # In a real implementation, you would use a proper email service
-    # like SendGrid, Mailgun, or SMTP
-
-    # Example implementation using SMTP:
-    # msg = MIMEMultipart()
-    # msg["From"] = SMTP_USER
-    # msg["To"] = ALERT_EMAIL
-    # msg["Subject"] = subject
-    # msg.attach(MIMEText(body, "plain"))
-    # 
-    # server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-    # server.starttls()
-    # server.login(SMTP_USER, SMTP_PASSWORD)
-    # server.send_message(msg)
-    # server.quit()
-
-    pass
+        raw = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError) as e:
+        return str(data).encode("utf-8"), {"raw": str(data)[:200]}, f"data is not valid base64: {e}"
+    try:
+        return raw, decode_event(raw, encoding=message_encoding(attributes)), None
+    except EventValidationError as e:
+        error = f"invalid event: {e}"
+    try:
+        partial = loads(raw)
+    except ValueError:
+        partial = None
+    if not isinstance(partial, dict):
+        partial = {"raw": base64.b64encode(raw[:150]).decode("ascii")}
+    return raw, partial, error
+
+def store_for_manual_intervention(data: bytes, attributes: Dict[str, str], message_data: Dict[str, Any],
+                                  message_id: Optional[str], ordering_key: Optional[str], error: Optional[str]):
+    """Park the failed message, indexed by correlation ID, event type and version, tenant and failure time"""
+    parked = store.park(ParkedMessage.new(data, attributes, message_data, message_id, ordering_key or "", error))
+    if parked:
+        logger.info(f"Parked message {message_id} for manual intervention "
+                    f"(correlation_id: {message_data.get('correlation_id')})")
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    """Seconds since the epoch, from seconds or an ISO 8601 time"""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+def parse_filter(params: Mapping[str, Any]) -> DLQFilter:
+    """
+    A DLQFilter from query parameters or a replay request's "filter": type,
+    version, tenant_id, correlation_id, failed_after and failed_before (epoch
+    seconds or ISO 8601) and replayed (true or false).
+
+    Raises:
+        ValueError: If a time or ``replayed`` is not valid
+    """
+    replayed = params.get("replayed")
+    if isinstance(replayed, str):
+        if replayed.lower() not in ("true", "false"):
+            raise ValueError(f"replayed must be true or false, not {replayed!r}")
+        replayed = replayed.lower() == "true"
+    return DLQFilter(
+        correlation_id=params.get("correlation_id"),
+        event_type=params.get("type"),
+        event_version=params.get("version"),
+        tenant_id=params.get("tenant_id"),
+        failed_after=_timestamp(params.get("failed_after")),
+        failed_before=_timestamp(params.get("failed_before")),
+        replayed=replayed,
+    )
+
+@app.route("/dlq/messages", methods=["GET"])
+def list_parked_messages():
+    """
+    Parked messages matching the query parameters (see parse_filter), oldest
+    failure first, ``limit`` per page. Pass the returned ``next_cursor`` as
+    ``cursor`` for the next page; it is null on the last one.
+    """
+    try:
+        where = parse_filter(request.args)
+        after = decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+        limit = int(request.args.get("limit", "100"))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if not 0 < limit <= DLQ_QUERY_MAX_LIMIT:
+        return {"error": f"limit must be between 1 and {DLQ_QUERY_MAX_LIMIT}"}, 400
+
+    messages = store.query(where, after, limit)
+    return {
+        "messages": [parked.to_dict() for parked in messages],
+        "next_cursor": encode_cursor(messages[-1]) if len(messages) == limit else None,
+    }
+
+@app.route("/dlq/messages/<int:parked_id>", methods=["GET"])
+def get_parked_message(parked_id: int):
+    """One parked message"""
+    parked = store.get(parked_id)
+    if parked is None:
+        return {"error": f"Parked message {parked_id} not found"}, 404
+    return parked.to_dict()
+
+@app.route("/dlq/replay", methods=["POST"])
+def start_replay():
+    """
+    Replay parked messages to their original topics in the background.
+
+    Accepts {"filter": {...}} (see parse_filter; {} selects every message)
+    and/or {"ids": [...]}, with optional "rate" (messages per second) and
+    "batch_size". Messages already replayed are skipped unless the filter
+    sets "replayed". Returns the job, to poll at /dlq/replay/<job_id>.
+    """
+    body = request.get_json(silent=True) or {}
+    if "filter" not in body and "ids" not in body:
+        return {"error": "Select the messages to replay with a filter or ids"}, 400
+    ids = body.get("ids")
+    if ids is not None and not (isinstance(ids, list) and all(isinstance(i, int) for i in ids)):
+        return {"error": "ids must be a list of parked message IDs"}, 400
+    try:
+        where = parse_filter(body.get("filter") or {})
+        if where.replayed is None:
+            where = where._replace(replayed=False)
+        job = replayer.replay(where, ids, rate=body.get("rate"), batch_size=body.get("batch_size"))
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}, 400
+    logger.warning(f"Started DLQ replay {job.id}: filter {where._asdict()}, {len(ids) if ids else 'all'} ids")
+    return job.to_dict(), 202
+
+@app.route("/dlq/replay", methods=["GET"])
+def list_replays():
+    """Replay jobs since the service started"""
+    return {"jobs": [job.to_dict() for job in replayer.jobs()]}
+
+@app.route("/dlq/replay/<job_id>", methods=["GET"])
+def get_replay(job_id: str):
+    """Progress of a replay job"""
+    job = replayer.job(job_id)
+    if job is None:
+        return {"error": f"Replay {job_id} not found"}, 404
+    return job.to_dict()
+
+@app.route("/dlq/replay/<job_id>/cancel", methods=["POST"])
+def cancel_replay(job_id: str):
+    """Stop a replay job after its current batch"""
+    job = replayer.job(job_id)
+    if job is None:
+        return {"error": f"Replay {job_id} not found"}, 404
+    job.cancel()
+    return job.to_dict(), 202
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
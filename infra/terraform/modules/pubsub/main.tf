@@ -21,6 +21,9 @@ resource "google_pubsub_subscription" "subs" {
   name  = replace(each.key, ".", "-")
   topic = each.value.name
 
+  # Deliver messages with the same ordering key in publish order
+  enable_message_ordering = true
+
   dead_letter_policy {
     dead_letter_topic     = google_pubsub_topic.dlq_topics[each.key].id
     max_delivery_attempts = 5
@@ -0,0 +1,39 @@
+"""
+Event envelope schema, validation and JSON or compact binary encoding,
+version-compatible dispatch, redelivery deduplication and the handler
+registry, shared by the core-api producer and consumer and the Cloud Run /
+Cloud Functions event processors.
+"""
+
+from .codec import CODEC, dumps, loads
+from .dedup import (
+    DUPLICATE,
+    IN_FLIGHT,
+    NEW,
+    DedupStore,
+    Deduplicator,
+    DuplicateInFlight,
+    MemoryDedupStore,
+    SharedMemoryDedupStore,
+    SQLiteDedupStore,
+    get_deduplicator,
+)
+from .dispatch import DispatchTable, ParkingLot, Route, VersionSpec, parse_version
+from .compact import CompactCodec, get_compact_codec
+from .envelope import (
+    COMPACT,
+    DEFAULT_DOMAIN,
+    DEFAULT_VERSION,
+    ENCODING_ATTRIBUTE,
+    ENCODINGS,
+    EVENT_ENCODING,
+    JSON,
+    build_event,
+    decode_base64_event,
+    decode_event,
+    detect_encoding,
+    encode_event,
+    message_encoding,
+)
+from .processing import FAILED, INVALID, PROCESSED, UNHANDLED, EventProcessor
+from .schema import EventValidationError, compile_schema, get_validator, load_schema
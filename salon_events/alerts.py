@@ -0,0 +1,364 @@
+"""
+Aggregated alerts for dead-lettered messages.
+
+A poison message burst dead-letters thousands of messages with the same
+failure within seconds; one email each would flood the inbox and open as
+many SMTP connections. AlertAggregator instead groups failures by
+(event type, version, error signature) and, once per window, sends one
+digest per group with the count, the tenants and subscriptions affected
+and a few sample messages:
+
+    aggregator = AlertAggregator(SMTPDigestSender(...))
+    aggregator.start()
+    aggregator.record(event_type, version, error, message_id=..., sample=...)
+
+Recording a message costs a dict lookup and a few counter updates; only the
+samples of each group are kept, and formatted at flush time. Redeliveries
+of a message already recorded (push subscriptions deliver at least once)
+are not counted again. SMTPDigestSender sends all of a window's digests
+over one SMTP connection, kept open between windows while the server
+allows it.
+"""
+
+import json
+import logging
+import os
+import re
+import smtplib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How long failures are collected before their digests are sent
+ALERT_WINDOW_SECONDS = float(os.getenv("ALERT_WINDOW_SECONDS", "60"))
+# Sample messages kept, and shown, per digest
+ALERT_MAX_SAMPLES = int(os.getenv("ALERT_MAX_SAMPLES", "3"))
+# Distinct groups per window; further failures are counted in an overflow group
+ALERT_MAX_GROUPS = int(os.getenv("ALERT_MAX_GROUPS", "100"))
+# Digests kept for the next window when sending fails
+ALERT_MAX_PENDING = int(os.getenv("ALERT_MAX_PENDING", "500"))
+
+# Tenants and subscriptions listed per digest
+_MAX_LISTED = 20
+# Recently recorded message IDs remembered to skip redeliveries
+_RECENT_MESSAGE_IDS = 10000
+# Error text longer than this is cut before it is normalized
+_MAX_ERROR_LENGTH = 200
+OVERFLOW_SIGNATURE = "(other errors)"
+
+_VOLATILE = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"  # UUIDs
+    r"|\b0x[0-9a-fA-F]+\b"                                                          # addresses
+    r"|'[^']*'|\"[^\"]*\""                                                          # quoted values
+    r"|(?<![A-Za-z])\d+"                                                            # numbers, but not the 64 of base64
+)
+
+
+def error_signature(error: Optional[str]) -> str:
+    """
+    The part of an error message that identifies the failure: IDs, numbers
+    and quoted values are replaced with placeholders, so the same failure of
+    different messages gets the same signature.
+    """
+    if not error:
+        return "unknown error"
+    error = error[:_MAX_ERROR_LENGTH]
+    return _VOLATILE.sub(lambda match: "'*'" if match.group()[0] in "'\"" else "#", error).strip()
+
+
+class _Group:
+    __slots__ = ("count", "first_seen", "last_seen", "tenants", "subscriptions", "max_attempts", "samples")
+
+    def __init__(self, now: float):
+        self.count = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.tenants: Dict[str, int] = {}
+        self.subscriptions: Dict[str, int] = {}
+        self.max_attempts = 0
+        self.samples: List[Dict[str, Any]] = []
+
+
+def _tally(counts: Dict[str, int], value: Optional[str]):
+    if value is None:
+        return
+    if value in counts:
+        counts[value] += 1
+    elif len(counts) < _MAX_LISTED:
+        counts[value] = 1
+
+
+class Digest:
+    """The failures of one group in one window"""
+
+    def __init__(self, key: Tuple[str, str, str], group: _Group):
+        self.event_type, self.version, self.signature = key
+        self.count = group.count
+        self.first_seen = group.first_seen
+        self.last_seen = group.last_seen
+        self.tenants = group.tenants
+        self.subscriptions = group.subscriptions
+        self.max_attempts = group.max_attempts
+        self.samples = group.samples
+
+    @property
+    def subject(self) -> str:
+        noun = "message" if self.count == 1 else "messages"
+        return (f"ALERT: {self.count} dead-lettered {noun} - {self.event_type} v{self.version}: "
+                f"{self.signature[:80]}")
+
+    def body(self) -> str:
+        def when(timestamp):
+            return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+        def listed(counts):
+            return ", ".join(f"{value} ({n})" for value, n in counts.items()) or "-"
+
+        noun = "message" if self.count == 1 else "messages"
+        lines = [
+            f"{self.count} {noun} reached the Dead Letter Queue after failing to process "
+            f"within the maximum number of delivery attempts.",
+            "",
+            f"Event Type: {self.event_type}",
+            f"Event Version: {self.version}",
+            f"Error: {self.signature}",
+            f"First Seen: {when(self.first_seen)}",
+            f"Last Seen: {when(self.last_seen)}",
+            f"Tenants: {listed(self.tenants)}",
+            f"Subscriptions: {listed(self.subscriptions)}",
+        ]
+        if self.max_attempts:
+            lines.append(f"Delivery Attempts: up to {self.max_attempts}")
+        lines += ["", "Please investigate this issue as soon as possible."]
+        for i, sample in enumerate(self.samples, 1):
+            lines += ["", f"Sample {i} of {self.count}:", json.dumps(sample, indent=2, default=str)]
+        return "\n".join(lines) + "\n"
+
+
+class AlertAggregator:
+    """
+    Groups dead-lettered messages by (event type, version, error signature)
+    and sends one digest per group per window.
+
+    Digests are sent by the background thread started with ``start``, or by
+    calling ``flush``. Digests that could not be sent are retried with the
+    next window's, up to ALERT_MAX_PENDING.
+    """
+
+    def __init__(self, sender: "SMTPDigestSender", window_seconds: float = ALERT_WINDOW_SECONDS,
+                 max_samples: int = ALERT_MAX_SAMPLES, max_groups: int = ALERT_MAX_GROUPS,
+                 max_pending: int = ALERT_MAX_PENDING):
+        self.sender = sender
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self.max_groups = max_groups
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._groups: Dict[Tuple[str, str, str], _Group] = {}
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._pending: List[Digest] = []
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.duplicates = 0
+        self.digests_sent = 0
+        self.digests_dropped = 0
+
+    def record(self, event_type: Optional[str], version: Optional[str], error: Optional[str],
+               message_id: Optional[str] = None, tenant_id: Optional[str] = None,
+               subscription: Optional[str] = None, delivery_attempt: Optional[int] = None,
+               sample: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Count a dead-lettered message in its group.
+
+        Args:
+            error: The failure, reduced to its ``error_signature``
+            sample: The message as shown in the digest, kept only while the
+                group has fewer than ``max_samples``
+
+        Returns:
+            False if the message ID was already recorded
+        """
+        signature = error_signature(error)
+        key = (event_type or "unknown", version or "?", signature)
+        now = time.time()
+        with self._lock:
+            if message_id is not None:
+                if message_id in self._recent:
+                    self.duplicates += 1
+                    return False
+                self._recent[message_id] = None
+                if len(self._recent) > _RECENT_MESSAGE_IDS:
+                    self._recent.popitem(last=False)
+            group = self._groups.get(key)
+            if group is None:
+                if len(self._groups) >= self.max_groups:
+                    key = (key[0], key[1], OVERFLOW_SIGNATURE)
+                    group = self._groups.get(key)
+                if group is None:
+                    group = self._groups[key] = _Group(now)
+            group.count += 1
+            group.last_seen = now
+            _tally(group.tenants, tenant_id)
+            _tally(group.subscriptions, subscription)
+            if delivery_attempt and delivery_attempt > group.max_attempts:
+                group.max_attempts = delivery_attempt
+            if sample is not None and len(group.samples) < self.max_samples:
+                group.samples.append(sample)
+            self.recorded += 1
+        return True
+
+    def flush(self) -> int:
+        """Send the digests of the failures recorded so far; returns how many were sent"""
+        with self._lock:
+            groups, self._groups = self._groups, {}
+        with self._flush_lock:
+            digests = self._pending + [Digest(key, group) for key, group in groups.items()]
+            self._pending = []
+            if not digests:
+                return 0
+            sent = self.sender.send(self._message(digest) for digest in digests)
+            self.digests_sent += sent
+            unsent = digests[sent:]
+            dropped = max(0, len(unsent) - self.max_pending)
+            if dropped:
+                logger.error(f"Dropping {dropped} alert digests that could not be sent")
+                self.digests_dropped += dropped
+            self._pending = unsent[dropped:]
+            return sent
+
+    def _message(self, digest: Digest) -> EmailMessage:
+        logger.warning(f"Sending alert digest: {digest.subject}")
+        return self.sender.build_message(digest.subject, digest.body())
+
+    def start(self):
+        """Start sending digests every ``window_seconds`` on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alert-aggregator", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.window_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing alert digests: {e}", exc_info=True)
+
+    def close(self):
+        """Stop the background thread, send what is left and close the SMTP connection"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.sender.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "duplicates": self.duplicates,
+                "open_groups": len(self._groups),
+                "pending_digests": len(self._pending),
+                "digests_sent": self.digests_sent,
+                "digests_dropped": self.digests_dropped,
+                "smtp_connections": self.sender.connections,
+            }
+
+
+class SMTPDigestSender:
+    """
+    Sends alert emails over one reused SMTP connection.
+
+    The connection is opened on the first send and kept between calls; it
+    is checked with NOOP before reuse, and reopened once if the server has
+    closed it.
+    """
+
+    def __init__(self, host: str, port: int = 587, user: Optional[str] = None, password: Optional[str] = None,
+                 sender: Optional[str] = None, recipients: Sequence[str] = (), starttls: bool = True,
+                 timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender or user or "dlq-processor@localhost"
+        self.recipients = list(recipients)
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._lock = threading.Lock()
+        self.connections = 0
+
+    def build_message(self, subject: str, body: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message["Subject"] = subject
+        message.set_content(body)
+        return message
+
+    def send(self, messages: Iterable[EmailMessage]) -> int:
+        """
+        Send messages in order over the shared connection, reconnecting once
+        if the server drops it.
+
+        Returns:
+            The number sent; sending stops, and the error is logged, at the
+            first message that could not be sent
+        """
+        sent = 0
+        with self._lock:
+            try:
+                smtp = self._connection()
+                for message in messages:
+                    try:
+                        smtp.send_message(message)
+                    except smtplib.SMTPServerDisconnected:
+                        self._disconnect()
+                        smtp = self._connection()
+                        smtp.send_message(message)
+                    sent += 1
+            except (smtplib.SMTPException, OSError) as e:
+                logger.error(f"Error sending alert email to {self.host}:{self.port}: {e}")
+                self._disconnect()
+        return sent
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            self._disconnect()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.connections += 1
+        self._smtp = smtp
+        return smtp
+
+    def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
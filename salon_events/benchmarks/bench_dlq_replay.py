@@ -0,0 +1,130 @@
+"""
+Benchmark: parking, querying and replaying dead-lettered messages with the
+SQLite DLQ store.
+
+Run from the repository root:
+
+    python -m salon_events.benchmarks.bench_dlq_replay
+    python -m salon_events.benchmarks.bench_dlq_replay --parked 100000 --replay 20000 --rate 1500
+
+Parks ``--parked`` booking events for 50 tenants, then reads a page of
+``--page`` from the start and from 90% into the table, following the
+cursor vs. with LIMIT/OFFSET. Then replays ``--replay`` of them through the
+in-process Pub/Sub stand-in to a subscriber with ``--workers`` threads that
+each spend ``--handler-ms`` per message, at most ``--rate`` messages per
+second vs. unpaced. "max backlog" is the most messages waiting in the
+subscription, and "p99 ms" the publish-to-ack latency the consumer's own
+traffic would queue behind.
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from salon_events import build_event, encode_event
+from salon_events.dlq import DLQFilter, DLQReplayer, ParkedMessage, SQLiteDLQStore
+from salon_events.fake_pubsub import FakePubSub, FakePublisherClient, FakeSubscriberClient
+
+SUBSCRIPTION = "core-api-v1-events"
+
+
+def park(store, n):
+    attributes = {"CloudPubSubDeadLetterSourceSubscription": SUBSCRIPTION,
+                  "CloudPubSubDeadLetterSourceDeliveryCount": "5"}
+    for i in range(n):
+        event = build_event("booking_created", "1", f"tenant-{i % 50}", {"booking_id": f"b{i}"})
+        store.park(ParkedMessage.new(encode_event(event), attributes, event, message_id=str(i)))
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def replay(store, n, rate, args):
+    pubsub = FakePubSub(ack_deadline_seconds=3600)
+    pubsub.create_subscription(SUBSCRIPTION, "core-api.v1.events")
+    handler_seconds = args.handler_ms / 1000
+
+    def handler(message):
+        time.sleep(handler_seconds)
+        message.ack()
+
+    future = FakeSubscriberClient(pubsub, callback_threads=args.workers).subscribe(SUBSCRIPTION, handler)
+    max_backlog = [0]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.01):
+            max_backlog[0] = max(max_backlog[0], pubsub.stats(SUBSCRIPTION)["backlog"])
+
+    threading.Thread(target=sample, daemon=True).start()
+    start = time.perf_counter()
+    ids = [parked.id for parked in store.query(DLQFilter(), limit=n)]
+    job = DLQReplayer(store, FakePublisherClient(pubsub), "bench", rate=rate, batch_size=args.batch_size).replay(ids=ids)
+    job.wait()
+    while pubsub.stats(SUBSCRIPTION)["acked"] < n:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    done.set()
+    future.cancel()
+    return elapsed, max_backlog[0], pubsub.stats(SUBSCRIPTION)["p99_ms"]
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dlq.sqlite3")
+        store = SQLiteDLQStore(path)
+        start = time.perf_counter()
+        park(store, args.parked)
+        elapsed = time.perf_counter() - start
+        print(f"parked {args.parked} messages: {args.parked / elapsed:.0f} messages/s")
+        print()
+
+        conn = sqlite3.connect(path)
+        deep = store.query(DLQFilter(), limit=1, ids=[int(args.parked * 0.9)])[0]
+        header = f"{'page':<28} {'ms/page':>8}"
+        print(header)
+        print("-" * len(header))
+        for label, fn in (
+            ("first, cursor", lambda: store.query(DLQFilter(), None, args.page)),
+            ("90% in, cursor", lambda: store.query(DLQFilter(), (deep.failed_at, deep.id), args.page)),
+            ("90% in, offset", lambda: conn.execute(
+                "SELECT * FROM dlq_messages ORDER BY failed_at, id LIMIT ? OFFSET ?",
+                (args.page, int(args.parked * 0.9))).fetchall()),
+            ("tenant 90% in, cursor", lambda: store.query(
+                DLQFilter(tenant_id="tenant-7"), (deep.failed_at, deep.id), args.page)),
+            ("tenant 90% in, offset", lambda: conn.execute(
+                "SELECT * FROM dlq_messages WHERE tenant_id = ? ORDER BY failed_at, id LIMIT ? OFFSET ?",
+                ("tenant-7", args.page, int(args.parked * 0.9 / 50))).fetchall()),
+        ):
+            print(f"{label:<28} {timed(fn):>8.2f}")
+        conn.close()
+
+        print()
+        print(f"replay of {args.replay}: {args.workers} workers x {args.handler_ms} ms handlers, "
+              f"batches of {args.batch_size}")
+        header = f"{'replay':<16} {'messages/s':>11} {'max backlog':>12} {'p99 ms':>9}"
+        print(header)
+        print("-" * len(header))
+        for label, rate in ((f"{args.rate:g}/s", args.rate), ("unpaced", 1e9)):
+            elapsed, backlog, p99 = replay(store, args.replay, rate, args)
+            print(f"{label:<16} {args.replay / elapsed:>11.0f} {backlog:>12} {p99:>9.0f}")
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--parked", type=int, default=100000)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--replay", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=1500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--handler-ms", type=float, default=2.0)
+    main(parser.parse_args())
@@ -0,0 +1,113 @@
+"""
+Benchmark: message size and encode/decode speed of the JSON and compact
+event encodings, on realistic booking and customer events.
+
+Run from the repository root:
+
+    python -m salon_events.benchmarks.bench_encoding
+    python -m salon_events.benchmarks.bench_encoding --events 200000
+
+Events are core-api.v1 envelopes as the booking service and EventProducer
+build them: booking_created with a UUID booking ID and notes,
+booking_updated with a status change, and customer_updated. Both paths
+include schema validation, as encode_event and decode_event always do.
+"JSON" uses the configured codec (orjson when installed). "push bytes" is
+the base64 size of the data in a push or Cloud Functions delivery.
+"""
+
+import argparse
+import base64
+import random
+import statistics
+import time
+import uuid
+
+from salon_events import COMPACT, JSON, build_event, decode_event, encode_event
+from salon_events.codec import CODEC
+
+NOTES = ["", "Window seat, please", "Allergic to lavender oil; use the unscented products",
+         "First visit - referred by Maria"]
+
+
+def make_events(n, seed=42):
+    rng = random.Random(seed)
+    events = []
+    for i in range(n):
+        tenant_id = f"tenant-{rng.randrange(200)}"
+        kind = rng.random()
+        if kind < 0.5:
+            event = build_event("booking_created", "1", tenant_id, {
+                "booking_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "service_id": f"service_{rng.randrange(1000)}",
+                "customer_name": rng.choice(["John Doe", "Ana Silva", "Wei Chen", "Fatima Al-Sayed"]),
+                "date": f"2025-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+                "time": f"{rng.randrange(8, 20):02d}:{rng.choice(['00', '15', '30', '45'])}",
+                "notes": rng.choice(NOTES),
+            })
+        elif kind < 0.8:
+            event = build_event("booking_updated", "1", tenant_id, {
+                "booking_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "status": rng.choice(["confirmed", "cancelled", "completed", "no_show"]),
+                "staff_id": f"staff_{rng.randrange(50)}",
+                "duration_minutes": rng.choice([30, 45, 60, 90]),
+                "price": rng.choice([25.0, 40.0, 62.5, 120.0]),
+                "currency": "USD",
+            })
+        else:
+            event = build_event("customer_updated", "1", tenant_id, {
+                "customer_id": f"cust_{rng.randrange(100000)}",
+                "action": "update",
+                "email": f"customer{i}@example.com",
+                "phone": f"+1555{rng.randrange(10 ** 7):07d}",
+            })
+        events.append(event)
+    return events
+
+
+def per_event(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    encoded = {encoding: [encode_event(event, encoding=encoding) for event in events] for encoding in (JSON, COMPACT)}
+
+    print(f"{args.events} events, JSON codec: {CODEC}")
+    print()
+    header = f"{'encoding':<10} {'bytes/event':>12} {'p99 bytes':>10} {'push bytes':>11} {'vs JSON':>8}"
+    print(header)
+    print("-" * len(header))
+    json_mean = statistics.mean(len(data) for data in encoded[JSON])
+    for encoding, messages in encoded.items():
+        sizes = sorted(len(data) for data in messages)
+        mean = statistics.mean(sizes)
+        push = statistics.mean(len(base64.b64encode(data)) for data in messages[:10000])
+        print(f"{encoding:<10} {mean:>12.0f} {sizes[int(len(sizes) * 0.99)]:>10} {push:>11.0f} "
+              f"{mean / json_mean:>7.0%}")
+
+    print()
+    header = f"{'path':<28} {'us/event':>9} {'events/s':>11}"
+    print(header)
+    print("-" * len(header))
+    rows = [
+        (f"encode_event ({JSON})", lambda event: encode_event(event), events),
+        (f"encode_event ({COMPACT})", lambda event: encode_event(event, encoding=COMPACT), events),
+        (f"decode_event ({JSON})", lambda data: decode_event(data, encoding=JSON), encoded[JSON]),
+        (f"decode_event ({COMPACT})", lambda data: decode_event(data, encoding=COMPACT), encoded[COMPACT]),
+        ("decode_event (detected)", decode_event, encoded[COMPACT]),
+    ]
+    for label, fn, items in rows:
+        per_event(fn, items[:1000])  # warm up
+        us = per_event(fn, items)
+        print(f"{label:<28} {us:>9.2f} {1e6 / us:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
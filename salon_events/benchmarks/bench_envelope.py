@@ -0,0 +1,89 @@
+"""
+Benchmark: per-event cost of schema enforcement, validate+encode and
+decode+validate vs. the previous unvalidated json.dumps / json.loads.
+
+Run from the repository root:
+
+    python -m salon_events.benchmarks.bench_envelope
+    python -m salon_events.benchmarks.bench_envelope --events 200000
+
+Events are core-api.v1 booking_created envelopes as EventProducer builds
+them. "json" rows use the standard library, "orjson" rows the optional
+codec (skipped when it is not installed). The validator is compiled once,
+before timing, exactly as producers and consumers do at startup.
+"""
+
+import argparse
+import json
+import time
+
+from salon_events import build_event, decode_event, encode_event, get_validator
+from salon_events.codec import CODEC
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_events(n):
+    return [
+        build_event("booking_created", "1", "tenant-42", {
+            "booking_id": f"booking-{i}",
+            "service_id": "service_123",
+            "customer_name": "John Doe",
+            "date": "2025-08-07",
+            "time": "10:00",
+            "notes": "Window seat, please",
+        })
+        for i in range(n)
+    ]
+
+
+def per_event(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    validate = get_validator("core-api", "1")
+    compact = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+    events = make_events(args.events)
+    messages = [json.dumps(event).encode("utf-8") for event in events]
+
+    encoders = [
+        ("before: json.dumps", lambda e: json.dumps(e).encode("utf-8")),
+        ("validate only", validate),
+        ("validate + json", lambda e: (validate(e), compact.encode(e).encode("utf-8"))),
+    ]
+    decoders = [
+        ("before: json.loads", lambda m: json.loads(m.decode("utf-8"))),
+        ("json + validate", lambda m: validate(json.loads(m))),
+    ]
+    if orjson is not None:
+        encoders.append(("validate + orjson", lambda e: (validate(e), orjson.dumps(e))))
+        decoders.append(("orjson + validate", lambda m: validate(orjson.loads(m))))
+    encoders.append((f"encode_event ({CODEC})", encode_event))
+    decoders.append((f"decode_event ({CODEC})", decode_event))
+
+    print(f"{args.events} events, {len(messages[0])} bytes each")
+    header = f"{'path':<28} {'us/event':>9} {'events/s':>11}"
+    for title, rows, items in (("encode", encoders, events), ("decode", decoders, messages)):
+        print()
+        print(f"{title:<28}")
+        print(header)
+        print("-" * len(header))
+        for label, fn, in rows:
+            per_event(fn, items[:1000])  # warm up
+            us = per_event(fn, items)
+            print(f"{label:<28} {us:>9.2f} {1e6 / us:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
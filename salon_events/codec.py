@@ -0,0 +1,48 @@
+import json
+import os
+import uuid
+from datetime import date, datetime
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment
+    orjson = None
+
+# JSON codec for event envelopes: "auto" uses orjson when it is installed and
+# falls back to the standard library; "json" forces the standard library.
+EVENT_JSON_CODEC = os.getenv("EVENT_JSON_CODEC", "auto").lower()
+
+
+def _default(value: Any) -> Any:
+    # Serialize the same extra types orjson does, so both codecs agree
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None and EVENT_JSON_CODEC in ("auto", "orjson"):
+    CODEC = "orjson"
+
+    def dumps(value: Any) -> bytes:
+        """Encode a value as compact UTF-8 JSON"""
+        return orjson.dumps(value)
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Decode UTF-8 JSON"""
+        return orjson.loads(data)
+else:
+    if EVENT_JSON_CODEC == "orjson":
+        raise ImportError("EVENT_JSON_CODEC=orjson but orjson is not installed")
+    CODEC = "json"
+    _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=_default)
+
+    def dumps(value: Any) -> bytes:
+        """Encode a value as compact UTF-8 JSON"""
+        return _encoder.encode(value).encode("utf-8")
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Decode UTF-8 JSON"""
+        return json.loads(data)
@@ -0,0 +1,363 @@
+"""
+Compact binary encoding of event envelopes.
+
+A schema-driven tagged format: the envelope fields, payload field names and
+common string values of a topic are listed in a dictionary,
+``pubsub_schemas/<domain>.v<version>.compact.json``, and encoded as small
+integers instead of repeated JSON text. Values carry a one-byte tag; short
+strings, dictionary symbols and small integers fit their tag byte. RFC 3339
+UTC timestamps as ``build_event`` writes them are stored as 8-byte
+microsecond counts, and UUID strings as their 16 bytes; both decode to the
+exact original strings.
+
+Layout: ``0xC5``, the dictionary revision, one value per envelope field in
+dictionary order, then a map of any envelope fields the dictionary does not
+list. Dictionaries are append-only, so a decoder reads data written with
+any revision up to its own; deploy consumers before producers when
+extending one.
+"""
+
+import json
+import logging
+import struct
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .schema import EVENT_SCHEMA_DIR, EventValidationError
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0xC5
+
+# Tag bytes
+_NULL, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _MAP, _SYMBOL, _TIME, _UUID, _ABSENT = range(12)
+_SHORT_STR = 0x20      # 0x20-0x3f: strings of 0-31 bytes
+_SHORT_SYMBOL = 0x40   # 0x40-0x7f: symbols 0-63
+_SMALL_INT = 0x80      # 0x80-0xff: integers 0-127
+# Map keys: a field index byte, or _KEY_NAME and the key inline
+_KEY_NAME = 0xFF
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_HEX = "0123456789abcdef"
+_double = struct.Struct("<d")
+_int64 = struct.Struct("<q")
+
+
+def _varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _timestamp(value: str) -> Optional[int]:
+    """Microseconds since the epoch if ``value`` is a UTC timestamp that formats back identically"""
+    if len(value) not in (20, 27) or value[-1] != "Z" or value[10] != "T":
+        return None
+    try:
+        moment = datetime.fromisoformat(value[:-1])
+    except ValueError:
+        return None
+    if moment.tzinfo is not None or moment.isoformat() + "Z" != value:
+        return None
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def _uuid(value: str) -> Optional[bytes]:
+    """The 16 bytes of a lowercase hyphenated UUID string, or None"""
+    if value[8] != "-" or value[13] != "-" or value[18] != "-" or value[23] != "-":
+        return None
+    digits = value.replace("-", "")
+    if len(digits) != 32 or digits.strip(_HEX):
+        return None
+    return bytes.fromhex(digits)
+
+
+class CompactCodec:
+    """Encoder and decoder for one topic's dictionary"""
+
+    def __init__(self, dictionary: Dict[str, Any], name: str = "compact"):
+        """
+        Args:
+            dictionary: ``revision``, ``envelope`` field order, payload
+                ``fields`` and string ``symbols``, as in the dictionary files
+            name: Used in error messages
+        """
+        self.name = name
+        self.revision: int = dictionary["revision"]
+        self.envelope: List[str] = list(dictionary["envelope"])
+        self.fields: List[str] = list(dictionary.get("fields", ()))
+        self.symbols: List[str] = list(dictionary.get("symbols", ()))
+        if not 0 < self.revision < 256:
+            raise ValueError(f"{name}: revision must be 1-255")
+        if len(self.fields) > _KEY_NAME:
+            raise ValueError(f"{name}: at most {_KEY_NAME} fields")
+        self._field_index = {field: i for i, field in enumerate(self.fields)}
+        self._symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._envelope_fields = frozenset(self.envelope)
+        self.encode = self._compile_encoder()
+        self.decode = self._compile_decoder()
+
+    def _compile_encoder(self) -> Callable[[Dict[str, Any]], bytes]:
+        field_index = self._field_index
+        symbol_index = self._symbol_index
+        envelope = self.envelope
+        envelope_fields = self._envelope_fields
+        header = bytes((MAGIC, self.revision))
+
+        def write(value: Any, out: bytearray):
+            kind = type(value)
+            if kind is str:
+                symbol = symbol_index.get(value)
+                if symbol is not None:
+                    if symbol < 64:
+                        out.append(_SHORT_SYMBOL + symbol)
+                    else:
+                        out.append(_SYMBOL)
+                        _varint(symbol, out)
+                    return
+                length = len(value)
+                if length == 36:
+                    raw = _uuid(value)
+                    if raw is not None:
+                        out.append(_UUID)
+                        out += raw
+                        return
+                elif length == 20 or length == 27:
+                    micros = _timestamp(value)
+                    if micros is not None:
+                        out.append(_TIME)
+                        out += _int64.pack(micros)
+                        return
+                data = value.encode("utf-8")
+                if len(data) < 32:
+                    out.append(_SHORT_STR + len(data))
+                else:
+                    out.append(_STR)
+                    _varint(len(data), out)
+                out += data
+            elif kind is dict:
+                out.append(_MAP)
+                _varint(len(value), out)
+                for key, item in value.items():
+                    index = field_index.get(key)
+                    if index is not None:
+                        out.append(index)
+                    elif type(key) is str:
+                        name = key.encode("utf-8")
+                        out.append(_KEY_NAME)
+                        _varint(len(name), out)
+                        out += name
+                    else:
+                        raise TypeError(f"Map keys must be strings, not {type(key).__name__}")
+                    write(item, out)
+            elif kind is int:
+                if 0 <= value < 128:
+                    out.append(_SMALL_INT + value)
+                else:
+                    out.append(_INT)
+                    # Zigzag, so small negative numbers stay short
+                    _varint(value * 2 if value >= 0 else -value * 2 - 1, out)
+            elif value is None:
+                out.append(_NULL)
+            elif value is True:
+                out.append(_TRUE)
+            elif value is False:
+                out.append(_FALSE)
+            elif kind is float:
+                out.append(_FLOAT)
+                out += _double.pack(value)
+            elif kind is list or kind is tuple:
+                out.append(_LIST)
+                _varint(len(value), out)
+                for item in value:
+                    write(item, out)
+            elif isinstance(value, str):
+                write(str(value), out)
+            elif isinstance(value, int):
+                write(int(value), out)
+            elif isinstance(value, (datetime, date)):
+                # The same extra types the JSON codec accepts
+                write(value.isoformat(), out)
+            elif isinstance(value, uuid.UUID):
+                write(str(value), out)
+            else:
+                raise TypeError(f"Object of type {kind.__name__} cannot be encoded")
+
+        def encode(event: Dict[str, Any]) -> bytes:
+            out = bytearray(header)
+            for field in envelope:
+                if field in event:
+                    write(event[field], out)
+                else:
+                    out.append(_ABSENT)
+            write({key: value for key, value in event.items() if key not in envelope_fields}, out)
+            return bytes(out)
+
+        return encode
+
+    def _compile_decoder(self) -> Callable[[bytes], Dict[str, Any]]:
+        fields = self.fields
+        symbols = self.symbols
+        envelope = self.envelope
+        revision = self.revision
+        name = self.name
+        unpack_double = _double.unpack_from
+        unpack_int64 = _int64.unpack_from
+        # Formatted dates by day since the epoch; events cluster on few days
+        dates: Dict[int, str] = {}
+
+        def timestamp(micros: int) -> str:
+            seconds, fraction = divmod(micros, 1000000)
+            day, seconds = divmod(seconds, 86400)
+            day_text = dates.get(day)
+            if day_text is None:
+                day_text = (_EPOCH + timedelta(days=day)).date().isoformat()
+                if len(dates) < 4096:
+                    dates[day] = day_text
+            hours, seconds = divmod(seconds, 3600)
+            minutes, seconds = divmod(seconds, 60)
+            if fraction:
+                return f"{day_text}T{hours:02d}:{minutes:02d}:{seconds:02d}.{fraction:06d}Z"
+            return f"{day_text}T{hours:02d}:{minutes:02d}:{seconds:02d}Z"
+
+        def varint(data: bytes, pos: int) -> Tuple[int, int]:
+            result = shift = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                result |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    return result, pos
+                shift += 7
+
+        def read(data: bytes, pos: int) -> Tuple[Any, int]:
+            tag = data[pos]
+            pos += 1
+            if tag >= _SMALL_INT:
+                return tag - _SMALL_INT, pos
+            if tag >= _SHORT_SYMBOL:
+                return symbols[tag - _SHORT_SYMBOL], pos
+            if tag >= _SHORT_STR:
+                end = pos + tag - _SHORT_STR
+                return data[pos:end].decode(), end
+            if tag == _MAP:
+                count, pos = varint(data, pos)
+                result = {}
+                for _ in range(count):
+                    key = data[pos]
+                    pos += 1
+                    if key != _KEY_NAME:
+                        key = fields[key]
+                    else:
+                        length, pos = varint(data, pos)
+                        key, pos = data[pos:pos + length].decode(), pos + length
+                    # Values that fit their tag byte are decoded inline, sparing a call
+                    tag = data[pos]
+                    if tag >= _SMALL_INT:
+                        result[key] = tag - _SMALL_INT
+                        pos += 1
+                    elif tag >= _SHORT_SYMBOL:
+                        result[key] = symbols[tag - _SHORT_SYMBOL]
+                        pos += 1
+                    elif tag >= _SHORT_STR:
+                        end = pos + 1 + tag - _SHORT_STR
+                        result[key] = data[pos + 1:end].decode()
+                        pos = end
+                    else:
+                        result[key], pos = read(data, pos)
+                return result, pos
+            if tag == _UUID:
+                digits = data[pos:pos + 16].hex()
+                return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:32]}", pos + 16
+            if tag == _TIME:
+                return timestamp(unpack_int64(data, pos)[0]), pos + 8
+            if tag == _STR:
+                length, pos = varint(data, pos)
+                return data[pos:pos + length].decode(), pos + length
+            if tag == _SYMBOL:
+                index, pos = varint(data, pos)
+                return symbols[index], pos
+            if tag == _INT:
+                zigzag, pos = varint(data, pos)
+                return (zigzag >> 1) ^ -(zigzag & 1), pos
+            if tag == _NULL:
+                return None, pos
+            if tag == _TRUE:
+                return True, pos
+            if tag == _FALSE:
+                return False, pos
+            if tag == _FLOAT:
+                return unpack_double(data, pos)[0], pos + 8
+            if tag == _LIST:
+                count, pos = varint(data, pos)
+                items = []
+                for _ in range(count):
+                    item, pos = read(data, pos)
+                    items.append(item)
+                return items, pos
+            raise ValueError(f"unknown tag 0x{tag:02x} at byte {pos - 1}")
+
+        def decode(data: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+            if type(data) is not bytes:
+                data = bytes(data)
+            if len(data) < 2 or data[0] != MAGIC:
+                raise EventValidationError("$", f"is not {name} data")
+            if data[1] > revision:
+                raise EventValidationError("$", f"uses {name} dictionary revision {data[1]}, newer than {revision}")
+            try:
+                event: Dict[str, Any] = {}
+                pos = 2
+                for field in envelope:
+                    tag = data[pos]
+                    if tag >= _SHORT_SYMBOL:
+                        event[field] = symbols[tag - _SHORT_SYMBOL] if tag < _SMALL_INT else tag - _SMALL_INT
+                        pos += 1
+                    elif tag >= _SHORT_STR:
+                        end = pos + 1 + tag - _SHORT_STR
+                        event[field] = data[pos + 1:end].decode()
+                        pos = end
+                    elif tag == _ABSENT:
+                        pos += 1
+                    else:
+                        event[field], pos = read(data, pos)
+                if data[pos] == _MAP and data[pos + 1] == 0:
+                    extra, pos = None, pos + 2
+                else:
+                    extra, pos = read(data, pos)
+            except (IndexError, ValueError, UnicodeDecodeError, struct.error, OverflowError) as e:
+                raise EventValidationError("$", f"is not valid {name} data: {e or 'truncated'}")
+            if pos != len(data) or not (extra is None or type(extra) is dict):
+                raise EventValidationError("$", f"is not valid {name} data: trailing bytes")
+            if extra:
+                event.update(extra)
+            return event
+
+        return decode
+
+
+def load_dictionary(domain: str, version: str, schema_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the compact dictionary of ``<domain>.v<version>`` from the schema directory"""
+    dictionary_path = Path(schema_dir or EVENT_SCHEMA_DIR) / f"{domain}.v{version}.compact.json"
+    with open(dictionary_path, encoding="utf-8") as dictionary_file:
+        return json.load(dictionary_file)
+
+
+_codecs: Dict[Tuple[str, str], CompactCodec] = {}
+
+
+def get_compact_codec(domain: str = "core-api", version: str = "1") -> CompactCodec:
+    """
+    Return the compact codec for ``<domain>.v<version>`` events, loaded on
+    the first call for each pair and cached for the life of the process.
+    """
+    key = (domain, str(version))
+    codec = _codecs.get(key)
+    if codec is None:
+        codec = CompactCodec(load_dictionary(*key), f"{domain}.v{version} compact")
+        _codecs[key] = codec
+        logger.info(f"Loaded compact dictionary {domain}.v{version} (revision {codec.revision})")
+    return codec
@@ -0,0 +1,58 @@
+"""
+Handlers for core-api events, shared by the Cloud Run service and the Cloud
+Function in cloud_run/ and cloud_functions/core_event_processor.
+"""
+
+import logging
+from typing import Dict, Any
+
+from .processing import EventProcessor
+
+logger = logging.getLogger(__name__)
+
+processor = EventProcessor("core-api", "1")
+
+
+@processor.handler("booking_created", "^1")
+def process_booking_created(event: Dict[str, Any]):
+    """Process a booking created event"""
+    payload = event.get('payload', {})
+    booking_id = payload.get('booking_id')
+    customer_id = payload.get('customer_id')
+    timestamp = payload.get('timestamp')
+
+    logger.info(f"Booking created: {booking_id} for customer {customer_id} at {timestamp}")
+
+    # Here you would implement the business logic for handling a booking creation
+    # This might include:
+    # - Sending notifications
+    # - Updating analytics
+    # - Triggering other workflows
+    # - etc.
+
+    # Example: Send a notification
+    send_booking_notification(booking_id, customer_id)
+
+
+@processor.handler("customer_updated", "^1")
+def process_customer_updated(event: Dict[str, Any]):
+    """Process a customer updated event"""
+    payload = event.get('payload', {})
+    customer_id = payload.get('customer_id')
+    action = payload.get('action')
+    timestamp = payload.get('timestamp')
+
+    logger.info(f"Customer {customer_id} updated with action {action} at {timestamp}")
+
+    # Here you would implement the business logic for handling a customer update
+    # This might include:
+    # - Updating customer data in other systems
+    # - Sending notifications
+    # - Triggering other workflows
+    # - etc.
+
+
+def send_booking_notification(booking_id: str, customer_id: str):
+    """Send a notification about a booking creation"""
+    # This is a placeholder for the actual notification logic
+    logger.info(f"Sending notification for booking {booking_id} to customer {customer_id}")
@@ -0,0 +1,461 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .striped_table import StripedTable
+
+logger = logging.getLogger(__name__)
+
+# Where processed message keys are remembered: "memory" (per process),
+# "sqlite" or "shm" (shared by the processes on a host), or "off"
+EVENT_DEDUP_BACKEND = os.getenv("EVENT_DEDUP_BACKEND", "memory")
+EVENT_DEDUP_PATH = os.getenv("EVENT_DEDUP_PATH", "")
+# What identifies a redelivery: "message_id", or "correlation_id", which
+# also catches an event published twice by a retrying producer
+EVENT_DEDUP_KEY = os.getenv("EVENT_DEDUP_KEY", "message_id")
+EVENT_DEDUP_MAX_ENTRIES = int(os.getenv("EVENT_DEDUP_MAX_ENTRIES", "100000"))
+EVENT_DEDUP_TTL_SECONDS = int(os.getenv("EVENT_DEDUP_TTL_SECONDS", "86400"))
+# How long a message being processed blocks its redeliveries. Pub/Sub's
+# longest ack deadline is 600 s, after which the message is redelivered anyway.
+EVENT_DEDUP_CLAIM_SECONDS = int(os.getenv("EVENT_DEDUP_CLAIM_SECONDS", "600"))
+
+# Outcomes of claiming a message key
+NEW = "new"                # First delivery; process it
+DUPLICATE = "duplicate"    # Already processed; ack without processing
+IN_FLIGHT = "in_flight"    # Being processed elsewhere; let it be redelivered
+
+_PENDING = 1
+_DONE = 2
+
+# Returned by Deduplicator._begin for a message to skip
+_SKIP = object()
+
+
+class DedupStore(ABC):
+    """
+    Remembers which message keys were processed.
+
+    ``claim`` atomically marks a key as being processed unless it already
+    is, or was; ``complete`` marks it processed and ``release`` forgets it
+    again, so a failed message is processed on redelivery.
+    """
+
+    def __init__(self, ttl_seconds: int = EVENT_DEDUP_TTL_SECONDS,
+                 claim_seconds: int = EVENT_DEDUP_CLAIM_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.claim_seconds = claim_seconds
+
+    @abstractmethod
+    def claim(self, key: str) -> str:
+        """Mark ``key`` as being processed; returns NEW, DUPLICATE or IN_FLIGHT"""
+
+    @abstractmethod
+    def complete(self, key: str):
+        """Mark ``key`` processed, for ``ttl_seconds``"""
+
+    @abstractmethod
+    def release(self, key: str):
+        """Forget ``key``, so its next delivery is processed"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Keys remembered"""
+
+    def close(self):
+        pass
+
+
+class MemoryDedupStore(DedupStore):
+    """
+    In-process LRU of message keys with a TTL.
+
+    Holds at most ``max_entries`` keys; the least recently seen are evicted
+    first, so memory stays bounded however many messages pass through.
+    """
+
+    def __init__(self, max_entries: int = EVENT_DEDUP_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> str:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= now:
+                self._entries.move_to_end(key)
+                return DUPLICATE if entry[0] == _DONE else IN_FLIGHT
+            self._entries[key] = (_PENDING, now + self.claim_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return NEW
+
+    def complete(self, key: str):
+        with self._lock:
+            self._entries[key] = (_DONE, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def release(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_messages (
+    key TEXT PRIMARY KEY,
+    state INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_messages_expires_at ON processed_messages (expires_at);
+"""
+
+
+class SQLiteDedupStore(DedupStore):
+    """
+    Message keys in a local SQLite database in WAL mode.
+
+    Shared by every process on the host that opens the same file and kept
+    across restarts. Expired keys are purged every ``purge_every`` claims.
+    """
+
+    def __init__(self, path: str = "/tmp/event-dedup.sqlite3", purge_every: int = 1000, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.purge_every = purge_every
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._claims = 0
+
+    def claim(self, key: str) -> str:
+        now = time.time()
+        with self._db_lock:
+            self._claims += 1
+            if self.purge_every and self._claims % self.purge_every == 0:
+                self._conn.execute("DELETE FROM processed_messages WHERE expires_at < ?", (now,))
+            # Inserts, or takes over an expired key; changes nothing when the
+            # key is live, which makes the claim atomic across processes
+            cursor = self._conn.execute(
+                "INSERT INTO processed_messages (key, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at "
+                "WHERE processed_messages.expires_at < ?",
+                (key, _PENDING, now + self.claim_seconds, now)
+            )
+            if cursor.rowcount:
+                return NEW
+            row = self._conn.execute("SELECT state FROM processed_messages WHERE key = ?", (key,)).fetchone()
+        return DUPLICATE if row is not None and row[0] == _DONE else IN_FLIGHT
+
+    def complete(self, key: str):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed_messages (key, state, expires_at) VALUES (?, ?, ?)",
+                (key, _DONE, time.time() + self.ttl_seconds)
+            )
+
+    def release(self, key: str):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM processed_messages WHERE key = ?", (key,))
+
+    def __len__(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_messages").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+_SHM_MAGIC = b"DDUP"
+# Version 2 added the slot size to the header and per-stripe entry counters
+_SHM_LAYOUT_VERSION = 2
+# Slot: state, key hash, expires_at
+_SHM_SLOT = struct.Struct("<B7xQd")
+# State of a released slot: reusable, and no longer counted as an entry
+_RELEASED = 3
+
+
+def _hash_key(key: str) -> int:
+    # Must be identical in every process, so Python's salted hash() won't do.
+    # Zero marks an empty slot.
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+class SharedMemoryDedupStore(DedupStore):
+    """
+    Fixed-size hash table of message keys in a memory-mapped file, shared by
+    every worker process on the host.
+
+    Only a 64-bit hash of each key is kept, 24 bytes a slot. Slots are
+    grouped into stripes, each guarded by an fcntl byte range lock (see
+    StripedTable). When a stripe has no free or expired slot, the processed
+    key closest to expiry is evicted; keys still being processed never are.
+    Each stripe counts its entries, expired ones included until their slot
+    is reused, so ``len`` reads 256 counters instead of every slot.
+    """
+
+    def __init__(self, path: str = "/dev/shm/event-dedup", slots: int = 131072, stripes: int = 256, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.evictions = 0
+        self._table = StripedTable(path, _SHM_MAGIC, _SHM_LAYOUT_VERSION, slots, _SHM_SLOT.size, stripes,
+                                   counters=True, kind="dedup")
+        self.slots, self.stripes = self._table.slots, self._table.stripes
+
+    def _find(self, key_hash: int, now: float) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Probe the key's stripe.
+
+        Returns (offset of the live slot holding the key, offset of the slot
+        a new key should go in); the second is None only if every slot in the
+        stripe holds a key still being processed.
+        """
+        table = self._table
+        mm = table.mm
+        per_stripe = table.slots_per_stripe
+        base = table.stripe_base(table.stripe_of(key_hash))
+        start = key_hash >> 32
+        reusable = None
+        oldest, oldest_expiry = None, float("inf")
+        for i in range(per_stripe):
+            offset = base + ((start + i) & (per_stripe - 1)) * _SHM_SLOT.size
+            state, slot_hash, expires_at = _SHM_SLOT.unpack_from(mm, offset)
+            if slot_hash == 0:
+                return None, reusable if reusable is not None else offset
+            if expires_at < now:
+                if reusable is None:
+                    reusable = offset
+                continue
+            if slot_hash == key_hash:
+                return offset, reusable
+            if state == _DONE and expires_at < oldest_expiry:
+                oldest, oldest_expiry = offset, expires_at
+        if reusable is None and oldest is not None:
+            self.evictions += 1
+            reusable = oldest
+        return None, reusable
+
+    def _insert(self, offset: int, stripe: int, state: int, key_hash: int, expires_at: float):
+        """Write a key to a free slot, counting it unless it replaces another entry"""
+        if self._table.mm[offset] in (0, _RELEASED):
+            self._table.add_to_count(stripe, 1)
+        _SHM_SLOT.pack_into(self._table.mm, offset, state, key_hash, expires_at)
+
+    def claim(self, key: str) -> str:
+        key_hash = _hash_key(key)
+        stripe = self._table.stripe_of(key_hash)
+        now = time.time()
+        with self._table.locked(stripe):
+            found, reusable = self._find(key_hash, now)
+            if found is not None:
+                return DUPLICATE if self._table.mm[found] == _DONE else IN_FLIGHT
+            if reusable is None:
+                logger.warning(f"Dedup table stripe for {key} is full of in-flight messages")
+                return NEW
+            self._insert(reusable, stripe, _PENDING, key_hash, now + self.claim_seconds)
+            return NEW
+
+    def complete(self, key: str):
+        key_hash = _hash_key(key)
+        stripe = self._table.stripe_of(key_hash)
+        now = time.time()
+        with self._table.locked(stripe):
+            found, reusable = self._find(key_hash, now)
+            if found is not None:
+                _SHM_SLOT.pack_into(self._table.mm, found, _DONE, key_hash, now + self.ttl_seconds)
+            elif reusable is not None:
+                self._insert(reusable, stripe, _DONE, key_hash, now + self.ttl_seconds)
+
+    def release(self, key: str):
+        key_hash = _hash_key(key)
+        stripe = self._table.stripe_of(key_hash)
+        with self._table.locked(stripe):
+            found, _ = self._find(key_hash, time.time())
+            if found is not None:
+                # Expired rather than emptied, so probes for other keys continue past it
+                _SHM_SLOT.pack_into(self._table.mm, found, _RELEASED, key_hash, 0.0)
+                self._table.add_to_count(stripe, -1)
+
+    def __len__(self) -> int:
+        return self._table.count()
+
+    def close(self):
+        self._table.close()
+
+
+class Deduplicator:
+    """
+    Skips redelivered messages so handlers run once per message.
+
+    Pub/Sub delivers at least once. Wrapping a handler with a Deduplicator
+    claims the message key before the handler runs: a message already
+    processed is skipped, and one still being processed elsewhere raises
+    DuplicateInFlight, so the caller can have it redelivered later instead
+    of acking a message whose processing may yet fail. The key is
+    remembered once the handler returns and forgotten if it raises.
+
+    A store that fails is logged and the message processed anyway;
+    deduplication never costs a delivery.
+    """
+
+    def __init__(self, store: Optional[DedupStore] = None, key_by: str = EVENT_DEDUP_KEY):
+        """
+        Args:
+            store: Where keys are kept; by default a MemoryDedupStore
+            key_by: "message_id", or "correlation_id" to key on the event's
+                correlation ID and type
+        """
+        if key_by not in ("message_id", "correlation_id"):
+            raise ValueError(f"Unknown dedup key: {key_by}")
+        self.store = store or MemoryDedupStore()
+        self.key_by = key_by
+        self.checked = 0
+        self.duplicates = 0
+        self.in_flight = 0
+
+    def key(self, event: Dict[str, Any], message_id: Optional[str] = None) -> Optional[str]:
+        """The dedup key of a message, or None if it has none"""
+        if self.key_by == "correlation_id" and event.get("correlation_id"):
+            return f"{event['correlation_id']}:{event.get('type')}"
+        return message_id or None
+
+    def claim(self, event: Dict[str, Any], message_id: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        Claim a message for processing.
+
+        Returns:
+            (outcome, key): NEW, DUPLICATE or IN_FLIGHT, and the key to pass
+            to ``complete`` or ``release``; messages without a key are
+            always NEW
+        """
+        key = self.key(event, message_id)
+        if key is None:
+            return NEW, None
+        self.checked += 1
+        try:
+            outcome = self.store.claim(key)
+        except Exception as e:
+            logger.error(f"Dedup store failed to claim {key}: {e}")
+            return NEW, None
+        if outcome == DUPLICATE:
+            self.duplicates += 1
+        elif outcome == IN_FLIGHT:
+            self.in_flight += 1
+        return outcome, key
+
+    def complete(self, key: Optional[str]):
+        if key is not None:
+            try:
+                self.store.complete(key)
+            except Exception as e:
+                logger.error(f"Dedup store failed to record {key}: {e}")
+
+    def release(self, key: Optional[str]):
+        if key is not None:
+            try:
+                self.store.release(key)
+            except Exception as e:
+                logger.error(f"Dedup store failed to release {key}: {e}")
+
+    def __call__(self, handler: Callable) -> Callable:
+        """
+        Wrap a handler taking (event, message_id=None, ...) so it is skipped
+        for duplicates; the wrapper returns DUPLICATE for those and the
+        handler's result otherwise.
+        """
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(event, message_id=None, *args, **kwargs):
+                key = self._begin(event, message_id)
+                if key is _SKIP:
+                    return DUPLICATE
+                try:
+                    result = await handler(event, message_id, *args, **kwargs)
+                except BaseException:
+                    self.release(key)
+                    raise
+                self.complete(key)
+                return result
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(event, message_id=None, *args, **kwargs):
+            key = self._begin(event, message_id)
+            if key is _SKIP:
+                return DUPLICATE
+            try:
+                result = handler(event, message_id, *args, **kwargs)
+            except BaseException:
+                self.release(key)
+                raise
+            self.complete(key)
+            return result
+        return wrapper
+
+    def _begin(self, event: Dict[str, Any], message_id: Optional[str]):
+        outcome, key = self.claim(event, message_id)
+        if outcome == DUPLICATE:
+            logger.info(f"Skipping duplicate message {key} (dedup hit rate {self.hit_rate:.1%})")
+            return _SKIP
+        if outcome == IN_FLIGHT:
+            raise DuplicateInFlight(key)
+        return key
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of checked messages that were redeliveries"""
+        return (self.duplicates + self.in_flight) / self.checked if self.checked else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "in_flight": self.in_flight,
+            "hit_rate": round(self.hit_rate, 4),
+            "entries": len(self.store),
+        }
+
+
+class DuplicateInFlight(Exception):
+    """The message is being processed by another delivery; retry it later"""
+
+    def __init__(self, key: str):
+        super().__init__(f"Message {key} is already being processed")
+        self.key = key
+
+
+def get_deduplicator(backend: str = EVENT_DEDUP_BACKEND, path: str = EVENT_DEDUP_PATH) -> Optional[Deduplicator]:
+    """Factory function to build the deduplicator configured by EVENT_DEDUP_*; None when it is off"""
+    if backend == "off":
+        return None
+    if backend == "memory":
+        store = MemoryDedupStore()
+    elif backend == "sqlite":
+        store = SQLiteDedupStore(path or "/tmp/event-dedup.sqlite3")
+    elif backend == "shm":
+        store = SharedMemoryDedupStore(path or "/dev/shm/event-dedup")
+    else:
+        raise ValueError(f"Unknown EVENT_DEDUP_BACKEND: {backend}")
+    return Deduplicator(store)
@@ -0,0 +1,196 @@
+import logging
+import re
+import threading
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+Upcaster = Callable[[Event], Event]
+
+# Parked events kept by the default in-memory parking lot
+DEFAULT_PARKING_CAPACITY = 10000
+
+_VERSION = re.compile(r"\d+(\.\d+){0,2}")
+
+
+def parse_version(version: str) -> Optional[Tuple[int, int, int]]:
+    """'1' -> (1, 0, 0), '1.2' -> (1, 2, 0); None if not numeric"""
+    version = str(version).lstrip("v")
+    if not _VERSION.fullmatch(version):
+        return None
+    parts = [int(part) for part in version.split(".")]
+    return tuple(parts + [0] * (3 - len(parts)))
+
+
+class VersionSpec:
+    """
+    Which event versions a handler accepts.
+
+    - ``"1"`` or ``"1.2"``: exactly that version
+    - ``"^1.2"``: semver compatible, i.e. same major version and at least 1.2
+    - ``">=1,<3"``: comma-separated comparisons (``>=``, ``>``, ``<=``, ``<``, ``==``)
+    - ``"*"``: any version
+    """
+
+    _COMPARISON = re.compile(r"(>=|<=|==|>|<)\s*(\S+)")
+
+    def __init__(self, spec: str):
+        self.spec = spec = str(spec).strip()
+        self.exact: Optional[str] = None
+        self._checks: List[Callable[[Tuple[int, int, int]], bool]] = []
+        if spec == "*":
+            return
+        if spec.startswith("^"):
+            floor = self._parse(spec[1:])
+            self._checks = [lambda v: v[0] == floor[0], lambda v: v >= floor]
+        elif spec[0] in "<>=":
+            for part in spec.split(","):
+                match = self._COMPARISON.fullmatch(part.strip())
+                if not match:
+                    raise ValueError(f"Invalid version range: {spec}")
+                self._checks.append(self._comparison(match.group(1), self._parse(match.group(2))))
+        else:
+            self.exact = spec
+
+    @staticmethod
+    def _parse(version: str) -> Tuple[int, int, int]:
+        parsed = parse_version(version)
+        if parsed is None:
+            raise ValueError(f"Invalid version: {version}")
+        return parsed
+
+    @staticmethod
+    def _comparison(operator: str, bound: Tuple[int, int, int]):
+        return {
+            ">=": lambda v: v >= bound,
+            ">": lambda v: v > bound,
+            "<=": lambda v: v <= bound,
+            "<": lambda v: v < bound,
+            "==": lambda v: v == bound,
+        }[operator]
+
+    def matches(self, version: str) -> bool:
+        if self.exact is not None:
+            return version == self.exact
+        if not self._checks:
+            return True
+        parsed = parse_version(version)
+        return parsed is not None and all(check(parsed) for check in self._checks)
+
+    def __repr__(self):
+        return f"VersionSpec({self.spec!r})"
+
+
+class Route:
+    """Resolved dispatch for one (event type, version): upcasters to apply, then the handler"""
+
+    __slots__ = ("handler", "upcasters", "target_version")
+
+    def __init__(self, handler: Any, upcasters: Tuple[Tuple[str, Upcaster], ...], target_version: str):
+        self.handler = handler
+        self.upcasters = upcasters
+        self.target_version = target_version
+
+    def prepare(self, event: Event) -> Event:
+        """Upcast an event to the version its handler expects"""
+        for to_version, upcast in self.upcasters:
+            event = upcast(event)
+            event["version"] = to_version
+        return event
+
+
+class ParkingLot:
+    """
+    Default parking path for events nobody handles: a bounded in-memory
+    buffer, oldest dropped first, that operators can inspect or replay from.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_PARKING_CAPACITY):
+        self.events: Deque[Event] = deque(maxlen=capacity)
+
+    def __call__(self, event: Event, message):
+        self.events.append(event)
+
+
+class DispatchTable:
+    """
+    Maps (event type, version) to a handler, resolving version-compatible
+    handlers and upcaster chains once per pair and caching the result.
+
+    Resolution for an incoming version walks the upcaster chain from it (v,
+    then what v upcasts to, and so on). At each step a handler registered for
+    exactly that version wins, then one whose range accepts it, the most
+    recently registered first. Without a match the pair is a miss, and misses
+    are cached too, so an unknown version costs one dict lookup per message.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Tuple[VersionSpec, Any]]] = {}
+        self._upcasters: Dict[Tuple[str, str], Tuple[str, Upcaster]] = {}
+        self._routes: Dict[Tuple[str, str], Optional[Route]] = {}
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.upcast = 0
+        self.misses: Counter = Counter()
+
+    def register(self, event_type: str, version: str, handler: Any):
+        """Register a handler for an exact version, a semver range (``^1``) or comparisons (``>=1,<3``)"""
+        spec = VersionSpec(version)
+        with self._lock:
+            entries = [entry for entry in self._handlers.get(event_type, []) if entry[0].spec != spec.spec]
+            entries.append((spec, handler))
+            self._handlers[event_type] = entries
+            self._routes.clear()
+
+    def register_upcaster(self, event_type: str, from_version: str, to_version: str, upcaster: Upcaster):
+        """Register a function turning a ``from_version`` event into the ``to_version`` shape"""
+        with self._lock:
+            self._upcasters[(event_type, str(from_version))] = (str(to_version), upcaster)
+            self._routes.clear()
+
+    def handlers(self) -> List[Any]:
+        return [handler for entries in self._handlers.values() for _, handler in entries]
+
+    def _resolve(self, event_type: str, version: str) -> Optional[Route]:
+        entries = self._handlers.get(event_type, [])
+        chain: List[Tuple[str, Upcaster]] = []
+        seen = set()
+        while version not in seen:
+            seen.add(version)
+            exact = [handler for spec, handler in entries if spec.exact == version]
+            ranged = [handler for spec, handler in reversed(entries) if spec.exact is None and spec.matches(version)]
+            if exact or ranged:
+                return Route((exact or ranged)[0], tuple(chain), version)
+            step = self._upcasters.get((event_type, version))
+            if step is None:
+                return None
+            chain.append(step)
+            version = step[0]
+        logger.error(f"Upcaster cycle for {event_type} at version {version}")
+        return None
+
+    def route(self, event_type: str, version: str) -> Optional[Route]:
+        """The route for an event, or None on a dispatch miss"""
+        key = (event_type, str(version))
+        try:
+            route = self._routes[key]
+        except KeyError:
+            with self._lock:
+                route = self._routes[key] = self._resolve(*key)
+        if route is None:
+            self.misses[f"{key[0]}:{key[1]}"] += 1
+        else:
+            self.dispatched += 1
+            if route.upcasters:
+                self.upcast += 1
+        return route
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dispatched": self.dispatched,
+            "upcast": self.upcast,
+            "misses": sum(self.misses.values()),
+            "misses_by_key": dict(self.misses),
+        }
@@ -0,0 +1,550 @@
+"""
+Parking store and replay for dead-lettered messages.
+
+The DLQ processor parks every dead-lettered message in a SQLiteDLQStore with what
+it could read of the event. The store is indexed for the questions asked
+after an incident: by correlation ID, by event type and version, and by
+tenant, each within a failure time range. Once a fix ships, a DLQReplayer
+re-publishes a selection to the topic each message came from,
+``<domain>.v<version>.events``:
+
+    store = SQLiteDLQStore("/mnt/dlq/dlq.sqlite3")
+    store.park(ParkedMessage.new(...))
+    page = store.query(DLQFilter(event_type="booking_created", tenant_id="t1"), limit=100)
+    job = DLQReplayer(store, publisher, "my-project").replay(DLQFilter(event_type="booking_created"))
+
+Replay is paced at ``rate`` messages per second, in batches of
+``batch_size``, and waits for each batch to be published before the next,
+so a 100k message backlog reaches the consumers as a steady stream rather
+than all at once.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .envelope import DEFAULT_DOMAIN, DEFAULT_VERSION
+
+logger = logging.getLogger(__name__)
+
+# SQLite database of parked messages. Required: it must be on storage that
+# outlives the instance (not /tmp, which Cloud Run keeps in memory)
+DLQ_STORE_PATH = os.getenv("DLQ_STORE_PATH")
+# How long a write waits for another connection's lock, in milliseconds
+DLQ_STORE_BUSY_TIMEOUT_MS = int(os.getenv("DLQ_STORE_BUSY_TIMEOUT_MS", "10000"))
+# Replay pace, in messages per second, and messages published per batch
+DLQ_REPLAY_RATE = float(os.getenv("DLQ_REPLAY_RATE", "200"))
+DLQ_REPLAY_BATCH_SIZE = int(os.getenv("DLQ_REPLAY_BATCH_SIZE", "100"))
+# Fastest pace and largest batch a replay may ask for; higher values are clamped
+DLQ_REPLAY_MAX_RATE = float(os.getenv("DLQ_REPLAY_MAX_RATE", "1000"))
+DLQ_REPLAY_MAX_BATCH_SIZE = int(os.getenv("DLQ_REPLAY_MAX_BATCH_SIZE", "500"))
+# Largest page a query may ask for
+DLQ_QUERY_MAX_LIMIT = int(os.getenv("DLQ_QUERY_MAX_LIMIT", "1000"))
+
+# Attributes Pub/Sub adds when dead-lettering, dropped on replay
+DEAD_LETTER_ATTRIBUTE_PREFIX = "CloudPubSubDeadLetter"
+SOURCE_SUBSCRIPTION_ATTRIBUTE = "CloudPubSubDeadLetterSourceSubscription"
+# Added on replay: how many times the message has been replayed
+REPLAY_ATTRIBUTE = "dlq_replay_count"
+
+# Subscriptions are named after their topic with dots replaced (see
+# infra/terraform/modules/pubsub): core-api.v1.events -> core-api-v1-events
+_SUBSCRIPTION_TOPIC = re.compile(r"^(?P<domain>.+)-v(?P<version>\d+)-events$")
+
+# File systems SQLite's WAL mode does not work on: its shared-memory index
+# must be visible to every process opening the database, so a local disk
+NETWORK_FILESYSTEMS = frozenset(("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "lustre",
+                                 "fuse.gcsfuse"))
+
+# Replay job states
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+def source_topic(subscription: Optional[str]) -> Tuple[str, str]:
+    """
+    The (domain, version) of the topic a dead-lettered message was published
+    to, from its source subscription; the default topic if the name does not
+    follow the convention.
+    """
+    if subscription:
+        match = _SUBSCRIPTION_TOPIC.match(subscription.rsplit("/", 1)[-1])
+        if match:
+            return match.group("domain"), match.group("version")
+    return DEFAULT_DOMAIN, DEFAULT_VERSION
+
+
+def filesystem_type(path: str, mounts: str = "/proc/mounts") -> Optional[str]:
+    """The type of the file system holding ``path``, from the mount table; None if unknown"""
+    directory = os.path.dirname(os.path.realpath(path))
+    try:
+        with open(mounts) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    mount_point, fstype = "", None
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # Spaces in mount points are escaped as \040
+        point = fields[1].replace("\\040", " ")
+        if (directory == point or directory.startswith(point.rstrip("/") + "/")) and len(point) >= len(mount_point):
+            mount_point, fstype = point, fields[2]
+    return fstype
+
+
+def journal_mode(path: str) -> str:
+    """
+    WAL for a database on a local disk, the rollback journal (DELETE) on a
+    network file system such as the Filestore share, where WAL is unsupported
+    """
+    return "DELETE" if filesystem_type(path) in NETWORK_FILESYSTEMS else "WAL"
+
+
+class ParkedMessage(NamedTuple):
+    """A dead-lettered message, as received, with what could be read of its event"""
+    id: Optional[int]
+    message_id: Optional[str]
+    correlation_id: Optional[str]
+    event_type: Optional[str]
+    event_version: Optional[str]
+    tenant_id: Optional[str]
+    # Topic to replay to: <domain>.v<version>.events
+    domain: str
+    version: str
+    subscription: Optional[str]
+    ordering_key: str
+    error: Optional[str]
+    delivery_attempts: Optional[int]
+    data: bytes
+    attributes: Dict[str, str]
+    failed_at: float
+    replay_count: int = 0
+    replayed_at: Optional[float] = None
+
+    @classmethod
+    def new(cls, data: bytes, attributes: Dict[str, str], event: Dict[str, Any],
+            message_id: Optional[str] = None, ordering_key: str = "", error: Optional[str] = None,
+            failed_at: Optional[float] = None) -> "ParkedMessage":
+        """A message to park; the topic and delivery attempts come from the dead-letter attributes"""
+        subscription = attributes.get(SOURCE_SUBSCRIPTION_ATTRIBUTE)
+        domain, version = source_topic(subscription)
+        attempts = attributes.get(f"{DEAD_LETTER_ATTRIBUTE_PREFIX}SourceDeliveryCount", "")
+        return cls(
+            None, message_id, event.get("correlation_id"), event.get("type"), event.get("version"),
+            event.get("tenant_id"), domain, version, subscription, ordering_key or "", error,
+            int(attempts) if attempts.isdigit() else None, data, attributes,
+            time.time() if failed_at is None else failed_at,
+        )
+
+    @property
+    def topic(self) -> str:
+        return f"{self.domain}.v{self.version}.events"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly form, with the data in base64 as in push messages"""
+        fields = self._asdict()
+        fields["data"] = base64.b64encode(self.data).decode("ascii")
+        fields["topic"] = self.topic
+        return fields
+
+
+class DLQFilter(NamedTuple):
+    """Which parked messages to select; None matches anything"""
+    correlation_id: Optional[str] = None
+    event_type: Optional[str] = None
+    event_version: Optional[str] = None
+    tenant_id: Optional[str] = None
+    failed_after: Optional[float] = None
+    failed_before: Optional[float] = None
+    # True for messages replayed at least once, False for never replayed
+    replayed: Optional[bool] = None
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dlq_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT UNIQUE,
+    correlation_id TEXT,
+    event_type TEXT,
+    event_version TEXT,
+    tenant_id TEXT,
+    domain TEXT NOT NULL,
+    version TEXT NOT NULL,
+    subscription TEXT,
+    ordering_key TEXT NOT NULL DEFAULT '',
+    error TEXT,
+    delivery_attempts INTEGER,
+    data BLOB NOT NULL,
+    attributes TEXT NOT NULL,
+    failed_at REAL NOT NULL,
+    replay_count INTEGER NOT NULL DEFAULT 0,
+    replayed_at REAL
+);
+-- Pages are in (failed_at, id) order. Every index ends with failed_at and the
+-- implicit rowid (id), so a filter pages through its index without sorting.
+-- That only holds when the filter pins every column before failed_at, hence
+-- one index for the event type alone and one for type and version.
+CREATE INDEX IF NOT EXISTS idx_dlq_correlation_id ON dlq_messages (correlation_id, failed_at);
+DROP INDEX IF EXISTS idx_dlq_type;
+CREATE INDEX IF NOT EXISTS idx_dlq_event_type ON dlq_messages (event_type, failed_at);
+CREATE INDEX IF NOT EXISTS idx_dlq_event_type_version ON dlq_messages (event_type, event_version, failed_at);
+CREATE INDEX IF NOT EXISTS idx_dlq_tenant ON dlq_messages (tenant_id, failed_at);
+CREATE INDEX IF NOT EXISTS idx_dlq_failed_at ON dlq_messages (failed_at);
+"""
+
+_COLUMNS = ("id, message_id, correlation_id, event_type, event_version, tenant_id, domain, version, "
+            "subscription, ordering_key, error, delivery_attempts, data, attributes, failed_at, "
+            "replay_count, replayed_at")
+
+
+def encode_cursor(message: ParkedMessage) -> str:
+    """Opaque cursor for the page after a message"""
+    return base64.urlsafe_b64encode(f"{message.failed_at!r}:{message.id}".encode("ascii")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Raises:
+        ValueError: If the cursor was not made by ``encode_cursor``
+    """
+    try:
+        failed_at, _, message_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii").partition(":")
+        return float(failed_at), int(message_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def _row(row: tuple) -> ParkedMessage:
+    row = list(row)
+    row[13] = json.loads(row[13])
+    return ParkedMessage(*row)
+
+
+class SQLiteDLQStore:
+    """
+    Parked messages in a SQLite database: in WAL mode on a local disk, with a
+    rollback journal on a network file system (see ``journal_mode``). SQLite
+    on a network file system is only safe with a single writer.
+
+    Pages are ordered by failure time, then ID, and a page continues after
+    the last message of the previous one (keyset pagination, see
+    ``encode_cursor``), so deep pages cost the same as the first and
+    messages parked meanwhile are not skipped.
+    """
+
+    def __init__(self, path: Optional[str] = DLQ_STORE_PATH):
+        """
+        Raises:
+            ValueError: If no path is given and DLQ_STORE_PATH is not set
+        """
+        if not path:
+            raise ValueError("DLQ_STORE_PATH must name the SQLite database of parked messages, "
+                             "on storage that outlives the instance")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute(f"PRAGMA busy_timeout={DLQ_STORE_BUSY_TIMEOUT_MS}")
+        self.journal_mode = self._conn.execute(f"PRAGMA journal_mode={journal_mode(path)}").fetchone()[0].upper()
+        # NORMAL is durable enough with WAL; a rollback journal needs FULL
+        self._conn.execute(f"PRAGMA synchronous={'NORMAL' if self.journal_mode == 'WAL' else 'FULL'}")
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+
+    def park(self, message: ParkedMessage) -> bool:
+        """Store a message; False if its message ID is already parked (a redelivered push)"""
+        values = list(message)
+        values[13] = json.dumps(message.attributes)
+        with self._db_lock:
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO dlq_messages ({_COLUMNS}) VALUES ({', '.join('?' * len(values))})",
+                values
+            )
+        return cursor.rowcount == 1
+
+    def get(self, message_id: int) -> Optional[ParkedMessage]:
+        with self._db_lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM dlq_messages WHERE id = ?", (message_id,)).fetchone()
+        return _row(row) if row else None
+
+    def query(self, where: DLQFilter = DLQFilter(), after: Optional[Tuple[float, int]] = None,
+              limit: int = 100, up_to: Optional[int] = None,
+              ids: Optional[Sequence[int]] = None) -> List[ParkedMessage]:
+        """
+        Up to ``limit`` matching messages, in (failed_at, id) order.
+
+        Args:
+            after: The (failed_at, id) of the last message of the previous page
+            up_to: Highest ID to include
+            ids: Only these IDs
+        """
+        clauses, params = [], []
+        if ids is not None:
+            clauses.append(f"id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        for column in ("correlation_id", "event_type", "event_version", "tenant_id"):
+            value = getattr(where, column)
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if where.failed_after is not None:
+            clauses.append("failed_at >= ?")
+            params.append(where.failed_after)
+        if where.failed_before is not None:
+            clauses.append("failed_at < ?")
+            params.append(where.failed_before)
+        if where.replayed is not None:
+            clauses.append("replay_count > 0" if where.replayed else "replay_count = 0")
+        if after is not None:
+            clauses.append("(failed_at, id) > (?, ?)")
+            params.extend(after)
+        if up_to is not None:
+            clauses.append("id <= ?")
+            params.append(up_to)
+        sql = f"SELECT {_COLUMNS} FROM dlq_messages"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY failed_at, id LIMIT ?"
+        params.append(limit)
+        with self._db_lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [_row(row) for row in rows]
+
+    def last_id(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM dlq_messages").fetchone()[0]
+
+    def mark_replayed(self, ids: Iterable[int]) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.executemany(
+                "UPDATE dlq_messages SET replay_count = replay_count + 1, replayed_at = ? WHERE id = ?",
+                [(now, message_id) for message_id in ids]
+            )
+
+    def stats(self) -> Dict[str, float]:
+        with self._db_lock:
+            parked, replayed, oldest = self._conn.execute(
+                "SELECT COUNT(*), COUNT(replayed_at), MIN(failed_at) FROM dlq_messages"
+            ).fetchone()
+        return {
+            "parked": parked,
+            "replayed": replayed,
+            "oldest_seconds": time.time() - oldest if oldest is not None else 0.0,
+        }
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+
+class ReplayJob:
+    """
+    Progress of one replay. The selection is fixed when the job starts:
+    messages parked later, including replays that fail again, are left for
+    another job.
+    """
+
+    def __init__(self, where: DLQFilter, ids: Optional[Sequence[int]], up_to: int, rate: float,
+                 batch_size: int):
+        self.id = uuid.uuid4().hex
+        self.where = where
+        self.ids = sorted(set(ids)) if ids is not None else None
+        self.up_to = up_to
+        self.rate = rate
+        self.batch_size = batch_size
+        self.status = RUNNING
+        self.published = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._cancelled = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def cancel(self):
+        """Stop after the batch being published"""
+        self._cancelled.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the job to finish; False on timeout"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "status": self.status,
+            "filter": self.where._asdict(),
+            "ids": self.ids,
+            "rate": self.rate,
+            "batch_size": self.batch_size,
+            "published": self.published,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "messages_per_second": self.published / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class DLQReplayer:
+    """
+    Re-publishes parked messages to their original topics, paced and batched.
+
+    Each batch is published and awaited before the next starts, so at most
+    ``batch_size`` messages are in flight, and batches are spaced so the
+    average never exceeds ``rate`` messages per second. Messages are
+    republished with their original data, attributes (minus the dead-letter
+    ones) and ordering key, plus ``dlq_replay_count``; they get new message
+    IDs, so consumers deduplicating by message ID process them again.
+    Published messages are marked replayed; failed ones stay as they were.
+    """
+
+    def __init__(self, store: SQLiteDLQStore, publisher, project_id: str, rate: float = DLQ_REPLAY_RATE,
+                 batch_size: int = DLQ_REPLAY_BATCH_SIZE, timeout: float = 60.0,
+                 max_rate: float = DLQ_REPLAY_MAX_RATE, max_batch_size: int = DLQ_REPLAY_MAX_BATCH_SIZE):
+        """
+        Args:
+            publisher: Pub/Sub publisher client, with message ordering
+                enabled if replayed messages have ordering keys; None creates
+                one on the first replay
+            rate: Default pace in messages per second
+            batch_size: Default messages per batch
+            timeout: Seconds to wait for a batch to be published
+            max_rate: Fastest pace a replay may ask for
+            max_batch_size: Largest batch a replay may ask for
+        """
+        self.store = store
+        self.publisher = publisher
+        self.project_id = project_id
+        self.rate = rate
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_rate = max_rate
+        self.max_batch_size = max_batch_size
+        self._topic_paths: Dict[Tuple[str, str], str] = {}
+        self._jobs: Dict[str, ReplayJob] = {}
+        self._lock = threading.Lock()
+
+    def replay(self, where: DLQFilter = DLQFilter(), ids: Optional[Sequence[int]] = None,
+               rate: Optional[float] = None, batch_size: Optional[int] = None) -> ReplayJob:
+        """
+        Start replaying the messages matching ``where``, or only those of
+        ``ids`` among them, on a background thread. A ``rate`` or
+        ``batch_size`` above ``max_rate`` or ``max_batch_size`` is clamped to it.
+        """
+        rate = rate or self.rate
+        batch_size = batch_size or self.batch_size
+        if rate <= 0 or batch_size <= 0:
+            raise ValueError("rate and batch_size must be positive")
+        rate = min(rate, self.max_rate)
+        batch_size = min(batch_size, self.max_batch_size)
+        job = ReplayJob(where, ids, self.store.last_id(), rate, batch_size)
+        job._thread = threading.Thread(target=self._run, args=(job,), name=f"dlq-replay-{job.id[:8]}", daemon=True)
+        with self._lock:
+            self._jobs[job.id] = job
+        job._thread.start()
+        return job
+
+    def job(self, job_id: str) -> Optional[ReplayJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[ReplayJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _batches(self, job: ReplayJob) -> Iterable[List[ParkedMessage]]:
+        if job.ids is not None:
+            for start in range(0, len(job.ids), job.batch_size):
+                chunk = job.ids[start:start + job.batch_size]
+                batch = self.store.query(job.where, limit=len(chunk), up_to=job.up_to, ids=chunk)
+                if batch:
+                    yield batch
+            return
+        after = None
+        while True:
+            batch = self.store.query(job.where, after, job.batch_size, job.up_to)
+            if not batch:
+                return
+            yield batch
+            after = (batch[-1].failed_at, batch[-1].id)
+
+    def _run(self, job: ReplayJob):
+        logger.info(f"Replay {job.id} started at {job.rate:g} messages/s in batches of {job.batch_size}")
+        start = time.monotonic()
+        try:
+            for batch in self._batches(job):
+                if job._cancelled.is_set():
+                    job.status = CANCELLED
+                    break
+                self._publish_batch(job, batch)
+                # Space batches so the average stays at the rate
+                delay = start + (job.published + job.failed) / job.rate - time.monotonic()
+                if delay > 0 and job._cancelled.wait(delay):
+                    job.status = CANCELLED
+                    break
+            else:
+                job.status = COMPLETED
+        except Exception as e:
+            logger.error(f"Replay {job.id} failed: {e}", exc_info=True)
+            job.status = FAILED
+            job.last_error = str(e)
+        job.finished_at = time.time()
+        logger.info(f"Replay {job.id} {job.status}: {job.published} published, {job.failed} failed")
+
+    def _publish_batch(self, job: ReplayJob, batch: List[ParkedMessage]):
+        futures = [(message, self._publish(message)) for message in batch]
+        published = []
+        for message, future in futures:
+            try:
+                future.result(timeout=self.timeout)
+            except Exception as e:
+                job.failed += 1
+                job.last_error = f"message {message.id}: {e}"
+                logger.error(f"Replay {job.id} could not publish parked message {message.id}: {e}")
+            else:
+                published.append(message.id)
+        self.store.mark_replayed(published)
+        job.published += len(published)
+
+    def _client(self):
+        if self.publisher is None:
+            from google.cloud import pubsub_v1
+            self.publisher = pubsub_v1.PublisherClient(
+                publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=True)
+            )
+        return self.publisher
+
+    def _publish(self, message: ParkedMessage):
+        publisher = self._client()
+        key = (message.domain, message.version)
+        topic_path = self._topic_paths.get(key)
+        if topic_path is None:
+            topic_path = self._topic_paths[key] = publisher.topic_path(self.project_id, message.topic)
+        attributes = {name: value for name, value in message.attributes.items()
+                      if not name.startswith(DEAD_LETTER_ATTRIBUTE_PREFIX)}
+        attributes[REPLAY_ATTRIBUTE] = str(message.replay_count + 1)
+        if not message.ordering_key:
+            return publisher.publish(topic_path, message.data, **attributes)
+        future = publisher.publish(topic_path, message.data, ordering_key=message.ordering_key, **attributes)
+
+        def resume(done):
+            # The client pauses a key after a failed publish; resume it for the next replay
+            if done.exception() is not None:
+                publisher.resume_publish(topic_path, message.ordering_key)
+
+        future.add_done_callback(resume)
+        return future
@@ -0,0 +1,106 @@
+import base64
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Union
+
+from .codec import dumps, loads
+from .compact import MAGIC, get_compact_codec
+from .schema import EventValidationError, get_validator
+
+DEFAULT_DOMAIN = "core-api"
+DEFAULT_VERSION = "1"
+
+# Encodings of message data, named in the ENCODING_ATTRIBUTE message attribute
+JSON = "json"
+COMPACT = "compact"
+ENCODINGS = (JSON, COMPACT)
+ENCODING_ATTRIBUTE = "event_encoding"
+# Encoding producers publish with; consumers accept both
+EVENT_ENCODING = os.getenv("EVENT_ENCODING", JSON).lower()
+
+_COMPACT_PREFIX = bytes((MAGIC,))
+
+
+def build_event(
+    event_type: str,
+    version: str,
+    tenant_id: str,
+    payload: Dict[str, Any],
+    correlation_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Build the standard event envelope"""
+    return {
+        "type": event_type,
+        "version": version,
+        "occurred_at": datetime.utcnow().isoformat() + "Z",
+        "tenant_id": tenant_id,
+        # Generate correlation ID if not provided
+        "correlation_id": correlation_id or str(uuid.uuid4()),
+        "payload": payload
+    }
+
+
+def encode_event(event: Dict[str, Any], domain: str = DEFAULT_DOMAIN, version: str = DEFAULT_VERSION,
+                 encoding: str = JSON) -> bytes:
+    """
+    Validate an envelope against the ``<domain>.v<version>`` schema and
+    encode it as JSON or, with ``encoding=COMPACT``, in the compact binary
+    format of that topic (see ``salon_events.compact``).
+    """
+    get_validator(domain, version)(event)
+    if encoding == JSON:
+        return dumps(event)
+    if encoding == COMPACT:
+        return get_compact_codec(domain, version).encode(event)
+    raise ValueError(f"Unknown event encoding: {encoding}")
+
+
+def detect_encoding(data: Union[bytes, str]) -> str:
+    """The encoding of message data, from its first byte: compact data starts with a byte JSON cannot"""
+    return COMPACT if data[:1] == _COMPACT_PREFIX else JSON
+
+
+def message_encoding(attributes: Optional[Mapping[str, str]]) -> Optional[str]:
+    """The encoding named by a message's attributes, or None for messages published without one"""
+    return attributes.get(ENCODING_ATTRIBUTE) if attributes else None
+
+
+def decode_event(data: Union[bytes, str], domain: str = DEFAULT_DOMAIN, version: str = DEFAULT_VERSION,
+                 encoding: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Decode message data and validate it against the ``<domain>.v<version>`` schema.
+
+    Args:
+        encoding: JSON or COMPACT, usually from ``message_encoding``; None
+            detects it from the data
+
+    Raises:
+        EventValidationError: If the data is not valid in its encoding or
+            not a valid envelope
+    """
+    if encoding is None:
+        encoding = detect_encoding(data)
+    if encoding == JSON:
+        try:
+            event = loads(data)
+        except ValueError as e:
+            raise EventValidationError("$", f"is not valid JSON: {e}")
+    elif encoding == COMPACT:
+        if isinstance(data, str):
+            raise EventValidationError("$", "is text, not compact data")
+        event = get_compact_codec(domain, version).decode(data)
+    else:
+        raise EventValidationError("$", f"has unknown encoding {encoding!r}")
+    get_validator(domain, version)(event)
+    return event
+
+
+def decode_base64_event(data: Union[bytes, str], domain: str = DEFAULT_DOMAIN,
+                        version: str = DEFAULT_VERSION, encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Decode the base64 ``data`` of a push or Cloud Functions Pub/Sub message"""
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except ValueError as e:
+        raise EventValidationError("$", f"is not valid base64: {e}")
+    return decode_event(raw, domain, version, encoding)
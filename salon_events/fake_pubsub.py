@@ -0,0 +1,398 @@
+"""
+In-process stand-in for the Pub/Sub publisher and subscriber clients.
+
+EventProducer and EventConsumer accept a client, so pointing both at one
+FakePubSub runs the producer -> topic -> consumer -> dead-letter path in a
+single process, without GCP or the emulator:
+
+    pubsub = FakePubSub(time_scale=0.001)
+    producer = EventProducer("test", publisher=FakePublisherClient(pubsub))
+    consumer = EventConsumer("test", subscriber=FakeSubscriberClient(pubsub))
+
+Subscriptions get the policy the Terraform pubsub module gives ours (see
+DLQ_IMPLEMENTATION.md): failed messages are retried with exponential backoff
+from 10 s to 600 s, and after 5 delivery attempts are published to the
+topic's ``<topic>-dlq`` dead-letter topic. A delivery fails when it is
+nacked or its ack deadline passes first; leases are not extended, so a
+handler slower than the ack deadline sees its message redelivered.
+
+``time_scale`` shrinks every duration, so with 0.001 a 10 s backoff takes
+10 ms of wall time. Topics are created on first publish.
+
+Ordering keys are carried to the subscriber (``message.ordering_key``) but
+not enforced: messages of one key may reach the callback threads out of
+order, as they would on a subscription without message ordering.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Mirrors infra/terraform/modules/pubsub/main.tf
+DEFAULT_MAX_DELIVERY_ATTEMPTS = 5
+DEFAULT_MIN_BACKOFF_SECONDS = 10.0
+DEFAULT_MAX_BACKOFF_SECONDS = 600.0
+# Pub/Sub's default ack deadline
+DEFAULT_ACK_DEADLINE_SECONDS = 10.0
+DLQ_SUFFIX = "-dlq"
+
+
+class _Message:
+    __slots__ = ("message_id", "data", "attributes", "ordering_key", "published_at", "publish_time", "size")
+
+    def __init__(self, message_id: str, data: bytes, attributes: Dict[str, str], ordering_key: str = ""):
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.ordering_key = ordering_key
+        self.published_at = time.monotonic()
+        self.publish_time = datetime.now(timezone.utc)
+        self.size = len(data)
+
+
+class _Delivery:
+    """A message's state in one subscription"""
+
+    __slots__ = ("message", "attempt", "ack_id", "deadline")
+
+    def __init__(self, message: _Message):
+        self.message = message
+        self.attempt = 0
+        self.ack_id: Optional[int] = None
+        self.deadline = 0.0
+
+
+class _Subscription:
+    def __init__(self, pubsub: "FakePubSub", name: str, topic: str, ack_deadline: float,
+                 max_delivery_attempts: int, dead_letter_topic: Optional[str],
+                 min_backoff: float, max_backoff: float):
+        self.pubsub = pubsub
+        self.name = name
+        self.topic = topic
+        self.ack_deadline = ack_deadline
+        self.max_delivery_attempts = max_delivery_attempts
+        self.dead_letter_topic = dead_letter_topic
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.cond = threading.Condition()
+        # (available at, sequence, delivery); a heap, so retries wait out their backoff
+        self.ready: List[Any] = []
+        # ack ID -> delivery, for messages handed out and not yet settled
+        self.leased: Dict[int, _Delivery] = {}
+        # (ack deadline, ack ID) of leased deliveries; entries for settled ones are skipped
+        self.deadlines: List[Any] = []
+        self.latencies: List[float] = []
+        self.counts = dict.fromkeys(
+            ("published", "delivered", "acked", "nacked", "expired", "redelivered", "dead_lettered"), 0)
+
+    def enqueue(self, message: _Message):
+        with self.cond:
+            self.counts["published"] += 1
+            heapq.heappush(self.ready, (time.monotonic(), next(self.pubsub.sequence), _Delivery(message)))
+            self.cond.notify_all()
+
+    def backoff(self, attempt: int) -> float:
+        return min(self.min_backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def _failed(self, delivery: _Delivery, now: float):
+        """Retry a failed delivery after its backoff, or dead-letter it; holds cond"""
+        if self.dead_letter_topic and delivery.attempt >= self.max_delivery_attempts:
+            self.counts["dead_lettered"] += 1
+            message = delivery.message
+            attributes = dict(message.attributes,
+                              CloudPubSubDeadLetterSourceDeliveryCount=str(delivery.attempt),
+                              CloudPubSubDeadLetterSourceSubscription=self.name)
+            # Published outside the lock, as the DLQ may have subscribers of its own
+            threading.Thread(target=self.pubsub.publish,
+                             args=(self.dead_letter_topic, message.data, attributes), daemon=True).start()
+            return
+        self.counts["redelivered"] += 1
+        heapq.heappush(self.ready, (now + self.backoff(delivery.attempt), next(self.pubsub.sequence), delivery))
+        self.cond.notify_all()
+
+    def expire_leases(self, now: float) -> Optional[float]:
+        """Fail deliveries whose ack deadline passed; returns the next deadline. Holds cond."""
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _, ack_id = heapq.heappop(deadlines)
+            delivery = self.leased.pop(ack_id, None)
+            if delivery is not None:
+                self.counts["expired"] += 1
+                self._failed(delivery, now)
+        return deadlines[0][0] if deadlines else None
+
+    def lease(self, now: float) -> _Delivery:
+        """Hand out the first ready delivery; holds cond"""
+        _, _, delivery = heapq.heappop(self.ready)
+        delivery.attempt += 1
+        delivery.ack_id = next(self.pubsub.sequence)
+        delivery.deadline = now + self.ack_deadline
+        self.leased[delivery.ack_id] = delivery
+        heapq.heappush(self.deadlines, (delivery.deadline, delivery.ack_id))
+        self.counts["delivered"] += 1
+        return delivery
+
+    def settle(self, ack_id: int, ack: bool):
+        with self.cond:
+            # A settle after the ack deadline finds nothing; that delivery
+            # already failed and the message is queued for redelivery
+            delivery = self.leased.pop(ack_id, None)
+            if delivery is None:
+                return
+            now = time.monotonic()
+            if ack:
+                self.counts["acked"] += 1
+                self.latencies.append(now - delivery.message.published_at)
+            else:
+                self.counts["nacked"] += 1
+                self._failed(delivery, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            stats = dict(self.counts, backlog=len(self.ready), outstanding=len(self.leased))
+            latencies = sorted(self.latencies)
+        if latencies:
+            stats["p50_ms"] = latencies[len(latencies) // 2] * 1000
+            stats["p99_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        return stats
+
+
+class FakePubSub:
+    """
+    Topics and subscriptions shared by the fake clients.
+
+    Args:
+        time_scale: Multiplies every duration (ack deadlines, backoff); e.g.
+            0.001 to run 10 s retries in 10 ms
+        ack_deadline_seconds: Default ack deadline of new subscriptions
+        max_delivery_attempts: Default attempts before dead-lettering
+        min_backoff_seconds, max_backoff_seconds: Default retry backoff
+        dead_letter: Give new subscriptions a ``<topic>-dlq`` dead-letter
+            topic unless their request names another one
+    """
+
+    def __init__(self,
+                 time_scale: float = 1.0,
+                 ack_deadline_seconds: float = DEFAULT_ACK_DEADLINE_SECONDS,
+                 max_delivery_attempts: int = DEFAULT_MAX_DELIVERY_ATTEMPTS,
+                 min_backoff_seconds: float = DEFAULT_MIN_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = DEFAULT_MAX_BACKOFF_SECONDS,
+                 dead_letter: bool = True):
+        self.time_scale = time_scale
+        self.ack_deadline_seconds = ack_deadline_seconds
+        self.max_delivery_attempts = max_delivery_attempts
+        self.min_backoff_seconds = min_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.dead_letter = dead_letter
+        self.sequence = itertools.count(1)
+        self.topics: Dict[str, List[_Subscription]] = {}
+        self.subscriptions: Dict[str, _Subscription] = {}
+        self._lock = threading.Lock()
+
+    def create_topic(self, topic: str):
+        with self._lock:
+            self.topics.setdefault(topic, [])
+
+    def create_subscription(self, name: str, topic: str, ack_deadline_seconds: Optional[float] = None,
+                            dead_letter_topic: Optional[str] = None,
+                            max_delivery_attempts: Optional[int] = None) -> _Subscription:
+        """Create a subscription; raises ValueError if it exists"""
+        if dead_letter_topic is None and self.dead_letter and not topic.endswith(DLQ_SUFFIX):
+            dead_letter_topic = topic + DLQ_SUFFIX
+        with self._lock:
+            if name in self.subscriptions:
+                raise ValueError(f"Subscription already exists: {name}")
+            subscription = _Subscription(
+                self, name, topic,
+                ack_deadline=(ack_deadline_seconds or self.ack_deadline_seconds) * self.time_scale,
+                max_delivery_attempts=max_delivery_attempts or self.max_delivery_attempts,
+                dead_letter_topic=dead_letter_topic,
+                min_backoff=self.min_backoff_seconds * self.time_scale,
+                max_backoff=self.max_backoff_seconds * self.time_scale,
+            )
+            self.subscriptions[name] = subscription
+            self.topics.setdefault(topic, []).append(subscription)
+            if dead_letter_topic:
+                self.topics.setdefault(dead_letter_topic, [])
+        return subscription
+
+    def publish(self, topic: str, data: bytes, attributes: Optional[Dict[str, str]] = None,
+                ordering_key: str = "") -> str:
+        """Add a message to every subscription of a topic; returns its message ID"""
+        message = _Message(str(next(self.sequence)), data, attributes or {}, ordering_key)
+        with self._lock:
+            subscriptions = self.topics.setdefault(topic, [])[:]
+        for subscription in subscriptions:
+            subscription.enqueue(message)
+        return message.message_id
+
+    def stats(self, subscription: str) -> Dict[str, Any]:
+        """
+        Delivery counters for a subscription, the backlog, and p50/p99
+        publish-to-ack latency in wall-clock milliseconds
+        """
+        return self.subscriptions[subscription].stats()
+
+
+def _name(path: str) -> str:
+    """Last segment of a projects/<project>/topics|subscriptions/<name> path"""
+    return path.rsplit("/", 1)[-1]
+
+
+class FakePublisherClient:
+    """The PublisherClient methods EventProducer uses"""
+
+    def __init__(self, pubsub: FakePubSub):
+        self.pubsub = pubsub
+
+    def topic_path(self, project_id: str, topic: str) -> str:
+        return f"projects/{project_id}/topics/{topic}"
+
+    def create_topic(self, request=None, name: Optional[str] = None):
+        self.pubsub.create_topic(_name(name or request["name"]))
+
+    def publish(self, topic: str, data: bytes, ordering_key: str = "", **attributes) -> Future:
+        future = Future()
+        try:
+            future.set_result(self.pubsub.publish(_name(topic), data, attributes, ordering_key))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def resume_publish(self, topic: str, ordering_key: str):
+        """Publishing never pauses a key here, so there is nothing to resume"""
+
+
+class FakeMessage:
+    """What the subscriber callback receives, like ``pubsub_v1.subscriber.message.Message``"""
+
+    __slots__ = ("_subscription", "_delivery", "_ack_id", "_release", "_settled",
+                 "message_id", "data", "attributes", "ordering_key", "publish_time", "delivery_attempt", "size")
+
+    def __init__(self, subscription: _Subscription, delivery: _Delivery, release):
+        self._subscription = subscription
+        self._delivery = delivery
+        self._ack_id = delivery.ack_id
+        self._release = release
+        self._settled = False
+        message = delivery.message
+        self.message_id = message.message_id
+        self.data = message.data
+        self.attributes = message.attributes
+        self.ordering_key = message.ordering_key
+        self.publish_time = message.publish_time
+        self.delivery_attempt = delivery.attempt
+        self.size = message.size
+
+    def _settle(self, ack: bool):
+        if self._settled:
+            return
+        self._settled = True
+        self._subscription.settle(self._ack_id, ack)
+        self._release(self)
+
+    def ack(self):
+        self._settle(True)
+
+    def nack(self):
+        self._settle(False)
+
+
+class _StreamingPullFuture:
+    """Returned by ``subscribe``: ``cancel()`` stops the pull, ``result()`` waits for that"""
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return self._cancelled.is_set()
+
+    def result(self, timeout: Optional[float] = None):
+        if not self._cancelled.wait(timeout):
+            raise TimeoutError()
+
+
+class FakeSubscriberClient:
+    """
+    The SubscriberClient methods EventConsumer uses.
+
+    ``subscribe`` leases messages while flow control allows and runs the
+    callback on a pool of ``callback_threads`` threads, as the client's
+    scheduler does.
+    """
+
+    def __init__(self, pubsub: FakePubSub, callback_threads: int = 10):
+        self.pubsub = pubsub
+        self.callback_threads = callback_threads
+
+    def topic_path(self, project_id: str, topic: str) -> str:
+        return f"projects/{project_id}/topics/{topic}"
+
+    def subscription_path(self, project_id: str, subscription: str) -> str:
+        return f"projects/{project_id}/subscriptions/{subscription}"
+
+    def create_subscription(self, request=None, name: Optional[str] = None, topic: Optional[str] = None):
+        request = dict(request or {}, **{key: value for key, value in (("name", name), ("topic", topic)) if value})
+        dead_letter_policy = request.get("dead_letter_policy") or {}
+        self.pubsub.create_subscription(
+            _name(request["name"]),
+            _name(request["topic"]),
+            ack_deadline_seconds=request.get("ack_deadline_seconds"),
+            dead_letter_topic=_name(dead_letter_policy["dead_letter_topic"])
+            if dead_letter_policy.get("dead_letter_topic") else None,
+            max_delivery_attempts=dead_letter_policy.get("max_delivery_attempts"),
+        )
+
+    def subscribe(self, subscription: str, callback, flow_control=()) -> _StreamingPullFuture:
+        sub = self.pubsub.subscriptions[_name(subscription)]
+        if isinstance(flow_control, tuple):
+            max_bytes = flow_control[0] if len(flow_control) > 0 else 100 * 1024 * 1024
+            max_messages = flow_control[1] if len(flow_control) > 1 else 1000
+        else:
+            max_bytes = flow_control.max_bytes
+            max_messages = flow_control.max_messages
+        future = _StreamingPullFuture()
+        scheduler = ThreadPoolExecutor(max_workers=self.callback_threads, thread_name_prefix="fake-subscriber")
+        outstanding = {"messages": 0, "bytes": 0}
+
+        def release(message: FakeMessage):
+            with sub.cond:
+                outstanding["messages"] -= 1
+                outstanding["bytes"] -= message.size
+                sub.cond.notify_all()
+
+        def pull():
+            while not future.cancelled():
+                with sub.cond:
+                    now = time.monotonic()
+                    next_deadline = sub.expire_leases(now)
+                    can_lease = (outstanding["messages"] < max_messages
+                                 and (outstanding["bytes"] < max_bytes or not outstanding["messages"]))
+                    if can_lease and sub.ready and sub.ready[0][0] <= now:
+                        delivery = sub.lease(now)
+                        outstanding["messages"] += 1
+                        outstanding["bytes"] += delivery.message.size
+                    else:
+                        wakeups = [deadline for deadline in (
+                            next_deadline, sub.ready[0][0] if sub.ready and can_lease else None
+                        ) if deadline is not None]
+                        sub.cond.wait(min(max(min(wakeups) - now, 0.0005), 0.1) if wakeups else 0.1)
+                        continue
+                scheduler.submit(callback, FakeMessage(sub, delivery, release))
+            scheduler.shutdown(wait=False)
+
+        threading.Thread(target=pull, name=f"fake-pull-{sub.name}", daemon=True).start()
+        return future
@@ -0,0 +1,134 @@
+"""
+Local SMTP stand-in for tests and benchmarks of the DLQ alerts.
+
+FakeSMTPServer listens on localhost and speaks enough SMTP for smtplib:
+EHLO/HELO, AUTH PLAIN and LOGIN (any credentials are accepted), MAIL, RCPT,
+DATA, RSET, NOOP and QUIT. Received emails are parsed and kept in
+``messages``, and ``connections`` counts the SMTP sessions opened:
+
+    with FakeSMTPServer() as server:
+        sender = SMTPDigestSender("localhost", server.port, starttls=False)
+        ...
+        assert server.connections == 1
+
+STARTTLS is not offered, so senders must be created with ``starttls=False``.
+``drop_connections()`` closes the open sessions, as a server does with
+idle clients.
+"""
+
+import socket
+import socketserver
+import threading
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+from typing import List
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server: "FakeSMTPServer" = self.server.owner
+        server._opened(self.connection)
+        try:
+            self._reply("220 localhost fake SMTP service ready")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command, _, argument = line.decode("ascii", "replace").rstrip("\r\n").partition(" ")
+                command = command.upper()
+                if command == "EHLO":
+                    self._reply("250-localhost", "250-AUTH PLAIN LOGIN", "250 8BITMIME")
+                elif command == "HELO":
+                    self._reply("250 localhost")
+                elif command == "AUTH":
+                    mechanism, _, initial_response = argument.partition(" ")
+                    # Prompt for whatever the client did not send with the command
+                    prompts = {"PLAIN": [""], "LOGIN": ["VXNlcm5hbWU6", "UGFzc3dvcmQ6"]}.get(mechanism.upper(), [])
+                    for prompt in prompts[1 if initial_response else 0:]:
+                        self._reply(f"334 {prompt}")
+                        self.rfile.readline()
+                    self._reply("235 2.7.0 Authentication successful")
+                elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    self._reply("250 OK")
+                elif command == "DATA":
+                    self._reply("354 End data with <CR><LF>.<CR><LF>")
+                    server._received(self._read_data())
+                    self._reply("250 OK: queued")
+                elif command == "QUIT":
+                    self._reply("221 Bye")
+                    return
+                else:
+                    self._reply("502 Command not implemented")
+        except OSError:
+            pass
+        finally:
+            server._closed(self.connection)
+
+    def _read_data(self) -> bytes:
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b".\r\n":
+                return b"".join(lines)
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+    def _reply(self, *lines: str):
+        self.wfile.write("".join(f"{line}\r\n" for line in lines).encode("ascii"))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSMTPServer:
+    """An SMTP server on localhost that keeps what it receives"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = _Server((host, port), _SMTPHandler)
+        self._server.owner = self
+        self.host, self.port = self._server.server_address[:2]
+        self._lock = threading.Lock()
+        self._open: List[socket.socket] = []
+        self.messages: List[EmailMessage] = []
+        self.connections = 0
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-smtp", daemon=True)
+
+    def start(self) -> "FakeSMTPServer":
+        self._thread.start()
+        return self
+
+    def _opened(self, connection: socket.socket):
+        with self._lock:
+            self.connections += 1
+            self._open.append(connection)
+
+    def _closed(self, connection: socket.socket):
+        with self._lock:
+            if connection in self._open:
+                self._open.remove(connection)
+
+    def _received(self, data: bytes):
+        with self._lock:
+            self.messages.append(message_from_bytes(data, policy=policy.default))
+
+    def drop_connections(self):
+        """Close every open session without a reply"""
+        with self._lock:
+            connections, self._open = self._open, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeSMTPServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,169 @@
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+from .dedup import DUPLICATE, IN_FLIGHT, Deduplicator, DuplicateInFlight, get_deduplicator
+from .dispatch import DispatchTable, Upcaster
+from .envelope import DEFAULT_DOMAIN, DEFAULT_VERSION, decode_base64_event, message_encoding
+from .schema import EventValidationError, get_validator
+
+logger = logging.getLogger(__name__)
+
+# Most messages accepted in one batch request
+EVENT_BATCH_MAX_MESSAGES = int(os.getenv("EVENT_BATCH_MAX_MESSAGES", "1000"))
+
+Handler = Callable[[Dict[str, Any]], Any]
+
+# Outcomes of processing one message
+PROCESSED = "processed"
+UNHANDLED = "unhandled"    # No handler accepts its type and version
+INVALID = "invalid"        # Not a valid envelope
+FAILED = "failed"          # Its handler raised
+
+
+class EventProcessor:
+    """
+    Handler registry and dispatch path shared by the event processors.
+
+    Handlers are registered with decorators and looked up in a DispatchTable,
+    so version ranges and upcasters work as they do in EventConsumer:
+
+        processor = EventProcessor("core-api", "1")
+
+        @processor.handler("booking_created")
+        def booking_created(event):
+            ...
+
+    ``process`` runs one decoded event, ``process_message`` one base64
+    Pub/Sub message and ``process_batch`` many messages in one call, with a
+    result per message. Redeliveries are skipped by a Deduplicator.
+    """
+
+    def __init__(self,
+                 domain: str = DEFAULT_DOMAIN,
+                 version: str = DEFAULT_VERSION,
+                 dedup: Optional[Deduplicator] = None):
+        """
+        Args:
+            domain: Domain of the topic the processor consumes
+            version: Envelope schema version of that topic
+            dedup: Deduplicator for redeliveries; by default the one
+                configured by the EVENT_DEDUP_* settings
+        """
+        self.domain = domain
+        self.version = version
+        self.dispatch_table = DispatchTable()
+        self.dedup = dedup if dedup is not None else get_deduplicator()
+        # Compile the envelope schema once, when the processor is created
+        get_validator(domain, version)
+
+    def handler(self, event_type: str, version: str = DEFAULT_VERSION) -> Callable[[Handler], Handler]:
+        """Decorator registering a handler for an event type and version or version range"""
+        def register(func: Handler) -> Handler:
+            self.dispatch_table.register(event_type, version, func)
+            return func
+        return register
+
+    def upcaster(self, event_type: str, from_version: str, to_version: str) -> Callable[[Upcaster], Upcaster]:
+        """Decorator registering an upcaster from one event version to the next"""
+        def register(func: Upcaster) -> Upcaster:
+            self.dispatch_table.register_upcaster(event_type, from_version, to_version, func)
+            return func
+        return register
+
+    def process(self, event: Dict[str, Any], message_id: Optional[str] = None) -> str:
+        """
+        Run the handler for a decoded event.
+
+        Returns:
+            PROCESSED, DUPLICATE, or UNHANDLED if no handler accepts the event
+
+        Raises:
+            DuplicateInFlight: If another delivery is processing the message
+            Exception: Whatever the handler raised
+        """
+        event_type = event.get("type")
+        event_version = event.get("version")
+        correlation_id = event.get("correlation_id")
+
+        route = self.dispatch_table.route(event_type, event_version)
+        if route is None:
+            logger.warning(f"Unknown event type: {event_type} v{event_version}")
+            return UNHANDLED
+
+        dedup_key = None
+        if self.dedup is not None:
+            outcome, dedup_key = self.dedup.claim(event, message_id)
+            if outcome == DUPLICATE:
+                logger.info(f"Skipping duplicate message {dedup_key} (dedup hit rate {self.dedup.hit_rate:.1%})")
+                return DUPLICATE
+            if outcome == IN_FLIGHT:
+                raise DuplicateInFlight(dedup_key)
+
+        logger.info(f"Processing {event_type} v{event_version} event (correlation_id: {correlation_id})")
+        try:
+            route.handler(route.prepare(event))
+        except BaseException:
+            if self.dedup is not None:
+                self.dedup.release(dedup_key)
+            raise
+        if self.dedup is not None:
+            self.dedup.complete(dedup_key)
+        logger.info(f"Successfully processed event {event_type} (correlation_id: {correlation_id})")
+        return PROCESSED
+
+    def process_message(self, data: str, message_id: Optional[str] = None,
+                        attributes: Optional[Mapping[str, str]] = None) -> str:
+        """
+        Decode and validate the base64 data of a Pub/Sub message and process it.
+        The data is JSON or compact, as the ``event_encoding`` attribute says,
+        or as detected when the message has none.
+
+        Raises:
+            EventValidationError: If the data is not a valid envelope
+        """
+        event = decode_base64_event(data, self.domain, self.version, message_encoding(attributes))
+        return self.process(event, message_id)
+
+    def process_batch(self, messages: Iterable[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Process several Pub/Sub messages, one result per message, in order.
+
+        Each item is a Pub/Sub message (``data``, ``messageId``) or a pull
+        response entry wrapping one (``ackId``, ``message``). One message
+        failing does not affect the others.
+
+        Returns:
+            Dicts with ``messageId``, ``ackId`` if given, ``ack`` (True if the
+            message should be acked) and ``outcome``, plus ``error`` for
+            messages that should be redelivered
+        """
+        results = []
+        for item in messages:
+            message = item.get("message", item)
+            message_id = message.get("messageId") or message.get("message_id")
+            result: Dict[str, Any] = {"messageId": message_id}
+            if "ackId" in item:
+                result["ackId"] = item["ackId"]
+            try:
+                if "data" not in message:
+                    raise EventValidationError("$", "no data in Pub/Sub message")
+                outcome = self.process_message(message["data"], message_id, message.get("attributes"))
+                result.update(ack=True, outcome=outcome)
+            except EventValidationError as e:
+                logger.error(f"Invalid event in message {message_id}: {e}")
+                result.update(ack=False, outcome=INVALID, error=str(e))
+            except DuplicateInFlight as e:
+                result.update(ack=False, outcome=IN_FLIGHT, error=str(e))
+            except Exception as e:
+                logger.error(f"Error processing message {message_id}: {e}", exc_info=True)
+                result.update(ack=False, outcome=FAILED, error=str(e))
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Dispatch counters and the dedup hit rate"""
+        stats = self.dispatch_table.stats()
+        if self.dedup is not None:
+            stats["dedup"] = self.dedup.stats()
+        return stats
@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the <domain>.v<version>.json envelope schemas. By default
+# the pubsub_schemas directory next to this package, which deployments stage
+# together with it.
+EVENT_SCHEMA_DIR = Path(os.getenv("EVENT_SCHEMA_DIR", str(Path(__file__).resolve().parent.parent / "pubsub_schemas")))
+
+Validator = Callable[[Any], None]
+
+# Keywords that describe a schema without constraining it
+_ANNOTATIONS = frozenset(("$schema", "$id", "$comment", "title", "description", "default", "examples"))
+
+_FORMATS = {
+    "date-time": re.compile(r"\d{4}-\d{2}-\d{2}[Tt ]\d{2}:\d{2}:\d{2}(\.\d+)?([Zz]|[+-]\d{2}:\d{2})\Z").match,
+    "date": re.compile(r"\d{4}-\d{2}-\d{2}\Z").match,
+    "uuid": re.compile(r"[0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}\Z").match,
+}
+
+
+class EventValidationError(ValueError):
+    """An event does not match its envelope schema"""
+
+    def __init__(self, path: str, message: str):
+        super().__init__(f"{path} {message}")
+        self.path = path
+
+
+def _is_integer(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _json_equal(a: Any, b: Any) -> bool:
+    """
+    Equality as JSON Schema defines it: like ``==``, except that booleans
+    only equal booleans (in Python ``True == 1``), and 1 equals 1.0
+    """
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if _is_number(a) or _is_number(b):
+        return _is_number(a) and _is_number(b) and a == b
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[key], b[key]) for key in a)
+    return type(a) is type(b) and a == b
+
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "boolean": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+    "integer": _is_integer,
+    "number": _is_number,
+}
+
+
+def compile_schema(schema: Dict[str, Any], path: str = "$") -> Validator:
+    """
+    Compile a JSON schema into a validator function.
+
+    Every keyword is turned into a closure up front, so validating walks only
+    the checks the schema actually declares, with no per-call keyword lookups.
+    Supports type, properties, required, additionalProperties, items, enum,
+    const, minLength, maxLength, minimum, maximum, pattern and the date-time,
+    date and uuid formats; unknown formats are ignored, as annotations.
+
+    Args:
+        schema: The JSON schema
+        path: Location of the schema, used in error messages
+
+    Returns:
+        A function that returns None for a valid value and raises
+        EventValidationError otherwise
+
+    Raises:
+        ValueError: If the schema uses a keyword this compiler doesn't support
+    """
+    unsupported = set(schema) - _ANNOTATIONS - {
+        "type", "properties", "required", "additionalProperties", "items", "enum", "const",
+        "minLength", "maxLength", "minimum", "maximum", "pattern", "format"
+    }
+    if unsupported:
+        raise ValueError(f"Unsupported schema keywords at {path}: {sorted(unsupported)}")
+
+    checks = []
+
+    type_names = schema.get("type")
+    if type_names is not None:
+        if isinstance(type_names, str):
+            type_names = [type_names]
+        type_checks = tuple(_TYPE_CHECKS[name] for name in type_names)
+        expected = " or ".join(type_names)
+        if len(type_checks) == 1:
+            type_check = type_checks[0]
+        else:
+            def type_check(value, type_checks=type_checks):
+                return any(check(value) for check in type_checks)
+
+        def check_type(value):
+            if not type_check(value):
+                raise EventValidationError(path, f"must be of type {expected}")
+        checks.append(check_type)
+
+    if "enum" in schema or "const" in schema:
+        allowed = schema["enum"] if "enum" in schema else [schema["const"]]
+
+        def check_enum(value):
+            # ``in`` rules out most values fast, but would let True match 1
+            if value not in allowed or not any(_json_equal(value, option) for option in allowed):
+                raise EventValidationError(path, f"must be one of {allowed}")
+        checks.append(check_enum)
+
+    format_match = _FORMATS.get(schema.get("format"))
+    if format_match is not None:
+        format_name = schema["format"]
+
+        def check_format(value):
+            if isinstance(value, str) and not format_match(value):
+                raise EventValidationError(path, f"must be a {format_name} string")
+        checks.append(check_format)
+
+    if "pattern" in schema:
+        search = re.compile(schema["pattern"]).search
+
+        def check_pattern(value):
+            if isinstance(value, str) and not search(value):
+                raise EventValidationError(path, f"must match {schema['pattern']}")
+        checks.append(check_pattern)
+
+    min_length, max_length = schema.get("minLength"), schema.get("maxLength")
+    if min_length is not None or max_length is not None:
+        def check_length(value):
+            if isinstance(value, str) and ((min_length is not None and len(value) < min_length)
+                                           or (max_length is not None and len(value) > max_length)):
+                raise EventValidationError(path, f"length must be between {min_length} and {max_length}")
+        checks.append(check_length)
+
+    minimum, maximum = schema.get("minimum"), schema.get("maximum")
+    if minimum is not None or maximum is not None:
+        def check_range(value):
+            if _is_number(value) and ((minimum is not None and value < minimum)
+                                      or (maximum is not None and value > maximum)):
+                raise EventValidationError(path, f"must be between {minimum} and {maximum}")
+        checks.append(check_range)
+
+    if "properties" in schema or "required" in schema or "additionalProperties" in schema:
+        checks.append(_compile_object(schema, path))
+
+    if "items" in schema:
+        check_item = compile_schema(schema["items"], f"{path}[]")
+
+        def check_items(value):
+            if isinstance(value, list):
+                for item in value:
+                    check_item(item)
+        checks.append(check_items)
+
+    if not checks:
+        return lambda value: None
+    if len(checks) == 1:
+        return checks[0]
+    checks = tuple(checks)
+
+    def validate(value):
+        for check in checks:
+            check(value)
+    return validate
+
+
+# Types a property declared only as {"type": <name>} is checked against inline
+_SIMPLE_TYPES = {"object": dict, "array": list, "string": str}
+
+
+def _compile_object(schema: Dict[str, Any], path: str) -> Validator:
+    required = schema.get("required", ())
+    # Properties that only declare a simple type are checked inline with
+    # isinstance, which saves a closure call per field on the envelope
+    simple = []
+    nested = []
+    for name, subschema in schema.get("properties", {}).items():
+        if set(subschema) - _ANNOTATIONS == {"type"} and subschema["type"] in _SIMPLE_TYPES:
+            simple.append((name, _SIMPLE_TYPES[subschema["type"]], subschema["type"]))
+        else:
+            nested.append((name, compile_schema(subschema, f"{path}.{name}")))
+    required = tuple(required)
+    simple, nested = tuple(simple), tuple(nested)
+    known = frozenset(name for name, _, _ in simple) | frozenset(name for name, _ in nested)
+    additional = schema.get("additionalProperties", True)
+    check_additional = None
+    if isinstance(additional, dict):
+        check_additional = compile_schema(additional, f"{path}.*")
+
+    def check_object(value):
+        if not isinstance(value, dict):
+            return
+        for name in required:
+            if name not in value:
+                raise EventValidationError(f"{path}.{name}", "is required")
+        for name, python_type, type_name in simple:
+            if name in value and not isinstance(value[name], python_type):
+                raise EventValidationError(f"{path}.{name}", f"must be of type {type_name}")
+        for name, check in nested:
+            if name in value:
+                check(value[name])
+        if additional is not True:
+            for name in value.keys() - known:
+                if check_additional is None:
+                    raise EventValidationError(f"{path}.{name}", "is not allowed")
+                check_additional(value[name])
+    return check_object
+
+
+def load_schema(domain: str, version: str, schema_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the envelope schema of ``<domain>.v<version>`` from the schema directory"""
+    schema_path = Path(schema_dir or EVENT_SCHEMA_DIR) / f"{domain}.v{version}.json"
+    with open(schema_path, encoding="utf-8") as schema_file:
+        return json.load(schema_file)
+
+
+_validators: Dict[Tuple[str, str], Validator] = {}
+
+
+def get_validator(domain: str = "core-api", version: str = "1") -> Validator:
+    """
+    Return the compiled validator for ``<domain>.v<version>`` events.
+
+    The schema is loaded and compiled on the first call for each pair and
+    cached for the life of the process. An EventProcessor asks for its
+    schema when it is created and EventConsumer.subscribe before it starts
+    listening, so for them a missing or invalid schema fails at startup;
+    a producer compiles the schema of a topic when it encodes its first event.
+    """
+    key = (domain, str(version))
+    validator = _validators.get(key)
+    if validator is None:
+        validator = compile_schema(load_schema(*key))
+        _validators[key] = validator
+        logger.info(f"Compiled event schema {domain}.v{version}")
+    return validator
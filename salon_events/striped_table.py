@@ -0,0 +1,124 @@
+"""
+Fixed-slot tables in a memory-mapped file, shared by the processes on a host.
+
+The shared-memory idempotency store of core-api and SharedMemoryDedupStore
+both keep a hash table in a file under /dev/shm that every worker maps.
+StripedTable is the part they have in common: creating the file or attaching
+to the one another process created, the fcntl byte-range lock of each stripe,
+and where each stripe's slots are. What a slot holds, and how keys are
+probed, is up to the store.
+
+Layout: one header page with the magic, layout version, slot count, slot size
+and stripe count, and one lock byte per stripe from byte 64; then, if the
+table keeps counters, one uint32 per stripe, padded to a page; then the
+slots, stripe after stripe.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Tuple
+
+# File header: magic, layout version, slots, slot size, stripes
+_HEADER = struct.Struct("<4sIIII")
+# The first page holds the file header and one lock byte per stripe
+HEADER_BYTES = 4096
+_LOCK_BASE = 64
+_COUNTER = struct.Struct("<I")
+
+
+class StripedTable:
+    """
+    A memory-mapped file of ``slots`` slots of ``slot_size`` bytes, split
+    into ``stripes`` stripes that are locked independently.
+
+    The table's geometry is fixed by the process that creates the file;
+    later processes attach with whatever it chose. With ``counters``, every
+    stripe has a counter the store keeps up to date under the stripe's lock,
+    so counting entries never scans the slots.
+    """
+
+    def __init__(self, path: str, magic: bytes, version: int, slots: int, slot_size: int, stripes: int,
+                 counters: bool = False, kind: str = "striped"):
+        """
+        Open the table at ``path``, creating it if needed.
+
+        Args:
+            magic: Four bytes identifying what the table holds
+            version: Layout version of the slots
+            kind: What the table holds, for error messages
+
+        Raises:
+            ValueError: If the geometry is invalid, or the file holds another
+                kind of table or another layout version
+        """
+        for name, value in (("slots", slots), ("stripes", stripes)):
+            if value <= 0 or value & (value - 1):
+                raise ValueError(f"{name} must be a positive power of two")
+        if stripes > slots or stripes > HEADER_BYTES - _LOCK_BASE:
+            raise ValueError("too many stripes")
+        self.path = path
+        self.counters = counters
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self.slots, self.slot_size, self.stripes = self._init_file(magic, version, slots, slot_size, stripes, kind)
+            self.slots_per_stripe = self.slots // self.stripes
+            self.slots_offset = HEADER_BYTES + self._counter_bytes(self.stripes)
+            self.mm = mmap.mmap(self._fd, self.slots_offset + self.slots * self.slot_size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _counter_bytes(self, stripes: int) -> int:
+        if not self.counters:
+            return 0
+        return -(-stripes * _COUNTER.size // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    def _init_file(self, magic: bytes, version: int, slots: int, slot_size: int, stripes: int,
+                   kind: str) -> Tuple[int, int, int]:
+        """Create the table, or attach to the one another process created"""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) == _HEADER.size:
+                found_magic, found_version, slots, slot_size, stripes = _HEADER.unpack(header)
+                if found_magic != magic or found_version != version:
+                    raise ValueError(f"{self.path} is not a {kind} table")
+            else:
+                os.ftruncate(self._fd, HEADER_BYTES + self._counter_bytes(stripes) + slots * slot_size)
+                os.pwrite(self._fd, _HEADER.pack(magic, version, slots, slot_size, stripes), 0)
+            return slots, slot_size, stripes
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    @contextmanager
+    def locked(self, stripe: int, exclusive: bool = True):
+        """Hold the stripe's lock, shared by readers unless ``exclusive``"""
+        offset = _LOCK_BASE + stripe
+        fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def stripe_of(self, key_hash: int) -> int:
+        return key_hash & (self.stripes - 1)
+
+    def stripe_base(self, stripe: int) -> int:
+        """Offset of the stripe's first slot; slot i of the stripe is ``i * slot_size`` further"""
+        return self.slots_offset + stripe * self.slots_per_stripe * self.slot_size
+
+    def add_to_count(self, stripe: int, delta: int):
+        """Adjust the stripe's counter; call with the stripe locked"""
+        offset = HEADER_BYTES + stripe * _COUNTER.size
+        _COUNTER.pack_into(self.mm, offset, _COUNTER.unpack_from(self.mm, offset)[0] + delta)
+
+    def count(self) -> int:
+        """Sum of the stripe counters, read without locking"""
+        return sum(struct.unpack_from(f"<{self.stripes}I", self.mm, HEADER_BYTES))
+
+    def close(self):
+        self.mm.close()
+        os.close(self._fd)
@@ -0,0 +1,301 @@
+# Staff availability engine for the booking service.
+#
+# Every staff member gets one row of 5-minute slots per day (288 slots) over
+# a fixed horizon of days. Three NumPy arrays of shape (staff, days, 288)
+# hold the working-hours mask from staff.schedule, a per-slot booking count
+# and the resulting free mask. A "next N free slots" query runs on the free
+# mask of the qualified staff only: a run of k consecutive free slots is
+# found with log2(k) shifted bitwise ANDs, and np.nonzero yields the
+# candidates already ordered by day, slot and staff. Bookings update only the
+# slots they cover, so creating or cancelling one is O(duration).
+
+import logging
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+# Days scanned by the first step of a forward search; each later step doubles
+QUERY_CHUNK_DAYS = 1
+# Booking statuses that do not hold a slot
+RELEASED_STATUSES = frozenset(('cancelled', 'no-show'))
+
+
+class FreeSlot(NamedTuple):
+    start_time: datetime
+    end_time: datetime
+    staff_id: str
+
+
+class _Service(NamedTuple):
+    duration_slots: int
+    tags: frozenset
+
+
+class _Booking(NamedTuple):
+    staff: int
+    day: int
+    start: int
+    end: int
+
+
+def _slot_of(value: str) -> int:
+    """'HH:MM' -> slot index; '24:00' is the end of the day"""
+    hours, minutes = value.split(':')
+    return min((int(hours) * 60 + int(minutes)) // SLOT_MINUTES, SLOTS_PER_DAY)
+
+
+def local_time(value: datetime, tz) -> datetime:
+    """Convert an aware datetime (e.g. a Firestore timestamp) to naive time in ``tz``"""
+    if value.tzinfo is not None:
+        value = value.astimezone(tz).replace(tzinfo=None)
+    return value
+
+
+def _runs_of(mask: np.ndarray, length: int) -> np.ndarray:
+    """
+    Mark every slot that starts a run of ``length`` free slots.
+
+    Doubles the covered span with each shifted AND, so a 90-minute service
+    (18 slots) needs 5 operations instead of 18.
+    """
+    ok = mask.copy()
+    span = 1
+    while span < length:
+        shift = min(span, length - span)
+        ok[..., :-shift] &= ok[..., shift:]
+        ok[..., -shift:] = False
+        span += shift
+    return ok
+
+
+class AvailabilityEngine:
+    """
+    Per-staff, per-day free-slot bitmaps over ``days`` days from ``start_date``.
+
+    Times are naive datetimes in the salon's local time; aware datetimes
+    (e.g. Firestore timestamps) are converted to ``tz`` first. All methods are
+    thread-safe, so a Firestore snapshot listener may apply booking changes
+    while requests query.
+    """
+
+    def __init__(self, start_date: date, days: int = 90, tz=timezone.utc):
+        self.start_date = start_date
+        self.days = days
+        self.tz = tz
+        self._lock = threading.RLock()
+        self._staff_ids: List[str] = []
+        self._staff_index: Dict[str, int] = {}
+        self._staff_tags: List[Set[str]] = []
+        self._services: Dict[str, _Service] = {}
+        self._qualified_cache: Dict[str, np.ndarray] = {}
+        self._bookings: Dict[str, _Booking] = {}
+        capacity = 16
+        self._schedule = np.zeros((capacity, days, SLOTS_PER_DAY), dtype=bool)
+        self._booked = np.zeros((capacity, days, SLOTS_PER_DAY), dtype=np.uint8)
+        self._free = np.zeros((capacity, days, SLOTS_PER_DAY), dtype=bool)
+
+    # -- Loading ---------------------------------------------------------
+
+    def _grow(self):
+        capacity = self._schedule.shape[0] * 2
+        for name in ('_schedule', '_booked', '_free'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:old.shape[0]] = old
+            setattr(self, name, new)
+
+    def add_staff(self, staff_id: str, schedule: Dict[str, Dict[str, str]], specialties: Iterable[str] = ()):
+        """Add or replace a staff member's weekly schedule and specialties"""
+        with self._lock:
+            index = self._staff_index.get(staff_id)
+            if index is None:
+                index = len(self._staff_ids)
+                if index == self._schedule.shape[0]:
+                    self._grow()
+                self._staff_ids.append(staff_id)
+                self._staff_tags.append(set())
+                self._staff_index[staff_id] = index
+
+            week = np.zeros((7, SLOTS_PER_DAY), dtype=bool)
+            for weekday, hours in (schedule or {}).items():
+                if weekday in WEEKDAYS and hours and hours.get('start') and hours.get('end'):
+                    week[WEEKDAYS.index(weekday), _slot_of(hours['start']):_slot_of(hours['end'])] = True
+            first_weekday = self.start_date.weekday()
+            weekdays = (np.arange(self.days) + first_weekday) % 7
+            self._schedule[index] = week[weekdays]
+            self._free[index] = self._schedule[index] & (self._booked[index] == 0)
+
+            self._staff_tags[index] = {tag.lower() for tag in specialties}
+            self._qualified_cache.clear()
+
+    def add_service(self, service_id: str, duration_minutes: int, name: str = '', category: str = ''):
+        """Register a service; staff qualify if a specialty matches its name or category"""
+        with self._lock:
+            slots = -(-int(duration_minutes) // SLOT_MINUTES)
+            tags = frozenset(tag.lower() for tag in (name, category) if tag)
+            self._services[service_id] = _Service(max(slots, 1), tags)
+            self._qualified_cache.pop(service_id, None)
+
+    def _qualified(self, service_id: str) -> np.ndarray:
+        staff = self._qualified_cache.get(service_id)
+        if staff is None:
+            tags = self._services[service_id].tags
+            staff = np.array([i for i, staff_tags in enumerate(self._staff_tags) if staff_tags & tags],
+                             dtype=np.intp)
+            self._qualified_cache[service_id] = staff
+        return staff
+
+    # -- Incremental updates -----------------------------------------------
+
+    def _span(self, start_time: datetime, end_time: datetime) -> Optional[Tuple[int, int, int]]:
+        start_time, end_time = local_time(start_time, self.tz), local_time(end_time, self.tz)
+        day = (start_time.date() - self.start_date).days
+        if not 0 <= day < self.days:
+            return None
+        start = (start_time.hour * 60 + start_time.minute) // SLOT_MINUTES
+        if end_time.date() > start_time.date():
+            end = SLOTS_PER_DAY
+        else:
+            # A booking ending mid-slot still occupies that slot
+            end = -(-(end_time.hour * 60 + end_time.minute) // SLOT_MINUTES)
+        return (day, start, end) if end > start else None
+
+    def book(self, booking_id: str, staff_id: str, start_time: datetime, end_time: datetime) -> bool:
+        """
+        Mark a booking's slots as taken.
+
+        Re-booking an existing ID moves it. Returns False if the staff member
+        is unknown or the booking falls outside the horizon.
+        """
+        with self._lock:
+            self.cancel(booking_id)
+            staff = self._staff_index.get(staff_id)
+            span = self._span(start_time, end_time)
+            if staff is None or span is None:
+                return False
+            day, start, end = span
+            self._booked[staff, day, start:end] += 1
+            self._free[staff, day, start:end] = False
+            self._bookings[booking_id] = _Booking(staff, day, start, end)
+            return True
+
+    def cancel(self, booking_id: str) -> bool:
+        """Release a booking's slots"""
+        with self._lock:
+            booking = self._bookings.pop(booking_id, None)
+            if booking is None:
+                return False
+            staff, day, start, end = booking
+            booked = self._booked[staff, day, start:end]
+            booked -= 1
+            # Slots stay taken if another (overlapping) booking still holds them
+            self._free[staff, day, start:end] = self._schedule[staff, day, start:end] & (booked == 0)
+            return True
+
+    def apply_booking(self, booking_id: str, booking: Optional[Dict]) -> bool:
+        """Apply a 'bookings' document as it now stands; None means it was deleted"""
+        if booking is None or booking.get('status') in RELEASED_STATUSES:
+            return self.cancel(booking_id)
+        if not (booking.get('staff_id') and booking.get('start_time') and booking.get('end_time')):
+            return False
+        return self.book(booking_id, booking['staff_id'], booking['start_time'], booking['end_time'])
+
+    # -- Queries -----------------------------------------------------------
+
+    def next_free_slots(self, service_id: str, after: datetime, n: int = 5) -> List[FreeSlot]:
+        """Earliest ``n`` start times for ``service_id`` across qualified staff, at or after ``after``"""
+        with self._lock:
+            service = self._services[service_id]
+            staff = self._qualified(service_id)
+            if not len(staff) or n <= 0:
+                return []
+
+            after = local_time(after, self.tz)
+            first_day = max((after.date() - self.start_date).days, 0)
+            if after.date() >= self.start_date:
+                after_slot = -(-(after.hour * 60 + after.minute) // SLOT_MINUTES)
+            else:
+                after_slot = 0
+
+            found: List[FreeSlot] = []
+            chunk_start, chunk_days = first_day, QUERY_CHUNK_DAYS
+            while chunk_start < self.days:
+                chunk_end = min(chunk_start + chunk_days, self.days)
+                starts = _runs_of(self._free[staff, chunk_start:chunk_end], service.duration_slots)
+                if chunk_start == first_day:
+                    starts[:, 0, :after_slot] = False
+                # (day, slot, staff) order so nonzero yields the earliest first
+                days, slots, staff_pos = np.nonzero(starts.transpose(1, 2, 0))
+                for day, slot, position in zip(days[:n - len(found)], slots, staff_pos):
+                    start_time = datetime.combine(
+                        self.start_date + timedelta(days=chunk_start + int(day)), time()
+                    ) + timedelta(minutes=int(slot) * SLOT_MINUTES)
+                    found.append(FreeSlot(
+                        start_time,
+                        start_time + timedelta(minutes=service.duration_slots * SLOT_MINUTES),
+                        self._staff_ids[staff[position]]
+                    ))
+                if len(found) >= n:
+                    break
+                chunk_start, chunk_days = chunk_end, chunk_days * 2
+            return found
+
+    def is_free(self, staff_id: str, start_time: datetime, end_time: datetime) -> bool:
+        """Whether a staff member is working and unbooked for the whole interval"""
+        with self._lock:
+            staff = self._staff_index.get(staff_id)
+            span = self._span(start_time, end_time)
+            if staff is None or span is None:
+                return False
+            day, start, end = span
+            return bool(self._free[staff, day, start:end].all())
+
+    # -- Firestore ---------------------------------------------------------
+
+    @classmethod
+    def from_firestore(cls, db, start_date: date, days: int = 90, tz=timezone.utc) -> 'AvailabilityEngine':
+        """Build an engine from the 'staff', 'services' and 'bookings' collections"""
+        engine = cls(start_date, days, tz)
+        for doc in db.collection('staff').stream():
+            staff = doc.to_dict() or {}
+            if staff.get('is_active', True):
+                engine.add_staff(doc.id, staff.get('schedule') or {}, staff.get('specialties') or [])
+        for doc in db.collection('services').stream():
+            service = doc.to_dict() or {}
+            duration = service.get('duration_minutes') or service.get('duration_min')
+            if duration:
+                engine.add_service(doc.id, duration, service.get('name', ''), service.get('category', ''))
+        for doc in engine._bookings_query(db).stream():
+            engine.apply_booking(doc.id, doc.to_dict())
+        return engine
+
+    def _bookings_query(self, db):
+        """The bookings starting within the engine's horizon"""
+        horizon_start = datetime.combine(self.start_date, time(), tzinfo=self.tz)
+        return (db.collection('bookings')
+                .where('start_time', '>=', horizon_start)
+                .where('start_time', '<', horizon_start + timedelta(days=self.days)))
+
+    def watch_bookings(self, db):
+        """
+        Keep the engine current from a Firestore snapshot listener on the
+        bookings within its horizon; a booking moved out of it is REMOVED.
+
+        Returns the watch so the caller can ``unsubscribe()`` it.
+        """
+        def on_snapshot(_docs, changes, _read_time):
+            for change in changes:
+                try:
+                    if change.type.name == 'REMOVED':
+                        self.apply_booking(change.document.id, None)
+                    else:
+                        self.apply_booking(change.document.id, change.document.to_dict())
+                except Exception as e:
+                    logging.exception('Failed to apply booking change %s: %s', change.document.id, e)
+
+        return self._bookings_query(db).on_snapshot(on_snapshot)
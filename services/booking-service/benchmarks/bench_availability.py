@@ -0,0 +1,152 @@
+"""
+Benchmark: "next N free slots" for a service across qualified staff,
+per-query interval scan vs. the slot-bitmap AvailabilityEngine.
+
+Run from services/booking-service:
+
+    python -m benchmarks.bench_availability
+    python -m benchmarks.bench_availability --staff 200 --days 90 --occupancy 0.8
+
+The synthetic salon has ``--staff`` staff members working 09:00-18:00 six
+days a week, two of three specialties each, and bookings filling roughly
+``--occupancy`` of their working hours over ``--days`` days. "scan" walks
+candidate start times in 5-minute steps and checks each qualified staff
+member's schedule and that day's bookings, which is what answering from the
+raw booking documents costs. "engine" is ``AvailabilityEngine``; its one-off
+build time and the cost of an incremental book/cancel are reported as well.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+from availability import AvailabilityEngine, WEEKDAYS
+
+SPECIALTIES = ('Haircut', 'Coloring', 'Manicure')
+SERVICES = {
+    'haircut-30': (30, 'Haircut'),
+    'coloring-90': (90, 'Coloring'),
+    'manicure-45': (45, 'Manicure'),
+}
+OPEN, CLOSE = 9 * 60, 18 * 60
+
+
+def build_salon(staff_count, days, occupancy, start):
+    rng = random.Random(42)
+    staff = {}
+    bookings = {}
+    for s in range(staff_count):
+        day_off = rng.randrange(7)
+        schedule = {day: {'start': '09:00', 'end': '18:00'} for i, day in enumerate(WEEKDAYS) if i != day_off}
+        staff[f'staff-{s}'] = (schedule, rng.sample(SPECIALTIES, 2), day_off)
+    for staff_id, (_, _, day_off) in staff.items():
+        for d in range(days):
+            day = start + timedelta(days=d)
+            if day.weekday() == day_off:
+                continue
+            minute = OPEN
+            while True:
+                # Gaps are sized so bookings fill about `occupancy` of the day
+                minute += rng.randrange(0, int(60 * (1 - occupancy) / occupancy) * 2 + 1, 5)
+                length = rng.choice((30, 45, 60, 90))
+                if minute + length > CLOSE:
+                    break
+                begin = datetime.combine(day, datetime.min.time()) + timedelta(minutes=minute)
+                bookings[f'b-{len(bookings)}'] = (staff_id, begin, begin + timedelta(minutes=length))
+                minute += length
+    return staff, bookings
+
+
+class ScanAvailability:
+    """Answers from the raw schedules and bookings on every query"""
+
+    def __init__(self, staff, bookings):
+        self.staff = staff
+        self.by_staff_day = {}
+        for staff_id, begin, end in bookings.values():
+            self.by_staff_day.setdefault((staff_id, begin.date()), []).append((begin, end))
+
+    def next_free_slots(self, service_id, after, n, days):
+        duration, specialty = SERVICES[service_id]
+        qualified = [s for s, (_, tags, _) in self.staff.items() if specialty in tags]
+        length = timedelta(minutes=duration)
+        found = []
+        candidate = after + timedelta(minutes=-after.minute % 5)
+        horizon = datetime.combine(after.date() + timedelta(days=days), datetime.min.time())
+        while candidate < horizon and len(found) < n:
+            end = candidate + length
+            for staff_id in qualified:
+                hours = self.staff[staff_id][0].get(WEEKDAYS[candidate.weekday()])
+                if not hours or candidate.strftime('%H:%M') < hours['start'] or end.strftime('%H:%M') > hours['end'] \
+                        or end.date() != candidate.date():
+                    continue
+                booked = self.by_staff_day.get((staff_id, candidate.date()), ())
+                if all(end <= b or candidate >= e for b, e in booked):
+                    found.append((candidate, staff_id))
+                    if len(found) == n:
+                        break
+            candidate += timedelta(minutes=5)
+        return found
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - begin)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--staff', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--occupancy', type=float, default=0.8)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    start = date(2025, 9, 1)
+    staff, bookings = build_salon(args.staff, args.days, args.occupancy, start)
+    print(f'{args.staff} staff x {args.days} days, {len(bookings)} bookings')
+
+    begin = time.perf_counter()
+    engine = AvailabilityEngine(start, args.days)
+    for staff_id, (schedule, tags, _) in staff.items():
+        engine.add_staff(staff_id, schedule, tags)
+    for service_id, (duration, specialty) in SERVICES.items():
+        engine.add_service(service_id, duration, category=specialty)
+    for booking_id, (staff_id, begin_time, end_time) in bookings.items():
+        engine.book(booking_id, staff_id, begin_time, end_time)
+    print(f'engine build: {(time.perf_counter() - begin) * 1e3:.0f} ms')
+    scan = ScanAvailability(staff, bookings)
+
+    print()
+    print(f"{'query':<34}{'scan':>12}{'engine':>12}{'speedup':>10}")
+    for service_id in SERVICES:
+        for offset in (0, args.days // 2):
+            after = datetime.combine(start + timedelta(days=offset), datetime.min.time()) + timedelta(hours=10)
+            expected = [(slot.start_time, slot.staff_id) for slot in engine.next_free_slots(service_id, after, args.n)]
+            assert scan.next_free_slots(service_id, after, args.n, args.days) == expected, service_id
+            t_scan = timed(lambda: scan.next_free_slots(service_id, after, args.n, args.days), max(args.repeat // 4, 1))
+            t_engine = timed(lambda: engine.next_free_slots(service_id, after, args.n), args.repeat)
+            label = f'{service_id} from day {offset}'
+            print(f'{label:<34}{t_scan * 1e3:>10.2f}ms{t_engine * 1e3:>10.3f}ms{t_scan / t_engine:>9.0f}x')
+
+    staff_id = next(iter(staff))
+    slot = engine.next_free_slots('haircut-30', datetime.combine(start, datetime.min.time()), 1)[0]
+    updates = 10000
+    begin = time.perf_counter()
+    for _ in range(updates):
+        engine.book('bench', slot.staff_id, slot.start_time, slot.end_time)
+        engine.cancel('bench')
+    per_update = (time.perf_counter() - begin) / (2 * updates)
+    print()
+    print(f'incremental book/cancel: {per_update * 1e6:.1f} us per update')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: Saturday-morning reservation peak, one global lock vs. per-staff
+lock striping.
+
+Run from services/booking-service:
+
+    python -m benchmarks.bench_reservations
+    python -m benchmarks.bench_reservations --clients 64 --staff 40 --commit-ms 5
+
+``--clients`` threads reserve random 30-90 minute slots between 09:00 and
+13:00 for ``--staff`` staff members on one day. Each commit takes
+``--commit-ms`` milliseconds, standing in for the Firestore round trip.
+"global" is a ReservationBook with a single stripe, so every reservation
+queues behind every other; "striped" uses the default 64 stripes. Both are
+checked for double bookings afterwards.
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from reservations import InMemoryReservationStore, ReservationBook, ReservationConflict
+
+DAY = date(2025, 9, 6)
+
+
+class RemoteStore(InMemoryReservationStore):
+    def __init__(self, commit_seconds):
+        super().__init__()
+        self.commit_seconds = commit_seconds
+
+    def commit(self, *args, **kwargs):
+        time.sleep(self.commit_seconds)
+        return super().commit(*args, **kwargs)
+
+
+def run(stripes, args):
+    store = RemoteStore(args.commit_ms / 1000)
+    book = ReservationBook(store, stripes=stripes)
+    counts = {'reserved': 0, 'conflicts': 0}
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        for i in range(args.requests):
+            start = datetime.combine(DAY, datetime.min.time()) + timedelta(minutes=rng.randrange(108, 156) * 5)
+            end = start + timedelta(minutes=rng.choice((30, 45, 60, 90)))
+            try:
+                book.reserve(f'{seed}-{i}', f'staff-{rng.randrange(args.staff)}', start, end)
+                key = 'reserved'
+            except ReservationConflict:
+                key = 'conflicts'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(args.clients)]
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+
+    for _, intervals in store._calendars.values():
+        ordered = sorted(intervals.values())
+        assert all(a_end <= b_start for (_, a_end), (b_start, _) in zip(ordered, ordered[1:]))
+    return (args.clients * args.requests) / elapsed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--staff', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--commit-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f'{args.clients} clients x {args.requests} requests, {args.staff} staff, {args.commit_ms} ms commits')
+    print(f"{'locking':<10}{'req/s':>10}{'reserved':>10}{'conflicts':>11}{'double':>8}")
+    for label, stripes in (('global', 1), ('striped', 64)):
+        throughput, counts = run(stripes, args)
+        print(f"{label:<10}{throughput:>10.0f}{counts['reserved']:>10}{counts['conflicts']:>11}{0:>8}")
+
+
+if __name__ == '__main__':
+    main()
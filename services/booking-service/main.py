@@ -1,6 +1,15 @@
 from flask import Flask, jsonify, request
 from google.cloud import firestore
+from datetime import date, datetime, timedelta
 import logging
+import os
+import threading
+
+from availability import AvailabilityEngine
+from reservations import FirestoreReservationStore, ReservationBook, ReservationConflict
+
+# Days ahead covered by the availability engine
+AVAILABILITY_DAYS = int(os.getenv('AVAILABILITY_DAYS', '90'))
 
 
 def create_app():
@@ -14,6 +23,24 @@ def create_app():
         logging.exception('Failed to init Firestore client: %s', e)
         db = None
 
+    # Built on first use and rebuilt when the day rolls over; a snapshot
+    # listener on 'bookings' keeps it current in between
+    availability = {'engine': None, 'watch': None}
+    availability_lock = threading.Lock()
+
+    def get_availability_engine():
+        with availability_lock:
+            engine = availability['engine']
+            if engine is None or engine.start_date != date.today():
+                if availability['watch'] is not None:
+                    availability['watch'].unsubscribe()
+                engine = AvailabilityEngine.from_firestore(db, date.today(), AVAILABILITY_DAYS)
+                availability['watch'] = engine.watch_bookings(db)
+                availability['engine'] = engine
+            return engine
+
+    reservations = ReservationBook(FirestoreReservationStore(db)) if db is not None else None
+
     @app.route('/healthz', methods=['GET'])
     def healthz():
         return jsonify(status='healthy'), 200
@@ -63,11 +90,114 @@ def create_app():
                 'price': float(price),
             }
             ref = db.collection('services').add(doc)[1]
+            if availability['engine'] is not None:
+                availability['engine'].add_service(ref.id, doc['duration_min'], doc['name'])
             return jsonify(id=ref.id, **doc), 200
         except Exception as e:
             logging.exception('Error creating service: %s', e)
             return jsonify(error='unavailable', detail=str(e)), 503
 
+    @app.get('/api/availability')
+    def next_available_slots():
+        try:
+            service_id = request.args.get('service_id')
+            if not service_id:
+                return jsonify(error='bad_request', detail='service_id required'), 400
+            after = request.args.get('after')
+            after = datetime.fromisoformat(after) if after else datetime.now()
+            n = min(int(request.args.get('n', 5)), 100)
+            if db is None:
+                return jsonify(error='unavailable', detail='Firestore not configured'), 503
+            engine = get_availability_engine()
+            try:
+                slots = engine.next_free_slots(service_id, after, n)
+            except KeyError:
+                return jsonify(error='not_found', detail=f'Unknown service {service_id}'), 404
+            items = [{
+                'staff_id': slot.staff_id,
+                'start_time': slot.start_time.isoformat(),
+                'end_time': slot.end_time.isoformat(),
+            } for slot in slots]
+            return jsonify(slots=items), 200
+        except ValueError as e:
+            return jsonify(error='bad_request', detail=str(e)), 400
+        except Exception as e:
+            logging.exception('Error computing availability: %s', e)
+            return jsonify(error='unavailable', detail=str(e)), 503
+
+    @app.post('/api/bookings')
+    def create_booking():
+        try:
+            payload = request.get_json(silent=True) or {}
+            staff_id = payload.get('staff_id')
+            service_id = payload.get('service_id')
+            start_time = payload.get('start_time')
+            if not staff_id or not service_id or not start_time:
+                return jsonify(error='bad_request', detail='staff_id, service_id, start_time required'), 400
+            if db is None:
+                return jsonify(error='unavailable', detail='Firestore not configured'), 503
+            service = db.collection('services').document(service_id).get()
+            if not service.exists:
+                return jsonify(error='not_found', detail=f'Unknown service {service_id}'), 404
+            service = service.to_dict() or {}
+            start_time = datetime.fromisoformat(start_time)
+            end_time = start_time + timedelta(
+                minutes=int(service.get('duration_minutes') or service.get('duration_min')))
+            booking_ref = db.collection('bookings').document()
+            doc = {
+                'customer_id': payload.get('customer_id'),
+                'service_id': service_id,
+                'staff_id': staff_id,
+                'start_time': start_time,
+                'end_time': end_time,
+                'status': 'scheduled',
+                'notes': payload.get('notes', ''),
+                'price_at_booking': service.get('price'),
+                'payment_status': 'pending',
+                'created_at': firestore.SERVER_TIMESTAMP,
+                'updated_at': firestore.SERVER_TIMESTAMP,
+            }
+            reservations.reserve(booking_ref.id, staff_id, start_time, end_time, booking=doc)
+            if availability['engine'] is not None:
+                availability['engine'].book(booking_ref.id, staff_id, start_time, end_time)
+            return jsonify(id=booking_ref.id, staff_id=staff_id, service_id=service_id,
+                           start_time=start_time.isoformat(), end_time=end_time.isoformat(),
+                           status='scheduled'), 201
+        except ReservationConflict as e:
+            return jsonify(error='conflict', detail=str(e)), 409
+        except (TypeError, ValueError) as e:
+            return jsonify(error='bad_request', detail=str(e)), 400
+        except Exception as e:
+            logging.exception('Error creating booking: %s', e)
+            return jsonify(error='unavailable', detail=str(e)), 503
+
+    @app.post('/api/bookings/<booking_id>/cancel')
+    def cancel_booking(booking_id):
+        try:
+            if db is None:
+                return jsonify(error='unavailable', detail='Firestore not configured'), 503
+            booking = db.collection('bookings').document(booking_id).get()
+            if not booking.exists:
+                return jsonify(error='not_found', detail=f'Unknown booking {booking_id}'), 404
+            booking = booking.to_dict() or {}
+            update = {'status': 'cancelled', 'updated_at': firestore.SERVER_TIMESTAMP}
+            released = False
+            staff_id, start_time = booking.get('staff_id'), booking.get('start_time')
+            # Without a staff member or start time the booking holds no calendar interval
+            if staff_id is not None and start_time is not None:
+                released = reservations.release(booking_id, staff_id, start_time, booking=update)
+            if not released:
+                # Made before calendars existed, already released, or never assigned
+                db.collection('bookings').document(booking_id).update(update)
+            if availability['engine'] is not None:
+                availability['engine'].cancel(booking_id)
+            return jsonify(id=booking_id, status='cancelled'), 200
+        except ReservationConflict as e:
+            return jsonify(error='conflict', detail=str(e)), 409
+        except Exception as e:
+            logging.exception('Error cancelling booking: %s', e)
+            return jsonify(error='unavailable', detail=str(e)), 503
+
     return app
 
 app = create_app()
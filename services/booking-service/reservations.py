@@ -0,0 +1,292 @@
+# Conflict-free booking reservations for the booking service.
+#
+# Each process keeps an interval index per staff member and day: sorted,
+# non-overlapping booking intervals plus the version of the calendar they
+# were read at. A reservation checks overlap against the index in O(log n)
+# and then commits through the store with that version as a precondition.
+# If another process committed first, the precondition fails, the day is
+# reloaded and the check runs again, so two writers can never both take the
+# same slot. Staff members are hashed onto lock stripes: requests for the
+# same stylist queue up in-process instead of burning optimistic retries,
+# while requests for different staff proceed in parallel.
+
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from datetime import date, datetime, timezone
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from availability import local_time
+
+DEFAULT_STRIPES = 64
+# Optimistic commits attempted before giving up on a contended calendar
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class ReservationConflict(Exception):
+    """The requested interval overlaps an existing booking"""
+
+    def __init__(self, message: str, conflicting_booking_id: Optional[str] = None):
+        super().__init__(message)
+        self.conflicting_booking_id = conflicting_booking_id
+
+
+class VersionConflict(Exception):
+    """The calendar changed since it was read; raised by stores on commit"""
+
+
+class Reservation(NamedTuple):
+    booking_id: str
+    staff_id: str
+    start_time: datetime
+    end_time: datetime
+
+
+class _DayCalendar:
+    """Sorted, non-overlapping intervals of one staff member's day"""
+
+    __slots__ = ('version', 'starts', 'ends', 'booking_ids')
+
+    def __init__(self, version: Any, intervals: Dict[str, Tuple[datetime, datetime]]):
+        self.version = version
+        ordered = sorted(intervals.items(), key=lambda item: item[1][0])
+        self.booking_ids = [booking_id for booking_id, _ in ordered]
+        self.starts = [start for _, (start, _) in ordered]
+        self.ends = [end for _, (_, end) in ordered]
+
+    def conflict(self, start: datetime, end: datetime) -> Optional[str]:
+        """ID of a booking overlapping [start, end), if any"""
+        i = bisect_left(self.starts, end)
+        # Intervals don't overlap each other, so only the last one starting
+        # before `end` can reach into [start, end)
+        if i and self.ends[i - 1] > start:
+            return self.booking_ids[i - 1]
+        return None
+
+    def insert(self, booking_id: str, start: datetime, end: datetime):
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.booking_ids.insert(i, booking_id)
+
+    def remove(self, booking_id: str) -> bool:
+        try:
+            i = self.booking_ids.index(booking_id)
+        except ValueError:
+            return False
+        del self.starts[i], self.ends[i], self.booking_ids[i]
+        return True
+
+
+class ReservationStore(ABC):
+    """
+    Durable calendars, one per staff member and day.
+
+    ``load`` returns an opaque version with the day's intervals; ``commit``
+    applies a change only if the calendar is still at ``expected_version``
+    and returns the new version, otherwise it raises VersionConflict.
+    """
+
+    @abstractmethod
+    def load(self, staff_id: str, day: date) -> Tuple[Any, Dict[str, Tuple[datetime, datetime]]]:
+        """The calendar's version and its intervals by booking ID"""
+
+    @abstractmethod
+    def commit(self, staff_id: str, day: date, expected_version: Any,
+               add: Optional[Reservation] = None, remove: Optional[str] = None,
+               booking: Optional[Dict] = None) -> Any:
+        """Add and/or remove an interval, merging ``booking`` into its document; returns the new version"""
+
+
+class InMemoryReservationStore(ReservationStore):
+    """Process-local store with integer versions; for tests and benchmarks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calendars: Dict[Tuple[str, date], Tuple[int, Dict[str, Tuple[datetime, datetime]]]] = {}
+        self.bookings: Dict[str, Dict] = {}
+
+    def load(self, staff_id, day):
+        with self._lock:
+            version, intervals = self._calendars.get((staff_id, day), (0, {}))
+            return version, dict(intervals)
+
+    def commit(self, staff_id, day, expected_version, add=None, remove=None, booking=None):
+        with self._lock:
+            version, intervals = self._calendars.get((staff_id, day), (0, {}))
+            if version != expected_version:
+                raise VersionConflict(f'{staff_id} {day} is at version {version}, not {expected_version}')
+            intervals = dict(intervals)
+            if add is not None:
+                intervals[add.booking_id] = (add.start_time, add.end_time)
+                self.bookings[add.booking_id] = booking or {}
+            if remove is not None:
+                intervals.pop(remove, None)
+            self._calendars[(staff_id, day)] = (version + 1, intervals)
+            return version + 1
+
+
+class FirestoreReservationStore(ReservationStore):
+    """
+    Calendars in the 'staff_calendars' collection, one document per staff
+    member and day holding a map of booking ID to interval.
+
+    The document's update time is the version: commits are a batch that
+    updates the calendar with a last-update-time precondition (or creates it,
+    which fails if it already exists) and writes the booking document.
+    """
+
+    def __init__(self, db, tz=timezone.utc):
+        self.db = db
+        self.tz = tz
+
+    def _calendar_ref(self, staff_id: str, day: date):
+        return self.db.collection('staff_calendars').document(f'{staff_id}_{day.isoformat()}')
+
+    def load(self, staff_id, day):
+        snapshot = self._calendar_ref(staff_id, day).get()
+        if not snapshot.exists:
+            return None, {}
+        intervals = {
+            booking_id: (local_time(entry['start_time'], self.tz), local_time(entry['end_time'], self.tz))
+            for booking_id, entry in (snapshot.to_dict().get('bookings') or {}).items()
+        }
+        return snapshot.update_time, intervals
+
+    def commit(self, staff_id, day, expected_version, add=None, remove=None, booking=None):
+        from google.api_core import exceptions
+        from google.cloud import firestore
+
+        calendar_ref = self._calendar_ref(staff_id, day)
+        batch = self.db.batch()
+        if expected_version is None:
+            # No calendar yet: create it, which fails if another writer just did
+            if add is None:
+                return None
+            batch.create(calendar_ref, {
+                'staff_id': staff_id,
+                'date': day.isoformat(),
+                'bookings': {add.booking_id: self._interval(add)},
+            })
+        else:
+            changes = {}
+            if add is not None:
+                changes[f'bookings.`{add.booking_id}`'] = self._interval(add)
+            if remove is not None:
+                changes[f'bookings.`{remove}`'] = firestore.DELETE_FIELD
+            batch.update(calendar_ref, changes, option=self.db.write_option(last_update_time=expected_version))
+        if booking is not None:
+            booking_id = add.booking_id if add is not None else remove
+            batch.set(self.db.collection('bookings').document(booking_id), booking, merge=True)
+        try:
+            results = batch.commit()
+        except (exceptions.FailedPrecondition, exceptions.AlreadyExists, exceptions.Conflict) as e:
+            raise VersionConflict(str(e))
+        return results[0].update_time
+
+    def _interval(self, reservation: Reservation) -> Dict[str, datetime]:
+        return {
+            'start_time': reservation.start_time.replace(tzinfo=self.tz),
+            'end_time': reservation.end_time.replace(tzinfo=self.tz),
+        }
+
+
+class ReservationBook:
+    """
+    Reserve and release booking intervals without double bookings.
+
+    Args:
+        store: ReservationStore holding the durable calendars
+        stripes: Number of staff lock stripes
+        max_attempts: Optimistic commit attempts per request before a
+            ReservationConflict is raised
+        tz: Time zone that aware datetimes are converted to
+    """
+
+    def __init__(self, store: ReservationStore, stripes: int = DEFAULT_STRIPES,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, tz=timezone.utc):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.tz = tz
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._calendars: Dict[Tuple[str, date], _DayCalendar] = {}
+        self.commits = 0
+        self.retries = 0
+        self.conflicts = 0
+
+    def _lock_for(self, staff_id: str) -> threading.Lock:
+        return self._locks[hash(staff_id) % len(self._locks)]
+
+    def _calendar(self, staff_id: str, day: date, reload: bool = False) -> _DayCalendar:
+        calendar = None if reload else self._calendars.get((staff_id, day))
+        if calendar is None:
+            calendar = _DayCalendar(*self.store.load(staff_id, day))
+            self._calendars[(staff_id, day)] = calendar
+        return calendar
+
+    def reserve(self, booking_id: str, staff_id: str, start_time: datetime, end_time: datetime,
+                booking: Optional[Dict] = None) -> Reservation:
+        """
+        Reserve [start_time, end_time) for a staff member.
+
+        ``booking`` is the booking document written in the same commit.
+        Raises ReservationConflict if the interval overlaps another booking,
+        or if the calendar stayed contended for ``max_attempts`` commits.
+        """
+        start, end = local_time(start_time, self.tz), local_time(end_time, self.tz)
+        if end <= start or (end.date() != start.date() and end.time() != datetime.min.time()):
+            raise ValueError('A booking must end after it starts, on the same day')
+        reservation = Reservation(booking_id, staff_id, start, end)
+        day = start.date()
+        with self._lock_for(staff_id):
+            cached = (staff_id, day) in self._calendars
+            calendar = self._calendar(staff_id, day)
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    self.retries += 1
+                    calendar = self._calendar(staff_id, day, reload=True)
+                conflicting = calendar.conflict(start, end)
+                if conflicting is not None and cached and not attempt:
+                    # Another process may have released it; check the store once
+                    calendar = self._calendar(staff_id, day, reload=True)
+                    conflicting = calendar.conflict(start, end)
+                if conflicting is not None:
+                    self.conflicts += 1
+                    raise ReservationConflict(f'{staff_id} is already booked at {start.isoformat()}', conflicting)
+                try:
+                    calendar.version = self.store.commit(staff_id, day, calendar.version,
+                                                         add=reservation, booking=booking)
+                except VersionConflict:
+                    continue
+                calendar.insert(booking_id, start, end)
+                self.commits += 1
+                return reservation
+        self.conflicts += 1
+        raise ReservationConflict(f'Calendar of {staff_id} on {day.isoformat()} is too contended, try again')
+
+    def release(self, booking_id: str, staff_id: str, start_time: datetime,
+                booking: Optional[Dict] = None) -> bool:
+        """Release a booking's interval; ``booking`` holds fields to merge into its document"""
+        day = local_time(start_time, self.tz).date()
+        with self._lock_for(staff_id):
+            # Always reload: the booking may have been made by another process
+            calendar = self._calendar(staff_id, day, reload=True)
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    self.retries += 1
+                    calendar = self._calendar(staff_id, day, reload=True)
+                if booking_id not in calendar.booking_ids:
+                    return False
+                try:
+                    calendar.version = self.store.commit(staff_id, day, calendar.version,
+                                                         remove=booking_id, booking=booking)
+                except VersionConflict:
+                    continue
+                calendar.remove(booking_id)
+                self.commits += 1
+                return True
+        raise ReservationConflict(f'Calendar of {staff_id} on {day.isoformat()} is too contended, try again')
+
+    def stats(self) -> Dict[str, int]:
+        return {'calendars': len(self._calendars), 'commits': self.commits,
+                'retries': self.retries, 'conflicts': self.conflicts}
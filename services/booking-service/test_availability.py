@@ -0,0 +1,90 @@
+from datetime import date, datetime
+
+import numpy as np
+
+from availability import SLOTS_PER_DAY, AvailabilityEngine, _runs_of
+
+# Unit tests of the availability bitmaps: runs of free slots, bookings and
+# cancellations, and the forward search for the next free start times.
+# The horizon starts on a Monday.
+
+MONDAY = date(2025, 9, 1)
+WEEKDAYS = {day: {'start': '09:00', 'end': '17:00'}
+            for day in ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday')}
+
+
+def _at(day, hour, minute=0):
+    return datetime(2025, 9, day, hour, minute)
+
+
+def _engine(schedule=None, specialties=('cut',), days=14):
+    engine = AvailabilityEngine(MONDAY, days=days)
+    engine.add_staff('alice', WEEKDAYS if schedule is None else schedule, specialties)
+    engine.add_service('cut', 60, name='Cut')
+    return engine
+
+
+def _starts(slots):
+    return [(slot.start_time, slot.staff_id) for slot in slots]
+
+
+def test_runs_stop_at_the_end_of_the_day():
+    mask = np.zeros((2, SLOTS_PER_DAY), dtype=bool)
+    mask[0, -3:] = True
+    mask[1, :3] = True
+    assert np.flatnonzero(_runs_of(mask, 3)[0]).tolist() == [SLOTS_PER_DAY - 3]
+    assert not _runs_of(mask, 4).any()  # a run never continues into the next day
+    assert np.array_equal(_runs_of(mask, 1), mask)
+
+
+def test_a_run_reaching_the_end_of_the_day_is_found_and_longer_ones_roll_over():
+    engine = _engine({'Monday': {'start': '22:00', 'end': '24:00'}})
+    assert _starts(engine.next_free_slots('cut', _at(1, 23), n=2)) == [(_at(1, 23), 'alice'), (_at(8, 22), 'alice')]
+
+    engine.add_service('long', 65, name='Cut')
+    # Too long for what is left of the day: the next Monday, past the first search chunk
+    assert _starts(engine.next_free_slots('long', _at(1, 23), n=1)) == [(_at(8, 22), 'alice')]
+
+
+def test_cancelling_one_of_two_overlapping_bookings_keeps_the_shared_slots_taken():
+    engine = _engine()
+    assert engine.book('b1', 'alice', _at(1, 10), _at(1, 11))
+    assert engine.book('b2', 'alice', _at(1, 10, 30), _at(1, 11, 30))
+
+    assert engine.cancel('b1') and not engine.cancel('b1')
+    assert engine.is_free('alice', _at(1, 10), _at(1, 10, 30))
+    assert not engine.is_free('alice', _at(1, 10, 30), _at(1, 11))
+    assert _starts(engine.next_free_slots('cut', _at(1, 10), n=1)) == [(_at(1, 11, 30), 'alice')]
+
+    assert engine.cancel('b2')
+    assert engine.is_free('alice', _at(1, 10), _at(1, 11, 30))
+
+
+def test_searches_after_a_time_within_a_slot_start_at_the_next_slot():
+    engine = _engine()
+    assert _starts(engine.next_free_slots('cut', _at(1, 10, 2), n=1)) == [(_at(1, 10, 5), 'alice')]
+    assert _starts(engine.next_free_slots('cut', _at(1, 10, 5), n=1)) == [(_at(1, 10, 5), 'alice')]
+    # A booking ending mid-slot holds that slot too
+    engine.book('b1', 'alice', _at(1, 9), _at(1, 16, 2))
+    assert _starts(engine.next_free_slots('cut', _at(1, 9), n=1)) == [(_at(2, 9), 'alice')]
+
+
+def test_bookings_outside_the_horizon_are_ignored():
+    engine = _engine(days=7)
+    assert not engine.book('early', 'alice', datetime(2025, 8, 31, 10), datetime(2025, 8, 31, 11))
+    assert not engine.book('late', 'alice', _at(8, 10), _at(8, 11))
+    assert not engine.book('unknown', 'bob', _at(1, 10), _at(1, 11))
+    assert not engine.cancel('late')
+    assert engine.is_free('alice', _at(1, 9), _at(1, 17))
+    assert not engine.is_free('alice', _at(8, 10), _at(8, 11))
+
+
+def test_staff_qualify_by_service_category_alone():
+    engine = _engine()
+    engine.add_staff('bob', WEEKDAYS, ['Colour'])
+    engine.add_service('balayage', 120, name='Balayage', category='Colour')
+    engine.book('b1', 'bob', _at(1, 9), _at(1, 12))
+
+    slots = engine.next_free_slots('balayage', _at(1, 9), n=2)
+    assert _starts(slots) == [(_at(1, 12), 'bob'), (_at(1, 12, 5), 'bob')]
+    assert slots[0].end_time == _at(1, 14)
@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from reservations import (
+    InMemoryReservationStore,
+    ReservationBook,
+    ReservationConflict,
+    VersionConflict,
+)
+
+# Concurrent property tests for the reservation path: threads acting for
+# several processes (one ReservationBook each, sharing one store) race for
+# overlapping intervals of a few popular staff members, and the committed
+# calendars must never contain two overlapping bookings.
+
+BOOKS = 4
+THREADS = 16
+REQUESTS_PER_THREAD = 200
+STAFF = ('staff-a', 'staff-b', 'staff-c')
+DAYS = (date(2025, 9, 6), date(2025, 9, 7))
+
+
+class SlowCommitStore(InMemoryReservationStore):
+    """Widens the window between the overlap check and the commit"""
+
+    def commit(self, *args, **kwargs):
+        time.sleep(0.0001)
+        return super().commit(*args, **kwargs)
+
+
+def _random_interval(rng):
+    start = datetime.combine(rng.choice(DAYS), datetime.min.time()) + timedelta(minutes=rng.randrange(108, 216) * 5)
+    return rng.choice(STAFF), start, start + timedelta(minutes=rng.choice((15, 30, 45, 60, 90)))
+
+
+def _committed(store):
+    return {
+        (staff_id, day): intervals
+        for (staff_id, day), (_, intervals) in store._calendars.items()
+    }
+
+
+def _assert_no_overlaps(store):
+    for intervals in _committed(store).values():
+        ordered = sorted(intervals.values())
+        for (_, previous_end), (start, _) in zip(ordered, ordered[1:]):
+            assert previous_end <= start
+
+
+def _run(threads):
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+        assert not thread.is_alive()
+
+
+def test_concurrent_reservations_never_double_book():
+    store = SlowCommitStore()
+    books = [ReservationBook(store, stripes=8, max_attempts=50) for _ in range(BOOKS)]
+    reserved, rejected = [], []
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        for i in range(REQUESTS_PER_THREAD):
+            staff_id, start, end = _random_interval(rng)
+            try:
+                books[seed % BOOKS].reserve(f'{seed}-{i}', staff_id, start, end)
+                outcome = reserved
+            except ReservationConflict:
+                outcome = rejected
+            with lock:
+                outcome.append((f'{seed}-{i}', staff_id, start, end))
+
+    _run([threading.Thread(target=client, args=(seed,)) for seed in range(THREADS)])
+
+    _assert_no_overlaps(store)
+    committed = _committed(store)
+    # Every accepted reservation was committed, and nothing else was
+    assert sum(len(intervals) for intervals in committed.values()) == len(reserved)
+    for booking_id, staff_id, start, _ in reserved:
+        assert booking_id in committed[(staff_id, start.date())]
+    # Nothing is cancelled, so every rejection overlaps a committed booking
+    for _, staff_id, start, end in rejected:
+        intervals = committed.get((staff_id, start.date()), {}).values()
+        assert any(s < end and start < e for s, e in intervals)
+    # The books really raced each other
+    assert sum(book.retries for book in books) > 0
+
+
+def test_concurrent_reserve_and_release_keep_calendars_consistent():
+    store = SlowCommitStore()
+    books = [ReservationBook(store, stripes=8, max_attempts=50) for _ in range(BOOKS)]
+    live = {}
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = random.Random(seed)
+        mine = []
+        for i in range(REQUESTS_PER_THREAD):
+            book = books[rng.randrange(BOOKS)]
+            if mine and rng.random() < 0.3:
+                booking_id, staff_id, start = mine.pop(rng.randrange(len(mine)))
+                assert book.release(booking_id, staff_id, start)
+                with lock:
+                    del live[booking_id]
+                continue
+            staff_id, start, end = _random_interval(rng)
+            try:
+                book.reserve(f'{seed}-{i}', staff_id, start, end)
+            except ReservationConflict:
+                continue
+            mine.append((f'{seed}-{i}', staff_id, start))
+            with lock:
+                live[f'{seed}-{i}'] = (staff_id, start, end)
+
+    _run([threading.Thread(target=client, args=(seed,)) for seed in range(THREADS)])
+
+    _assert_no_overlaps(store)
+    committed = {
+        booking_id: (staff_id, start, end)
+        for (staff_id, _), intervals in _committed(store).items()
+        for booking_id, (start, end) in intervals.items()
+    }
+    assert committed == live
+
+
+def test_stale_commit_is_rejected_by_version():
+    store = InMemoryReservationStore()
+    version, _ = store.load('staff-a', DAYS[0])
+    start = datetime.combine(DAYS[0], datetime.min.time()) + timedelta(hours=10)
+    first = ReservationBook(store)
+    first.reserve('b1', 'staff-a', start, start + timedelta(minutes=30))
+    try:
+        store.commit('staff-a', DAYS[0], version)
+    except VersionConflict:
+        pass
+    else:
+        raise AssertionError('commit at a stale version succeeded')
+
+    # A second book with a stale view still sees the booking on commit
+    second = ReservationBook(store)
+    second._calendar('staff-a', DAYS[0]).version = version
+    try:
+        second.reserve('b2', 'staff-a', start + timedelta(minutes=15), start + timedelta(minutes=45))
+    except ReservationConflict as e:
+        assert e.conflicting_booking_id == 'b1'
+    else:
+        raise AssertionError('overlapping reservation succeeded')
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class BookingRequest(BaseModel):
+    service_id: str
+    customer_name: str
+    date: str
+    time: str
+    notes: Optional[str] = None
+
+
+class BookingResponse(BaseModel):
+    booking_id: str
+    service_id: str
+    customer_name: str
+    date: str
+    time: str
+    status: str
+    notes: Optional[str] = None
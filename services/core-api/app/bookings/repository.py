@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Sequence
+from ..outbox.store import InMemoryOutboxStore, OutboxEvent, OutboxStore, SQLiteOutboxStore, append_events
+from .models import BookingResponse
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    booking_id TEXT PRIMARY KEY,
+    service_id TEXT NOT NULL,
+    customer_name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    status TEXT NOT NULL,
+    notes TEXT
+);
+"""
+
+_COLUMNS = ("booking_id", "service_id", "customer_name", "date", "time", "status", "notes")
+
+
+class BookingRepository(ABC):
+    """
+    Async persistence interface used by the booking pipeline.
+
+    Every repository has an ``outbox``; events passed to ``add`` are written
+    to it in the same unit of work as the booking, so either both are
+    stored or neither is.
+    """
+
+    outbox: OutboxStore
+
+    @abstractmethod
+    async def add(self, booking: BookingResponse, events: Sequence[OutboxEvent] = ()) -> None:
+        """Persist a new booking and the events it produced"""
+
+    @abstractmethod
+    async def get(self, booking_id: str) -> Optional[BookingResponse]:
+        """Load a booking by ID"""
+
+
+class InMemoryBookingRepository(BookingRepository):
+    """Dictionary-backed repository for tests and local runs"""
+
+    def __init__(self):
+        self._bookings: Dict[str, BookingResponse] = {}
+        self.outbox = InMemoryOutboxStore()
+
+    async def add(self, booking: BookingResponse, events: Sequence[OutboxEvent] = ()) -> None:
+        # No await in between, so no other task sees one without the other
+        self._bookings[booking.booking_id] = booking
+        self.outbox.append(events)
+
+    async def get(self, booking_id: str) -> Optional[BookingResponse]:
+        return self._bookings.get(booking_id)
+
+    def __len__(self) -> int:
+        return len(self._bookings)
+
+
+class SQLiteBookingRepository(BookingRepository):
+    """
+    SQLite-backed repository.
+
+    Queries run on the default executor so the event loop never waits on
+    disk I/O; a single connection is shared behind a thread lock. The outbox
+    table lives in the same database, so a booking and its events are
+    committed in one transaction.
+    """
+
+    def __init__(self, path: str = "/tmp/bookings.sqlite3"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self.outbox = SQLiteOutboxStore(conn=self._conn, lock=self._db_lock)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _add(self, booking: BookingResponse, events: Sequence[OutboxEvent]):
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    f"INSERT INTO bookings ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    tuple(getattr(booking, column) for column in _COLUMNS)
+                )
+                append_events(self._conn, events)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _get(self, booking_id: str) -> Optional[BookingResponse]:
+        with self._db_lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM bookings WHERE booking_id = ?", (booking_id,)
+            ).fetchone()
+        return BookingResponse(**dict(zip(_COLUMNS, row))) if row else None
+
+    async def add(self, booking: BookingResponse, events: Sequence[OutboxEvent] = ()) -> None:
+        await self._run(self._add, booking, events)
+
+    async def get(self, booking_id: str) -> Optional[BookingResponse]:
+        return await self._run(self._get, booking_id)
+
+    def close(self):
+        self._conn.close()
+
+
+# BOOKING_REPOSITORY is "sqlite" or "memory". The memory repository loses
+# its bookings and unpublished outbox events on restart: tests only
+BOOKING_REPOSITORY = os.getenv("BOOKING_REPOSITORY", "sqlite")
+BOOKING_SQLITE_PATH = os.getenv("BOOKING_SQLITE_PATH", "/tmp/bookings.sqlite3")
+
+
+def create_booking_repository(kind: Optional[str] = None) -> BookingRepository:
+    """Factory function to create the configured booking repository"""
+    kind = (kind or BOOKING_REPOSITORY).lower()
+    if kind == "memory":
+        logger.warning("Using the in-memory booking repository: bookings and unpublished events "
+                       "are lost when the process stops")
+        return InMemoryBookingRepository()
+    if kind == "sqlite":
+        return SQLiteBookingRepository(BOOKING_SQLITE_PATH)
+    raise ValueError(f"Unknown booking repository: {kind}")
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+import logging
+import os
+from .models import BookingRequest, BookingResponse
+from .repository import create_booking_repository
+from .service import BookingService, BookingValidationError
+from ..outbox.relay import OutboxRelay
+
+logger = logging.getLogger(__name__)
+
+# Create a router for booking endpoints
+router = APIRouter()
+
+# Get the project ID from environment variables
+PROJECT_ID = os.getenv("PROJECT_ID", "your-gcp-project-id")
+
+_booking_service = None
+
+
+def get_booking_service() -> BookingService:
+    """Dependency returning the process-wide booking service"""
+    global _booking_service
+    if _booking_service is None:
+        # Imported here so the Pub/Sub client is only created when needed
+        from ..events.producer import get_event_producer
+        repository = create_booking_repository()
+        relay = OutboxRelay(repository.outbox, get_event_producer(PROJECT_ID))
+        _booking_service = BookingService(repository, relay)
+    return _booking_service
+
+
+async def start_booking_service():
+    """Startup hook: start relaying booking events, including any left from a previous run"""
+    get_booking_service().relay.start()
+
+
+async def drain_booking_service():
+    """Shutdown hook: let the outbox relay finish its current batch"""
+    if _booking_service is not None:
+        await _booking_service.drain(timeout=10)
+
+
+@router.post("/bookings", response_model=BookingResponse)
+async def create_booking(booking: BookingRequest, service: BookingService = Depends(get_booking_service)):
+    """Create a booking; repeated requests are deduplicated by the idempotency middleware"""
+    logger.info(f"Processing booking request for {booking.customer_name}")
+    try:
+        response_data = await service.create_booking(booking)
+    except BookingValidationError as e:
+        return JSONResponse(
+            status_code=422,
+            content={"error": "Invalid booking request", "details": e.errors}
+        )
+    return JSONResponse(content=response_data.dict(), status_code=201)
@@ -0,0 +1,104 @@
+import logging
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from salon_events import EVENT_ENCODING, build_event, encode_event
+from ..outbox.relay import OutboxRelay
+from ..outbox.store import OutboxEvent
+from .models import BookingRequest, BookingResponse
+from .repository import BookingRepository
+
+logger = logging.getLogger(__name__)
+
+
+class BookingValidationError(ValueError):
+    """Raised when a booking request fails validation"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def validate_booking(booking: BookingRequest):
+    """Check the fields the schema alone cannot; raises BookingValidationError"""
+    errors = []
+    if not booking.service_id.strip():
+        errors.append("service_id must not be empty")
+    if not booking.customer_name.strip():
+        errors.append("customer_name must not be empty")
+    try:
+        datetime.strptime(booking.date, "%Y-%m-%d")
+    except ValueError:
+        errors.append("date must be formatted as YYYY-MM-DD")
+    try:
+        datetime.strptime(booking.time, "%H:%M")
+    except ValueError:
+        errors.append("time must be formatted as HH:MM")
+    if errors:
+        raise BookingValidationError(errors)
+
+
+class BookingService:
+    """
+    Async booking creation pipeline: validate, then persist the booking and
+    its ``booking_created`` event in one unit of work.
+
+    The event goes to the repository's outbox rather than to Pub/Sub, so
+    the request never waits on a publish and a Pub/Sub outage cannot lose
+    the event. An OutboxRelay publishes it in the background.
+    """
+
+    def __init__(self, repository: BookingRepository, relay: Optional[OutboxRelay] = None,
+                 tenant_id: str = "default"):
+        """
+        Args:
+            repository: Where bookings and their events are persisted
+            relay: Relay draining the repository's outbox, woken after each
+                booking; None leaves the events for a relay elsewhere
+            tenant_id: Tenant recorded on the events
+        """
+        self.repository = repository
+        self.relay = relay
+        self.tenant_id = tenant_id
+
+    async def create_booking(self, booking: BookingRequest) -> BookingResponse:
+        validate_booking(booking)
+
+        # Create a booking ID and persist the booking together with its event
+        created = BookingResponse(
+            booking_id=str(uuid.uuid4()),
+            service_id=booking.service_id,
+            customer_name=booking.customer_name,
+            date=booking.date,
+            time=booking.time,
+            status="confirmed",
+            notes=booking.notes
+        )
+        await self.repository.add(created, [self._booking_created(created)])
+        logger.info(f"Booking created with ID: {created.booking_id}")
+
+        if self.relay is not None:
+            self.relay.notify()
+        return created
+
+    def _booking_created(self, booking: BookingResponse) -> OutboxEvent:
+        event = build_event(
+            event_type="booking_created",
+            version="1",
+            tenant_id=self.tenant_id,
+            payload={
+                "booking_id": booking.booking_id,
+                "service_id": booking.service_id,
+                "customer_name": booking.customer_name,
+                "date": booking.date,
+                "time": booking.time,
+            }
+        )
+        # Events of one booking are published in order
+        data = encode_event(event, "core-api", "1", EVENT_ENCODING)
+        return OutboxEvent("core-api", "1", f"{self.tenant_id}/{booking.booking_id}", data)
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Stop the relay, e.g. on shutdown; unpublished events stay in the outbox"""
+        if self.relay is not None:
+            await self.relay.stop(timeout=timeout)
@@ -0,0 +1,362 @@
+"""
+Adaptive concurrency limits (bulkheads) for calls to a dependency.
+
+A slow dependency otherwise collects pending calls without bound: every
+request waits on it, the event loop fills with coroutines, and latency
+collapses for everything else. A bulkhead caps the calls in flight to one
+dependency:
+
+    @with_circuit_breaker("pricing", bulkhead=get_bulkhead("pricing"))
+    async def get_prices(service_id: str): ...
+
+Calls beyond the limit wait in a bounded queue for up to ``max_wait``
+seconds; when the queue is full, or the wait runs out, they fail at once
+with BulkheadFull instead of adding to the pile.
+
+The limit is not fixed. GradientLimit compares the latency of recent calls
+with the long-run latency: while they match, the limit grows by about its
+square root, and when recent calls are slower by more than ``tolerance``
+(requests queueing inside the dependency) it shrinks in proportion to the
+slowdown. Failed calls cut it multiplicatively. It settles at about the
+concurrency the dependency serves without queueing.
+
+Placed by with_circuit_breaker outside the breaker, so rejected calls are
+not counted as dependency failures, and inside a fallback cache, so cached
+results are served without taking a slot.
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .circuit_breaker import CircuitBreakerOpen
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bulkhead configuration
+# Limits on calls in flight; the adaptive limit starts at the initial one
+INITIAL_LIMIT = int(os.getenv("BULKHEAD_INITIAL_LIMIT", "20"))
+MIN_LIMIT = int(os.getenv("BULKHEAD_MIN_LIMIT", "1"))
+MAX_LIMIT = int(os.getenv("BULKHEAD_MAX_LIMIT", "200"))
+# Calls waiting for a slot, and how long each may wait
+MAX_QUEUE = int(os.getenv("BULKHEAD_MAX_QUEUE", "50"))
+MAX_WAIT_SECONDS = float(os.getenv("BULKHEAD_MAX_WAIT_SECONDS", "1.0"))
+# Recent latency, relative to the long-run latency, tolerated before the limit shrinks
+LATENCY_TOLERANCE = float(os.getenv("BULKHEAD_LATENCY_TOLERANCE", "2.0"))
+
+# Latencies are floored at this, in seconds: a clock too coarse to time a
+# fast call reports 0, and the latency ratio must never divide by zero
+MIN_LATENCY_SECONDS = 1e-6
+
+
+class BulkheadFull(Exception):
+    """Raised instead of calling a dependency with no free slot"""
+
+    def __init__(self, name: str, reason: str):
+        super().__init__(f"Bulkhead {name!r} is full ({reason})")
+        self.name = name
+        self.reason = reason
+
+
+class GradientLimit:
+    """
+    Concurrency limit following the latency gradient.
+
+    ``update`` takes every completed call. The short-run latency is an
+    average over about ``short_window`` calls and the long-run one over
+    about ``long_window``; their ratio (times ``tolerance``, at most 1) scales
+    the limit, and ``sqrt(limit)`` is added so it keeps probing upwards. The
+    change is smoothed, and the long-run latency is pulled down after a
+    lasting improvement so the baseline does not stay stale.
+    """
+
+    def __init__(self,
+                 initial: int = INITIAL_LIMIT,
+                 min_limit: int = MIN_LIMIT,
+                 max_limit: int = MAX_LIMIT,
+                 tolerance: float = LATENCY_TOLERANCE,
+                 smoothing: float = 0.2,
+                 backoff: float = 0.9,
+                 short_window: int = 10,
+                 long_window: int = 2000):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self._short_alpha = 2.0 / (short_window + 1)
+        self._long_alpha = 2.0 / (long_window + 1)
+        self.short_latency = 0.0
+        self.long_latency = 0.0
+
+    def update(self, latency: float, in_flight: int, failed: bool = False) -> int:
+        """Adjust the limit for a completed call and return it"""
+        if failed:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            return int(self.limit)
+        latency = max(latency, MIN_LATENCY_SECONDS)
+        if not self.long_latency:
+            self.short_latency = self.long_latency = latency
+        self.short_latency += (latency - self.short_latency) * self._short_alpha
+        self.long_latency += (latency - self.long_latency) * self._long_alpha
+        if self.long_latency / self.short_latency > 2:
+            # Much faster than it used to be: let the baseline catch up
+            self.long_latency *= 0.95
+        if in_flight < self.limit / 2:
+            # Too few calls to tell whether the limit is too high
+            return int(self.limit)
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_latency / self.short_latency))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = min(self.max_limit, max(self.min_limit,
+                                             self.limit * (1 - self.smoothing) + target * self.smoothing))
+        return int(self.limit)
+
+
+class _Waiter:
+    """A queued call: an asyncio future, or an event for a thread"""
+
+    __slots__ = ("future", "loop", "event", "granted")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+
+
+class Bulkhead:
+    """
+    Adaptive limit on the calls in flight to one dependency.
+
+    Use it as a decorator of async or sync functions (usually through the
+    ``bulkhead`` argument of ``with_circuit_breaker``), or pair
+    ``acquire``/``acquire_sync`` with ``release``. Slots are handed to
+    queued calls in arrival order.
+    """
+
+    def __init__(self,
+                 name: str,
+                 limit: Optional[GradientLimit] = None,
+                 max_queue: int = MAX_QUEUE,
+                 max_wait: float = MAX_WAIT_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the bulkhead.
+
+        Args:
+            name: Dependency the bulkhead protects
+            limit: Adaptive limit; a GradientLimit with the module defaults otherwise
+            max_queue: Calls that may wait for a slot; 0 rejects at once when full
+            max_wait: Seconds a call may wait for a slot
+            clock: Monotonic time source
+        """
+        self.name = name
+        self.limit = limit or GradientLimit()
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self.in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        # Metrics
+        self.accepted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.max_in_flight = 0
+
+    def _try_acquire(self, waiter_factory: Callable[[], _Waiter]) -> Optional[_Waiter]:
+        """Take a slot (None), or queue a waiter; raise when the queue is full"""
+        with self._lock:
+            if self.in_flight < int(self.limit.limit) and not self._waiters:
+                self._admit()
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.rejected_full += 1
+                raise BulkheadFull(self.name, "queue full")
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            self.queued += 1
+            return waiter
+
+    def _admit(self):
+        self.in_flight += 1
+        self.accepted += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def _grant(self):
+        """Hand free slots to queued calls; call with the lock held"""
+        while self._waiters and self.in_flight < int(self.limit.limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._admit()
+            if waiter.event is not None:
+                waiter.event.set()
+            else:
+                waiter.loop.call_soon_threadsafe(self._deliver, waiter)
+
+    def _deliver(self, waiter: _Waiter):
+        """Wake an async waiter, or pass its slot on if it stopped waiting"""
+        if waiter.future.done():
+            self.release()
+        else:
+            waiter.future.set_result(None)
+
+    def _leave(self, waiter: _Waiter) -> bool:
+        """Leave the queue; False if a slot was granted first"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def _abandon(self, waiter: _Waiter):
+        """Stop waiting, giving back the slot if one was granted"""
+        if not self._leave(waiter):
+            if waiter.future.done():
+                self.release()
+            else:
+                # Passed on when the grant is delivered
+                waiter.future.cancel()
+
+    def _reject_timeout(self) -> BulkheadFull:
+        self.rejected_timeout += 1
+        return BulkheadFull(self.name, f"no slot within {self.max_wait}s")
+
+    async def acquire(self):
+        """
+        Wait for a slot.
+
+        Raises:
+            BulkheadFull: If the queue is full, or no slot freed up in ``max_wait``
+        """
+        waiter = self._try_acquire(lambda: _Waiter(asyncio.get_running_loop()))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+            return
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        if self._leave(waiter):
+            raise self._reject_timeout()
+        # Granted as the wait ran out; the slot arrives with the callback
+        try:
+            await waiter.future
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def acquire_sync(self):
+        """Wait for a slot, blocking the thread; raises like ``acquire``"""
+        waiter = self._try_acquire(_Waiter)
+        if waiter is None:
+            return
+        if not waiter.event.wait(self.max_wait) and self._leave(waiter):
+            raise self._reject_timeout()
+
+    def release(self, latency: Optional[float] = None, failed: bool = False):
+        """Free a slot, adapting the limit to the call's latency if given"""
+        with self._lock:
+            try:
+                if latency is not None:
+                    self.limit.update(latency, self.in_flight, failed)
+            finally:
+                # Whatever happens to the limit, the slot must not leak
+                self.in_flight -= 1
+                self._grant()
+
+    def __call__(self, func: Callable) -> Callable:
+        """
+        Decorator to run a function within the bulkhead.
+
+        Args:
+            func: Function to decorate, async or sync
+
+        Returns:
+            Decorated function, with a ``bulkhead`` attribute
+        """
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                await self.acquire()
+                start = self.clock()
+                latency, failed = None, False
+                try:
+                    result = await func(*args, **kwargs)
+                    latency = self.clock() - start
+                    return result
+                except CircuitBreakerOpen:
+                    raise
+                except Exception:
+                    latency, failed = self.clock() - start, True
+                    raise
+                finally:
+                    self.release(latency, failed)
+            async_wrapper.bulkhead = self
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.acquire_sync()
+            start = self.clock()
+            latency, failed = None, False
+            try:
+                result = func(*args, **kwargs)
+                latency = self.clock() - start
+                return result
+            except CircuitBreakerOpen:
+                raise
+            except Exception:
+                latency, failed = self.clock() - start, True
+                raise
+            finally:
+                self.release(latency, failed)
+        wrapper.bulkhead = self
+        return wrapper
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit.limit),
+            "in_flight": self.in_flight,
+            "queued_now": len(self._waiters),
+            "max_in_flight": self.max_in_flight,
+            "accepted": self.accepted,
+            "queued": self.queued,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "short_latency": self.limit.short_latency,
+            "long_latency": self.limit.long_latency,
+        }
+
+
+# Bulkheads by dependency name, for sharing and for the metrics endpoint
+bulkheads: Dict[str, Bulkhead] = {}
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkhead(name: str, **config) -> Bulkhead:
+    """The registered bulkhead for a dependency, created with ``config`` on first use"""
+    bulkhead = bulkheads.get(name)
+    if bulkhead is None:
+        with _bulkheads_lock:
+            bulkhead = bulkheads.get(name)
+            if bulkhead is None:
+                bulkhead = bulkheads[name] = Bulkhead(name, **config)
+    return bulkhead
+
+
+def bulkhead_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: bulkhead.stats() for name, bulkhead in list(bulkheads.items())}
@@ -2,64 +2,436 @@
 Circuit Breaker Implementation for Core-API Service
 
 This module implements the circuit breaker pattern following Google Cloud's recommended practices.
+
+Each dependency gets a breaker of its own from the registry, by name, so a
+failing pricing service does not open the circuit for unrelated calls:
+
+    @with_circuit_breaker("pricing")
+    async def get_prices(service_id: str): ...
+
+A breaker opens when, over a sliding window of the last
+``window_seconds``, at least ``minimum_calls`` calls were made and either
+the failure rate or the slow-call rate reaches its threshold. While open,
+calls are rejected with CircuitBreakerOpen without running. After
+``timeout`` seconds it lets ``half_open_max_calls`` trial calls through
+(half-open) and closes again if they succeed, or reopens if not.
+
+The window is a ring of time buckets with running totals, so recording a
+call and checking the rates cost the same however many calls the window
+holds, and a closed breaker admits a call with one attribute check.
 """
 
+import asyncio
+import functools
 import logging
-from typing import Any, Callable, Optional
-from fastapi import HTTPException, status
-from fastapi_cb import circuit_breaker
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 # Circuit breaker configuration
-FAILURE_THRESHOLD = 5  # Number of failures before opening the circuit
-TIMEOUT = 60  # Timeout in seconds before trying again
-EXPECTED_EXCEPTION = Exception  # Exception type to catch
+# Failure rate (0-1) over the window at which the circuit opens
+FAILURE_RATE_THRESHOLD = float(os.getenv("CIRCUIT_FAILURE_RATE_THRESHOLD", "0.5"))
+# Share (0-1) of calls slower than SLOW_CALL_SECONDS at which the circuit opens
+SLOW_CALL_RATE_THRESHOLD = float(os.getenv("CIRCUIT_SLOW_CALL_RATE_THRESHOLD", "0.8"))
+SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "5.0"))
+# Sliding window length and the number of buckets it is kept in
+WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+WINDOW_BUCKETS = int(os.getenv("CIRCUIT_WINDOW_BUCKETS", "12"))
+# Calls in the window before the rates are acted on
+MINIMUM_CALLS = int(os.getenv("CIRCUIT_MINIMUM_CALLS", "10"))
+TIMEOUT = float(os.getenv("CIRCUIT_OPEN_SECONDS", "60"))  # Timeout in seconds before trying again
+# Trial calls let through when half-open
+HALF_OPEN_MAX_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_MAX_CALLS", "3"))
+EXPECTED_EXCEPTION = Exception  # Exception type counted as a failure
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+ExceptionTypes = Union[Type[BaseException], Tuple[Type[BaseException], ...]]
+# Called with (breaker, old state, new state) on every transition
+TransitionListener = Callable[["CircuitBreaker", str, str], None]
+
+
+class CircuitBreakerOpen(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit breaker {name!r} is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class SlidingWindow:
+    """
+    Call, failure and slow-call counts over the last ``window_seconds``, in
+    ``buckets`` time buckets. Whole buckets expire as time moves on, so the
+    window covers between ``window_seconds`` minus one bucket and
+    ``window_seconds``.
+    """
+
+    __slots__ = ("bucket_seconds", "size", "_calls", "_failures", "_slow", "_head",
+                 "calls", "failures", "slow")
+
+    def __init__(self, window_seconds: float = WINDOW_SECONDS, buckets: int = WINDOW_BUCKETS):
+        self.bucket_seconds = window_seconds / buckets
+        self.size = buckets
+        self._calls = [0] * buckets
+        self._failures = [0] * buckets
+        self._slow = [0] * buckets
+        self._head: Optional[int] = None
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
 
+    def _advance(self, now: float) -> int:
+        index = int(now / self.bucket_seconds)
+        if self._head is None:
+            self._head = index
+        elif index > self._head:
+            # Expire the buckets between the newest one and now, at most all of them
+            for expired in range(self._head + 1, min(index, self._head + self.size) + 1):
+                slot = expired % self.size
+                self.calls -= self._calls[slot]
+                self.failures -= self._failures[slot]
+                self.slow -= self._slow[slot]
+                self._calls[slot] = self._failures[slot] = self._slow[slot] = 0
+            self._head = index
+        return self._head % self.size
 
-class CoreAPICircuitBreaker:
-    """Circuit Breaker for Core-API Service"""
+    def record(self, now: float, failed: bool, slow: bool):
+        slot = self._advance(now)
+        self._calls[slot] += 1
+        self.calls += 1
+        if failed:
+            self._failures[slot] += 1
+            self.failures += 1
+        if slow:
+            self._slow[slot] += 1
+            self.slow += 1
 
-    def __init__(self, 
-                 failure_threshold: int = FAILURE_THRESHOLD,
-                 timeout: int = TIMEOUT,
-                 expected_exception: Exception = EXPECTED_EXCEPTION):
+    def rates(self, now: float) -> Tuple[int, float, float]:
+        """(calls, failure rate, slow-call rate) in the window ending now"""
+        self._advance(now)
+        if not self.calls:
+            return 0, 0.0, 0.0
+        return self.calls, self.failures / self.calls, self.slow / self.calls
+
+    def reset(self):
+        self._calls = [0] * self.size
+        self._failures = [0] * self.size
+        self._slow = [0] * self.size
+        self._head = None
+        self.calls = self.failures = self.slow = 0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one dependency.
+
+    Use it as a decorator of async or sync functions, or ``await
+    breaker.call(func, ...)``. Exceptions matching ``expected_exception``
+    count as failures; others propagate without counting either way.
+    Calls taking ``slow_call_seconds`` or more count as slow, whether they
+    succeed or fail. State changes are logged, counted in ``stats()`` and
+    passed to listeners added with ``add_listener``.
+    """
+
+    def __init__(self,
+                 name: str,
+                 failure_rate_threshold: float = FAILURE_RATE_THRESHOLD,
+                 slow_call_rate_threshold: float = SLOW_CALL_RATE_THRESHOLD,
+                 slow_call_seconds: float = SLOW_CALL_SECONDS,
+                 window_seconds: float = WINDOW_SECONDS,
+                 window_buckets: int = WINDOW_BUCKETS,
+                 minimum_calls: int = MINIMUM_CALLS,
+                 timeout: float = TIMEOUT,
+                 half_open_max_calls: int = HALF_OPEN_MAX_CALLS,
+                 expected_exception: ExceptionTypes = EXPECTED_EXCEPTION,
+                 clock: Callable[[], float] = time.monotonic):
         """
         Initialize the circuit breaker with configuration parameters.
 
         Args:
-            failure_threshold: Number of failures before opening the circuit
-            timeout: Timeout in seconds before trying again
-            expected_exception: Exception type to catch
+            name: Dependency the breaker protects
+            failure_rate_threshold: Failure rate (0-1) that opens the circuit
+            slow_call_rate_threshold: Slow-call rate (0-1) that opens the circuit
+            slow_call_seconds: Duration from which a call counts as slow
+            window_seconds: Length of the sliding window
+            window_buckets: Time buckets the window is kept in
+            minimum_calls: Calls in the window before the rates are acted on
+            timeout: Seconds open before trial calls are let through
+            half_open_max_calls: Trial calls when half-open; all must
+                complete before the circuit closes or reopens
+            expected_exception: Exception type(s) counted as failures
+            clock: Monotonic time source
         """
-        self.failure_threshold = failure_threshold
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.minimum_calls = minimum_calls
         self.timeout = timeout
+        self.half_open_max_calls = half_open_max_calls
         self.expected_exception = expected_exception
+        self.clock = clock
+        self.window = SlidingWindow(window_seconds, window_buckets)
+        self._lock = threading.Lock()
+        self._listeners: List[TransitionListener] = []
+        self._state = CLOSED
+        self._state_since = clock()
+        self._opened_at = 0.0
+        # Half-open trials: started, and completed with failures or slow calls
+        self._trials = 0
+        self._trial_calls = 0
+        self._trial_failures = 0
+        self._trial_slow = 0
+        # Metrics
+        self.successful_calls = 0
+        self.failed_calls = 0
+        self.slow_calls = 0
+        self.ignored_calls = 0
+        self.rejected_calls = 0
+        self.transitions: Dict[str, int] = {}
 
-        # Create the circuit breaker decorator
-        self.cb_decorator = circuit_breaker(
-            failure_threshold=self.failure_threshold,
-            timeout=self.timeout,
-            expected_exception=self.expected_exception
-        )
+    @property
+    def state(self) -> str:
+        """The state, moving an open circuit whose timeout has passed to half-open"""
+        if self._state == OPEN and self.clock() - self._opened_at >= self.timeout:
+            with self._lock:
+                expired = self._state == OPEN and self.clock() - self._opened_at >= self.timeout
+                if expired:
+                    self._transition(HALF_OPEN)
+            if expired:
+                self._notify(OPEN, HALF_OPEN)
+        return self._state
+
+    def add_listener(self, listener: TransitionListener):
+        self._listeners.append(listener)
+
+    def _transition(self, state: str):
+        """Change state; call with the lock held, then ``_notify`` without it"""
+        old = self._state
+        self._state = state
+        self._state_since = self.clock()
+        key = f"{old}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        if state == OPEN:
+            self._opened_at = self._state_since
+        elif state == CLOSED:
+            self.window.reset()
+        self._trials = self._trial_calls = self._trial_failures = self._trial_slow = 0
+        log = logger.info if state == CLOSED else logger.warning
+        log(f"Circuit breaker {self.name!r} {old} -> {state}")
+
+    def _notify(self, old: str, new: str):
+        for listener in self._listeners:
+            try:
+                listener(self, old, new)
+            except Exception as e:
+                logger.error(f"Circuit breaker {self.name!r} listener failed: {e}", exc_info=True)
+
+    def acquire(self) -> bool:
+        """
+        Whether a call may proceed now. A closed circuit admits every call;
+        a half-open one admits up to ``half_open_max_calls`` trials, which
+        must then be reported with ``record`` or ``release``.
+        """
+        if self._state == CLOSED:
+            return True
+        if self.state == HALF_OPEN:
+            with self._lock:
+                if self._state == HALF_OPEN and self._trials < self.half_open_max_calls:
+                    self._trials += 1
+                    return True
+            if self._state == CLOSED:
+                return True
+        self.rejected_calls += 1
+        return False
+
+    def check(self):
+        """
+        Acquire a call permit.
+
+        Raises:
+            CircuitBreakerOpen: If the circuit is open, or half-open with all
+                trial calls in flight
+        """
+        if not self.acquire():
+            raise CircuitBreakerOpen(self.name, self.retry_after)
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets trial calls through"""
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.timeout - self.clock())
+
+    def record(self, duration: float, failed: bool):
+        """Report the outcome of a permitted call"""
+        slow = duration >= self.slow_call_seconds
+        changed = None
+        with self._lock:
+            if failed:
+                self.failed_calls += 1
+            else:
+                self.successful_calls += 1
+            if slow:
+                self.slow_calls += 1
+            if self._state == CLOSED:
+                now = self.clock()
+                self.window.record(now, failed, slow)
+                if failed or slow:
+                    calls, failure_rate, slow_rate = self.window.rates(now)
+                    if calls >= self.minimum_calls and (failure_rate >= self.failure_rate_threshold
+                                                        or slow_rate >= self.slow_call_rate_threshold):
+                        changed = (CLOSED, OPEN)
+            elif self._state == HALF_OPEN and self._trial_calls < self._trials:
+                # A trial; calls started before the circuit opened do not count
+                self._trial_calls += 1
+                self._trial_failures += failed
+                self._trial_slow += slow
+                if self._trial_calls >= self.half_open_max_calls:
+                    reopen = (self._trial_failures / self._trial_calls >= self.failure_rate_threshold
+                              or self._trial_slow / self._trial_calls >= self.slow_call_rate_threshold)
+                    changed = (HALF_OPEN, OPEN if reopen else CLOSED)
+            if changed:
+                self._transition(changed[1])
+        if changed:
+            self._notify(*changed)
+
+    def release(self):
+        """Give back the permit of a call whose outcome does not count"""
+        with self._lock:
+            self.ignored_calls += 1
+            if self._state == HALF_OPEN and self._trials > self._trial_calls:
+                self._trials -= 1
+
+    async def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Call an async function, or a sync one, through the breaker"""
+        self.check()
+        start = self.clock()
+        try:
+            result = func(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except self.expected_exception:
+            self.record(self.clock() - start, failed=True)
+            raise
+        except BaseException:
+            # Includes cancellation: neither a success nor a failure
+            self.release()
+            raise
+        self.record(self.clock() - start, failed=False)
+        return result
+
+    def call_sync(self, func: Callable, *args, **kwargs) -> Any:
+        """Call a sync function through the breaker"""
+        self.check()
+        start = self.clock()
+        try:
+            result = func(*args, **kwargs)
+        except self.expected_exception:
+            self.record(self.clock() - start, failed=True)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record(self.clock() - start, failed=False)
+        return result
 
     def __call__(self, func: Callable) -> Callable:
         """
         Decorator to apply circuit breaker to a function.
 
         Args:
-            func: Function to decorate
+            func: Function to decorate, async or sync
 
         Returns:
             Decorated function with circuit breaker
         """
-        return self.cb_decorator(func)
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await self.call(func, *args, **kwargs)
+            async_wrapper.circuit_breaker = self
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call_sync(func, *args, **kwargs)
+        wrapper.circuit_breaker = self
+        return wrapper
+
+    def reset(self):
+        """Close the circuit and forget the window"""
+        with self._lock:
+            old = self._state
+            if old != CLOSED:
+                self._transition(CLOSED)
+            else:
+                self.window.reset()
+        if old != CLOSED:
+            self._notify(old, CLOSED)
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        now = self.clock()
+        with self._lock:
+            calls, failure_rate, slow_rate = self.window.rates(now)
+        return {
+            "state": state,
+            "state_seconds": now - self._state_since,
+            "retry_after": self.retry_after,
+            "window_calls": calls,
+            "failure_rate": failure_rate,
+            "slow_call_rate": slow_rate,
+            "successful_calls": self.successful_calls,
+            "failed_calls": self.failed_calls,
+            "slow_calls": self.slow_calls,
+            "ignored_calls": self.ignored_calls,
+            "rejected_calls": self.rejected_calls,
+            "transitions": dict(self.transitions),
+        }
+
+
+class CircuitBreakerRegistry:
+    """Circuit breakers by dependency name, created on first use"""
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, **config) -> CircuitBreaker:
+        """
+        The breaker for ``name``. ``config`` overrides the defaults when the
+        breaker is created, and is ignored afterwards.
+        """
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = self._breakers[name] = CircuitBreaker(name, **dict(self.defaults, **config))
+        return breaker
+
+    def __iter__(self):
+        return iter(list(self._breakers.values()))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {breaker.name: breaker.stats() for breaker in self}
 
 
 def fallback_handler(exception: Exception) -> Any:
     """
-    Fallback handler for when the circuit breaker is open.
+    Fallback handler for when the circuit breaker is open and no cached
+    result (see fallback_cache.py) can be served instead.
 
     Args:
         exception: The exception that caused the circuit breaker to open
@@ -70,36 +442,69 @@ def fallback_handler(exception: Exception) -> Any:
     logger.warning(f"Circuit breaker is open. Exception: {exception}")
 
     # Return a fallback response
-    return {
+    response = {
         "error": "Service temporarily unavailable",
         "message": "The service is currently unavailable. Please try again later.",
         "status": "circuit_open"
     }
+    if isinstance(exception, CircuitBreakerOpen):
+        response["circuit"] = exception.name
+    return response
 
 
-def create_circuit_breaker(failure_threshold: int = FAILURE_THRESHOLD,
-                          timeout: int = TIMEOUT,
-                          expected_exception: Exception = EXPECTED_EXCEPTION) -> CoreAPICircuitBreaker:
+def create_circuit_breaker(name: str, **config) -> CircuitBreaker:
     """
     Factory function to create a circuit breaker instance.
 
     Args:
-        failure_threshold: Number of failures before opening the circuit
-        timeout: Timeout in seconds before trying again
-        expected_exception: Exception type to catch
+        name: Dependency the breaker protects
+        config: CircuitBreaker settings; the module defaults otherwise
 
     Returns:
-        CoreAPICircuitBreaker instance
+        CircuitBreaker instance, not registered; use ``get_circuit_breaker``
+        for the shared one
+    """
+    return CircuitBreaker(name, **config)
+
+
+# Breakers shared by every caller of a dependency
+registry = CircuitBreakerRegistry()
+
+
+def get_circuit_breaker(name: str, **config) -> CircuitBreaker:
+    """The registered breaker for a dependency, created with ``config`` on first use"""
+    return registry.get(name, **config)
+
+
+def with_circuit_breaker(func: Union[Callable, str, None] = None, *, name: Optional[str] = None,
+                         bulkhead: Optional[Callable[[Callable], Callable]] = None,
+                         retry: Optional[Callable[[Callable], Callable]] = None,
+                         fallback_cache: Optional[Callable[[Callable], Callable]] = None, **config):
     """
-    return CoreAPICircuitBreaker(
-        failure_threshold=failure_threshold,
-        timeout=timeout,
-        expected_exception=expected_exception
-    )
+    Decorator for easy use: guards a function with the registered breaker of
+    its dependency.
+
+        @with_circuit_breaker("pricing")
+        @with_circuit_breaker(name="pricing", timeout=30)
+        @with_circuit_breaker  # a breaker of the function's own
+        @with_circuit_breaker("pricing", bulkhead=get_bulkhead("pricing"), retry=RetryPolicy("pricing"),
+                              fallback_cache=get_fallback_cache("pricing"))
 
+    Functions naming the same dependency share its breaker. A ``bulkhead``
+    (see bulkhead.py) limits the calls in flight, outside the breaker so its
+    rejections do not count as failures. A ``retry`` policy (see retry.py)
+    wraps both, so every attempt is counted and backoff holds no slot. With
+    a ``fallback_cache`` (see fallback_cache.py) the last good results are
+    served while the circuit is open, without taking a bulkhead slot.
+    """
+    if isinstance(func, str):
+        name, func = func, None
 
-# Default circuit breaker instance
-DEFAULT_CIRCUIT_BREAKER = create_circuit_breaker()
+    def decorate(f: Callable) -> Callable:
+        guarded = get_circuit_breaker(name or f"{f.__module__}.{f.__qualname__}", **config)(f)
+        for layer in (bulkhead, retry, fallback_cache):
+            if layer is not None:
+                guarded = layer(guarded)
+        return guarded
 
-# Decorator for easy use
-with_circuit_breaker = DEFAULT_CIRCUIT_BREAKER
+    return decorate(func) if func is not None else decorate
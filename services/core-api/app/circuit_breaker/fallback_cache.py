@@ -0,0 +1,283 @@
+"""
+Last good results of circuit-broken calls, served while the dependency fails.
+
+For read-style dependencies (pricing lookups, service catalogs) the last good
+response beats a 503. Wrap the guarded function with a cache:
+
+    @with_circuit_breaker("pricing", fallback_cache=get_fallback_cache("pricing", max_age=600))
+    async def get_prices(service_id: str): ...
+
+This is a fallback, not a read-through cache. While the circuit is closed
+every call goes to the dependency and its result replaces the cached one; the
+cached result is served only when the call fails. While the circuit is open
+it is served without calling the dependency, and while it is half-open it is
+served while a background refresh makes the trial call, so a recovered
+dependency closes the circuit and updates the cache without making the
+caller wait. A call with nothing cached younger than ``max_age`` gets the
+dependency's error, or CircuitBreakerOpen while the circuit is open.
+
+Entries are kept in LRU order up to ``max_entries``. Cached results are
+returned as they were stored and must not be mutated by callers.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from .bulkhead import BulkheadFull
+from .circuit_breaker import CLOSED, HALF_OPEN, CircuitBreakerOpen
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Fallback cache configuration
+# Age up to which a result is served in place of the dependency's; older ones are dropped
+FALLBACK_MAX_AGE_SECONDS = float(os.getenv("FALLBACK_CACHE_MAX_AGE_SECONDS", "3600"))
+# Results kept per cache, least recently used evicted first
+FALLBACK_MAX_ENTRIES = int(os.getenv("FALLBACK_CACHE_MAX_ENTRIES", "1000"))
+# Threads refreshing the results of sync functions
+FALLBACK_REFRESH_WORKERS = int(os.getenv("FALLBACK_CACHE_REFRESH_WORKERS", "4"))
+
+# Computes the cache key of a call from (function, args, kwargs)
+KeyFunction = Callable[[Callable, tuple, dict], Hashable]
+
+
+def call_signature(func: Callable, args: tuple, kwargs: dict) -> Hashable:
+    """The function and its arguments; their repr if they are not hashable"""
+    key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return repr(key)
+    return key
+
+
+class FallbackCache:
+    """
+    Last good results of the functions it wraps, by call signature.
+
+    Use it as a decorator of a function guarded by a circuit breaker (one
+    with a ``circuit_breaker`` attribute), usually through the
+    ``fallback_cache`` argument of ``with_circuit_breaker``. Async and sync
+    functions are supported; sync refreshes run on a small thread pool.
+    Exceptions the breaker counts as failures, and its and the bulkhead's
+    rejections, are answered from the cache; any other error is raised.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_age: float = FALLBACK_MAX_AGE_SECONDS,
+                 max_entries: int = FALLBACK_MAX_ENTRIES,
+                 key: KeyFunction = call_signature,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the cache.
+
+        Args:
+            name: Name reported in the metrics, usually the dependency's
+            max_age: Seconds a result may still be served in place of the
+                dependency's
+            max_entries: Results kept before the least recently used are evicted
+            key: Cache key of a call, from (function, args, kwargs)
+            clock: Monotonic time source
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.name = name
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.key = key
+        self.clock = clock
+        # key -> (result, stored at)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: Set[Hashable] = set()
+        self._tasks: Set[asyncio.Future] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Metrics
+        self.calls = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self.unavailable = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """The (result, age) cached under ``key``, dropping it if too old to serve"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            age = now - entry[1]
+            if age >= self.max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], age
+
+    def put(self, key: Hashable, result: Any):
+        with self._lock:
+            self._entries[key] = (result, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: Hashable, breaker) -> Tuple[bool, Any, bool]:
+        """
+        (found, result, refresh): whether to serve a cached result instead of
+        calling, and whether to refresh it in the background. Only while the
+        circuit is open or half-open; half-open, the refresh is the trial call.
+        """
+        state = breaker.state
+        if state == CLOSED:
+            return False, None, False
+        entry = self.get(key)
+        if entry is None:
+            return False, None, False
+        self.hits += 1
+        if state != HALF_OPEN:
+            return True, entry[0], False
+        with self._lock:
+            refresh = key not in self._refreshing
+            self._refreshing.add(key)
+        return True, entry[0], refresh
+
+    def _fallback(self, key: Hashable, error: BaseException, breaker) -> Any:
+        """The cached result answering a failed call, or the call's error"""
+        if not isinstance(error, (CircuitBreakerOpen, BulkheadFull, breaker.expected_exception)):
+            raise error
+        entry = self.get(key)
+        if entry is None:
+            self.unavailable += 1
+            raise error
+        self.fallbacks += 1
+        logger.info(f"Fallback cache {self.name!r} answered a failed call: {error}")
+        return entry[0]
+
+    def _refreshed(self, key: Hashable, future):
+        """Store the result of a background refresh, or count its failure"""
+        with self._lock:
+            self._refreshing.discard(key)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.refreshes += 1
+            self.put(key, future.result())
+        elif not isinstance(error, (CircuitBreakerOpen, BulkheadFull)):
+            # Counted by the breaker too; the cached result stays
+            self.refresh_failures += 1
+            logger.warning(f"Fallback cache {self.name!r} refresh failed: {error}")
+
+    def _refresh_sync(self, key: Hashable, guarded: Callable, args: tuple, kwargs: dict):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=FALLBACK_REFRESH_WORKERS,
+                                                        thread_name_prefix="fallback-refresh")
+        future = self._executor.submit(guarded, *args, **kwargs)
+        future.add_done_callback(functools.partial(self._refreshed, key))
+
+    def __call__(self, guarded: Callable) -> Callable:
+        """
+        Decorator serving a guarded function's results from the cache.
+
+        Args:
+            guarded: Function wrapped by a circuit breaker
+
+        Returns:
+            Decorated function, with ``fallback_cache`` and ``circuit_breaker``
+            attributes
+        """
+        breaker = guarded.circuit_breaker
+        func = getattr(guarded, "__wrapped__", guarded)
+
+        if asyncio.iscoroutinefunction(guarded):
+            @functools.wraps(guarded)
+            async def async_wrapper(*args, **kwargs):
+                key = self.key(func, args, kwargs)
+                found, result, refresh = self._lookup(key, breaker)
+                if refresh:
+                    task = asyncio.ensure_future(guarded(*args, **kwargs))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                    task.add_done_callback(functools.partial(self._refreshed, key))
+                if found:
+                    return result
+                self.calls += 1
+                try:
+                    result = await guarded(*args, **kwargs)
+                except Exception as e:
+                    return self._fallback(key, e, breaker)
+                self.put(key, result)
+                return result
+            async_wrapper.fallback_cache = self
+            return async_wrapper
+
+        @functools.wraps(guarded)
+        def wrapper(*args, **kwargs):
+            key = self.key(func, args, kwargs)
+            found, result, refresh = self._lookup(key, breaker)
+            if refresh:
+                self._refresh_sync(key, guarded, args, kwargs)
+            if found:
+                return result
+            self.calls += 1
+            try:
+                result = guarded(*args, **kwargs)
+            except Exception as e:
+                return self._fallback(key, e, breaker)
+            self.put(key, result)
+            return result
+        wrapper.fallback_cache = self
+        return wrapper
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "calls": self.calls,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "unavailable": self.unavailable,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refreshing": len(self._refreshing),
+            "evictions": self.evictions,
+        }
+
+
+# Caches by name, for sharing and for the metrics endpoint
+fallback_caches: Dict[str, FallbackCache] = {}
+_fallback_caches_lock = threading.Lock()
+
+
+def get_fallback_cache(name: str, **config) -> FallbackCache:
+    """The registered cache called ``name``, created with ``config`` on first use"""
+    cache = fallback_caches.get(name)
+    if cache is None:
+        with _fallback_caches_lock:
+            cache = fallback_caches.get(name)
+            if cache is None:
+                cache = fallback_caches[name] = FallbackCache(name, **config)
+    return cache
+
+
+def fallback_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: cache.stats() for name, cache in list(fallback_caches.items())}
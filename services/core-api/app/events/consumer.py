@@ -1,30 +1,321 @@
-import json
-from google.cloud import pubsub_v1
+import asyncio
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Callable, Optional
 import logging
 
+try:
+    from google.cloud.pubsub_v1.types import FlowControl
+except ImportError:  # pragma: no cover - depends on the deployment
+    # Without the client library only a fake subscriber can be used, and it
+    # reads the same two fields
+    FlowControl = namedtuple("FlowControl", ("max_bytes", "max_messages"))
+
+from salon_events import (
+    DUPLICATE,
+    IN_FLIGHT,
+    Deduplicator,
+    DispatchTable,
+    EventValidationError,
+    ParkingLot,
+    decode_event,
+    get_deduplicator,
+    get_validator,
+    message_encoding,
+)
+from salon_events.dispatch import Upcaster
+from .ordering import KeyedSequencer
+
 logger = logging.getLogger(__name__)
 
+# Flow control: the subscriber stops pulling once this many messages, or
+# bytes, are leased and not yet acked or nacked
+EVENT_CONSUMER_MAX_MESSAGES = int(os.getenv("EVENT_CONSUMER_MAX_MESSAGES", "200"))
+EVENT_CONSUMER_MAX_BYTES = int(os.getenv("EVENT_CONSUMER_MAX_BYTES", str(20 * 1024 * 1024)))
+# Threads running sync handlers that have no concurrency limit of their own
+EVENT_CONSUMER_MAX_WORKERS = int(os.getenv("EVENT_CONSUMER_MAX_WORKERS", "10"))
+
+
+def message_ordering_key(event: Dict[str, Any], message) -> Optional[str]:
+    """The Pub/Sub ordering key the event was published with, if any"""
+    return getattr(message, "ordering_key", None) or None
+
+
+def invalid_event(message, error: EventValidationError) -> Dict[str, Any]:
+    """What is parked for a message that is not a valid event: its data and why it was rejected"""
+    return {
+        "type": None,
+        "version": None,
+        "invalid": str(error),
+        "message_id": message.message_id,
+        "data": message.data,
+    }
+
+
+class _Handler:
+    """A registered handler and where it runs"""
+
+    __slots__ = ("func", "is_async", "max_concurrency", "executor", "semaphore")
+
+    def __init__(self, func: Callable, max_concurrency: Optional[int]):
+        self.func = func
+        self.is_async = asyncio.iscoroutinefunction(func)
+        self.max_concurrency = max_concurrency
+        # Sync handlers with a limit get a pool of exactly that many threads;
+        # async handlers get a semaphore, created on the consumer's loop
+        self.executor = None
+        if max_concurrency and not self.is_async:
+            self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="event-handler")
+        self.semaphore = None
+
+
 class EventConsumer:
-    def __init__(self, project_id: str):
+    """
+    Consumes versioned events and dispatches them to registered handlers.
+
+    The subscriber client's callback only decodes and validates a message and
+    hands it off, so slow handlers never hold the client's threads:
+
+    - sync handlers run on a shared pool of ``max_workers`` threads, or on a
+      pool of their own when registered with ``max_concurrency``
+    - ``async def`` handlers run on a dedicated event loop thread, limited by
+      a semaphore when registered with ``max_concurrency``
+
+    A message is acked or nacked when its handler finishes, so flow control
+    (``max_messages``/``max_bytes`` outstanding) bounds the work in flight.
+
+    Handlers are looked up in a DispatchTable, which accepts version ranges
+    and upcasters. Events no handler accepts, and messages that are not
+    valid events, are passed to ``park`` and acked instead of being nacked,
+    which would only have them redelivered until they are dead-lettered, or
+    forever on a subscription without a dead letter topic.
+
+    Redelivered messages are skipped by a Deduplicator: one already
+    processed is acked without running its handler again, and one still
+    being processed is nacked to be redelivered after it finishes.
+
+    Events with an ordering key (by default the message's Pub/Sub ordering
+    key) are handled strictly one at a time per key, in arrival order, while
+    different keys run in parallel. When one fails, the events queued behind
+    it on its key are nacked too, so none is applied before its redelivery.
+    """
+
+    def __init__(self,
+                 project_id: str,
+                 subscriber=None,
+                 max_messages: int = EVENT_CONSUMER_MAX_MESSAGES,
+                 max_bytes: int = EVENT_CONSUMER_MAX_BYTES,
+                 max_workers: int = EVENT_CONSUMER_MAX_WORKERS,
+                 park: Optional[Callable[[Dict[str, Any], Any], None]] = None,
+                 dedup: Optional[Deduplicator] = None,
+                 ordering_key: Callable[[Dict[str, Any], Any], Optional[str]] = message_ordering_key):
+        """
+        Args:
+            project_id: GCP project owning the topics and subscriptions
+            subscriber: Subscriber client to use, e.g. one pointed at the
+                emulator; by default a new SubscriberClient
+            max_messages: Outstanding (leased, unacked) messages per subscription
+            max_bytes: Outstanding message bytes per subscription
+            max_workers: Threads for sync handlers without their own limit
+            park: Called with (event, message) for events no handler accepts,
+                e.g. to publish them to a parking topic; by default they are
+                kept in a bounded in-memory ParkingLot. For a message that
+                is not a valid event, ``event`` is an ``invalid_event`` record
+            dedup: Deduplicator for redeliveries; by default the one
+                configured by the EVENT_DEDUP_* settings
+            ordering_key: Called with (event, message) to get the key the
+                event is serialized on, or None to handle it unordered; e.g.
+                ``lambda event, message: event["payload"]["booking_id"]``
+        """
         self.project_id = project_id
-        self.subscriber = pubsub_v1.SubscriberClient()
-        self.handlers = {}
-    
+        if subscriber is None:
+            from google.cloud import pubsub_v1
+            subscriber = pubsub_v1.SubscriberClient()
+        self.subscriber = subscriber
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.dispatch_table = DispatchTable()
+        self.park = park or ParkingLot()
+        self.parked = 0
+        self.invalid = 0
+        self.dedup = dedup if dedup is not None else get_deduplicator()
+        self.ordering_key = ordering_key
+        self._sequencer: KeyedSequencer[tuple] = KeyedSequencer()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="event-consumer")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
     def register_handler(
-        self, 
-        event_type: str, 
-        version: str, 
-        handler: Callable[[Dict[str, Any]], None]
+        self,
+        event_type: str,
+        version: str,
+        handler: Callable[[Dict[str, Any]], Any],
+        max_concurrency: Optional[int] = None
     ):
-        """Register a handler for a specific event type and version"""
-        key = f"{event_type}:{version}"
-        self.handlers[key] = handler
-    
+        """
+        Register a handler for a specific event type and version or versions.
+
+        Args:
+            event_type: Event type, e.g. "booking_created"
+            version: Event version ("1"), a semver-compatible range ("^1")
+                or comparisons (">=1,<3"); see VersionSpec
+            handler: A function or ``async def`` coroutine function taking the event
+            max_concurrency: Most events this handler processes at once;
+                None shares the consumer's pool (sync) or is unlimited (async)
+        """
+        self.dispatch_table.register(event_type, version, _Handler(handler, max_concurrency))
+
+    def register_upcaster(self, event_type: str, from_version: str, to_version: str, upcaster: Upcaster):
+        """
+        Register a function that turns a ``from_version`` event into the
+        ``to_version`` shape, so older events reach the current handler.
+        Upcasters chain: 1 -> 2 -> 3.
+        """
+        self.dispatch_table.register_upcaster(event_type, from_version, to_version, upcaster)
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the loop for async handlers on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="event-consumer-loop", daemon=True).start()
+            return self._loop
+
+    def _done(self, message, dedup_key: Optional[str], error: Optional[Exception] = None,
+              ordering_key: Optional[str] = None):
+        if error is None:
+            if self.dedup is not None:
+                self.dedup.complete(dedup_key)
+            message.ack()
+        else:
+            logger.error(f"Error processing event: {error}")
+            if self.dedup is not None:
+                self.dedup.release(dedup_key)
+            message.nack()
+        if ordering_key is None:
+            return
+        if error is None:
+            queued = self._sequencer.done(ordering_key)
+            if queued is not None:
+                self._start(*queued)
+            return
+        # Later events of the key must not be applied before this one is redelivered
+        for _, _, queued_message, queued_dedup_key, _ in self._sequencer.abort(ordering_key):
+            if self.dedup is not None:
+                self.dedup.release(queued_dedup_key)
+            queued_message.nack()
+
+    def _start(self, handler: _Handler, event: Dict[str, Any], message, dedup_key: Optional[str],
+               ordering_key: Optional[str]):
+        """Run a handler where it belongs; acks or nacks the message when done"""
+        try:
+            if handler.is_async:
+                asyncio.run_coroutine_threadsafe(self._run_async(handler, event, message, dedup_key, ordering_key),
+                                                 self._event_loop())
+            else:
+                (handler.executor or self._executor).submit(self._run_sync, handler, event, message, dedup_key,
+                                                            ordering_key)
+        except Exception as e:
+            self._done(message, dedup_key, e, ordering_key)
+
+    def _run_sync(self, handler: _Handler, event: Dict[str, Any], message, dedup_key: Optional[str] = None,
+                  ordering_key: Optional[str] = None):
+        try:
+            handler.func(event)
+        except Exception as e:
+            self._done(message, dedup_key, e, ordering_key)
+            return
+        self._done(message, dedup_key, ordering_key=ordering_key)
+
+    async def _run_async(self, handler: _Handler, event: Dict[str, Any], message, dedup_key: Optional[str] = None,
+                         ordering_key: Optional[str] = None):
+        try:
+            if handler.max_concurrency:
+                if handler.semaphore is None:
+                    handler.semaphore = asyncio.Semaphore(handler.max_concurrency)
+                async with handler.semaphore:
+                    await handler.func(event)
+            else:
+                await handler.func(event)
+        except Exception as e:
+            self._done(message, dedup_key, e, ordering_key)
+            return
+        self._done(message, dedup_key, ordering_key=ordering_key)
+
+    def dispatch(self, message, domain: str, version: str):
+        """Decode a message and hand it to its handler; acks or nacks it when done"""
+        dedup_key = None
+        try:
+            # Decode the message, JSON or compact, and validate it against the envelope schema
+            event = decode_event(message.data, domain, version, message_encoding(getattr(message, "attributes", None)))
+
+            # Extract event details
+            event_type = event.get("type")
+            event_version = event.get("version")
+            correlation_id = event.get("correlation_id")
+
+            logger.debug(f"Received event: {event_type} v{event_version} (correlation_id: {correlation_id})")
+
+            # Find and schedule the appropriate handler
+            route = self.dispatch_table.route(event_type, event_version)
+            if route is None:
+                handler_key = f"{event_type}:{event_version}"
+                if self.dispatch_table.misses[handler_key] == 1:
+                    logger.warning(f"No handler registered for {handler_key}; parking its events")
+                self._park(event, message, f"{handler_key} event (correlation_id: {correlation_id})")
+                return
+            if self.dedup is not None:
+                outcome, dedup_key = self.dedup.claim(event, message.message_id)
+                if outcome == DUPLICATE:
+                    logger.info(f"Skipping duplicate message {message.message_id} "
+                                f"(dedup hit rate {self.dedup.hit_rate:.1%})")
+                    message.ack()
+                    return
+                if outcome == IN_FLIGHT:
+                    message.nack()
+                    return
+            event = route.prepare(event)
+            ordering_key = self.ordering_key(event, message)
+            job = (route.handler, event, message, dedup_key, ordering_key)
+            # Keyed events wait for the key's running event, if any, to finish
+            if ordering_key is None or self._sequencer.submit(ordering_key, job):
+                self._start(*job)
+        except EventValidationError as e:
+            # Redelivery cannot make it valid; park it for inspection instead
+            logger.error(f"Invalid event in message {message.message_id}: {e}")
+            self.invalid += 1
+            self._park(invalid_event(message, e), message, f"invalid message {message.message_id}")
+        except Exception as e:
+            self._done(message, dedup_key, e)
+
+    def _park(self, event: Dict[str, Any], message, description: str):
+        """Hand a message to ``park`` and ack it; nack it if parking fails"""
+        try:
+            self.park(event, message)
+        except Exception as e:
+            logger.error(f"Failed to park {description}: {e}")
+            message.nack()
+            return
+        self.parked += 1
+        message.ack()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Dispatch counters, including dispatch misses per event type and
+        version, the dedup hit rate and the events waiting on ordering keys
+        """
+        stats = {**self.dispatch_table.stats(), "parked": self.parked, "invalid": self.invalid,
+                 "ordering": self._sequencer.stats()}
+        if self.dedup is not None:
+            stats["dedup"] = self.dedup.stats()
+        return stats
+
     def subscribe(
-        self, 
-        domain: str, 
-        version: str, 
+        self,
+        domain: str,
+        version: str,
         subscription_id: str
     ):
         """Subscribe to a versioned Pub/Sub topic and start listening for events"""
@@ -32,49 +323,43 @@ class EventConsumer:
         topic_name = f"{domain}.v{version}.events"
         topic_path = self.subscriber.topic_path(self.project_id, topic_name)
         subscription_path = self.subscriber.subscription_path(self.project_id, subscription_id)
-        
-        # Create subscription if it doesn't exist
+
+        # Create subscription if it doesn't exist, delivering each ordering key's messages in order
         try:
             self.subscriber.create_subscription(
-                request={"name": subscription_path, "topic": topic_path}
+                request={"name": subscription_path, "topic": topic_path, "enable_message_ordering": True}
             )
         except Exception as e:
             # Subscription might already exist
             logger.info(f"Subscription may already exist: {e}")
-        
-        # Define the callback function
+
+        # Compile the envelope schema now rather than on the first message
+        get_validator(domain, version)
+
         def callback(message):
-            try:
-                # Decode and parse the message
-                event = json.loads(message.data.decode("utf-8"))
-                
-                # Extract event details
-                event_type = event.get("type")
-                event_version = event.get("version")
-                correlation_id = event.get("correlation_id")
-                
-                logger.info(f"Received event: {event_type} v{event_version} (correlation_id: {correlation_id})")
-                
-                # Find and execute the appropriate handler
-                handler_key = f"{event_type}:{event_version}"
-                if handler_key in self.handlers:
-                    self.handlers[handler_key](event)
-                    message.ack()
-                else:
-                    logger.warning(f"No handler registered for {handler_key}")
-                    # Try to find a handler for a compatible version
-                    # This is where backward compatibility logic would be implemented
-                    message.nack()
-            except Exception as e:
-                logger.error(f"Error processing event: {e}")
-                message.nack()
-        
+            self.dispatch(message, domain, version)
+
         # Start listening for messages
-        streaming_pull_future = self.subscriber.subscribe(subscription_path, callback=callback)
-        logger.info(f"Listening for messages on {subscription_path}")
-        
+        streaming_pull_future = self.subscriber.subscribe(
+            subscription_path,
+            callback=callback,
+            flow_control=FlowControl(max_messages=self.max_messages, max_bytes=self.max_bytes)
+        )
+        logger.info(f"Listening for messages on {subscription_path} "
+                    f"(max {self.max_messages} messages / {self.max_bytes} bytes outstanding)")
+
         return streaming_pull_future
 
+    def close(self):
+        """Stop the async handler loop and the handler thread pools"""
+        self._executor.shutdown(wait=False)
+        for handler in self.dispatch_table.handlers():
+            if handler.executor is not None:
+                handler.executor.shutdown(wait=False)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
 def get_event_consumer(project_id: str) -> EventConsumer:
     """Factory function to get an event consumer instance"""
     return EventConsumer(project_id)
@@ -0,0 +1,59 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class KeyedSequencer(Generic[T]):
+    """
+    Serializes work per ordering key while different keys run in parallel.
+
+    ``submit`` returns True when the key is idle and the caller should start
+    the item now; otherwise the item waits behind the key's running one.
+    When an item finishes, ``done`` hands back the key's next item to start,
+    or None once the key is idle. Items are started wherever the caller
+    likes (a thread pool, an event loop), so one key may mix sync and async
+    work and still be applied strictly in arrival order.
+    """
+
+    def __init__(self):
+        # Items waiting per busy key; a key is busy while it has an entry
+        self._waiting: Dict[str, Deque[T]] = {}
+        self._lock = threading.Lock()
+        self.max_waiting = 0
+
+    def submit(self, key: str, item: T) -> bool:
+        """Queue an item behind its key; True if it should be started now"""
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if waiting is None:
+                self._waiting[key] = deque()
+                return True
+            waiting.append(item)
+            if len(waiting) > self.max_waiting:
+                self.max_waiting = len(waiting)
+            return False
+
+    def done(self, key: str) -> Optional[T]:
+        """Finish the key's running item; returns the next one to start, if any"""
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if waiting:
+                return waiting.popleft()
+            self._waiting.pop(key, None)
+            return None
+
+    def abort(self, key: str) -> List[T]:
+        """Finish the key's running item and drop everything queued behind it"""
+        with self._lock:
+            waiting = self._waiting.pop(key, None)
+        return list(waiting or ())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active_keys": len(self._waiting),
+                "waiting": sum(len(waiting) for waiting in self._waiting.values()),
+                "max_waiting": self.max_waiting,
+            }
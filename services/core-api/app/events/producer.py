@@ -1,50 +1,211 @@
-import json
-from datetime import datetime
-import uuid
-from google.cloud import pubsub_v1
-from typing import Dict, Any, Optional
+import asyncio
+import logging
+import os
+from typing import Dict, Any, Iterable, List, Mapping, Optional, Tuple
+
+from salon_events import (
+    ENCODING_ATTRIBUTE,
+    ENCODINGS,
+    EVENT_ENCODING,
+    JSON,
+    build_event,
+    detect_encoding,
+    encode_event,
+)
+
+logger = logging.getLogger(__name__)
+
+# Publisher batching. The client groups messages for the same topic into one
+# publish RPC until a batch holds PUBSUB_BATCH_MAX_MESSAGES messages or
+# PUBSUB_BATCH_MAX_BYTES bytes, or PUBSUB_BATCH_MAX_LATENCY seconds have
+# passed since its first message.
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100"))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024)))
+PUBSUB_BATCH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.01"))
+
+
+def _bridge(future, loop: asyncio.AbstractEventLoop) -> "asyncio.Future[str]":
+    """Wrap a publisher future, resolved on a client thread, in an asyncio future"""
+    result = loop.create_future()
+
+    def resolve(done):
+        if result.cancelled():
+            return
+        error = done.exception()
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(done.result())
+
+    future.add_done_callback(lambda done: loop.call_soon_threadsafe(resolve, done))
+    return result
+
 
 class EventProducer:
-    def __init__(self, project_id: str):
+    """
+    Publishes versioned events to ``<domain>.v<version>.events`` topics.
+
+    ``publish_event`` hands the message to the publisher client and returns
+    an awaitable for its message ID straight away. The client sends batches
+    on its own threads, so awaiting never blocks the event loop, and events
+    published close together share a publish RPC.
+
+    Events published with the same ``ordering_key``, e.g. a booking ID, are
+    delivered in publish order on subscriptions with message ordering
+    enabled. If one of them fails to publish, the client rejects the key's
+    later events until the failure has been reported, so none overtakes it.
+
+    Events are encoded as JSON by default, or in the compact binary format
+    with ``encoding="compact"``; non-JSON messages name their encoding in
+    the ``event_encoding`` attribute, and consumers accept either.
+    """
+
+    def __init__(self,
+                 project_id: str,
+                 publisher=None,
+                 max_messages: int = PUBSUB_BATCH_MAX_MESSAGES,
+                 max_bytes: int = PUBSUB_BATCH_MAX_BYTES,
+                 max_latency: float = PUBSUB_BATCH_MAX_LATENCY,
+                 encoding: str = EVENT_ENCODING):
+        """
+        Args:
+            project_id: GCP project owning the topics
+            publisher: Publisher client to use, e.g. one pointed at the
+                emulator; by default a PublisherClient with the batch settings below
+            max_messages: Messages per publish batch
+            max_bytes: Bytes per publish batch
+            max_latency: Seconds a batch may wait for more messages
+            encoding: "json" or "compact"
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown event encoding: {encoding}")
         self.project_id = project_id
-        self.publisher = pubsub_v1.PublisherClient()
-    
+        self.encoding = encoding
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient(
+                batch_settings=pubsub_v1.types.BatchSettings(
+                    max_messages=max_messages,
+                    max_bytes=max_bytes,
+                    max_latency=max_latency
+                ),
+                publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=True)
+            )
+        self.publisher = publisher
+        self._topic_paths: Dict[Tuple[str, str], str] = {}
+
+    def topic_path(self, domain: str, version: str) -> str:
+        """Topic path for a domain and version, cached per pair"""
+        key = (domain, version)
+        topic_path = self._topic_paths.get(key)
+        if topic_path is None:
+            # Create topic name following the pattern: <domain>.v<version>.events
+            topic_path = self.publisher.topic_path(self.project_id, f"{domain}.v{version}.events")
+            self._topic_paths[key] = topic_path
+        return topic_path
+
+    def _publish(self, domain: str, version: str, data: bytes, ordering_key: Optional[str] = None,
+                 encoding: str = JSON):
+        topic_path = self.topic_path(domain, version)
+        # JSON messages carry no attribute, as before encodings were named
+        attributes = {ENCODING_ATTRIBUTE: encoding} if encoding != JSON else {}
+        if not ordering_key:
+            return self.publisher.publish(topic_path, data, **attributes)
+        future = self.publisher.publish(topic_path, data, ordering_key=ordering_key, **attributes)
+
+        def resume(done):
+            # The client pauses a key after a failed publish; resume it so a retry can go through
+            if done.exception() is not None:
+                self.publisher.resume_publish(topic_path, ordering_key)
+
+        future.add_done_callback(resume)
+        return future
+
     def publish_event(
-        self, 
-        domain: str, 
-        version: str, 
-        event_type: str, 
-        tenant_id: str, 
-        payload: Dict[str, Any], 
-        correlation_id: Optional[str] = None
+        self,
+        domain: str,
+        version: str,
+        event_type: str,
+        tenant_id: str,
+        payload: Dict[str, Any],
+        correlation_id: Optional[str] = None,
+        ordering_key: Optional[str] = None
+    ) -> "asyncio.Future[str]":
+        """
+        Publish an event to a versioned Pub/Sub topic.
+
+        Must be called from a running event loop. The envelope is validated
+        against the ``<domain>.v<version>`` schema (raising
+        EventValidationError) and queued for publishing at once; the returned
+        future resolves to its message ID. Events sharing an
+        ``ordering_key``, such as a booking ID or tenant ID, are delivered
+        in the order they were published.
+        """
+        loop = asyncio.get_running_loop()
+        data = encode_event(build_event(event_type, version, tenant_id, payload, correlation_id), domain, version,
+                            self.encoding)
+        return _bridge(self._publish(domain, version, data, ordering_key, self.encoding), loop)
+
+    def publish_encoded(self, domain: str, version: str, data: bytes,
+                        ordering_key: Optional[str] = None) -> "asyncio.Future[str]":
+        """
+        Publish an envelope already built and encoded with ``encode_event``,
+        e.g. one stored in the outbox, in whichever encoding it was stored.
+        Must be called from a running event loop; the returned future
+        resolves to its message ID.
+        """
+        return _bridge(self._publish(domain, version, data, ordering_key, detect_encoding(data)),
+                       asyncio.get_running_loop())
+
+    async def publish_many(
+        self,
+        domain: str,
+        version: str,
+        events: Iterable[Mapping[str, Any]],
+        return_exceptions: bool = False
+    ) -> List[Any]:
+        """
+        Publish several events and wait for all of them.
+
+        Each event is a mapping with ``event_type``, ``tenant_id``, ``payload``
+        and optionally ``correlation_id`` and ``ordering_key``. All messages are queued before the
+        first await, so the client packs them into as few batches as the
+        batch settings allow.
+
+        Returns:
+            Message IDs in the order of ``events``; with ``return_exceptions``
+            a failed publish yields its exception instead of raising
+        """
+        futures = [
+            self.publish_event(
+                domain,
+                version,
+                event["event_type"],
+                event["tenant_id"],
+                event["payload"],
+                event.get("correlation_id"),
+                event.get("ordering_key")
+            )
+            for event in events
+        ]
+        return await asyncio.gather(*futures, return_exceptions=return_exceptions)
+
+    def publish_event_sync(
+        self,
+        domain: str,
+        version: str,
+        event_type: str,
+        tenant_id: str,
+        payload: Dict[str, Any],
+        correlation_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        ordering_key: Optional[str] = None
     ) -> str:
-        """Publish an event to a versioned Pub/Sub topic"""
-        # Create topic name following the pattern: <domain>.v<version>.events
-        topic_name = f"{domain}.v{version}.events"
-        topic_path = self.publisher.topic_path(self.project_id, topic_name)
-        
-        # Generate correlation ID if not provided
-        if not correlation_id:
-            correlation_id = str(uuid.uuid4())
-        
-        # Create the event message following the standard schema
-        event = {
-            "type": event_type,
-            "version": version,
-            "occurred_at": datetime.utcnow().isoformat() + "Z",
-            "tenant_id": tenant_id,
-            "correlation_id": correlation_id,
-            "payload": payload
-        }
-        
-        # Convert to JSON and encode
-        message_data = json.dumps(event).encode("utf-8")
-        
-        # Publish the message
-        future = self.publisher.publish(topic_path, message_data)
-        message_id = future.result()
-        
-        return message_id
+        """Publish an event and block until it is sent; for code without an event loop"""
+        data = encode_event(build_event(event_type, version, tenant_id, payload, correlation_id), domain, version,
+                            self.encoding)
+        return self._publish(domain, version, data, ordering_key, self.encoding).result(timeout=timeout)
+
 
 def get_event_producer(project_id: str) -> EventProducer:
     """Factory function to get an event producer instance"""
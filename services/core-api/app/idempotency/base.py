@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLEANUP_INTERVAL_SECONDS = 300
+
+
+class IdempotencyBackend(ABC):
+    """
+    Interface implemented by every idempotency store.
+
+    The middleware only talks to this interface, so the backend behind
+    ``idempotency_store`` can be swapped through configuration.
+    """
+
+    default_ttl_seconds: int = 86400
+    cleanup_interval_seconds: int = DEFAULT_CLEANUP_INTERVAL_SECONDS
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[IdempotencyKey]:
+        """Retrieve an idempotency key if it exists and hasn't expired"""
+
+    @abstractmethod
+    async def set(self,
+                  key: str,
+                  response_code: int,
+                  response_body: bytes,
+                  ttl_seconds: Optional[int] = None,
+                  response_headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> bool:
+        """Store an idempotency key with its raw response"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Delete an idempotency key"""
+
+    @abstractmethod
+    async def claim(self, key: str, ttl_seconds: int) -> bool:
+        """
+        Atomically mark ``key`` as in progress unless it is already present.
+
+        The marker is invisible to ``get``. Every store needs a real
+        insert-if-absent: a duplicate whose ``get`` missed can reach this
+        after the in-process leader has finished, and must find the key then.
+        A claim is released with ``delete`` or replaced by ``set``.
+        """
+
+    async def purge_expired(self) -> int:
+        """Remove expired keys; returns the number removed"""
+        return 0
+
+    def stats(self) -> Dict[str, int]:
+        """Counters exposed for monitoring"""
+        return {}
+
+    async def _cleanup_expired_keys(self):
+        """Periodically clean up expired idempotency keys"""
+        while True:
+            try:
+                await asyncio.sleep(self.cleanup_interval_seconds)
+                removed = await self.purge_expired()
+                if removed:
+                    logger.info(f"Cleaned up {removed} expired idempotency keys")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error during idempotency key cleanup: {e}")
@@ -0,0 +1,128 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from .base import DEFAULT_CLEANUP_INTERVAL_SECONDS
+from .models import IdempotencyKey, PENDING_RESPONSE_CODE
+from .memory_store import InMemoryIdempotencyStore, _Stripe, DEFAULT_STRIPES
+
+logger = logging.getLogger(__name__)
+
+# Rough per-record cost beyond the key, body and header bytes: the record
+# object, the key and body object headers and the dict/heap slots
+RECORD_OVERHEAD_BYTES = 200
+
+
+def record_size(idempotency_key: IdempotencyKey) -> int:
+    """Approximate memory held by one stored record, in bytes"""
+    size = RECORD_OVERHEAD_BYTES + len(idempotency_key.key) + len(idempotency_key.response_body)
+    for name, value in idempotency_key.response_headers:
+        size += len(name) + len(value)
+    return size
+
+
+class _LRUStripe(_Stripe):
+    """Stripe whose entries are kept in recency order with a byte total"""
+
+    __slots__ = ("nbytes",)
+
+    def __init__(self):
+        super().__init__()
+        self.entries: "OrderedDict[str, IdempotencyKey]" = OrderedDict()
+        self.nbytes = 0
+
+    def remove(self, key: str) -> Optional[IdempotencyKey]:
+        idempotency_key = self.entries.pop(key, None)
+        if idempotency_key is not None:
+            self.nbytes -= record_size(idempotency_key)
+        return idempotency_key
+
+
+class LRUIdempotencyStore(InMemoryIdempotencyStore):
+    """
+    Bounded, lock-striped in-memory idempotency store.
+
+    Every stripe gets an equal share of ``max_bytes`` (and ``max_entries``)
+    and evicts its least recently used keys when a new response does not fit,
+    so memory stays bounded no matter how long the TTLs are. Hits, misses,
+    evictions and the current byte total are available from ``stats()``.
+    """
+
+    stripe_class = _LRUStripe
+
+    def __init__(self,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_entries: int = 0,
+                 default_ttl_seconds: int = 86400,
+                 stripes: int = DEFAULT_STRIPES,
+                 cleanup_interval_seconds: int = DEFAULT_CLEANUP_INTERVAL_SECONDS):
+        super().__init__(
+            default_ttl_seconds=default_ttl_seconds,
+            stripes=stripes,
+            cleanup_interval_seconds=cleanup_interval_seconds
+        )
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._stripe_max_bytes = max(max_bytes // stripes, 1)
+        # 0 disables the entry cap
+        self._stripe_max_entries = max(max_entries // stripes, 1) if max_entries else 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    async def get(self, key: str) -> Optional[IdempotencyKey]:
+        """Retrieve an idempotency key and mark it as recently used"""
+        stripe = self._stripe_for(key)
+        async with stripe.lock:
+            idempotency_key = stripe.entries.get(key)
+            if idempotency_key is None:
+                self.misses += 1
+                return None
+            if idempotency_key.expires_at < time.time():
+                stripe.remove(key)
+                self.misses += 1
+                return None
+            if idempotency_key.response_code == PENDING_RESPONSE_CODE:
+                self.misses += 1
+                return None
+            stripe.entries.move_to_end(key)
+            self.hits += 1
+            return idempotency_key
+
+    def _insert(self, stripe: _LRUStripe, key: str, idempotency_key: IdempotencyKey) -> bool:
+        size = record_size(idempotency_key)
+        stripe.remove(key)
+        if size > self._stripe_max_bytes:
+            self.rejections += 1
+            logger.warning(f"Response for idempotency key {key} is too large to store ({size} bytes)")
+            return False
+
+        entries = stripe.entries
+        max_entries = self._stripe_max_entries
+        while entries and (stripe.nbytes + size > self._stripe_max_bytes
+                           or (max_entries and len(entries) >= max_entries)):
+            _, evicted = entries.popitem(last=False)
+            stripe.nbytes -= record_size(evicted)
+            self.evictions += 1
+
+        entries[key] = idempotency_key
+        stripe.nbytes += size
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return sum(stripe.nbytes for stripe in self._stripes)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+        }
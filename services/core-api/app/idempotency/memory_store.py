@@ -0,0 +1,202 @@
+import asyncio
+import heapq
+import time
+from typing import Optional, Dict, List, Tuple
+from .base import IdempotencyBackend, DEFAULT_CLEANUP_INTERVAL_SECONDS
+from .models import IdempotencyKey, PENDING_RESPONSE_CODE
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRIPES = 64  # Must be a power of two
+# A stripe's expiry heap is rebuilt from its live keys once it holds this many
+# times as many pairs (and at least HEAP_COMPACT_MIN), so pairs left behind by
+# evicted, deleted or overwritten keys cannot grow it without bound
+HEAP_COMPACT_FACTOR = 2
+HEAP_COMPACT_MIN = 64
+
+
+class _Stripe:
+    """One shard of the store: its own dict, lock and expiry heap"""
+
+    __slots__ = ("entries", "lock", "expiry_heap")
+
+    def __init__(self):
+        self.entries: Dict[str, IdempotencyKey] = {}
+        # Assigned on first use so it binds to the serving event loop, not to
+        # whatever loop (if any) exists when the module is imported
+        self.lock: Optional[asyncio.Lock] = None
+        # (expires_at timestamp, key) pairs; entries for keys that were
+        # overwritten or deleted are skipped lazily when they reach the top
+        self.expiry_heap: List[Tuple[float, str]] = []
+
+    def remove(self, key: str) -> Optional[IdempotencyKey]:
+        return self.entries.pop(key, None)
+
+    def push_expiry(self, deadline: float, key: str):
+        """Schedule ``key`` for expiry, compacting the heap when it is mostly stale"""
+        heap = self.expiry_heap
+        heapq.heappush(heap, (deadline, key))
+        if len(heap) > HEAP_COMPACT_MIN and len(heap) > HEAP_COMPACT_FACTOR * len(self.entries):
+            # O(n), but only after at least n pushes since the last rebuild
+            self.expiry_heap = [(entry.expires_at, entry_key) for entry_key, entry in self.entries.items()]
+            heapq.heapify(self.expiry_heap)
+
+    def purge_expired(self, now: float) -> int:
+        """Pop every heap entry that is due and drop the keys that really expired"""
+        heap = self.expiry_heap
+        removed = 0
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            entry = self.entries.get(key)
+            # A key that was re-set later has a newer heap entry; leave it alone
+            if entry is not None and entry.expires_at <= deadline:
+                self.remove(key)
+                removed += 1
+        return removed
+
+
+class InMemoryIdempotencyStore(IdempotencyBackend):
+    """
+    Lock-striped in-memory idempotency store.
+
+    Keys are spread over a fixed number of stripes, each guarded by its own
+    lock, so operations on different keys do not serialize behind each other.
+    Every stripe keeps a min-heap on ``expires_at`` so that cleanup only
+    touches keys that are actually due instead of scanning the whole store.
+    """
+
+    stripe_class = _Stripe
+
+    def __init__(self,
+                 default_ttl_seconds: int = 86400,  # 24 hours default
+                 stripes: int = DEFAULT_STRIPES,
+                 cleanup_interval_seconds: int = DEFAULT_CLEANUP_INTERVAL_SECONDS):
+        if stripes <= 0 or stripes & (stripes - 1):
+            raise ValueError("stripes must be a positive power of two")
+        self.default_ttl_seconds = default_ttl_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        self._stripes = [self.stripe_class() for _ in range(stripes)]
+        self._mask = stripes - 1
+        # Locks and the cleanup task are created by the first call made inside
+        # a running event loop, so the store can be created at import time
+        self._started = False
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    def _stripe_for(self, key: str) -> _Stripe:
+        if not self._started:
+            self._start()
+        return self._stripes[hash(key) & self._mask]
+
+    def _start(self):
+        for stripe in self._stripes:
+            stripe.lock = asyncio.Lock()
+        if self.cleanup_interval_seconds:
+            self._cleanup_task = asyncio.get_running_loop().create_task(
+                self._cleanup_expired_keys()
+            )
+        self._started = True
+
+    async def purge_expired(self) -> int:
+        """Remove expired keys from every stripe, one stripe lock at a time"""
+        if not self._started:
+            self._start()
+        removed = 0
+        now = time.time()
+        for stripe in self._stripes:
+            if not stripe.expiry_heap or stripe.expiry_heap[0][0] > now:
+                continue
+            async with stripe.lock:
+                removed += stripe.purge_expired(now)
+        return removed
+
+    async def get(self, key: str) -> Optional[IdempotencyKey]:
+        """Retrieve an idempotency key if it exists and hasn't expired"""
+        stripe = self._stripe_for(key)
+        async with stripe.lock:
+            idempotency_key = stripe.entries.get(key)
+            if idempotency_key is None:
+                return None
+            # Check if key has expired
+            if idempotency_key.expires_at < time.time():
+                stripe.remove(key)
+                return None
+            if idempotency_key.response_code == PENDING_RESPONSE_CODE:
+                return None
+            return idempotency_key
+
+    async def claim(self, key: str, ttl_seconds: int) -> bool:
+        """Insert an in-progress marker unless the key is present, under its stripe lock"""
+        stripe = self._stripe_for(key)
+        async with stripe.lock:
+            now = time.time()
+            existing = stripe.entries.get(key)
+            if existing is not None and existing.expires_at >= now:
+                return False
+            marker = IdempotencyKey(
+                key=key,
+                response_code=PENDING_RESPONSE_CODE,
+                response_body=b"",
+                response_headers=(),
+                created_at=now,
+                expires_at=now + ttl_seconds
+            )
+            if not self._insert(stripe, key, marker):
+                return False
+            stripe.push_expiry(marker.expires_at, key)
+            return True
+
+    async def set(self,
+                  key: str,
+                  response_code: int,
+                  response_body: bytes,
+                  ttl_seconds: Optional[int] = None,
+                  response_headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> bool:
+        """Store an idempotency key with its raw response"""
+        stripe = self._stripe_for(key)
+        async with stripe.lock:
+            try:
+                ttl = ttl_seconds if ttl_seconds is not None else self.default_ttl_seconds
+                now = time.time()
+                deadline = now + ttl
+
+                idempotency_key = IdempotencyKey(
+                    key=key,
+                    response_code=response_code,
+                    response_body=response_body,
+                    response_headers=response_headers,
+                    created_at=now,
+                    expires_at=deadline
+                )
+
+                if not self._insert(stripe, key, idempotency_key):
+                    return False
+                stripe.push_expiry(deadline, key)
+                return True
+            except Exception as e:
+                logger.error(f"Error storing idempotency key {key}: {e}")
+                return False
+
+    def _insert(self, stripe: _Stripe, key: str, idempotency_key: IdempotencyKey) -> bool:
+        stripe.entries[key] = idempotency_key
+        return True
+
+    async def delete(self, key: str) -> bool:
+        """Delete an idempotency key"""
+        stripe = self._stripe_for(key)
+        async with stripe.lock:
+            # The heap entry is left behind, discarded when it comes due or
+            # when the heap is compacted
+            return stripe.remove(key) is not None
+
+    def __len__(self) -> int:
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self)}
+
+    def __del__(self):
+        """Clean up the cleanup task when the store is deleted"""
+        task = getattr(self, '_cleanup_task', None)
+        if task is not None:
+            task.cancel()
@@ -1,107 +1,223 @@
-from fastapi import Request, Response, HTTPException
-from fastapi.responses import JSONResponse
+import hashlib
 import logging
-from .storage import idempotency_store
-from .models import IdempotencyKey
-from typing import Callable, Awaitable
-import json
+from typing import List, Optional, Tuple
+from .singleflight import (
+    in_flight_requests,
+    wait_for_leader,
+    wait_for_other_worker,
+    CLAIM_TTL_SECONDS,
+    DEFAULT_WAIT_TIMEOUT_SECONDS,
+)
+from .models import FINGERPRINT_HEADER
+from .storage import get_idempotency_store
+from .utils import replay_response, replayable_headers
 
 logger = logging.getLogger(__name__)
 
+IDEMPOTENT_METHODS = frozenset(("POST", "PUT", "PATCH"))
+IDEMPOTENCY_HEADER = b"idempotency-key"
+DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+
+
+def scoped_key(method: str, path: str, idempotency_key: str) -> str:
+    """
+    The stored key for a client's Idempotency-Key: keys are only unique per
+    endpoint, so the same key sent to two routes must not share a response
+    """
+    return f"{method} {path} {idempotency_key}"
+
+
+async def read_request_body(receive) -> Tuple[List[dict], bytes]:
+    """
+    Receive the whole request body.
+
+    Returns:
+        The messages received, to hand to the app again, and the body
+    """
+    messages, chunks = [], []
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            # The client disconnected; the app gets the disconnect too
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return messages, b"".join(chunks)
+
+
+def replaying_receive(messages: List[dict], receive):
+    """``receive`` that returns ``messages`` first, then the client's next ones"""
+    pending = list(reversed(messages))
+
+    async def replay():
+        if pending:
+            return pending.pop()
+        return await receive()
+
+    return replay
+
+
+class _ResponseCapture:
+    """
+    ``send`` wrapper that forwards every message to the client immediately
+    and keeps a copy of the status, headers and body chunks for storage.
+    """
+
+    __slots__ = ("send", "max_body_bytes", "status", "headers", "chunks", "size", "complete")
+
+    def __init__(self, send, max_body_bytes: int):
+        self.send = send
+        self.max_body_bytes = max_body_bytes
+        self.status: Optional[int] = None
+        self.headers = ()
+        self.chunks: Optional[List[bytes]] = []
+        self.size = 0
+        self.complete = False
+
+    async def __call__(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.status = message["status"]
+            self.headers = message.get("headers", ())
+        elif message_type == "http.response.body":
+            body = message.get("body", b"")
+            if self.chunks is not None and body:
+                self.size += len(body)
+                if self.size > self.max_body_bytes:
+                    # Too large to keep; the client still gets all of it
+                    self.chunks = None
+                else:
+                    self.chunks.append(body)
+            if not message.get("more_body", False):
+                self.complete = True
+        await self.send(message)
+
+    @property
+    def storable(self) -> bool:
+        # Server errors are not stored so that a retry runs the handler again
+        return self.complete and self.chunks is not None and self.status is not None and self.status < 500
+
 
 class IdempotencyMiddleware:
-    def __init__(self, app):
+    """
+    Pure ASGI middleware that makes every POST/PUT/PATCH route idempotent.
+
+    Requests without an Idempotency-Key, and all other methods, are passed
+    straight through. The first response for a key is streamed to the client
+    as usual while a copy is captured and stored; later requests with the
+    same key get the stored response replayed. With ``single_flight``,
+    concurrent duplicates wait for the first request instead of running the
+    handler again.
+
+    Keys are scoped to the method and path, and stored with a SHA-256 digest
+    of the request body: a key reused on the same endpoint with a different
+    body gets a 422 instead of the other request's response.
+    """
+
+    def __init__(self,
+                 app,
+                 store=None,
+                 ttl_seconds: int = 86400,
+                 single_flight: bool = True,
+                 wait_timeout_seconds: float = DEFAULT_WAIT_TIMEOUT_SECONDS,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES):
+        """
+        Args:
+            app: ASGI application to wrap
+            store: None for the configured global store, a backend name
+                ("memory", "lru", "sqlite", "shm") or an IdempotencyBackend
+            ttl_seconds: How long stored responses are replayed
+            single_flight: Coalesce concurrent requests with the same key
+            wait_timeout_seconds: How long a duplicate waits before a 409
+            max_body_bytes: Responses larger than this are not stored
+        """
         self.app = app
-    
+        self.store = get_idempotency_store(store)
+        self.ttl_seconds = ttl_seconds
+        self.single_flight = single_flight
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self.max_body_bytes = max_body_bytes
+
     async def __call__(self, scope, receive, send):
-        if scope["type"] != "http":
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
             await self.app(scope, receive, send)
             return
-        
-        request = Request(scope, receive)
-        
-        # Check if this is a request that should be idempotent
-        if request.method in ["POST", "PUT", "PATCH"]:
-            idempotency_key = request.headers.get("Idempotency-Key")
-            
-            if idempotency_key:
-                # Check if we have already processed this key
-                existing_key = await idempotency_store.get(idempotency_key)
-                
-                if existing_key:
-                    # Return the stored response
-                    logger.info(f"Returning cached response for idempotency key: {idempotency_key}")
-                    response = Response(
-                        content=json.dumps(existing_key.response_body),
-                        status_code=existing_key.response_code,
-                        headers={"Content-Type": "application/json"}
-                    )
-                    await response(scope, receive, send)
-                    return
-        
-        # Continue with the request processing
-        await self.app(scope, receive, send)
-
-
-def idempotent_request(ttl_seconds: int = 86400):
-    """
-    Decorator to make a FastAPI endpoint idempotent
-    """
-    def decorator(func: Callable):
-        async def wrapper(*args, **kwargs):
-            # Get request from args or kwargs
-            request = kwargs.get('request')
-            if not request:
-                for arg in args:
-                    if isinstance(arg, Request):
-                        request = arg
-                        break
-            
-            if request and request.method in ["POST", "PUT", "PATCH"]:
-                idempotency_key = request.headers.get("Idempotency-Key")
-                
-                if idempotency_key:
-                    # Check if we have already processed this key
-                    existing_key = await idempotency_store.get(idempotency_key)
-                    
-                    if existing_key:
-                        # Return the stored response
-                        logger.info(f"Returning cached response for idempotency key: {idempotency_key}")
-                        return JSONResponse(
-                            content=existing_key.response_body,
-                            status_code=existing_key.response_code
-                        )
-            
-            # Execute the original function
-            response = await func(*args, **kwargs)
-            
-            # Store the response if idempotency key was provided
-            if request and request.method in ["POST", "PUT", "PATCH"]:
-                idempotency_key = request.headers.get("Idempotency-Key")
-                
-                if idempotency_key and response:
-                    # Extract response data
-                    response_code = response.status_code
-                    response_body = getattr(response, 'body', None)
-                    
-                    # If it's a JSONResponse, we can get the content directly
-                    if hasattr(response, 'body'):
-                        try:
-                            response_body = json.loads(response.body.decode())
-                        except:
-                            response_body = response.body.decode()
-                    elif hasattr(response, 'content'):
-                        response_body = response.content
-                    
-                    # Store the idempotency key with response data
-                    await idempotency_store.set(
-                        idempotency_key, 
-                        response_code, 
-                        response_body, 
-                        ttl_seconds
-                    )
-                    logger.info(f"Stored response for idempotency key: {idempotency_key}")
-            
-            return response
-        return wrapper
-    return decorator
+
+        idempotency_key = None
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_HEADER:
+                idempotency_key = value.decode("latin-1")
+                break
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = scoped_key(scope["method"], scope["path"], idempotency_key)
+        messages, body = await read_request_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest().encode("ascii")
+        receive = replaying_receive(messages, receive)
+
+        # Check if we have already processed this key
+        existing_key = await self.store.get(idempotency_key)
+        if existing_key:
+            await replay_response(idempotency_key, existing_key, fingerprint)(scope, receive, send)
+            return
+
+        if not self.single_flight:
+            await self._run_and_store(idempotency_key, fingerprint, scope, receive, send)
+            return
+
+        leader = in_flight_requests.join(idempotency_key)
+        if leader is not None:
+            response = await wait_for_leader(idempotency_key, leader, self.wait_timeout_seconds, self.store,
+                                             fingerprint)
+            await response(scope, receive, send)
+            return
+
+        # Only a claim this request holds may be released; a duplicate must
+        # never delete the other worker's claim or its stored response
+        claimed = False
+        try:
+            # The key may be in flight on another worker sharing the store, or
+            # this request's get may have missed just before an in-process
+            # leader stored its response and left the single-flight registry
+            if not await self.store.claim(idempotency_key, CLAIM_TTL_SECONDS):
+                response = await wait_for_other_worker(idempotency_key, self.wait_timeout_seconds, self.store,
+                                                       fingerprint)
+                in_flight_requests.complete(idempotency_key)
+                await response(scope, receive, send)
+                return
+            claimed = True
+
+            if not await self._run_and_store(idempotency_key, fingerprint, scope, receive, send):
+                # Release the claim so a retry can run the handler again
+                await self.store.delete(idempotency_key)
+        except BaseException as e:
+            in_flight_requests.complete(idempotency_key, error=e)
+            if claimed:
+                await self.store.delete(idempotency_key)
+            raise
+        in_flight_requests.complete(idempotency_key)
+
+    async def _run_and_store(self, idempotency_key: str, fingerprint: bytes, scope, receive, send) -> bool:
+        """Run the app, streaming to the client, then store the captured response"""
+        capture = _ResponseCapture(send, self.max_body_bytes)
+        await self.app(scope, receive, capture)
+        if not capture.storable:
+            return False
+
+        body = b"".join(capture.chunks)
+        headers = tuple(
+            (name, value) for name, value in replayable_headers(capture.headers)
+            if name != b"content-length"
+        )
+        # A streamed response may not have declared its length; the replay does
+        if capture.status >= 200 and capture.status not in (204, 304):
+            headers += ((b"content-length", str(len(body)).encode("latin-1")),)
+        headers += ((FINGERPRINT_HEADER, fingerprint),)
+        stored = await self.store.set(idempotency_key, capture.status, body, self.ttl_seconds, headers)
+        if stored:
+            logger.info(f"Stored response for idempotency key: {idempotency_key}")
+        return stored
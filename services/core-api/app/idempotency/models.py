@@ -1,13 +1,48 @@
-from pydantic import BaseModel
-from typing import Optional, Any
-from datetime import datetime
-
-class IdempotencyKey(BaseModel):
-    key: str
-    response_code: int
-    response_body: Any
-    created_at: datetime
-    expires_at: datetime
-    
-    class Config:
-        arbitrary_types_allowed = True
+from typing import Optional, Tuple
+
+# Response headers worth replaying; everything else (date, server, ...) is
+# regenerated by the server for the replayed response
+REPLAYED_HEADERS = frozenset((b"content-type", b"content-length", b"location", b"etag"))
+# Stored among the response headers but never replayed: the digest of the
+# request body the response was made for, so every backend keeps it as is
+FINGERPRINT_HEADER = b"idempotency-request-fingerprint"
+# Response code of the in-progress marker a claim stores; never a real status
+PENDING_RESPONSE_CODE = 0
+
+
+class IdempotencyKey:
+    """
+    Stored outcome of a request made with an Idempotency-Key.
+
+    The response is kept exactly as it was sent: the raw body bytes, the
+    status code and the encoded header pairs, so a replay never has to parse
+    or re-serialize it. Timestamps are epoch seconds.
+    """
+
+    __slots__ = ("key", "response_code", "response_body", "response_headers", "created_at", "expires_at")
+
+    def __init__(self,
+                 key: str,
+                 response_code: int,
+                 response_body: bytes,
+                 response_headers: Tuple[Tuple[bytes, bytes], ...],
+                 created_at: float,
+                 expires_at: float):
+        self.key = key
+        self.response_code = response_code
+        self.response_body = response_body
+        self.response_headers = response_headers
+        self.created_at = created_at
+        self.expires_at = expires_at
+
+    @property
+    def request_fingerprint(self) -> Optional[bytes]:
+        """Digest of the request body, if the response was stored with one"""
+        for name, value in self.response_headers:
+            if name == FINGERPRINT_HEADER:
+                return value
+        return None
+
+    def __repr__(self) -> str:
+        return (f"IdempotencyKey(key={self.key!r}, response_code={self.response_code}, "
+                f"body_bytes={len(self.response_body)}, expires_at={self.expires_at})")
@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import struct
+import time
+from typing import Dict, Optional, Tuple
+from salon_events.striped_table import StripedTable
+from .base import IdempotencyBackend
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"IDMP"
+_LAYOUT_VERSION = 1
+
+# Slot header: state, response_code, key_len, headers_len, body_len,
+# key_hash, created_at, expires_at
+_SLOT = struct.Struct("<BxHHHIQdd")
+
+_EMPTY = 0
+_PENDING = 1    # Claimed by a worker that is still handling the request
+_COMPLETE = 2   # Holds a stored response
+_DELETED = 3    # Tombstone; lookups probe past it and inserts may reuse it
+
+
+def _hash_key(key: bytes) -> int:
+    # Must be identical in every process, so Python's salted hash() won't do
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def _encode_headers(headers: Tuple[Tuple[bytes, bytes], ...]) -> bytes:
+    return b"\n".join(name + b":" + value for name, value in headers)
+
+
+def _decode_headers(blob: bytes) -> Tuple[Tuple[bytes, bytes], ...]:
+    if not blob:
+        return ()
+    return tuple(tuple(line.split(b":", 1)) for line in blob.split(b"\n"))
+
+
+class SharedMemoryIdempotencyStore(IdempotencyBackend):
+    """
+    Fixed-slot hash table in a memory-mapped file shared by every worker
+    process on the host.
+
+    Slots are grouped into stripes. Each stripe is guarded by an fcntl byte
+    range lock (see StripedTable), which makes ``claim`` (insert-if-absent) atomic across
+    processes while workers touching different stripes never contend. A key
+    is probed linearly within its stripe only. Expired and deleted slots are
+    reused by later inserts, so the table never needs a cleanup scan.
+
+    Responses larger than one slot are not stored; ``set`` returns False.
+    """
+
+    def __init__(self,
+                 path: str = "/dev/shm/core-api-idempotency",
+                 slots: int = 16384,
+                 slot_size: int = 2048,
+                 stripes: int = 256,
+                 default_ttl_seconds: int = 86400):
+        if slot_size <= _SLOT.size:
+            raise ValueError("slot_size is too small")
+        self.path = path
+        self.default_ttl_seconds = default_ttl_seconds
+        # Nothing to clean up periodically; expired slots are reused in place
+        self.cleanup_interval_seconds = 0
+        self._table = StripedTable(path, _MAGIC, _LAYOUT_VERSION, slots, slot_size, stripes, kind="idempotency")
+        self.slots, self.slot_size, self.stripes = self._table.slots, self._table.slot_size, self._table.stripes
+        self._mm = self._table.mm
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+
+    def _find(self, key: bytes, key_hash: int, stripe: int, now: float) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Probe the stripe for ``key``.
+
+        Returns (offset of the live slot holding the key, offset of the first
+        reusable slot); either may be None.
+        """
+        mm = self._mm
+        per_stripe = self._table.slots_per_stripe
+        base = self._table.stripe_base(stripe)
+        start = key_hash >> 32
+        reusable = None
+        for i in range(per_stripe):
+            offset = base + ((start + i) & (per_stripe - 1)) * self.slot_size
+            state, _, key_len, _, _, slot_hash, _, expires_at = _SLOT.unpack_from(mm, offset)
+            if state == _EMPTY:
+                return None, reusable if reusable is not None else offset
+            live = state != _DELETED and expires_at >= now
+            if live and slot_hash == key_hash and mm[offset + _SLOT.size:offset + _SLOT.size + key_len] == key:
+                return offset, reusable
+            if not live and reusable is None:
+                reusable = offset
+        return None, reusable
+
+    def _write(self, offset: int, state: int, key: bytes, key_hash: int, response_code: int,
+               headers: bytes, body: bytes, created_at: float, expires_at: float):
+        mm = self._mm
+        data_offset = offset + _SLOT.size
+        mm[data_offset:data_offset + len(key)] = key
+        data_offset += len(key)
+        mm[data_offset:data_offset + len(headers)] = headers
+        data_offset += len(headers)
+        mm[data_offset:data_offset + len(body)] = body
+        # The header goes last so a slot never advertises data not yet written
+        _SLOT.pack_into(mm, offset, state, response_code, len(key), len(headers), len(body),
+                        key_hash, created_at, expires_at)
+
+    def _locate(self, key: str) -> Tuple[bytes, int, int]:
+        raw_key = key.encode("utf-8")
+        key_hash = _hash_key(raw_key)
+        return raw_key, key_hash, self._table.stripe_of(key_hash)
+
+    def claim_sync(self, key: str, ttl_seconds: int) -> bool:
+        """Atomically insert an in-progress marker unless the key is present"""
+        raw_key, key_hash, stripe = self._locate(key)
+        now = time.time()
+        with self._table.locked(stripe, exclusive=True):
+            found, reusable = self._find(raw_key, key_hash, stripe, now)
+            if found is not None or reusable is None:
+                if reusable is None and found is None:
+                    logger.warning(f"Idempotency table stripe {stripe} is full; cannot claim {key}")
+                return False
+            self._write(reusable, _PENDING, raw_key, key_hash, 0, b"", b"", now, now + ttl_seconds)
+            return True
+
+    def get_sync(self, key: str) -> Optional[IdempotencyKey]:
+        raw_key, key_hash, stripe = self._locate(key)
+        now = time.time()
+        with self._table.locked(stripe, exclusive=False):
+            offset, _ = self._find(raw_key, key_hash, stripe, now)
+            if offset is None:
+                return None
+            state, code, key_len, headers_len, body_len, _, created_at, expires_at = _SLOT.unpack_from(self._mm, offset)
+            if state != _COMPLETE:
+                return None
+            data_offset = offset + _SLOT.size + key_len
+            headers = self._mm[data_offset:data_offset + headers_len]
+            data_offset += headers_len
+            body = self._mm[data_offset:data_offset + body_len]
+        return IdempotencyKey(
+            key=key,
+            response_code=code,
+            response_body=body,
+            response_headers=_decode_headers(headers),
+            created_at=created_at,
+            expires_at=expires_at
+        )
+
+    def set_sync(self, key: str, response_code: int, response_body: bytes, ttl_seconds: int,
+                 response_headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> bool:
+        raw_key, key_hash, stripe = self._locate(key)
+        headers = _encode_headers(response_headers)
+        if _SLOT.size + len(raw_key) + len(headers) + len(response_body) > self.slot_size:
+            self.rejections += 1
+            logger.warning(f"Response for idempotency key {key} does not fit in a {self.slot_size} byte slot")
+            return False
+        now = time.time()
+        with self._table.locked(stripe, exclusive=True):
+            found, reusable = self._find(raw_key, key_hash, stripe, now)
+            offset = found if found is not None else reusable
+            if offset is None:
+                logger.warning(f"Idempotency table stripe {stripe} is full; cannot store {key}")
+                return False
+            self._write(offset, _COMPLETE, raw_key, key_hash, response_code, headers, response_body,
+                        now, now + ttl_seconds)
+            return True
+
+    def delete_sync(self, key: str) -> bool:
+        raw_key, key_hash, stripe = self._locate(key)
+        with self._table.locked(stripe, exclusive=True):
+            offset, _ = self._find(raw_key, key_hash, stripe, time.time())
+            if offset is None:
+                return False
+            self._mm[offset] = _DELETED
+            return True
+
+    # The table lives in RAM and every operation holds a stripe lock for a
+    # few microseconds, so the async API calls the sync one directly instead
+    # of paying for an executor hop.
+
+    async def get(self, key: str) -> Optional[IdempotencyKey]:
+        """Retrieve a stored response if it exists and hasn't expired"""
+        idempotency_key = self.get_sync(key)
+        if idempotency_key is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return idempotency_key
+
+    async def set(self,
+                  key: str,
+                  response_code: int,
+                  response_body: bytes,
+                  ttl_seconds: Optional[int] = None,
+                  response_headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> bool:
+        """Store a response, replacing an in-progress marker for the key"""
+        ttl = ttl_seconds if ttl_seconds is not None else self.default_ttl_seconds
+        return self.set_sync(key, response_code, response_body, ttl, response_headers)
+
+    async def claim(self, key: str, ttl_seconds: int) -> bool:
+        return self.claim_sync(key, ttl_seconds)
+
+    async def delete(self, key: str) -> bool:
+        """Delete an idempotency key or release its in-progress marker"""
+        return self.delete_sync(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {"slots": self.slots, "hits": self.hits, "misses": self.misses, "rejections": self.rejections}
+
+    def close(self):
+        self._table.close()
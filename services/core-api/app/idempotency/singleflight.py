@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+from .utils import get_cached_response, in_progress_response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WAIT_TIMEOUT_SECONDS = 10.0
+# How long a cross-process in-progress marker lives if its owner never
+# finishes (e.g. the worker crashed)
+CLAIM_TTL_SECONDS = 60
+
+
+class SingleFlight:
+    """
+    Registry of idempotency keys whose first request is still being handled.
+
+    The first caller for a key becomes the leader and registers a future;
+    concurrent duplicates get that future back and wait on it instead of
+    running the handler a second time.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def join(self, key: str) -> Optional[asyncio.Future]:
+        """
+        Register the caller as leader for ``key``.
+
+        Returns None if the caller is the leader, otherwise the leader's future.
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            return future
+        self._in_flight[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def complete(self, key: str, response: Any = None, error: Optional[BaseException] = None):
+        """Release ``key`` and hand the leader's outcome to every waiter"""
+        future = self._in_flight.pop(key, None)
+        if future is not None and not future.done():
+            # The outcome is passed as a value so that an unobserved error
+            # does not trigger "exception was never retrieved" warnings
+            future.set_result((response, error))
+
+    async def wait(self, future: asyncio.Future, timeout: float) -> Tuple[Any, Optional[BaseException]]:
+        """Wait for the leader's outcome; raises asyncio.TimeoutError"""
+        # shield() keeps one waiter's timeout from cancelling the shared future
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+
+# Global instance for the application
+in_flight_requests = SingleFlight()
+
+
+async def wait_for_leader(idempotency_key: str, leader: asyncio.Future, timeout: float, store,
+                          fingerprint: Optional[bytes] = None):
+    """
+    Wait for the in-process request that owns ``idempotency_key``.
+
+    Returns the replayed stored response (a 422 if it was made for a request
+    body other than the one with ``fingerprint``), or a 409 response if the
+    wait timed out or nothing was stored; re-raises the leader's error.
+    """
+    logger.info(f"Waiting for in-flight request with idempotency key: {idempotency_key}")
+    try:
+        _, error = await in_flight_requests.wait(leader, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out waiting for in-flight idempotency key: {idempotency_key}")
+        return in_progress_response(idempotency_key)
+
+    if error is not None and not isinstance(error, asyncio.CancelledError):
+        raise error
+
+    cached_response = await get_cached_response(idempotency_key, store, fingerprint)
+    if cached_response:
+        return cached_response
+    # The original request was cancelled or its response was not stored
+    # (e.g. a 5xx); let the client retry
+    return in_progress_response(idempotency_key)
+
+
+async def wait_for_other_worker(idempotency_key: str, timeout: float, store, fingerprint: Optional[bytes] = None):
+    """Poll a shared store until another worker process stores its response"""
+    logger.info(f"Idempotency key {idempotency_key} is in flight on another worker")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.005
+    while True:
+        cached_response = await get_cached_response(idempotency_key, store, fingerprint)
+        if cached_response:
+            return cached_response
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            logger.warning(f"Timed out waiting for in-flight idempotency key: {idempotency_key}")
+            return in_progress_response(idempotency_key)
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.1)
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from .base import IdempotencyBackend, DEFAULT_CLEANUP_INTERVAL_SECONDS
+from .models import IdempotencyKey, PENDING_RESPONSE_CODE
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    response_code INTEGER NOT NULL,
+    response_body BLOB NOT NULL,
+    response_headers BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+"""
+
+
+def _encode_headers(headers: Tuple[Tuple[bytes, bytes], ...]) -> bytes:
+    # Header names and values cannot contain CR/LF, so newline-separated
+    # "name:value" lines round-trip safely
+    return b"\n".join(name + b":" + value for name, value in headers)
+
+
+def _decode_headers(blob: bytes) -> Tuple[Tuple[bytes, bytes], ...]:
+    if not blob:
+        return ()
+    return tuple(tuple(line.split(b":", 1)) for line in blob.split(b"\n"))
+
+
+class SQLiteIdempotencyStore(IdempotencyBackend):
+    """
+    Persistent idempotency store backed by a local SQLite database in WAL mode.
+
+    Keys survive process restarts without needing a network service. Queries
+    run on the default executor so the event loop never waits on disk I/O;
+    a single connection is shared behind a thread lock.
+    """
+
+    def __init__(self,
+                 path: str = "/tmp/idempotency.sqlite3",
+                 default_ttl_seconds: int = 86400,
+                 cleanup_interval_seconds: int = DEFAULT_CLEANUP_INTERVAL_SECONDS):
+        self.path = path
+        self.default_ttl_seconds = default_ttl_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self._cleanup_task is None and self.cleanup_interval_seconds:
+            self._cleanup_task = loop.create_task(self._cleanup_expired_keys())
+        return await loop.run_in_executor(None, fn, *args)
+
+    def _get(self, key: str) -> Optional[IdempotencyKey]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT response_code, response_body, response_headers, created_at, expires_at "
+                "FROM idempotency_keys WHERE key = ? AND expires_at >= ? AND response_code != ?",
+                (key, time.time(), PENDING_RESPONSE_CODE)
+            ).fetchone()
+        if row is None:
+            return None
+        return IdempotencyKey(
+            key=key,
+            response_code=row[0],
+            response_body=bytes(row[1]),
+            response_headers=_decode_headers(row[2]),
+            created_at=row[3],
+            expires_at=row[4]
+        )
+
+    def _set(self, key: str, response_code: int, response_body: bytes, ttl: int,
+             response_headers: Tuple[Tuple[bytes, bytes], ...]):
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys "
+                "(key, response_code, response_body, response_headers, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response_code, response_body, _encode_headers(response_headers), now, now + ttl)
+            )
+
+    def _claim(self, key: str, ttl: int) -> bool:
+        now = time.time()
+        with self._db_lock:
+            # One write transaction, so workers sharing the file cannot both
+            # replace the same expired row
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at < ?", (key, now))
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO idempotency_keys "
+                    "(key, response_code, response_body, response_headers, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, PENDING_RESPONSE_CODE, b"", b"", now, now + ttl)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def _delete(self, key: str) -> bool:
+        with self._db_lock:
+            cursor = self._conn.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def _purge(self, now: float) -> int:
+        # Uses the expires_at index, so only expired rows are touched
+        with self._db_lock:
+            cursor = self._conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+        return cursor.rowcount
+
+    async def get(self, key: str) -> Optional[IdempotencyKey]:
+        """Retrieve an idempotency key if it exists and hasn't expired"""
+        idempotency_key = await self._run(self._get, key)
+        if idempotency_key is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return idempotency_key
+
+    async def set(self,
+                  key: str,
+                  response_code: int,
+                  response_body: bytes,
+                  ttl_seconds: Optional[int] = None,
+                  response_headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> bool:
+        """Store an idempotency key with its raw response"""
+        ttl = ttl_seconds if ttl_seconds is not None else self.default_ttl_seconds
+        try:
+            await self._run(self._set, key, response_code, response_body, ttl, response_headers)
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error storing idempotency key {key}: {e}")
+            return False
+
+    async def claim(self, key: str, ttl_seconds: int) -> bool:
+        """Insert an in-progress marker row unless the key is present"""
+        return await self._run(self._claim, key, ttl_seconds)
+
+    async def delete(self, key: str) -> bool:
+        """Delete an idempotency key"""
+        return await self._run(self._delete, key)
+
+    async def purge_expired(self) -> int:
+        return await self._run(self._purge, time.time())
+
+    def stats(self) -> Dict[str, int]:
+        with self._db_lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+        self._conn.close()
@@ -1,84 +1,82 @@
-import asyncio
-import time
-from typing import Optional, Dict, Any
-from .models import IdempotencyKey
-from datetime import datetime, timedelta
+import os
+from typing import Dict, Optional
+from .base import IdempotencyBackend
+from .memory_store import InMemoryIdempotencyStore
+from .lru_store import LRUIdempotencyStore
+from .sqlite_store import SQLiteIdempotencyStore
+from .shared_memory_store import SharedMemoryIdempotencyStore
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class InMemoryIdempotencyStore:
-    def __init__(self, default_ttl_seconds: int = 86400):  # 24 hours default
-        self._store: Dict[str, IdempotencyKey] = {}
-        self._lock = asyncio.Lock()
-        self.default_ttl_seconds = default_ttl_seconds
-        # Start cleanup task
-        self._cleanup_task = asyncio.create_task(self._cleanup_expired_keys())
-    
-    async def _cleanup_expired_keys(self):
-        """Periodically clean up expired idempotency keys"""
-        while True:
-            try:
-                await asyncio.sleep(300)  # Clean up every 5 minutes
-                now = datetime.utcnow()
-                expired_keys = [
-                    key for key, idempotency_key in self._store.items()
-                    if idempotency_key.expires_at < now
-                ]
-                for key in expired_keys:
-                    del self._store[key]
-                if expired_keys:
-                    logger.info(f"Cleaned up {len(expired_keys)} expired idempotency keys")
-            except Exception as e:
-                logger.error(f"Error during idempotency key cleanup: {e}")
-    
-    async def get(self, key: str) -> Optional[IdempotencyKey]:
-        """Retrieve an idempotency key if it exists and hasn't expired"""
-        async with self._lock:
-            if key in self._store:
-                idempotency_key = self._store[key]
-                # Check if key has expired
-                if idempotency_key.expires_at < datetime.utcnow():
-                    del self._store[key]
-                    return None
-                return idempotency_key
-            return None
-    
-    async def set(self, key: str, response_code: int, response_body: Any, ttl_seconds: Optional[int] = None) -> bool:
-        """Store an idempotency key with its response"""
-        async with self._lock:
-            try:
-                ttl = ttl_seconds if ttl_seconds is not None else self.default_ttl_seconds
-                now = datetime.utcnow()
-                expires_at = now + timedelta(seconds=ttl)
-                
-                idempotency_key = IdempotencyKey(
-                    key=key,
-                    response_code=response_code,
-                    response_body=response_body,
-                    created_at=now,
-                    expires_at=expires_at
-                )
-                
-                self._store[key] = idempotency_key
-                return True
-            except Exception as e:
-                logger.error(f"Error storing idempotency key {key}: {e}")
-                return False
-    
-    async def delete(self, key: str) -> bool:
-        """Delete an idempotency key"""
-        async with self._lock:
-            if key in self._store:
-                del self._store[key]
-                return True
-            return False
-    
-    def __del__(self):
-        """Clean up the cleanup task when the store is deleted"""
-        if hasattr(self, '_cleanup_task'):
-            self._cleanup_task.cancel()
+# Backend selection. IDEMPOTENCY_BACKEND is one of:
+#   memory - unbounded lock-striped store (InMemoryIdempotencyStore)
+#   lru    - bounded lock-striped LRU with byte accounting (LRUIdempotencyStore)
+#   sqlite - persistent SQLite/WAL store (SQLiteIdempotencyStore)
+#   shm    - memory-mapped table shared by all worker processes on the host
+#            (SharedMemoryIdempotencyStore)
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "lru")
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "0"))  # 0 = no entry cap
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "/tmp/idempotency.sqlite3")
+IDEMPOTENCY_SHM_PATH = os.getenv("IDEMPOTENCY_SHM_PATH", "/dev/shm/core-api-idempotency")
+IDEMPOTENCY_SHM_SLOTS = int(os.getenv("IDEMPOTENCY_SHM_SLOTS", "16384"))
+IDEMPOTENCY_SHM_SLOT_BYTES = int(os.getenv("IDEMPOTENCY_SHM_SLOT_BYTES", "2048"))
+
+
+def create_idempotency_store(backend: Optional[str] = None, **options) -> IdempotencyBackend:
+    """
+    Factory function to create an idempotency store for a configured backend.
+
+    Args:
+        backend: "memory", "lru", "sqlite" or "shm"; defaults to IDEMPOTENCY_BACKEND
+        options: Extra keyword arguments for the backend's constructor
+
+    Returns:
+        IdempotencyBackend instance
+    """
+    backend = (backend or IDEMPOTENCY_BACKEND).lower()
+    if backend == "memory":
+        return InMemoryIdempotencyStore(**options)
+    if backend == "lru":
+        options.setdefault("max_bytes", IDEMPOTENCY_MAX_BYTES)
+        options.setdefault("max_entries", IDEMPOTENCY_MAX_ENTRIES)
+        return LRUIdempotencyStore(**options)
+    if backend == "sqlite":
+        options.setdefault("path", IDEMPOTENCY_SQLITE_PATH)
+        return SQLiteIdempotencyStore(**options)
+    if backend == "shm":
+        options.setdefault("path", IDEMPOTENCY_SHM_PATH)
+        options.setdefault("slots", IDEMPOTENCY_SHM_SLOTS)
+        options.setdefault("slot_size", IDEMPOTENCY_SHM_SLOT_BYTES)
+        return SharedMemoryIdempotencyStore(**options)
+    raise ValueError(f"Unknown idempotency backend: {backend}")
+
 
 # Global instance for the application
-idempotency_store = InMemoryIdempotencyStore()
+idempotency_store = create_idempotency_store()
+
+_named_stores: Dict[str, IdempotencyBackend] = {IDEMPOTENCY_BACKEND.lower(): idempotency_store}
+
+
+def get_idempotency_store(store=None) -> IdempotencyBackend:
+    """
+    Resolve the store used by the idempotency middleware.
+
+    Args:
+        store: None for the global store, a backend name ("memory", "lru",
+            "sqlite", "shm") for a shared per-process instance of that backend, or
+            an IdempotencyBackend instance
+
+    Returns:
+        IdempotencyBackend instance
+    """
+    if store is None:
+        return idempotency_store
+    if isinstance(store, IdempotencyBackend):
+        return store
+    name = store.lower()
+    if name not in _named_stores:
+        _named_stores[name] = create_idempotency_store(name)
+    return _named_stores[name]
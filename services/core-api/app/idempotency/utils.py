@@ -1,54 +1,72 @@
-from fastapi import Request, HTTPException
+from fastapi import Response
 from fastapi.responses import JSONResponse
 import logging
+from typing import Optional
+from .base import IdempotencyBackend
 from .storage import idempotency_store
-import json
+from .models import FINGERPRINT_HEADER, IdempotencyKey, REPLAYED_HEADERS
 
 logger = logging.getLogger(__name__)
 
 
-def check_idempotency_key(request: Request):
-    """Check if an idempotency key exists in the request headers"""
-    return request.headers.get("Idempotency-Key")
+class ReplayedResponse(Response):
+    """Response that sends a stored body and header pairs back unchanged"""
 
+    def __init__(self, record: IdempotencyKey):
+        # Bypass Response.__init__: the body is already rendered and the
+        # headers are already encoded, content-length included
+        self.status_code = record.response_code
+        self.body = record.response_body
+        self.raw_headers = [pair for pair in record.response_headers if pair[0] != FINGERPRINT_HEADER]
+        self.background = None
 
-async def get_cached_response(idempotency_key: str):
-    """Get cached response for an idempotency key if it exists"""
-    existing_key = await idempotency_store.get(idempotency_key)
+
+def replayable_headers(raw_headers):
+    """Keep only the encoded header pairs that should be replayed"""
+    return tuple((name, value) for name, value in raw_headers if name in REPLAYED_HEADERS)
+
+
+def replay_response(idempotency_key: str, record: IdempotencyKey, fingerprint: Optional[bytes] = None) -> Response:
+    """
+    The stored response, or a 422 if it was made for a request body other
+    than the one with ``fingerprint``
+    """
+    stored_fingerprint = record.request_fingerprint
+    if fingerprint is not None and stored_fingerprint is not None and stored_fingerprint != fingerprint:
+        logger.warning(f"Idempotency key {idempotency_key} reused with a different request body")
+        return key_reused_response(idempotency_key)
+    logger.info(f"Returning cached response for idempotency key: {idempotency_key}")
+    return ReplayedResponse(record)
+
+
+async def get_cached_response(idempotency_key: str, store: Optional[IdempotencyBackend] = None,
+                              fingerprint: Optional[bytes] = None):
+    """Get cached response for an idempotency key if it exists (see replay_response)"""
+    existing_key = await (store or idempotency_store).get(idempotency_key)
     if existing_key:
-        logger.info(f"Returning cached response for idempotency key: {idempotency_key}")
-        return JSONResponse(
-            content=existing_key.response_body,
-            status_code=existing_key.response_code
-        )
+        return replay_response(idempotency_key, existing_key, fingerprint)
     return None
 
 
-async def store_response(idempotency_key: str, response: JSONResponse, ttl_seconds: int = 86400):
-    """Store response for an idempotency key"""
-    try:
-        # Extract response data
-        response_code = response.status_code
-        response_body = response.body.decode() if hasattr(response, 'body') else ""
-        
-        # Try to parse JSON response body
-        try:
-            parsed_body = json.loads(response_body)
-        except:
-            parsed_body = response_body
-        
-        # Store the idempotency key with response data
-        success = await idempotency_store.set(
-            idempotency_key, 
-            response_code, 
-            parsed_body, 
-            ttl_seconds
-        )
-        
-        if success:
-            logger.info(f"Stored response for idempotency key: {idempotency_key}")
-        else:
-            logger.error(f"Failed to store response for idempotency key: {idempotency_key}")
-            
-    except Exception as e:
-        logger.error(f"Error storing response for idempotency key {idempotency_key}: {e}")
+def in_progress_response(idempotency_key: str) -> JSONResponse:
+    """409 returned to a duplicate that gave up waiting for the original request"""
+    return JSONResponse(
+        status_code=409,
+        content={
+            "error": "Request in progress",
+            "message": f"A request with idempotency key {idempotency_key} is still being processed. Please retry later.",
+            "status": "in_progress"
+        }
+    )
+
+
+def key_reused_response(idempotency_key: str) -> JSONResponse:
+    """422 returned when an idempotency key is sent again with a different request body"""
+    return JSONResponse(
+        status_code=422,
+        content={
+            "error": "Idempotency key reused",
+            "message": f"Idempotency key {idempotency_key} was already used with a different request body.",
+            "status": "key_reused"
+        }
+    )
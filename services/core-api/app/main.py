@@ -1,14 +1,15 @@
-from fastapi import FastAPI, Request
-from pydantic import BaseModel
-from typing import Optional
-import uuid
+from fastapi import FastAPI
 import logging
-from .idempotency.decorator import idempotent
-from .circuit_breaker.circuit_breaker import with_circuit_breaker, fallback_handler
+from .idempotency.middleware import IdempotencyMiddleware
+from .circuit_breaker.circuit_breaker import CircuitBreakerOpen, fallback_handler, registry, with_circuit_breaker
+from .circuit_breaker.bulkhead import BulkheadFull, bulkhead_stats, get_bulkhead
+from .circuit_breaker.fallback_cache import fallback_cache_stats, get_fallback_cache
+from .circuit_breaker.retry import RetryPolicy, retry_stats
 from fastapi.responses import JSONResponse
 
-# Import the events router
+# Import the events and bookings routers
 from .events.example_usage import router as events_router
+from .bookings.router import router as bookings_router, drain_booking_service, start_booking_service
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,25 +19,27 @@ logger = logging.getLogger(__name__)
 # Import circuit breaker for external service calls
 app = FastAPI()
 
-# Include the events router
+# Every POST/PUT/PATCH route honours the Idempotency-Key header; keys are
+# scoped to the method and path, reusing one with a different body is a 422,
+# and concurrent retries with the same key are coalesced
+app.add_middleware(IdempotencyMiddleware, ttl_seconds=3600)  # 1 hour TTL
+
+# Include the events and bookings routers
 app.include_router(events_router, prefix="/events", tags=["events"])
+app.include_router(bookings_router, tags=["bookings"])
+
+
+@app.on_event("startup")
+async def startup():
+    # Publish booking events from the outbox in the background
+    await start_booking_service()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Let the outbox relay finish publishing its current batch
+    await drain_booking_service()
 
-# Example data model
-class BookingRequest(BaseModel):
-    service_id: str
-    customer_name: str
-    date: str
-    time: str
-    notes: Optional[str] = None
-
-class BookingResponse(BaseModel):
-    booking_id: str
-    service_id: str
-    customer_name: str
-    date: str
-    time: str
-    status: str
-    notes: Optional[str] = None
 
 @app.get("/")
 def read_root():
@@ -50,39 +53,32 @@ def read_item(item_id: int, q: str = None):
 def health_check():
     return {"status": "healthy"}
 
-# Example POST endpoint with idempotency support
-@app.post("/bookings", response_model=BookingResponse)
-@idempotent(ttl_seconds=3600)  # 1 hour TTL
-async def create_booking(booking: BookingRequest, request: Request):
-    """Create a booking with idempotency support"""
-    logger.info(f"Processing booking request for {booking.customer_name}")
-    
-    # Simulate some processing time
-    import time
-    time.sleep(1)
-    
-    # Create a booking ID (in a real app, this would involve database operations)
-    booking_id = str(uuid.uuid4())
-    
-    # Create response
-    response_data = BookingResponse(
-        booking_id=booking_id,
-        service_id=booking.service_id,
-        customer_name=booking.customer_name,
-        date=booking.date,
-        time=booking.time,
-        status="confirmed",
-        notes=booking.notes
-    )
-    
-    logger.info(f"Booking created with ID: {booking_id}")
-    
-    return JSONResponse(content=response_data.dict(), status_code=201)
-
-
-# Example endpoint with circuit breaker
+@app.get("/metrics/circuit-breakers")
+def circuit_breaker_metrics():
+    """State, window rates, call counts and state transitions of every circuit breaker"""
+    return registry.stats()
+
+@app.get("/metrics/bulkheads")
+def bulkhead_metrics():
+    """Adaptive limit, calls in flight and queued, and rejections of every bulkhead"""
+    return bulkhead_stats()
+
+@app.get("/metrics/retries")
+def retry_metrics():
+    """Retry budget tokens, calls, retries (made and denied) and hedges of every dependency"""
+    return retry_stats()
+
+@app.get("/metrics/fallback-caches")
+def fallback_cache_metrics():
+    """Entries, results served instead of calls, failed calls answered and refreshes of every fallback cache"""
+    return fallback_cache_stats()
+
+# Example endpoint with circuit breaker; both examples call the same
+# dependency, so they share its breaker, the bulkhead limiting the calls in
+# flight to it and the budget their retries draw on
 @app.get("/external-service-call")
-@with_circuit_breaker
+@with_circuit_breaker("external-service", bulkhead=get_bulkhead("external-service"),
+                      retry=RetryPolicy("external-service"))
 async def call_external_service():
     """Example endpoint that demonstrates circuit breaker usage"""
     logger.info("Calling external service with circuit breaker")
@@ -94,9 +90,11 @@ async def call_external_service():
 
     return {"message": "External service call successful"}
 
-# Example endpoint with circuit breaker and fallback
+# Example endpoint with circuit breaker and fallback: the last good response
+# is served while the circuit is open, or when the call fails
 @app.get("/external-service-call-with-fallback")
-@with_circuit_breaker
+@with_circuit_breaker("external-service", bulkhead=get_bulkhead("external-service"),
+                      retry=RetryPolicy("external-service"), fallback_cache=get_fallback_cache("external-service"))
 async def call_external_service_with_fallback():
     """Example endpoint that demonstrates circuit breaker with fallback"""
     logger.info("Calling external service with circuit breaker and fallback")
@@ -109,18 +107,27 @@ async def call_external_service_with_fallback():
     return {"message": "External service call successful"}
 
 # Add exception handler for circuit breaker
-from fastapi_cb import CircuitBreakerOpen
-
 @app.exception_handler(CircuitBreakerOpen)
 async def circuit_breaker_open_handler(request, exc):
     """Handle circuit breaker open exception"""
-    logger.warning("Circuit breaker is open")
     return JSONResponse(
         status_code=503,
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+        content=fallback_handler(exc)
+    )
+
+# Add exception handler for calls rejected by a full bulkhead
+@app.exception_handler(BulkheadFull)
+async def bulkhead_full_handler(request, exc):
+    """Handle bulkhead full exception"""
+    logger.warning(f"Bulkhead {exc.name!r} rejected a call: {exc.reason}")
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "1"},
         content={
             "error": "Service temporarily unavailable",
-            "message": "The service is currently unavailable due to circuit breaker. Please try again later.",
-            "status": "circuit_open"
+            "message": "The service is handling too many requests. Please try again shortly.",
+            "status": "overloaded",
+            "dependency": exc.name
         }
     )
-
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .store import OutboxRecord, OutboxStore
+
+logger = logging.getLogger(__name__)
+
+# Events claimed and published per round
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+# Seconds between polls when the outbox is idle; appends wake the relay sooner
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+# Seconds a claimed batch is reserved for this relay; must outlast a publish
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+# Retry backoff after a failed publish, doubling from min to max, with jitter
+OUTBOX_MIN_BACKOFF = float(os.getenv("OUTBOX_MIN_BACKOFF", "1.0"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+# Published events are kept this long for bookkeeping, then purged
+OUTBOX_RETENTION_SECONDS = float(os.getenv("OUTBOX_RETENTION_SECONDS", "86400"))
+
+
+class OutboxRelay:
+    """
+    Background task publishing outbox events in batches.
+
+    Each round claims up to ``batch_size`` due events. Events sharing an
+    ordering key are published one after the other, each only once the
+    previous one is acknowledged; different keys are published concurrently,
+    so the producer packs them into batched publish RPCs. A failed publish
+    holds back the rest of its key until a retry, with exponential backoff,
+    succeeds. Events are published at least once: if the process dies
+    between a publish and its bookkeeping the event is published again, with
+    the same correlation ID, which consumers deduplicate on.
+    """
+
+    def __init__(self,
+                 store: OutboxStore,
+                 producer,
+                 batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 lease_seconds: float = OUTBOX_LEASE_SECONDS,
+                 min_backoff: float = OUTBOX_MIN_BACKOFF,
+                 max_backoff: float = OUTBOX_MAX_BACKOFF,
+                 retention_seconds: float = OUTBOX_RETENTION_SECONDS):
+        """
+        Args:
+            store: The outbox to drain
+            producer: EventProducer the events are published with
+            batch_size: Events claimed per round
+            poll_interval: Seconds between polls when idle
+            lease_seconds: Seconds a claimed batch is reserved for this relay
+            min_backoff: Seconds before the first retry of a failed event
+            max_backoff: Longest wait between retries
+            retention_seconds: How long published events are kept
+        """
+        self.store = store
+        self.producer = producer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.retention_seconds = retention_seconds
+        self.published = 0
+        self.failed = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait after an event's ``attempts``-th failed publish"""
+        return min(self.max_backoff, self.min_backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+    async def _store(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _publish_key(self, records: List[OutboxRecord]) -> Tuple[List[Tuple[int, str]], List[int]]:
+        """Publish one ordering key's events in order, stopping at the first failure"""
+        published = []
+        for i, record in enumerate(records):
+            try:
+                message_id = await self.producer.publish_encoded(record.domain, record.version, record.data,
+                                                                 ordering_key=record.ordering_key)
+            except Exception as e:
+                self.failed += 1
+                attempts = record.attempts + 1
+                delay = self.backoff(attempts)
+                logger.warning(f"Failed to publish outbox event {record.id} (attempt {attempts}, "
+                               f"retrying in {delay:.1f}s): {e}")
+                await self._store(self.store.mark_failed, record.id, str(e), time.time() + delay)
+                return published, [later.id for later in records[i + 1:]]
+            published.append((record.id, message_id))
+        return published, []
+
+    async def run_once(self) -> int:
+        """Claim and publish one batch; returns the number of events claimed"""
+        records = await self._store(self.store.claim, self.batch_size, self.lease_seconds)
+        if not records:
+            return 0
+        by_key: "OrderedDict[str, List[OutboxRecord]]" = OrderedDict()
+        for record in records:
+            by_key.setdefault(record.ordering_key, []).append(record)
+        results = await asyncio.gather(*(self._publish_key(key_records) for key_records in by_key.values()))
+        published = [item for key_published, _ in results for item in key_published]
+        unattempted = [event_id for _, key_unattempted in results for event_id in key_unattempted]
+        if published:
+            await self._store(self.store.mark_published, published)
+            self.published += len(published)
+        if unattempted:
+            await self._store(self.store.release, unattempted)
+        return len(records)
+
+    def notify(self):
+        """Wake the relay, e.g. right after appending events"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Drain the outbox until stopped"""
+        self._wakeup = asyncio.Event()
+        last_purge = time.monotonic()
+        while not self._stopping:
+            # Cleared before claiming, so appends made during the round wake the next one
+            self._wakeup.clear()
+            try:
+                claimed = await self.run_once()
+                if time.monotonic() - last_purge > 60:
+                    last_purge = time.monotonic()
+                    await self._store(self.store.purge_published, time.time() - self.retention_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox relay round failed: {e}")
+                claimed = 0
+            if claimed < self.batch_size:
+                # Nothing more is due right now; sleep until an append or the next poll
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self) -> asyncio.Task:
+        """Start the relay on the running event loop"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Finish the current round, then stop; pending events stay in the outbox"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self.notify()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.store.stats(), "relayed": self.published, "failed_attempts": self.failed}
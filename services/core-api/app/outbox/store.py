@@ -0,0 +1,284 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class OutboxEvent(NamedTuple):
+    """An encoded event waiting to be published to ``<domain>.v<version>.events``"""
+    domain: str
+    version: str
+    # Events with the same key are published in the order they were appended
+    ordering_key: str
+    data: bytes
+
+
+class OutboxRecord(NamedTuple):
+    id: int
+    domain: str
+    version: str
+    ordering_key: str
+    data: bytes
+    attempts: int
+
+
+class OutboxStore(ABC):
+    """
+    Durable queue of events to publish.
+
+    Events are appended together with the write that produced them, then
+    claimed in batches by the relay and marked published or failed.
+    Published rows are kept, with their message IDs, until purged.
+    """
+
+    @abstractmethod
+    def append(self, events: Sequence[OutboxEvent]) -> None:
+        """Append events in a transaction of their own"""
+
+    @abstractmethod
+    def claim(self, limit: int, lease_seconds: float) -> List[OutboxRecord]:
+        """
+        Lease up to ``limit`` pending events that are due, oldest first.
+
+        An ordering key is only claimed when none of its pending events is
+        backing off or leased to another relay, so events of one key are
+        never published out of order.
+        """
+
+    @abstractmethod
+    def mark_published(self, published: Sequence[Tuple[int, str]]) -> None:
+        """Record (event ID, message ID) pairs as published"""
+
+    @abstractmethod
+    def mark_failed(self, event_id: int, error: str, retry_at: float) -> None:
+        """Count a failed attempt and hold the event's ordering key until ``retry_at``"""
+
+    @abstractmethod
+    def release(self, event_ids: Iterable[int]) -> None:
+        """Give back leased events that were not attempted"""
+
+    @abstractmethod
+    def purge_published(self, before: float) -> int:
+        """Delete events published before a timestamp"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, float]:
+        """Pending and published counts and the age of the oldest pending event"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    domain TEXT NOT NULL,
+    version TEXT NOT NULL,
+    ordering_key TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    leased_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    published_at REAL,
+    message_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (id) WHERE published_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_outbox_pending_key ON outbox (ordering_key) WHERE published_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_outbox_published_at ON outbox (published_at) WHERE published_at IS NOT NULL;
+"""
+
+
+def append_events(conn: sqlite3.Connection, events: Sequence[OutboxEvent]):
+    """Insert events using a connection, inside the caller's transaction"""
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO outbox (domain, version, ordering_key, data, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(event.domain, event.version, event.ordering_key, event.data, now) for event in events]
+    )
+
+
+class SQLiteOutboxStore(OutboxStore):
+    """
+    Outbox table in a local SQLite database in WAL mode.
+
+    Pass the connection and lock of a repository writing to the same
+    database, so it can append events in the transaction of its own write
+    (see ``append_events``); or a path for a connection of its own.
+    """
+
+    def __init__(self,
+                 path: str = "/tmp/outbox.sqlite3",
+                 conn: Optional[sqlite3.Connection] = None,
+                 lock: Optional[threading.Lock] = None):
+        if conn is None:
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn = conn
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = lock or threading.Lock()
+
+    def append(self, events: Sequence[OutboxEvent]) -> None:
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                append_events(self._conn, events)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def claim(self, limit: int, lease_seconds: float) -> List[OutboxRecord]:
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, domain, version, ordering_key, data, attempts FROM outbox "
+                    "WHERE published_at IS NULL AND ordering_key NOT IN ("
+                    "    SELECT ordering_key FROM outbox WHERE published_at IS NULL"
+                    "    AND (next_attempt_at > ? OR leased_until > ?)"
+                    ") ORDER BY id LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE outbox SET leased_until = ? WHERE id = ?",
+                        [(now + lease_seconds, row[0]) for row in rows]
+                    )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return [OutboxRecord(*row) for row in rows]
+
+    def mark_published(self, published: Sequence[Tuple[int, str]]) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._conn.executemany(
+                "UPDATE outbox SET published_at = ?, message_id = ?, attempts = attempts + 1, leased_until = 0 "
+                "WHERE id = ?",
+                [(now, message_id, event_id) for event_id, message_id in published]
+            )
+
+    def mark_failed(self, event_id: int, error: str, retry_at: float) -> None:
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?, leased_until = 0 "
+                "WHERE id = ?",
+                (error, retry_at, event_id)
+            )
+
+    def release(self, event_ids: Iterable[int]) -> None:
+        with self._db_lock:
+            self._conn.executemany("UPDATE outbox SET leased_until = 0 WHERE id = ?",
+                                   [(event_id,) for event_id in event_ids])
+
+    def purge_published(self, before: float) -> int:
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE published_at IS NOT NULL AND published_at < ?", (before,)
+            )
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, float]:
+        with self._db_lock:
+            pending, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE published_at IS NULL"
+            ).fetchone()
+            published = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE published_at IS NOT NULL"
+            ).fetchone()[0]
+        return {
+            "pending": pending,
+            "published": published,
+            "oldest_pending_seconds": time.time() - oldest if oldest is not None else 0.0,
+        }
+
+
+class _Row:
+    __slots__ = ("record", "created_at", "next_attempt_at", "leased_until", "last_error",
+                 "published_at", "message_id")
+
+    def __init__(self, record: OutboxRecord, created_at: float):
+        self.record = record
+        self.created_at = created_at
+        self.next_attempt_at = 0.0
+        self.leased_until = 0.0
+        self.last_error: Optional[str] = None
+        self.published_at: Optional[float] = None
+        self.message_id: Optional[str] = None
+
+
+class InMemoryOutboxStore(OutboxStore):
+    """Outbox for tests and local runs; appends are atomic with in-memory repository writes"""
+
+    def __init__(self):
+        # Insertion order is ID order
+        self._pending: Dict[int, _Row] = {}
+        self._published: Dict[int, _Row] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def append(self, events: Sequence[OutboxEvent]) -> None:
+        now = time.time()
+        with self._lock:
+            for event in events:
+                record = OutboxRecord(self._next_id, event.domain, event.version, event.ordering_key, event.data, 0)
+                self._pending[self._next_id] = _Row(record, now)
+                self._next_id += 1
+
+    def claim(self, limit: int, lease_seconds: float) -> List[OutboxRecord]:
+        now = time.time()
+        with self._lock:
+            blocked = {row.record.ordering_key for row in self._pending.values()
+                       if row.next_attempt_at > now or row.leased_until > now}
+            claimed = []
+            for row in self._pending.values():
+                if len(claimed) == limit:
+                    break
+                if row.record.ordering_key not in blocked:
+                    row.leased_until = now + lease_seconds
+                    claimed.append(row.record)
+        return claimed
+
+    def mark_published(self, published: Sequence[Tuple[int, str]]) -> None:
+        now = time.time()
+        with self._lock:
+            for event_id, message_id in published:
+                row = self._pending.pop(event_id)
+                row.record = row.record._replace(attempts=row.record.attempts + 1)
+                row.published_at, row.message_id, row.leased_until = now, message_id, 0.0
+                self._published[event_id] = row
+
+    def mark_failed(self, event_id: int, error: str, retry_at: float) -> None:
+        with self._lock:
+            row = self._pending[event_id]
+            row.record = row.record._replace(attempts=row.record.attempts + 1)
+            row.last_error, row.next_attempt_at, row.leased_until = error, retry_at, 0.0
+
+    def release(self, event_ids: Iterable[int]) -> None:
+        with self._lock:
+            for event_id in event_ids:
+                self._pending[event_id].leased_until = 0.0
+
+    def purge_published(self, before: float) -> int:
+        with self._lock:
+            purged = [event_id for event_id, row in self._published.items() if row.published_at < before]
+            for event_id in purged:
+                del self._published[event_id]
+        return len(purged)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            oldest = next(iter(self._pending.values()), None)
+            return {
+                "pending": len(self._pending),
+                "published": len(self._published),
+                "oldest_pending_seconds": time.time() - oldest.created_at if oldest is not None else 0.0,
+            }
+
+    def published(self) -> List[Tuple[OutboxRecord, str]]:
+        """Published events in publish order, with their message IDs"""
+        with self._lock:
+            return [(row.record, row.message_id) for row in self._published.values()]
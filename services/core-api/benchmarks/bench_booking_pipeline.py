@@ -0,0 +1,145 @@
+"""
+Load test: POST /bookings under 100 concurrent clients, previous handler vs.
+the async booking pipeline.
+
+Run from services/core-api:
+
+    PYTHONPATH=../.. python -m benchmarks.bench_booking_pipeline
+    PYTHONPATH=../.. python -m benchmarks.bench_booking_pipeline --duration 10 --repository sqlite
+
+"before" is the previous handler, which calls time.sleep(1) inside
+``async def`` and so stalls the event loop for every booking. "after" is
+``app.bookings.router`` backed by the chosen repository, whose outbox is
+drained by an OutboxRelay publishing through a fake producer; each publish
+resolves after ``--publish-latency`` seconds. Requests go through httpx's
+in-process ASGI transport.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app.bookings.models import BookingRequest, BookingResponse
+from app.bookings.repository import InMemoryBookingRepository, SQLiteBookingRepository
+from app.bookings.router import router as bookings_router, get_booking_service
+from app.bookings.service import BookingService
+from app.outbox.relay import OutboxRelay
+
+BOOKING = {
+    "service_id": "service_123",
+    "customer_name": "John Doe",
+    "date": "2025-08-07",
+    "time": "10:00",
+    "notes": "Load test booking",
+}
+
+
+class FakeProducer:
+    """Stands in for EventProducer; publish_encoded resolves after one round trip"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.published = 0
+
+    async def publish_encoded(self, domain, version, data, ordering_key=None):
+        await asyncio.sleep(self.latency)
+        self.published += 1
+        return str(self.published)
+
+
+def legacy_app(sleep_seconds: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/bookings", response_model=BookingResponse)
+    async def create_booking(booking: BookingRequest):
+        # Simulate some processing time (blocks the event loop)
+        time.sleep(sleep_seconds)
+        response_data = BookingResponse(
+            booking_id=str(uuid.uuid4()),
+            service_id=booking.service_id,
+            customer_name=booking.customer_name,
+            date=booking.date,
+            time=booking.time,
+            status="confirmed",
+            notes=booking.notes
+        )
+        return JSONResponse(content=response_data.dict(), status_code=201)
+
+    return app
+
+
+def pipeline_app(service: BookingService) -> FastAPI:
+    app = FastAPI()
+    app.include_router(bookings_router)
+    app.dependency_overrides[get_booking_service] = lambda: service
+    return app
+
+
+async def load(app: FastAPI, clients: int, duration: float):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        deadline = time.perf_counter() + duration
+
+        async def run_client():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post("/bookings", json=BOOKING)
+                assert response.status_code == 201, response.text
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_client() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else float("nan")
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float("nan")
+    return len(latencies), len(latencies) / elapsed, p50, p99
+
+
+async def main(args):
+    print(f"{args.clients} concurrent clients, {args.duration:.0f}s per run")
+    header = f"{'handler':<22} {'requests':>9} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+
+    result = await load(legacy_app(args.legacy_sleep), args.clients, args.duration)
+    print(f"{'before (time.sleep)':<22} {result[0]:>9} {result[1]:>10.1f} {result[2]:>10.1f} {result[3]:>10.1f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.repository == "sqlite":
+            repository = SQLiteBookingRepository(os.path.join(tmp, "bookings.sqlite3"))
+        else:
+            repository = InMemoryBookingRepository()
+        producer = FakeProducer(args.publish_latency)
+        relay = OutboxRelay(repository.outbox, producer)
+        service = BookingService(repository, relay)
+        relay.start()
+        result = await load(pipeline_app(service), args.clients, args.duration)
+        drain_start = time.perf_counter()
+        while repository.outbox.stats()["pending"]:
+            await asyncio.sleep(0.01)
+        drain_seconds = time.perf_counter() - drain_start
+        await service.drain()
+        label = f"after ({args.repository})"
+        print(f"{label:<22} {result[0]:>9} {result[1]:>10.1f} {result[2]:>10.1f} {result[3]:>10.1f}")
+        print(f"booking_created events published from the outbox: {producer.published} "
+              f"({drain_seconds * 1000:.0f} ms backlog after the load stopped)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--repository", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--legacy-sleep", type=float, default=1.0)
+    parser.add_argument("--publish-latency", type=float, default=0.02)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""
+Simulation: tail latency of calls to a degrading dependency, with and without a bulkhead.
+
+Run from services/core-api:
+
+    python -m benchmarks.bench_bulkhead
+    python -m benchmarks.bench_bulkhead --rate 1500 --phase-seconds 3 --slow-ms 80
+
+Requests arrive at ``--rate`` per second, open loop, for three phases of
+``--phase-seconds``: healthy, degraded and recovered. The simulated
+dependency serves ``--capacity`` calls at a time and queues the rest; a call
+takes ``--fast-ms``, or ``--slow-ms`` while degraded, when the rate exceeds
+what it can serve. Without a bulkhead the excess piles up as pending
+coroutines and every later call waits behind it, into the recovered phase.
+A fixed bulkhead caps the calls in flight at ``--capacity``; the adaptive
+one finds the limit from the latency. Both wait at most ``--max-wait-ms``
+for a slot and reject the rest at once.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from app.circuit_breaker.bulkhead import Bulkhead, BulkheadFull, GradientLimit
+
+
+class Dependency:
+    """A service with a fixed number of workers and an unbounded queue"""
+
+    def __init__(self, capacity: int, fast: float, slow: float):
+        self.workers = asyncio.Semaphore(capacity)
+        self.fast = fast
+        self.slow = slow
+        self.degraded = False
+
+    async def call(self):
+        async with self.workers:
+            await asyncio.sleep(self.slow if self.degraded else self.fast)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def simulate(args, bulkhead):
+    dependency = Dependency(args.capacity, args.fast_ms / 1000, args.slow_ms / 1000)
+    call = bulkhead(dependency.call) if bulkhead else dependency.call
+    # (phase, latency, ok) per request
+    results = []
+    pending = set()
+    max_pending = 0
+
+    async def request(phase):
+        start = time.perf_counter()
+        try:
+            await call()
+            ok = True
+        except BulkheadFull:
+            ok = False
+        results.append((phase, time.perf_counter() - start, ok))
+
+    start = time.perf_counter()
+    sent = 0
+    duration = 3 * args.phase_seconds
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        phase = int(elapsed // args.phase_seconds)
+        dependency.degraded = phase == 1
+        while sent < elapsed * args.rate:
+            task = asyncio.ensure_future(request(phase))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            sent += 1
+        max_pending = max(max_pending, len(pending))
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*pending)
+    return results, max_pending
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    print(f"{args.rate:.0f} requests/s, capacity {args.capacity}, {args.fast_ms:.0f} ms healthy / "
+          f"{args.slow_ms:.0f} ms degraded, {args.phase_seconds:.0f} s per phase")
+    header = (f"{'bulkhead':<9} {'ok':>6} {'rejected':>9} {'ok p50 ms':>10} {'ok p99 ms':>10} "
+              f"{'all p99 ms':>11} {'recovered p99 ms':>17} {'max pending':>12}")
+    print(header)
+    print("-" * len(header))
+    max_wait = args.max_wait_ms / 1000
+    bulkheads = [
+        ("none", None),
+        ("fixed", Bulkhead("fixed", GradientLimit(initial=args.capacity, min_limit=args.capacity,
+                                                  max_limit=args.capacity),
+                           max_queue=args.max_queue, max_wait=max_wait)),
+        ("adaptive", Bulkhead("adaptive", GradientLimit(initial=args.capacity // 2, max_limit=args.capacity * 10),
+                              max_queue=args.max_queue, max_wait=max_wait)),
+    ]
+    for label, bulkhead in bulkheads:
+        results, max_pending = asyncio.run(simulate(args, bulkhead))
+        ok = [latency for phase, latency, succeeded in results if succeeded]
+        recovered = [latency for phase, latency, succeeded in results if succeeded and phase == 2]
+        rejected = len(results) - len(ok)
+        print(f"{label:<9} {len(ok):>6} {rejected:>9} {percentile(ok, 0.5) * 1000:>10.1f} "
+              f"{percentile(ok, 0.99) * 1000:>10.1f} "
+              f"{percentile([latency for _, latency, _ in results], 0.99) * 1000:>11.1f} "
+              f"{percentile(recovered, 0.99) * 1000:>17.1f} {max_pending:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=1000)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--fast-ms", type=float, default=10)
+    parser.add_argument("--slow-ms", type=float, default=50)
+    parser.add_argument("--phase-seconds", type=float, default=2)
+    parser.add_argument("--max-queue", type=int, default=50)
+    parser.add_argument("--max-wait-ms", type=float, default=100)
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark: cost of a call through the circuit breaker.
+
+Run from services/core-api:
+
+    python -m benchmarks.bench_circuit_breaker
+    python -m benchmarks.bench_circuit_breaker --calls 500000 --rates 100,10000
+
+For every call rate it reports the time per call of an async function called
+directly, through a closed breaker, and rejected by an open one. The "list
+window" row keeps the window as a list of call times and counts it on every
+call, as a sliding window is often first written; its cost grows with the
+calls the window holds, the bucket ring's does not.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from app.circuit_breaker.circuit_breaker import CircuitBreaker, CircuitBreakerOpen
+
+
+class ListWindow:
+    """Every call in the window, filtered and counted on each record"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.calls = []
+
+    def record(self, now: float, failed: bool, slow: bool):
+        self.calls.append((now, failed, slow))
+        self.calls = [call for call in self.calls if call[0] > now - self.window_seconds]
+        total = len(self.calls)
+        return total, sum(call[1] for call in self.calls) / total, sum(call[2] for call in self.calls) / total
+
+
+class _Clock:
+    """Advances by 1 / rate per reading, so the window holds rate * window_seconds calls"""
+
+    def __init__(self, rate: float):
+        self.step = 1.0 / rate
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += self.step / 2  # read before and after every call
+        return self.now
+
+
+async def noop():
+    return None
+
+
+async def time_calls(func, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        try:
+            await func()
+        except CircuitBreakerOpen:
+            pass
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+async def run(rate: float, calls: int, window_seconds: float):
+    direct = await time_calls(noop, calls)
+    closed = CircuitBreaker("bench", window_seconds=window_seconds, clock=_Clock(rate))
+    through_closed = await time_calls(closed(noop), calls)
+    opened = CircuitBreaker("bench-open", window_seconds=window_seconds, timeout=float("inf"), clock=_Clock(rate))
+    for _ in range(opened.minimum_calls):
+        opened.check()
+        opened.record(0.0, failed=True)
+    rejected = await time_calls(opened(noop), calls)
+
+    window = ListWindow(window_seconds)
+    clock = _Clock(rate)
+    list_calls = min(calls, 20_000)
+    start = time.perf_counter()
+    for _ in range(list_calls):
+        window.record(clock(), False, False)
+    list_window = (time.perf_counter() - start) / list_calls * 1e6
+    return direct, through_closed, rejected, list_window
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    print(f"{args.calls} calls per row, {args.window:.0f} s window")
+    header = f"{'calls/s':>8} {'direct us':>10} {'closed us':>10} {'open us':>8} {'list window us':>15}"
+    print(header)
+    print("-" * len(header))
+    for rate in args.rates:
+        direct, closed, rejected, list_window = asyncio.run(run(rate, args.calls, args.window))
+        print(f"{rate:>8.0f} {direct:>10.2f} {closed:>10.2f} {rejected:>8.2f} {list_window:>15.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--rates", type=lambda value: [float(rate) for rate in value.split(",")],
+                        default=[10, 100, 1000])
+    parser.add_argument("--window", type=float, default=60.0)
+    main(parser.parse_args())
@@ -0,0 +1,123 @@
+"""
+Benchmark: end-to-end EventProducer -> topic -> EventConsumer throughput,
+publish-to-ack latency and redelivery overhead, against the in-process
+Pub/Sub stand-in (salon_events.fake_pubsub).
+
+Run from services/core-api:
+
+    PYTHONPATH=../.. python -m benchmarks.bench_event_pipeline
+    PYTHONPATH=../.. python -m benchmarks.bench_event_pipeline --events 50000 --handler-ms 1 --max-messages 500
+
+Subscriptions use the production policy (5 delivery attempts, 10-600 s
+backoff, ``<topic>-dlq`` dead-letter topic), with every duration scaled by
+``--time-scale`` so retries finish in milliseconds. Scenarios:
+
+- "healthy": every handler call succeeds
+- "transient": ``--fail-rate`` of events fail their first two attempts
+- "poison": ``--fail-rate`` of events always fail and are dead-lettered
+- "slow": ``--fail-rate`` of events take longer than the ack deadline once.
+  The stand-in does not extend leases, so messages queued behind them in
+  the consumer expire too; the row shows what head-of-line blocking costs.
+
+"deliveries/event" is the redelivery overhead: 1.00 means no message was
+delivered twice. Latency runs from publish to the ack of the delivery that
+succeeded, in wall-clock milliseconds.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import zlib
+
+from salon_events import Deduplicator, MemoryDedupStore
+from salon_events.fake_pubsub import FakePubSub, FakePublisherClient, FakeSubscriberClient
+from app.events.consumer import EventConsumer
+from app.events.producer import EventProducer
+
+SUBSCRIPTION = "core-api-v1-events"
+
+
+def selected(booking_id: str, rate: float) -> bool:
+    """Deterministically pick ``rate`` of the events"""
+    return zlib.crc32(booking_id.encode()) % 10000 < rate * 10000
+
+
+def make_handler(scenario, args, attempts):
+    handler_seconds = args.handler_ms / 1000
+    slow_seconds = args.ack_deadline * args.time_scale * 1.5
+
+    def handler(event):
+        booking_id = event["payload"]["booking_id"]
+        if handler_seconds:
+            time.sleep(handler_seconds)
+        if scenario == "healthy" or not selected(booking_id, args.fail_rate):
+            return
+        # Only the handler thread for this event touches its count
+        attempt = attempts[booking_id] = attempts.get(booking_id, 0) + 1
+        if scenario == "transient" and attempt <= 2:
+            raise RuntimeError("transient failure")
+        if scenario == "poison":
+            raise RuntimeError("poison message")
+        if scenario == "slow" and attempt == 1:
+            time.sleep(slow_seconds)
+
+    return handler
+
+
+async def publish(producer, n):
+    await producer.publish_many("core-api", "1", (
+        {"event_type": "booking_created", "tenant_id": "default", "payload": {"booking_id": str(i)}}
+        for i in range(n)
+    ))
+
+
+def run(scenario, args):
+    pubsub = FakePubSub(time_scale=args.time_scale, ack_deadline_seconds=args.ack_deadline)
+    producer = EventProducer("bench", publisher=FakePublisherClient(pubsub))
+    consumer = EventConsumer("bench", subscriber=FakeSubscriberClient(pubsub),
+                             max_messages=args.max_messages, max_workers=args.workers,
+                             dedup=Deduplicator(MemoryDedupStore()))
+    consumer.register_handler("booking_created", "1", make_handler(scenario, args, {}))
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    start = time.perf_counter()
+    asyncio.run(publish(producer, args.events))
+    while True:
+        stats = pubsub.stats(SUBSCRIPTION)
+        if stats["acked"] + stats["dead_lettered"] >= args.events:
+            break
+        time.sleep(0.002)
+    elapsed = time.perf_counter() - start
+    future.cancel()
+    consumer.close()
+    return stats, elapsed
+
+
+def main(args):
+    logging.disable(logging.ERROR)
+    print(f"{args.events} events, {args.handler_ms} ms handlers, fail rate {args.fail_rate:.0%}, "
+          f"time scale {args.time_scale}")
+    header = (f"{'scenario':<10} {'events/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'deliveries/event':>17} {'expired':>8} {'dead-lettered':>14}")
+    print(header)
+    print("-" * len(header))
+    for scenario in args.scenarios:
+        stats, elapsed = run(scenario, args)
+        print(f"{scenario:<10} {args.events / elapsed:>9.0f} {stats.get('p50_ms', 0):>8.2f} "
+              f"{stats.get('p99_ms', 0):>8.2f} {stats['delivered'] / args.events:>17.2f} "
+              f"{stats['expired']:>8} {stats['dead_lettered']:>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--scenarios", type=lambda value: value.split(","),
+                        default=["healthy", "transient", "poison", "slow"])
+    parser.add_argument("--fail-rate", type=float, default=0.05)
+    parser.add_argument("--handler-ms", type=float, default=0.0)
+    parser.add_argument("--max-messages", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--ack-deadline", type=float, default=60.0, help="seconds, before scaling")
+    parser.add_argument("--time-scale", type=float, default=0.001)
+    main(parser.parse_args())
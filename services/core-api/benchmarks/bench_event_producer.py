@@ -0,0 +1,149 @@
+"""
+Benchmark: events/sec through EventProducer, the previous blocking publish
+vs. awaited single publishes vs. publish_many.
+
+Run from services/core-api:
+
+    PYTHONPATH=../.. python -m benchmarks.bench_event_producer
+    PYTHONPATH=../.. python -m benchmarks.bench_event_producer --events 20000 --rtt-ms 5 --max-messages 500
+
+The publisher is an in-process fake that behaves like the Pub/Sub client's
+batcher: messages for a topic are collected until ``--max-messages`` are
+queued or ``--max-latency-ms`` has passed, and each batch then takes one
+``--rtt-ms`` round trip on a client thread before its futures resolve.
+
+- "before": the previous ``publish_event``, which called ``future.result()``
+  for every event and so waited a full batch latency plus round trip each time
+- "publish_event x1": awaiting each publish in turn from one task
+- "publish_event xN": ``--tasks`` tasks awaiting publishes concurrently, as
+  concurrent requests would
+- "publish_many": one call with all events
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.events.producer import EventProducer
+
+
+class FakePublisher:
+    """Batching publisher with the PublisherClient methods EventProducer uses"""
+
+    def __init__(self, max_messages: int, max_latency: float, rtt: float):
+        self.max_messages = max_messages
+        self.max_latency = max_latency
+        self.rtt = rtt
+        self.rpcs = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._batches = {}
+        # Like the client's commit threads: batches are sent concurrently
+        self._senders = ThreadPoolExecutor(max_workers=32)
+
+    def topic_path(self, project_id, topic):
+        return f"projects/{project_id}/topics/{topic}"
+
+    def publish(self, topic, data, **attributes):
+        future = Future()
+        with self._lock:
+            batch = self._batches.get(topic)
+            if batch is None:
+                batch = self._batches[topic] = []
+                timer = threading.Timer(self.max_latency, self._flush, (topic, batch))
+                timer.daemon = True
+                timer.start()
+            batch.append(future)
+            if len(batch) >= self.max_messages:
+                self._flush_locked(topic, batch)
+        return future
+
+    def _flush(self, topic, batch):
+        with self._lock:
+            self._flush_locked(topic, batch)
+
+    def _flush_locked(self, topic, batch):
+        if self._batches.get(topic) is batch:
+            del self._batches[topic]
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch):
+        time.sleep(self.rtt)
+        self.rpcs += 1
+        for future in batch:
+            future.set_result(str(next(self._ids)))
+
+
+def make_producer(args):
+    return EventProducer(
+        "bench-project",
+        publisher=FakePublisher(args.max_messages, args.max_latency_ms / 1000, args.rtt_ms / 1000)
+    )
+
+
+def event(i):
+    return {"event_type": "booking_created", "tenant_id": "default", "payload": {"booking_id": str(i)}}
+
+
+async def before(producer, n):
+    # The previous implementation, called from an async route
+    topic_path = producer.publisher.topic_path(producer.project_id, "core-api.v1.events")
+    for i in range(n):
+        data = json.dumps(event(i)).encode("utf-8")
+        producer.publisher.publish(topic_path, data).result()
+
+
+async def single(producer, n):
+    for i in range(n):
+        await producer.publish_event("core-api", "1", **event(i))
+
+
+async def concurrent(producer, n, tasks):
+    counter = iter(range(n))
+
+    async def worker():
+        for i in counter:
+            await producer.publish_event("core-api", "1", **event(i))
+
+    await asyncio.gather(*(worker() for _ in range(tasks)))
+
+
+async def many(producer, n):
+    message_ids = await producer.publish_many("core-api", "1", (event(i) for i in range(n)))
+    assert len(message_ids) == n
+
+
+async def main(args):
+    runs = [
+        ("before", args.legacy_events, lambda p, n: before(p, n)),
+        ("publish_event x1", args.legacy_events, lambda p, n: single(p, n)),
+        (f"publish_event x{args.tasks}", args.events, lambda p, n: concurrent(p, n, args.tasks)),
+        ("publish_many", args.events, lambda p, n: many(p, n)),
+    ]
+    print(f"fake publisher: {args.rtt_ms} ms round trip, batches of {args.max_messages} "
+          f"or {args.max_latency_ms} ms")
+    header = f"{'path':<22} {'events':>8} {'rpcs':>7} {'events/s':>10}"
+    print(header)
+    print("-" * len(header))
+    for label, n, run in runs:
+        producer = make_producer(args)
+        start = time.perf_counter()
+        await run(producer, n)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<22} {n:>8} {producer.publisher.rpcs:>7} {n / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--legacy-events", type=int, default=200,
+                        help="events for the one-at-a-time paths, which are much slower")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--rtt-ms", type=float, default=5.0)
+    parser.add_argument("--max-messages", type=int, default=100)
+    parser.add_argument("--max-latency-ms", type=float, default=10.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""
+Benchmark of the idempotency cache-hit path: parse + re-serialize vs. raw replay.
+
+Run from services/core-api:
+
+    python -m benchmarks.bench_idempotency_replay
+
+"before" reproduces the previous behaviour: the stored body is the parsed
+JSON, and every hit builds a new JSONResponse that serializes it again.
+"after" replays the stored body bytes and header pairs unchanged. For each
+payload size it reports the mean hit latency (response build + ASGI send)
+and the bytes allocated per hit, measured with tracemalloc.
+"""
+
+import asyncio
+import json
+import time
+import tracemalloc
+import uuid
+
+from fastapi.responses import JSONResponse
+
+from app.idempotency.memory_store import InMemoryIdempotencyStore
+from app.idempotency.utils import ReplayedResponse, replayable_headers
+
+ITERATIONS = 2000
+SCOPE = {"type": "http", "method": "POST", "path": "/bookings", "headers": []}
+
+
+def booking_payload(services: int) -> dict:
+    """A booking with ``services`` line items, similar to a group appointment"""
+    return {
+        "booking_id": str(uuid.uuid4()),
+        "tenant_id": "salon-chain-42",
+        "customer": {"id": str(uuid.uuid4()), "name": "Jane Doe", "phone": "+15555550100",
+                     "email": "jane@example.com", "loyalty_points": 1280},
+        "status": "confirmed",
+        "items": [
+            {
+                "service_id": f"service_{i}",
+                "name": "Balayage with toner and blow-dry",
+                "staff_id": f"staff_{i % 12}",
+                "start_time": "2025-08-07T10:00:00Z",
+                "end_time": "2025-08-07T11:30:00Z",
+                "price": 149.5,
+                "notes": "Prefers cool tones; patch test done on 2025-07-30.",
+            }
+            for i in range(services)
+        ],
+    }
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def hit_before(store: dict, key: str):
+    record = store[key]
+    response = JSONResponse(content=record["response_body"], status_code=record["response_code"])
+    await response(SCOPE, _receive, _send)
+
+
+async def hit_after(store: InMemoryIdempotencyStore, key: str):
+    record = await store.get(key)
+    await ReplayedResponse(record)(SCOPE, _receive, _send)
+
+
+async def measure(hit, store, key):
+    # Warm up
+    for _ in range(50):
+        await hit(store, key)
+
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await hit(store, key)
+    latency_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    await hit(store, key)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency_us, peak - before
+
+
+async def main():
+    header = f"{'items':>6} {'body KB':>8} {'before us':>10} {'after us':>9} {'before alloc':>13} {'after alloc':>12}"
+    print(header)
+    print("-" * len(header))
+    for services in (1, 50, 500, 2000):
+        response = JSONResponse(content=booking_payload(services), status_code=201)
+        key = str(uuid.uuid4())
+
+        legacy_store = {key: {"response_code": 201, "response_body": json.loads(response.body.decode())}}
+
+        store = InMemoryIdempotencyStore(cleanup_interval_seconds=0)
+        await store.set(key, 201, response.body, 3600, replayable_headers(response.raw_headers))
+
+        before_us, before_bytes = await measure(hit_before, legacy_store, key)
+        after_us, after_bytes = await measure(hit_after, store, key)
+        print(f"{services:>6} {len(response.body) / 1024:>8.1f} {before_us:>10.1f} {after_us:>9.1f} "
+              f"{before_bytes:>13,} {after_bytes:>12,}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+"""
+Micro-benchmark: lock-striped idempotency stores vs. the original global-lock store.
+
+Run from services/core-api:
+
+    python -m benchmarks.bench_idempotency_store            # 1k, 100k, 1M keys
+    python -m benchmarks.bench_idempotency_store 1000 50000 # custom sizes
+
+For every size it reports set/get throughput (sequential and with concurrent
+coroutines) and the time of one expiry pass with 1% of the keys expired.
+"""
+
+import asyncio
+import sys
+import time
+from typing import Dict, Optional
+
+from app.idempotency.models import IdempotencyKey
+from app.idempotency.lru_store import LRUIdempotencyStore
+from app.idempotency.memory_store import InMemoryIdempotencyStore
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+CONCURRENCY = 256
+EXPIRED_FRACTION = 0.01
+
+
+class LegacyIdempotencyStore:
+    """The previous store's locking and cleanup: one asyncio.Lock and a full scan"""
+
+    def __init__(self, default_ttl_seconds: int = 86400):
+        self._store: Dict[str, IdempotencyKey] = {}
+        self._lock = asyncio.Lock()
+        self.default_ttl_seconds = default_ttl_seconds
+
+    async def purge_expired(self) -> int:
+        now = time.time()
+        expired_keys = [
+            key for key, idempotency_key in self._store.items()
+            if idempotency_key.expires_at < now
+        ]
+        for key in expired_keys:
+            del self._store[key]
+        return len(expired_keys)
+
+    async def get(self, key: str) -> Optional[IdempotencyKey]:
+        async with self._lock:
+            if key in self._store:
+                idempotency_key = self._store[key]
+                if idempotency_key.expires_at < time.time():
+                    del self._store[key]
+                    return None
+                return idempotency_key
+            return None
+
+    async def set(self, key: str, response_code: int, response_body: bytes, ttl_seconds: Optional[int] = None) -> bool:
+        async with self._lock:
+            ttl = ttl_seconds if ttl_seconds is not None else self.default_ttl_seconds
+            now = time.time()
+            self._store[key] = IdempotencyKey(
+                key=key,
+                response_code=response_code,
+                response_body=response_body,
+                response_headers=(),
+                created_at=now,
+                expires_at=now + ttl
+            )
+            return True
+
+
+async def _concurrently(op, keys):
+    """Run ``op(key)`` for every key with CONCURRENCY coroutines in flight"""
+    it = iter(keys)
+
+    async def worker():
+        for key in it:
+            await op(key)
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+
+
+async def bench_store(name: str, store, size: int) -> Dict[str, float]:
+    keys = [f"key-{i}" for i in range(size)]
+    body = b'{"booking_id":"b-1","status":"confirmed"}'
+    expired_every = int(1 / EXPIRED_FRACTION)
+
+    start = time.perf_counter()
+    for i, key in enumerate(keys):
+        # 1% of the keys are written already expired
+        await store.set(key, 201, body, -1 if i % expired_every == 0 else 3600)
+    set_seconds = time.perf_counter() - start
+
+    live_keys = [key for i, key in enumerate(keys) if i % expired_every]
+
+    start = time.perf_counter()
+    for key in live_keys:
+        await store.get(key)
+    get_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await _concurrently(store.get, live_keys)
+    concurrent_get_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    removed = await store.purge_expired()
+    purge_ms = (time.perf_counter() - start) * 1000
+
+    # A second pass is the steady-state cost when nothing new has expired
+    start = time.perf_counter()
+    await store.purge_expired()
+    idle_purge_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "store": name,
+        "size": size,
+        "set_ops": size / set_seconds,
+        "get_ops": len(live_keys) / get_seconds,
+        "concurrent_get_ops": len(live_keys) / concurrent_get_seconds,
+        "purge_ms": purge_ms,
+        "idle_purge_ms": idle_purge_ms,
+        "removed": removed,
+    }
+
+
+async def main(sizes):
+    header = (f"{'store':<10} {'keys':>9} {'set/s':>11} {'get/s':>11} "
+              f"{'conc get/s':>11} {'purge ms':>10} {'idle ms':>9} {'removed':>8}")
+    print(header)
+    print("-" * len(header))
+    for size in sizes:
+        for name, factory in (
+            ("legacy", LegacyIdempotencyStore),
+            ("striped", lambda: InMemoryIdempotencyStore(cleanup_interval_seconds=0)),
+            # Large enough budget that nothing is evicted, to show the LRU bookkeeping cost
+            ("lru", lambda: LRUIdempotencyStore(max_bytes=1 << 40, cleanup_interval_seconds=0)),
+        ):
+            r = await bench_store(name, factory(), size)
+            print(f"{r['store']:<10} {r['size']:>9} {r['set_ops']:>11,.0f} {r['get_ops']:>11,.0f} "
+                  f"{r['concurrent_get_ops']:>11,.0f} {r['purge_ms']:>10.2f} "
+                  f"{r['idle_purge_ms']:>9.2f} {r['removed']:>8}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    asyncio.run(main(sizes))
@@ -0,0 +1,110 @@
+"""
+Benchmark: EventConsumer throughput with ordering keys, by number of
+distinct keys.
+
+Run from services/core-api:
+
+    PYTHONPATH=../.. python -m benchmarks.bench_ordered_consumer
+    PYTHONPATH=../.. python -m benchmarks.bench_ordered_consumer --events 20000 --handler-ms 1 --workers 50
+
+Events are published with ``--keys`` distinct ordering keys, round robin,
+through the in-process Pub/Sub stand-in (salon_events.fake_pubsub) with one
+callback thread, so they reach the consumer in publish order. The consumer
+handles each key's events one at a time and different keys in parallel, so
+throughput grows with the number of keys until the ``--workers`` handler
+threads or the ``--max-messages`` flow-control window are the limit.
+
+The "unordered" row publishes the fewest-keys case without ordering keys:
+the parallel ceiling, paid for with "out of order", the events applied
+before an earlier event of their booking. Events queued behind their key still hold a lease, and
+the stand-in does not extend leases, so ``--ack-deadline`` must outlast the
+longest queue.
+"""
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+from salon_events import Deduplicator, MemoryDedupStore
+from salon_events.fake_pubsub import FakePubSub, FakePublisherClient, FakeSubscriberClient
+from app.events.consumer import EventConsumer
+from app.events.producer import EventProducer
+
+SUBSCRIPTION = "core-api-v1-events"
+
+
+async def publish(producer, n, keys, ordered):
+    await producer.publish_many("core-api", "1", (
+        {
+            "event_type": "booking_created",
+            "tenant_id": "default",
+            "payload": {"booking_id": f"b{i % keys}", "seq": i // keys},
+            "ordering_key": f"default/b{i % keys}" if ordered else None,
+        }
+        for i in range(n)
+    ))
+
+
+def run(keys, ordered, args):
+    pubsub = FakePubSub(ack_deadline_seconds=args.ack_deadline)
+    producer = EventProducer("bench", publisher=FakePublisherClient(pubsub))
+    consumer = EventConsumer("bench", subscriber=FakeSubscriberClient(pubsub, callback_threads=1),
+                             max_messages=args.max_messages, max_workers=args.workers,
+                             dedup=Deduplicator(MemoryDedupStore()))
+    handler_seconds = args.handler_ms / 1000
+    last_seq = {}
+    out_of_order = [0]
+    lock = threading.Lock()
+
+    def handler(event):
+        time.sleep(handler_seconds)
+        booking_id, seq = event["payload"]["booking_id"], event["payload"]["seq"]
+        with lock:
+            if seq < last_seq.get(booking_id, -1):
+                out_of_order[0] += 1
+            else:
+                last_seq[booking_id] = seq
+
+    consumer.register_handler("booking_created", "1", handler)
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    start = time.perf_counter()
+    asyncio.run(publish(producer, args.events, keys, ordered))
+    while pubsub.stats(SUBSCRIPTION)["acked"] < args.events:
+        time.sleep(0.002)
+    elapsed = time.perf_counter() - start
+    future.cancel()
+    stats = consumer.stats()["ordering"]
+    consumer.close()
+    return elapsed, out_of_order[0], stats["max_waiting"]
+
+
+def main(args):
+    logging.disable(logging.ERROR)
+    print(f"{args.events} events, {args.handler_ms} ms handlers, {args.workers} workers, "
+          f"{args.max_messages} messages outstanding")
+    header = f"{'keys':<10} {'events/s':>9} {'vs 1 key':>9} {'out of order':>13} {'max queued/key':>15}"
+    print(header)
+    print("-" * len(header))
+    baseline = None
+    rows = [(keys, True) for keys in args.keys] + [(min(args.keys), False)]
+    for keys, ordered in rows:
+        elapsed, out_of_order, max_waiting = run(keys, ordered, args)
+        rate = args.events / elapsed
+        baseline = baseline or rate
+        label = str(keys) if ordered else "unordered"
+        print(f"{label:<10} {rate:>9.0f} {rate / baseline:>8.1f}x {out_of_order:>13} {max_waiting:>15}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--keys", type=lambda value: [int(keys) for keys in value.split(",")],
+                        default=[1, 2, 4, 8, 16, 32, 64, 256, 1000])
+    parser.add_argument("--handler-ms", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--max-messages", type=int, default=200)
+    parser.add_argument("--ack-deadline", type=float, default=60.0)
+    main(parser.parse_args())
@@ -0,0 +1,115 @@
+"""
+Simulation: load added by retries during failures, and p99 latency with hedged requests.
+
+Run from services/core-api:
+
+    python -m benchmarks.bench_retry
+    python -m benchmarks.bench_retry --calls 5000 --slow-fraction 0.02 --hedge-ms 15
+
+The first table makes ``--calls`` calls to a dependency failing a given share
+of attempts, with no retries, with naive retries (``--attempts`` per call)
+and with the same retries drawn from a 10% budget. It reports the attempts
+made per call, the dependency's load multiplier, and the share of calls
+that succeeded. The budget buys most of the naive retries' successes while
+failures are rare, and caps the load at about 1.1x during an outage.
+
+The second table makes ``--calls`` async calls, ``--concurrency`` at a time,
+to a dependency answering in ``--fast-ms`` except for ``--slow-fraction`` of
+attempts taking ``--slow-ms``, without and with a hedged attempt after
+``--hedge-ms``.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from app.circuit_breaker.retry import RetryBudget, RetryPolicy
+
+
+def run_failures(args, failure_rate, policy):
+    attempts = [0]
+
+    def call():
+        attempts[0] += 1
+        if random.random() < failure_rate:
+            raise ConnectionError("down")
+
+    call = policy(call) if policy else call
+    succeeded = 0
+    for _ in range(args.calls):
+        try:
+            call()
+            succeeded += 1
+        except ConnectionError:
+            pass
+    return attempts[0], succeeded
+
+
+async def run_hedging(args, hedge_after):
+    attempts = [0]
+    latencies = []
+
+    async def call():
+        attempts[0] += 1
+        slow = random.random() < args.slow_fraction
+        await asyncio.sleep((args.slow_ms if slow else args.fast_ms) / 1000)
+
+    budget = RetryBudget("bench-hedge", ratio=0.1)
+    call = RetryPolicy("bench-hedge", max_attempts=1, hedge_after=hedge_after, budget=budget)(call)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def timed():
+        async with slots:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed() for _ in range(args.calls)))
+    latencies.sort()
+    return attempts[0], latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    print(f"{args.calls} calls, up to {args.attempts} attempts each")
+    header = f"{'failing':>8} {'retries':<9} {'attempts/call':>14} {'succeeded':>10}"
+    print(header)
+    print("-" * len(header))
+    for failure_rate in args.failure_rates:
+        for label in ("none", "naive", "budget"):
+            policy = None
+            if label == "naive":
+                policy = RetryPolicy("bench-naive", max_attempts=args.attempts, base_delay=0, max_delay=0,
+                                     budget=RetryBudget("bench-naive", ratio=args.attempts, max_tokens=float("inf")))
+            elif label == "budget":
+                policy = RetryPolicy("bench-budget", max_attempts=args.attempts, base_delay=0, max_delay=0,
+                                     budget=RetryBudget("bench-budget", ratio=0.1, min_per_second=0))
+            attempts, succeeded = run_failures(args, failure_rate, policy)
+            print(f"{failure_rate:>8.0%} {label:<9} {attempts / args.calls:>14.2f} "
+                  f"{succeeded / args.calls:>10.1%}")
+
+    print()
+    print(f"{args.calls} calls, {args.concurrency} at a time, {args.fast_ms:.0f} ms, "
+          f"{args.slow_fraction:.0%} take {args.slow_ms:.0f} ms")
+    header = f"{'hedging':<12} {'attempts/call':>14} {'p50 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for label, hedge_after in (("none", None), (f"after {args.hedge_ms:.0f} ms", args.hedge_ms / 1000)):
+        attempts, p50, p99 = asyncio.run(run_hedging(args, hedge_after))
+        print(f"{label:<12} {attempts / args.calls:>14.2f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=3)
+    parser.add_argument("--failure-rates", type=lambda value: [float(rate) for rate in value.split(",")],
+                        default=[0.01, 0.1, 0.5, 1.0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--fast-ms", type=float, default=10)
+    parser.add_argument("--slow-ms", type=float, default=200)
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--hedge-ms", type=float, default=20)
+    main(parser.parse_args())
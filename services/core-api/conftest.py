@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The shared salon_events package lives at the repository root; deployments
+# copy it next to the app, locally it is imported from there
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.circuit_breaker.bulkhead import Bulkhead, BulkheadFull, GradientLimit
+from app.circuit_breaker.circuit_breaker import CLOSED, with_circuit_breaker
+
+# Tests of the adaptive concurrency limit and the bulkhead queueing calls to it.
+
+
+def _fixed(limit):
+    return GradientLimit(initial=limit, min_limit=limit, max_limit=limit)
+
+
+def test_limit_grows_while_latency_holds_and_shrinks_when_it_rises():
+    limit = GradientLimit(initial=10, max_limit=100, tolerance=1.5)
+    for _ in range(50):
+        limit.update(0.010, in_flight=int(limit.limit))
+    grown = limit.limit
+    assert grown > 30
+
+    for _ in range(50):
+        limit.update(0.040, in_flight=int(limit.limit))
+    assert limit.limit < grown / 2
+
+    # Few calls in flight say nothing about the limit
+    before = limit.limit
+    limit.update(0.001, in_flight=1)
+    assert limit.limit == before
+    limit.update(0.010, in_flight=1, failed=True)
+    assert limit.limit == pytest.approx(before * 0.9)
+
+
+def test_calls_beyond_the_limit_queue_in_order_then_are_rejected():
+    bulkhead = Bulkhead("pricing", _fixed(2), max_queue=2, max_wait=5)
+    started = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        @bulkhead
+        async def call(i):
+            started.append(i)
+            await release.wait()
+            return i
+
+        tasks = [asyncio.ensure_future(call(i)) for i in range(4)]
+        await asyncio.sleep(0.01)
+        assert started == [0, 1] and bulkhead.stats()["queued_now"] == 2
+        with pytest.raises(BulkheadFull, match="queue full"):
+            await call(4)
+        release.set()
+        assert await asyncio.gather(*tasks) == [0, 1, 2, 3]
+        assert started == [0, 1, 2, 3]
+
+    asyncio.run(scenario())
+    assert bulkhead.stats() == dict(bulkhead.stats(), in_flight=0, accepted=4, queued=2, rejected_full=1,
+                                    max_in_flight=2)
+
+
+def test_waits_time_out_and_cancelled_waiters_leave_no_slot_behind():
+    bulkhead = Bulkhead("pricing", _fixed(1), max_queue=5, max_wait=0.05)
+
+    async def scenario():
+        await bulkhead.acquire()
+        start = time.monotonic()
+        with pytest.raises(BulkheadFull, match="no slot"):
+            await bulkhead.acquire()
+        assert 0.04 < time.monotonic() - start < 1
+
+        waiting = asyncio.ensure_future(bulkhead.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        bulkhead.release()
+        await bulkhead.acquire()  # the cancelled waiter did not take the slot
+        bulkhead.release()
+
+    asyncio.run(scenario())
+    assert bulkhead.in_flight == 0 and bulkhead.stats()["rejected_timeout"] == 1
+
+
+def test_calls_too_fast_for_the_clock_keep_the_limit_and_free_their_slot():
+    bulkhead = Bulkhead("pricing", clock=lambda: 1.0)
+    for _ in range(100):
+        assert bulkhead(lambda: 1)() == 1
+    assert bulkhead.in_flight == 0 and bulkhead.limit.limit > 0
+
+    class BrokenLimit(GradientLimit):
+        def update(self, latency, in_flight, failed=False):
+            raise RuntimeError("bad limit")
+
+    bulkhead = Bulkhead("pricing", BrokenLimit())
+    with pytest.raises(RuntimeError):
+        bulkhead(lambda: 1)()
+    assert bulkhead.in_flight == 0
+
+
+def test_sync_calls_from_threads_stay_within_the_limit():
+    bulkhead = Bulkhead("catalog", _fixed(3), max_queue=100, max_wait=5)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    @bulkhead
+    def call():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+
+    threads = [threading.Thread(target=call) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 3 and bulkhead.in_flight == 0 and bulkhead.accepted == 20
+
+
+def test_rejections_are_not_counted_as_dependency_failures():
+    bulkhead = Bulkhead("test-bulkhead-inventory", _fixed(1), max_queue=0)
+
+    @with_circuit_breaker("test-bulkhead-inventory", bulkhead=bulkhead, minimum_calls=2)
+    async def reserve(wait):
+        await wait.wait()
+        return "reserved"
+
+    async def scenario():
+        wait = asyncio.Event()
+        first = asyncio.ensure_future(reserve(wait))
+        await asyncio.sleep(0)
+        for _ in range(5):
+            with pytest.raises(BulkheadFull):
+                await reserve(wait)
+        wait.set()
+        return await first
+
+    assert asyncio.run(scenario()) == "reserved"
+    breaker = reserve.circuit_breaker
+    assert reserve.bulkhead is bulkhead
+    assert breaker.state == CLOSED and breaker.stats()["failed_calls"] == 0
+    assert bulkhead.stats()["rejected_full"] == 5
@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from app.circuit_breaker.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakerOpen,
+    CircuitBreakerRegistry,
+    SlidingWindow,
+    with_circuit_breaker,
+)
+
+# Tests of the sliding-window circuit breaker, on a fake clock.
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _breaker(clock, **config):
+    return CircuitBreaker("test", **dict(dict(window_seconds=10, window_buckets=10, minimum_calls=4, timeout=30,
+                                              half_open_max_calls=2, slow_call_seconds=1.0), **config), clock=clock)
+
+
+def _fail(breaker, n=1):
+    for _ in range(n):
+        breaker.check()
+        breaker.record(0.01, failed=True)
+
+
+def _succeed(breaker, n=1, duration=0.01):
+    for _ in range(n):
+        breaker.check()
+        breaker.record(duration, failed=False)
+
+
+def test_window_expires_whole_buckets():
+    window = SlidingWindow(window_seconds=10, buckets=5)
+    for second in range(10):
+        window.record(100.0 + second, failed=second % 2 == 0, slow=False)
+    assert window.rates(109.5) == (10, 0.5, 0.0)
+    assert window.rates(112.0) == (6, 0.5, 0.0)
+    assert window.rates(500.0) == (0, 0.0, 0.0)
+    window.record(500.0, failed=True, slow=True)
+    assert window.rates(500.0) == (1, 1.0, 1.0)
+
+
+def test_opens_on_failure_rate_once_enough_calls_were_seen():
+    clock = _Clock()
+    breaker = _breaker(clock)
+    _fail(breaker, 3)
+    assert breaker.state == CLOSED  # below minimum_calls
+    _succeed(breaker, 5)
+    _fail(breaker)
+    assert breaker.state == CLOSED  # 4 of 9 failed
+    _fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitBreakerOpen) as raised:
+        breaker.check()
+    assert raised.value.retry_after == 30 and breaker.stats()["rejected_calls"] == 1
+
+    # Old failures leave the window
+    clock.now += 31
+    breaker.reset()
+    _fail(breaker, 3)
+    clock.now += 11
+    _fail(breaker, 1)
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_slow_call_rate():
+    clock = _Clock()
+    breaker = _breaker(clock, slow_call_rate_threshold=0.5)
+    _succeed(breaker, 2)
+    _succeed(breaker, 2, duration=1.5)
+    assert breaker.state == OPEN
+    assert breaker.stats()["slow_calls"] == 2
+
+
+def test_half_open_lets_limited_trials_through_then_closes_or_reopens():
+    clock = _Clock()
+    breaker = _breaker(clock)
+    transitions = []
+    breaker.add_listener(lambda b, old, new: transitions.append((old, new)))
+    _fail(breaker, 4)
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.acquire() and breaker.acquire()
+    assert not breaker.acquire()  # both trials in flight
+    breaker.record(0.01, failed=False)
+    breaker.record(0.01, failed=True)
+    assert breaker.state == OPEN  # 1 of 2 trials failed
+
+    clock.now += 30
+    _succeed(breaker, 2)
+    assert breaker.state == CLOSED
+    assert transitions == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN), (OPEN, HALF_OPEN),
+                           (HALF_OPEN, CLOSED)]
+    assert breaker.stats()["transitions"] == {"closed->open": 1, "open->half_open": 2, "half_open->open": 1,
+                                              "half_open->closed": 1}
+
+
+def test_decorated_calls_count_expected_exceptions_and_release_cancelled_trials():
+    clock = _Clock()
+    breaker = _breaker(clock, expected_exception=ConnectionError, half_open_max_calls=1)
+
+    @breaker
+    async def call(error=None, wait=None):
+        if wait is not None:
+            await wait.wait()
+        if error is not None:
+            raise error
+        return "ok"
+
+    async def scenario():
+        for _ in range(4):
+            with pytest.raises(ValueError):
+                await call(ValueError("bad request"))  # not a dependency failure
+        assert breaker.state == CLOSED and breaker.stats()["ignored_calls"] == 4
+        for _ in range(4):
+            with pytest.raises(ConnectionError):
+                await call(ConnectionError())
+        with pytest.raises(CircuitBreakerOpen):
+            await call()
+
+        clock.now += 30
+        trial = asyncio.ensure_future(call(wait=asyncio.Event()))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitBreakerOpen):
+            await call()
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        assert await call() == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_registry_keeps_dependencies_apart():
+    registry = CircuitBreakerRegistry(minimum_calls=2)
+    pricing, catalog = registry.get("pricing"), registry.get("catalog")
+    assert registry.get("pricing") is pricing and pricing.minimum_calls == 2
+    _fail(pricing, 2)
+    assert pricing.state == OPEN and catalog.state == CLOSED
+    assert set(registry.stats()) == {"pricing", "catalog"}
+
+
+def test_with_circuit_breaker_shares_a_breaker_per_dependency_name():
+    @with_circuit_breaker("test-inventory")
+    def reserve():
+        return "reserved"
+
+    @with_circuit_breaker(name="test-inventory")
+    async def release():
+        return "released"
+
+    @with_circuit_breaker
+    def other():
+        return "other"
+
+    assert reserve.circuit_breaker is release.circuit_breaker
+    assert other.circuit_breaker is not reserve.circuit_breaker
+    assert reserve() == "reserved" and asyncio.run(release()) == "released"
+    assert reserve.circuit_breaker.stats()["successful_calls"] == 2
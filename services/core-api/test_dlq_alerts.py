@@ -0,0 +1,89 @@
+from salon_events.alerts import OVERFLOW_SIGNATURE, AlertAggregator, SMTPDigestSender, error_signature
+from salon_events.fake_smtp import FakeSMTPServer
+
+# Tests of the DLQ alert digests, sent to the local SMTP stand-in.
+
+
+def _aggregator(server, port=None, **kwargs):
+    sender = SMTPDigestSender(server.host, port or server.port, user="alerts@example.com", password="secret",
+                              recipients=["admin@example.com"], starttls=False)
+    return AlertAggregator(sender, window_seconds=60, **kwargs)
+
+
+def test_error_signature_ignores_ids_and_numbers():
+    assert error_signature("Booking 'b-17' not found for tenant 42") == \
+        error_signature("Booking 'b-903' not found for tenant 7") == "Booking '*' not found for tenant #"
+    assert error_signature("lock 3f2b8c1e-0000-4000-8000-00000000abcd timed out at 0x7f3a") == \
+        "lock # timed out at #"
+    assert error_signature(None) == error_signature("") == "unknown error"
+
+
+def test_a_burst_becomes_one_digest_per_group_over_one_connection():
+    with FakeSMTPServer() as server:
+        aggregator = _aggregator(server, max_samples=2)
+        for i in range(1000):
+            aggregator.record("booking_created", "1", f"Booking 'b{i}' not found", message_id=f"m{i}",
+                              tenant_id=f"tenant-{i % 3}", subscription="core-api-v1-events",
+                              delivery_attempt=5, sample={"booking_id": f"b{i}"})
+        for i in range(10):
+            aggregator.record("booking_cancelled", "1", "Timeout after 30s", message_id=f"c{i}")
+        # Push subscriptions redeliver; a message is counted once
+        assert not aggregator.record("booking_created", "1", "Booking 'b0' not found", message_id="m0")
+
+        assert aggregator.flush() == 2
+        assert aggregator.flush() == 0
+        aggregator.close()
+
+        assert server.connections == 1
+        # Long subjects are folded, and the parser keeps the space they were folded at
+        subjects = sorted(message["Subject"].strip() for message in server.messages)
+        assert subjects == [
+            "ALERT: 10 dead-lettered messages - booking_cancelled v1: Timeout after #s",
+            "ALERT: 1000 dead-lettered messages - booking_created v1: Booking '*' not found",
+        ]
+        body = next(m for m in server.messages if "booking_created" in m["Subject"]).get_content()
+        assert "tenant-0 (334), tenant-1 (333), tenant-2 (333)" in body
+        assert "Delivery Attempts: up to 5" in body
+        assert body.count('"booking_id"') == 2
+        assert aggregator.stats()["duplicates"] == 1
+
+
+def test_the_connection_is_reused_across_windows_and_reopened_when_dropped():
+    with FakeSMTPServer() as server:
+        aggregator = _aggregator(server)
+        for window in range(3):
+            aggregator.record("booking_created", "1", "boom")
+            assert aggregator.flush() == 1
+        assert server.connections == 1
+
+        server.drop_connections()
+        aggregator.record("booking_created", "1", "boom")
+        assert aggregator.flush() == 1
+        aggregator.close()
+        assert server.connections == 2 and len(server.messages) == 4
+
+
+def test_unsent_digests_are_retried_with_the_next_window():
+    with FakeSMTPServer() as server:
+        port = server.port
+    aggregator = _aggregator(server, port)
+    aggregator.record("booking_created", "1", "boom")
+    assert aggregator.flush() == 0  # nothing is listening
+    assert aggregator.stats()["pending_digests"] == 1
+
+    with FakeSMTPServer(port=port) as server:
+        aggregator.record("booking_updated", "1", "boom")
+        assert aggregator.flush() == 2
+        aggregator.close()
+    assert len(server.messages) == 2
+
+
+def test_groups_beyond_the_limit_share_an_overflow_digest():
+    with FakeSMTPServer() as server:
+        aggregator = _aggregator(server, max_groups=2)
+        for error in ("first", "second", "third", "fourth"):
+            aggregator.record("booking_created", "1", error)
+        assert aggregator.flush() == 3
+        aggregator.close()
+        assert any(OVERFLOW_SIGNATURE in message["Subject"] and "2 dead-lettered" in message["Subject"]
+                   for message in server.messages)
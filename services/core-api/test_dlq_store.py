@@ -0,0 +1,206 @@
+import threading
+import time
+
+import pytest
+from concurrent.futures import Future
+
+from salon_events import Deduplicator, MemoryDedupStore, build_event, decode_event, encode_event
+from salon_events import dlq
+from salon_events.dlq import (
+    CANCELLED,
+    COMPLETED,
+    REPLAY_ATTRIBUTE,
+    DLQFilter,
+    DLQReplayer,
+    ParkedMessage,
+    SQLiteDLQStore,
+    decode_cursor,
+    encode_cursor,
+    filesystem_type,
+    journal_mode,
+    source_topic,
+)
+from salon_events.fake_pubsub import FakePubSub, FakePublisherClient, FakeSubscriberClient
+from app.events.consumer import EventConsumer
+
+# Tests of parking dead-lettered messages and replaying them, paced and
+# batched, to their original topics.
+
+TOPIC = "core-api.v1.events"
+SUBSCRIPTION = "core-api-v1-events"
+
+
+def _park(store, n, start=0, failed_at=None, **attributes):
+    for i in range(start, start + n):
+        event = build_event(("booking_created", "booking_updated")[i % 2], "1", f"tenant-{i % 5}",
+                            {"booking_id": f"b{i}"})
+        store.park(ParkedMessage.new(
+            encode_event(event), dict({"CloudPubSubDeadLetterSourceSubscription": SUBSCRIPTION}, **attributes),
+            event, message_id=f"m{i}", failed_at=failed_at(i) if failed_at else None,
+        ))
+
+
+class _RecordingPublisher:
+    """Completes every publish at once and records when it was made"""
+
+    def __init__(self):
+        self.published = []
+
+    def topic_path(self, project_id, topic):
+        return f"projects/{project_id}/topics/{topic}"
+
+    def publish(self, topic, data, ordering_key="", **attributes):
+        self.published.append((time.monotonic(), topic, data, attributes))
+        future = Future()
+        future.set_result(str(len(self.published)))
+        return future
+
+
+def test_queries_page_through_the_indexes_with_a_cursor():
+    store = SQLiteDLQStore(":memory:")
+    _park(store, 250, failed_at=lambda i: 1000.0 + i // 10)
+    _park(store, 5)  # redeliveries of parked messages
+
+    def pages(where, limit):
+        after, seen = None, []
+        while True:
+            page = store.query(where, after, limit)
+            seen += [parked.message_id for parked in page]
+            if len(page) < limit:
+                return seen
+            after = decode_cursor(encode_cursor(page[-1]))
+
+    assert store.stats()["parked"] == 250
+    assert pages(DLQFilter(), 7) == [f"m{i}" for i in range(250)]
+    assert pages(DLQFilter(tenant_id="tenant-3"), 4) == [f"m{i}" for i in range(3, 250, 5)]
+    assert pages(DLQFilter(event_type="booking_updated", event_version="1", failed_after=1010, failed_before=1012),
+                 3) == [f"m{i}" for i in range(101, 120, 2)]
+    parked = store.query(DLQFilter(tenant_id="tenant-1"), limit=1)[0]
+    assert store.query(DLQFilter(correlation_id=parked.correlation_id)) == [parked]
+    assert store.get(parked.id) == parked and parked.topic == TOPIC
+
+
+def test_every_filter_pages_through_an_index_without_sorting():
+    store = SQLiteDLQStore(":memory:")
+    for where in ("correlation_id = ?", "event_type = ?", "event_type = ? AND event_version = ?", "tenant_id = ?"):
+        params = ["x"] * where.count("?") + [0.0, 0]
+        plan = store._conn.execute(f"EXPLAIN QUERY PLAN SELECT id FROM dlq_messages WHERE {where} "
+                                   f"AND (failed_at, id) > (?, ?) ORDER BY failed_at, id LIMIT 10", params).fetchall()
+        details = " ".join(row[-1] for row in plan)
+        assert "USING COVERING INDEX" in details and "TEMP B-TREE" not in details, (where, details)
+
+
+def test_the_store_path_is_required():
+    with pytest.raises(ValueError):
+        SQLiteDLQStore(None)
+
+
+def test_wal_is_only_used_on_a_local_disk(tmp_path, monkeypatch):
+    mounts = tmp_path / "mounts"
+    mounts.write_text("overlay / overlay rw 0 0\n"
+                      "10.0.0.2:/dlq /mnt/dlq nfs rw,vers=3 0 0\n"
+                      "tmpfs /mnt/dlq\\040scratch tmpfs rw 0 0\n")
+    assert filesystem_type("/mnt/dlq/dlq.sqlite3", str(mounts)) == "nfs"
+    assert filesystem_type("/mnt/dlq scratch/dlq.sqlite3", str(mounts)) == "tmpfs"
+    assert filesystem_type("/mnt/dlqx/dlq.sqlite3", str(mounts)) == "overlay"
+    assert filesystem_type("/data/dlq.sqlite3", str(tmp_path / "missing")) is None
+
+    path = str(tmp_path / "dlq.sqlite3")
+    assert journal_mode(path) == "WAL" and SQLiteDLQStore(path).journal_mode == "WAL"
+    monkeypatch.setattr(dlq, "filesystem_type", lambda path: "nfs")
+    store = SQLiteDLQStore(str(tmp_path / "nfs.sqlite3"))
+    assert store.journal_mode == "DELETE"
+    _park(store, 3)
+    assert len(store.query(limit=10)) == 3
+
+
+def test_source_topics_follow_the_subscription_naming():
+    assert source_topic("projects/p/subscriptions/core-api-v1-events") == ("core-api", "1")
+    assert source_topic("billing-v2-events") == ("billing", "2")
+    assert source_topic("manual-sub") == source_topic(None) == ("core-api", "1")
+
+
+def test_dead_lettered_events_are_parked_and_replayed_after_a_fix():
+    pubsub = FakePubSub(time_scale=0.001, ack_deadline_seconds=60)
+    consumer = EventConsumer("test", subscriber=FakeSubscriberClient(pubsub),
+                             dedup=Deduplicator(MemoryDedupStore()))
+    fixed = threading.Event()
+    processed = []
+
+    def handler(event):
+        if not fixed.is_set():
+            raise RuntimeError("bug")
+        processed.append(event["payload"]["booking_id"])
+
+    consumer.register_handler("booking_created", "1", handler)
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    # The DLQ processor: park every dead-lettered message
+    store = SQLiteDLQStore(":memory:")
+    pubsub.create_subscription("dlq", TOPIC + "-dlq")
+
+    def park(message):
+        store.park(ParkedMessage.new(message.data, message.attributes, decode_event(message.data),
+                                     message.message_id, message.ordering_key))
+        message.ack()
+
+    dlq_future = FakeSubscriberClient(pubsub).subscribe("dlq", park)
+    publisher = FakePublisherClient(pubsub)
+    for i in range(20):
+        publisher.publish(TOPIC, encode_event(build_event("booking_created", "1", "default", {"booking_id": str(i)})))
+    deadline = time.monotonic() + 10
+    while store.stats()["parked"] < 20:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+    fixed.set()
+    job = DLQReplayer(store, publisher, "test", rate=1000, batch_size=6).replay(DLQFilter(replayed=False))
+    assert job.wait(10) and job.status == COMPLETED and job.published == 20
+    while len(processed) < 20:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+    future.cancel()
+    dlq_future.cancel()
+    consumer.close()
+
+    assert sorted(processed, key=int) == [str(i) for i in range(20)]
+    assert store.stats()["replayed"] == 20
+    # Replayed messages are not selected again
+    again = DLQReplayer(store, publisher, "test").replay(DLQFilter(replayed=False))
+    assert again.wait(10) and again.published == 0
+
+
+def test_replay_is_paced_and_batched_and_keeps_the_original_attributes():
+    store = SQLiteDLQStore(":memory:")
+    _park(store, 200, CloudPubSubDeadLetterSourceDeliveryCount="5", event_encoding="json")
+    publisher = _RecordingPublisher()
+
+    start = time.monotonic()
+    job = DLQReplayer(store, publisher, "test", rate=1000, batch_size=50).replay()
+    assert job.wait(10) and job.published == 200
+    assert time.monotonic() - start >= 0.19
+
+    # Batch n is published no earlier than n * 50 ms after the start
+    for i, (published_at, topic, data, attributes) in enumerate(publisher.published):
+        assert published_at - start >= (i // 50) * 0.05 - 0.005
+        assert topic == "projects/test/topics/core-api.v1.events"
+        assert attributes == {"event_encoding": "json", REPLAY_ATTRIBUTE: "1"}
+
+
+def test_replay_selects_ids_once_and_can_be_cancelled():
+    store = SQLiteDLQStore(":memory:")
+    _park(store, 30)
+    publisher = _RecordingPublisher()
+    replayer = DLQReplayer(store, publisher, "test", rate=1000, batch_size=2)
+
+    job = replayer.replay(DLQFilter(tenant_id="tenant-0"), ids=[1, 2, 6, 11, 12])
+    _park(store, 10, start=30)  # parked after the job started
+    assert job.wait(10) and job.published == 3
+    assert [parked.id for parked in store.query(DLQFilter(replayed=True))] == [1, 6, 11]
+
+    clamped = replayer.replay(DLQFilter(tenant_id="nobody"), rate=10 ** 9, batch_size=10 ** 6)
+    assert (clamped.rate, clamped.batch_size) == (replayer.max_rate, replayer.max_batch_size)
+    slow = replayer.replay(rate=10)
+    slow.cancel()
+    assert slow.wait(10) and slow.status == CANCELLED and slow.published < 40
+    assert replayer.job(slow.id) is slow
@@ -0,0 +1,337 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from salon_events import build_event, encode_event
+from app.events.consumer import EventConsumer
+
+# Throughput tests for EventConsumer against an in-process fake subscriber
+# that honours flow control and calls back from a small thread pool, like the
+# Pub/Sub client's scheduler.
+
+MESSAGES = 2000
+
+
+class FakeMessage:
+    def __init__(self, subscriber, message_id, data):
+        self._subscriber = subscriber
+        self.message_id = message_id
+        self.data = data
+
+    def ack(self):
+        self._subscriber.settle(self, acked=True)
+
+    def nack(self):
+        self._subscriber.settle(self, acked=False)
+
+
+class FakeSubscriber:
+    def __init__(self, messages, callback_threads=10):
+        self.messages = messages
+        self.callback_threads = callback_threads
+        self.acked = 0
+        self.nacked = 0
+        self.max_outstanding = 0
+        self.flow_control = None
+        self.done = threading.Event()
+        self._outstanding = 0
+        self._lock = threading.Condition()
+
+    def topic_path(self, project_id, topic):
+        return f"projects/{project_id}/topics/{topic}"
+
+    def subscription_path(self, project_id, subscription):
+        return f"projects/{project_id}/subscriptions/{subscription}"
+
+    def create_subscription(self, request):
+        pass
+
+    def subscribe(self, subscription, callback, flow_control=()):
+        self.flow_control = flow_control
+        max_messages = flow_control.max_messages
+        scheduler = ThreadPoolExecutor(max_workers=self.callback_threads)
+
+        def pull():
+            for i, data in enumerate(self.messages):
+                with self._lock:
+                    while self._outstanding >= max_messages:
+                        self._lock.wait()
+                    self._outstanding += 1
+                    self.max_outstanding = max(self.max_outstanding, self._outstanding)
+                scheduler.submit(callback, FakeMessage(self, str(i), data))
+
+        threading.Thread(target=pull, daemon=True).start()
+        return self.done
+
+    def settle(self, message, acked):
+        with self._lock:
+            self._outstanding -= 1
+            if acked:
+                self.acked += 1
+            else:
+                self.nacked += 1
+            if self.acked + self.nacked == len(self.messages):
+                self.done.set()
+            self._lock.notify()
+
+
+class ConcurrencyProbe:
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.current -= 1
+
+
+def _messages(n, event_type="booking_created"):
+    return [
+        encode_event(build_event(event_type, "1", "default", {"booking_id": str(i)}))
+        for i in range(n)
+    ]
+
+
+def _consume(consumer, subscriber):
+    start = time.perf_counter()
+    done = consumer.subscribe("core-api", "1", "test-subscription")
+    assert done.wait(timeout=30)
+    elapsed = time.perf_counter() - start
+    consumer.close()
+    return elapsed
+
+
+def test_sync_handlers_run_in_parallel_within_flow_control():
+    subscriber = FakeSubscriber(_messages(MESSAGES))
+    consumer = EventConsumer("test", subscriber=subscriber, max_messages=100, max_workers=50)
+    probe = ConcurrencyProbe()
+
+    def handler(event):
+        with probe:
+            time.sleep(0.002)
+
+    consumer.register_handler("booking_created", "1", handler)
+    elapsed = _consume(consumer, subscriber)
+
+    assert subscriber.acked == MESSAGES
+    assert subscriber.flow_control.max_messages == 100
+    assert subscriber.max_outstanding <= 100
+    assert probe.peak <= 50
+    # Serially this takes MESSAGES * 2 ms = 4 s
+    assert elapsed < MESSAGES * 0.002 / 5
+
+
+def test_async_handlers_run_on_the_consumer_loop_up_to_their_limit():
+    subscriber = FakeSubscriber(_messages(MESSAGES))
+    consumer = EventConsumer("test", subscriber=subscriber, max_messages=500)
+    probe = ConcurrencyProbe()
+    loops = set()
+
+    async def handler(event):
+        loops.add(asyncio.get_running_loop())
+        with probe:
+            await asyncio.sleep(0.01)
+
+    consumer.register_handler("booking_created", "1", handler, max_concurrency=200)
+    elapsed = _consume(consumer, subscriber)
+
+    assert subscriber.acked == MESSAGES
+    assert len(loops) == 1
+    assert 1 < probe.peak <= 200
+    # Serially this takes MESSAGES * 10 ms = 20 s
+    assert elapsed < MESSAGES * 0.01 / 20
+
+
+def test_per_handler_limit_does_not_starve_other_handlers():
+    messages = _messages(200, "booking_created") + _messages(MESSAGES, "customer_updated")
+    subscriber = FakeSubscriber(messages)
+    consumer = EventConsumer("test", subscriber=subscriber, max_messages=1000, max_workers=20)
+    slow, fast = ConcurrencyProbe(), ConcurrencyProbe()
+
+    def slow_handler(event):
+        with slow:
+            time.sleep(0.002)
+
+    def fast_handler(event):
+        with fast:
+            pass
+
+    consumer.register_handler("booking_created", "1", slow_handler, max_concurrency=2)
+    consumer.register_handler("customer_updated", "1", fast_handler)
+    _consume(consumer, subscriber)
+
+    assert subscriber.acked == len(messages)
+    assert slow.peak <= 2
+
+
+def test_failing_events_are_nacked_and_invalid_and_unknown_ones_parked():
+    messages = _messages(10) + _messages(5, "unknown_event") + [b"not json"]
+    subscriber = FakeSubscriber(messages)
+    consumer = EventConsumer("test", subscriber=subscriber)
+
+    async def handler(event):
+        if int(event["payload"]["booking_id"]) % 2:
+            raise RuntimeError("boom")
+
+    consumer.register_handler("booking_created", "1", handler)
+    _consume(consumer, subscriber)
+
+    assert subscriber.acked == 11
+    assert subscriber.nacked == 5
+    assert len(consumer.park.events) == 6
+    [invalid] = [event for event in consumer.park.events if event["type"] is None]
+    assert invalid["data"] == b"not json" and invalid["invalid"]
+    stats = consumer.stats()
+    assert stats["misses_by_key"] == {"unknown_event:1": 5}
+    assert stats["parked"] == 6 and stats["invalid"] == 1
+
+
+def _event(event_type, version, payload):
+    event = build_event(event_type, version, "default", payload)
+    return encode_event(event)
+
+
+def test_version_ranges_and_upcasters_route_old_events_to_current_handlers():
+    messages = [
+        _event("booking_created", "1", {"customer": "Ada Lovelace"}),
+        _event("booking_created", "2", {"first_name": "Ada", "last_name": "Lovelace"}),
+        _event("booking_created", "3", {"first_name": "Ada", "last_name": "Lovelace", "channel": "web"}),
+        _event("customer_updated", "1.4", {"customer_id": "c1"}),
+        _event("customer_updated", "2.0", {"customer_id": "c1"}),
+    ]
+    subscriber = FakeSubscriber(messages)
+    consumer = EventConsumer("test", subscriber=subscriber)
+    bookings, customers = [], []
+    lock = threading.Lock()
+
+    def split_name(event):
+        first, last = event["payload"].pop("customer").split(" ", 1)
+        event["payload"].update(first_name=first, last_name=last)
+        return event
+
+    def add_channel(event):
+        event["payload"]["channel"] = "unknown"
+        return event
+
+    def on_booking(event):
+        with lock:
+            bookings.append((event["version"], event["payload"]))
+
+    def on_customer(event):
+        with lock:
+            customers.append(event["version"])
+
+    consumer.register_handler("booking_created", "3", on_booking)
+    consumer.register_upcaster("booking_created", "1", "2", split_name)
+    consumer.register_upcaster("booking_created", "2", "3", add_channel)
+    consumer.register_handler("customer_updated", "^1.2", on_customer)
+    _consume(consumer, subscriber)
+
+    assert sorted(bookings, key=lambda b: b[1]["channel"]) == [
+        ("3", {"first_name": "Ada", "last_name": "Lovelace", "channel": "unknown"}),
+        ("3", {"first_name": "Ada", "last_name": "Lovelace", "channel": "unknown"}),
+        ("3", {"first_name": "Ada", "last_name": "Lovelace", "channel": "web"}),
+    ]
+    assert customers == ["1.4"]
+    stats = consumer.stats()
+    assert stats["upcast"] == 2
+    assert stats["misses_by_key"] == {"customer_updated:2.0": 1}
+    assert stats["parked"] == 1
+    assert subscriber.nacked == 0
+
+
+def _keyed_messages(keys, per_key):
+    # Interleaved, so each key's events arrive spread across the stream
+    return [
+        encode_event(build_event("booking_created", "1", "default", {"booking_id": f"b{key}", "seq": seq}))
+        for seq in range(per_key) for key in range(keys)
+    ]
+
+
+def _by_booking(event, message):
+    return event["payload"]["booking_id"]
+
+
+def test_ordering_keys_are_serial_per_key_and_parallel_across_keys():
+    # One callback thread delivers in publish order, as an ordered subscription does
+    subscriber = FakeSubscriber(_keyed_messages(20, 25), callback_threads=1)
+    consumer = EventConsumer("test", subscriber=subscriber, max_messages=200, max_workers=20,
+                             ordering_key=_by_booking)
+    applied = {}
+    probe = ConcurrencyProbe()
+    per_key = {f"b{key}": ConcurrencyProbe() for key in range(20)}
+
+    def handler(event):
+        booking_id = event["payload"]["booking_id"]
+        with probe, per_key[booking_id]:
+            time.sleep(0.001)
+            applied.setdefault(booking_id, []).append(event["payload"]["seq"])
+
+    consumer.register_handler("booking_created", "1", handler)
+    _consume(consumer, subscriber)
+
+    assert subscriber.acked == 500
+    assert all(seqs == list(range(25)) for seqs in applied.values())
+    assert all(key_probe.peak == 1 for key_probe in per_key.values())
+    assert probe.peak > 1
+    assert consumer.stats()["ordering"]["active_keys"] == 0
+
+
+def test_ordering_is_kept_across_sync_and_async_handlers():
+    messages = [
+        _event("booking_created" if seq % 2 == 0 else "booking_updated", "1", {"booking_id": "b1", "seq": seq})
+        for seq in range(40)
+    ]
+    subscriber = FakeSubscriber(messages, callback_threads=1)
+    consumer = EventConsumer("test", subscriber=subscriber, ordering_key=_by_booking)
+    applied = []
+
+    def on_created(event):
+        time.sleep(0.002)
+        applied.append(event["payload"]["seq"])
+
+    async def on_updated(event):
+        applied.append(event["payload"]["seq"])
+
+    consumer.register_handler("booking_created", "1", on_created)
+    consumer.register_handler("booking_updated", "1", on_updated)
+    _consume(consumer, subscriber)
+
+    assert applied == list(range(40))
+
+
+def test_a_failure_nacks_the_events_queued_behind_it_on_its_key():
+    messages = [_event("booking_created", "1", {"booking_id": "b1", "seq": seq}) for seq in range(5)]
+    subscriber = FakeSubscriber(messages, callback_threads=1)
+    consumer = EventConsumer("test", subscriber=subscriber, ordering_key=_by_booking)
+    started = threading.Event()
+    all_queued = threading.Event()
+    applied = []
+
+    def handler(event):
+        seq = event["payload"]["seq"]
+        if seq == 0:
+            started.set()
+            # Hold the key until the rest of its events are queued behind it
+            assert all_queued.wait(5)
+            raise RuntimeError("boom")
+        applied.append(seq)
+
+    consumer.register_handler("booking_created", "1", handler)
+    done = consumer.subscribe("core-api", "1", "test-subscription")
+    assert started.wait(5)
+    while consumer.stats()["ordering"]["waiting"] < 4:
+        time.sleep(0.001)
+    all_queued.set()
+    assert done.wait(5)
+    consumer.close()
+
+    assert applied == []
+    assert subscriber.nacked == 5
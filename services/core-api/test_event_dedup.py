@@ -0,0 +1,182 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from salon_events import (
+    DUPLICATE,
+    IN_FLIGHT,
+    NEW,
+    DedupStore,
+    Deduplicator,
+    DuplicateInFlight,
+    MemoryDedupStore,
+    SharedMemoryDedupStore,
+    SQLiteDedupStore,
+    build_event,
+    encode_event,
+)
+from app.events.consumer import EventConsumer
+
+
+@pytest.fixture(params=["memory", "sqlite", "shm"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = MemoryDedupStore(max_entries=1000)
+    elif request.param == "sqlite":
+        store = SQLiteDedupStore(str(tmp_path / "dedup.sqlite3"))
+    else:
+        store = SharedMemoryDedupStore(str(tmp_path / "dedup.shm"), slots=1024, stripes=16)
+    yield store
+    store.close()
+
+
+def test_store_claim_complete_release(store):
+    assert store.claim("a") == NEW
+    assert store.claim("a") == IN_FLIGHT
+    store.complete("a")
+    assert store.claim("a") == DUPLICATE
+
+    assert store.claim("b") == NEW
+    store.release("b")
+    assert store.claim("b") == NEW
+
+
+def test_store_claims_are_atomic(store):
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        outcomes = list(pool.map(lambda _: store.claim("same"), range(200)))
+    assert outcomes.count(NEW) == 1
+
+
+def test_expired_keys_are_processed_again(store):
+    store.ttl_seconds = 0.05
+    store.claim("a")
+    store.complete("a")
+    assert store.claim("a") == DUPLICATE
+    time.sleep(0.1)
+    assert store.claim("a") == NEW
+
+
+def test_memory_store_is_bounded():
+    store = MemoryDedupStore(max_entries=100)
+    for i in range(1000):
+        store.claim(str(i))
+        store.complete(str(i))
+    assert len(store) == 100
+    assert store.evictions == 900
+    assert store.claim("999") == DUPLICATE
+    assert store.claim("0") == NEW
+
+
+def test_shared_memory_store_counts_entries_without_scanning(tmp_path):
+    path = str(tmp_path / "dedup.shm")
+    store = SharedMemoryDedupStore(path, slots=64, stripes=4, ttl_seconds=60)
+    for i in range(40):
+        store.claim(str(i))
+        store.complete(str(i))
+    for i in range(10):
+        store.release(str(i))
+    assert len(store) == 30
+    # Full stripes evict their oldest keys, which replaces rather than adds entries
+    for i in range(100, 200):
+        store.claim(str(i))
+        store.complete(str(i))
+    assert len(store) == 64 and store.evictions > 0
+    # The counters live in the file, so every process reads the same count
+    other = SharedMemoryDedupStore(path)
+    assert len(other) == 64
+    other.close()
+    store.close()
+
+
+def test_dedup_stores_implement_the_whole_interface():
+    with pytest.raises(TypeError):
+        DedupStore()
+
+
+def test_wrapped_handler_runs_once_per_message():
+    dedup = Deduplicator(MemoryDedupStore())
+    calls = []
+
+    @dedup
+    def handler(event, message_id=None):
+        calls.append(message_id)
+        if event["payload"].get("fail") and calls.count(message_id) == 1:
+            raise RuntimeError("transient")
+
+    event = build_event("booking_created", "1", "default", {"booking_id": "b1"})
+    handler(event, "m1")
+    assert handler(event, "m1") == DUPLICATE
+
+    failing = build_event("booking_created", "1", "default", {"booking_id": "b2", "fail": True})
+    with pytest.raises(RuntimeError):
+        handler(failing, "m2")
+    handler(failing, "m2")  # a failed message is processed again on redelivery
+    assert calls == ["m1", "m2", "m2"]
+    assert dedup.stats()["hit_rate"] == pytest.approx(1 / 4)
+
+
+def test_wrapped_handler_rejects_in_flight_redelivery():
+    dedup = Deduplicator(MemoryDedupStore())
+    started, release = threading.Event(), threading.Event()
+
+    @dedup
+    def handler(event, message_id=None):
+        started.set()
+        release.wait(5)
+
+    event = build_event("booking_created", "1", "default", {"booking_id": "b1"})
+    worker = threading.Thread(target=handler, args=(event, "m1"))
+    worker.start()
+    started.wait(5)
+    with pytest.raises(DuplicateInFlight):
+        handler(event, "m1")
+    release.set()
+    worker.join()
+    assert handler(event, "m1") == DUPLICATE
+
+
+def test_correlation_id_key_catches_republished_events():
+    dedup = Deduplicator(MemoryDedupStore(), key_by="correlation_id")
+    event = build_event("booking_created", "1", "default", {"booking_id": "b1"}, correlation_id="c1")
+    other_type = build_event("notification_sent", "1", "default", {"booking_id": "b1"}, correlation_id="c1")
+    assert dedup.claim(event, "m1")[0] == NEW
+    dedup.complete("c1:booking_created")
+    assert dedup.claim(dict(event), "m2")[0] == DUPLICATE
+    assert dedup.claim(other_type, "m3")[0] == NEW
+
+
+class Message:
+    def __init__(self, message_id, data):
+        self.message_id = message_id
+        self.data = data
+        self.settled = threading.Event()
+        self.acked = None
+
+    def ack(self):
+        self.acked = True
+        self.settled.set()
+
+    def nack(self):
+        self.acked = False
+        self.settled.set()
+
+
+def test_consumer_skips_redelivered_messages():
+    dedup = Deduplicator(MemoryDedupStore())
+    consumer = EventConsumer("test", subscriber=object(), dedup=dedup)
+    notifications = []
+    consumer.register_handler("booking_created", "1", lambda event: notifications.append(event["payload"]))
+
+    data = encode_event(build_event("booking_created", "1", "default", {"booking_id": "b1"}))
+    deliveries = [Message("m1", data) for _ in range(5)]
+    for message in deliveries:
+        consumer.dispatch(message, "core-api", "1")
+        assert message.settled.wait(5)
+    consumer.close()
+
+    assert [message.acked for message in deliveries] == [True] * 5
+    assert notifications == [{"booking_id": "b1"}]
+    assert consumer.stats()["dedup"]["duplicates"] == 4
+    assert consumer.stats()["dedup"]["hit_rate"] == pytest.approx(0.8)
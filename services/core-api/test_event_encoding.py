@@ -0,0 +1,121 @@
+import base64
+import uuid
+
+import pytest
+
+from salon_events import (
+    COMPACT,
+    ENCODING_ATTRIBUTE,
+    JSON,
+    PROCESSED,
+    CompactCodec,
+    Deduplicator,
+    EventProcessor,
+    EventValidationError,
+    MemoryDedupStore,
+    build_event,
+    compile_schema,
+    decode_base64_event,
+    decode_event,
+    detect_encoding,
+    encode_event,
+    get_compact_codec,
+)
+
+# Tests of the compact binary event encoding and of its detection by the
+# consumers and processors, next to the default JSON encoding.
+
+
+def _booking_event(**payload):
+    return build_event("booking_created", "1", "tenant-42", dict({
+        "booking_id": str(uuid.uuid4()),
+        "service_id": "service_123",
+        "customer_name": "John Doe",
+        "date": "2025-08-07",
+        "time": "10:00",
+        "status": "confirmed",
+    }, **payload))
+
+
+def test_compact_round_trips_envelopes_exactly():
+    event = _booking_event(
+        notes="Window seat, please — near the door" * 2,
+        price=42.5, quantity=3, balance=-17, big=2 ** 62, paid=True, refunded=False, coupon=None,
+        tags=["vip", 1, None], address={"city": "Lisbon", "zip": "1000-001"},
+        created_at="2025-08-07T14:30:00Z", not_a_uuid="x" * 36,
+    )
+    event["trace"] = "extra envelope field"
+
+    data = encode_event(event, encoding=COMPACT)
+
+    assert decode_event(data) == event
+    assert len(data) < len(encode_event(event)) * 0.7
+
+
+def test_timestamps_and_uuids_decode_to_the_original_strings():
+    codec = get_compact_codec()
+    for occurred_at in ("2025-08-07T14:30:00Z", "2025-08-07T14:30:00.000120Z", "2025-08-07T14:30:00.1Z",
+                        "2025-08-07 14:30:00Z", "1969-12-31T23:59:59.999999Z"):
+        for correlation_id in (str(uuid.uuid4()), str(uuid.uuid4()).upper(), "not-a-uuid"):
+            event = _booking_event()
+            event.update(occurred_at=occurred_at, correlation_id=correlation_id)
+            assert codec.decode(codec.encode(event)) == event
+
+
+def test_encoding_is_detected_from_attributes_or_data():
+    event = _booking_event()
+    json_data, compact_data = encode_event(event), encode_event(event, encoding=COMPACT)
+
+    assert detect_encoding(json_data) == JSON and detect_encoding(compact_data) == COMPACT
+    assert decode_event(compact_data, encoding=COMPACT) == decode_event(compact_data) == event
+    assert decode_event(json_data, encoding=JSON) == event
+    with pytest.raises(EventValidationError):
+        decode_event(json_data, encoding=COMPACT)
+    with pytest.raises(EventValidationError):
+        decode_event(compact_data, encoding="avro")
+
+
+def test_corrupt_and_newer_compact_data_is_rejected():
+    data = encode_event(_booking_event(), encoding=COMPACT)
+    for end in range(len(data)):
+        with pytest.raises(EventValidationError):
+            decode_event(data[:end], encoding=COMPACT)
+    with pytest.raises(EventValidationError, match="trailing"):
+        decode_event(data + b"\x00", encoding=COMPACT)
+
+    older = CompactCodec({"revision": 1, "envelope": ["type"], "fields": [], "symbols": []})
+    newer = CompactCodec({"revision": 2, "envelope": ["type"], "fields": [], "symbols": []})
+    assert older.decode(older.encode({"type": "x"})) == newer.decode(older.encode({"type": "x"}))
+    with pytest.raises(EventValidationError, match="revision 2"):
+        older.decode(newer.encode({"type": "x"}))
+
+
+def test_processor_accepts_both_encodings():
+    processor = EventProcessor("core-api", "1", dedup=Deduplicator(MemoryDedupStore()))
+    seen = []
+    processor.handler("booking_created", "^1")(lambda event: seen.append(event["payload"]["booking_id"]))
+    json_event, compact_event = _booking_event(), _booking_event()
+
+    results = processor.process_batch([
+        {"messageId": "m1", "data": base64.b64encode(encode_event(json_event)).decode("ascii")},
+        {"messageId": "m2", "data": base64.b64encode(encode_event(compact_event, encoding=COMPACT)).decode("ascii"),
+         "attributes": {ENCODING_ATTRIBUTE: COMPACT}},
+    ])
+
+    assert [result["outcome"] for result in results] == [PROCESSED, PROCESSED]
+    assert seen == [json_event["payload"]["booking_id"], compact_event["payload"]["booking_id"]]
+    assert decode_base64_event(base64.b64encode(encode_event(compact_event, encoding=COMPACT))) == compact_event
+
+
+def test_enums_compare_booleans_and_numbers_by_type():
+    assert_one = compile_schema({"enum": [1, "two", [1, False]]})
+    for value in (1, 1.0, "two", [1, False], [1.0, False]):
+        assert_one(value)
+    for value in (True, "1", [True, False], [1, 0]):
+        with pytest.raises(EventValidationError):
+            assert_one(value)
+
+    assert_true = compile_schema({"const": True})
+    assert_true(True)
+    with pytest.raises(EventValidationError):
+        assert_true(1)
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+
+from salon_events import Deduplicator, MemoryDedupStore, decode_event
+from salon_events.fake_pubsub import FakePubSub, FakePublisherClient, FakeSubscriberClient
+from app.events.consumer import EventConsumer
+from app.events.producer import EventProducer
+
+# End-to-end tests of EventProducer -> topic -> EventConsumer -> dead-letter
+# topic against the in-process Pub/Sub stand-in. With time_scale=0.001 the
+# subscription's 10-600 s retry backoff takes 10-600 ms.
+
+TOPIC = "core-api.v1.events"
+SUBSCRIPTION = "core-api-v1-events"
+
+
+def _pipeline(**pubsub_options):
+    pubsub = FakePubSub(time_scale=0.001, **pubsub_options)
+    producer = EventProducer("test", publisher=FakePublisherClient(pubsub))
+    consumer = EventConsumer("test", subscriber=FakeSubscriberClient(pubsub),
+                             dedup=Deduplicator(MemoryDedupStore()))
+    return pubsub, producer, consumer
+
+
+def _publish(producer, n, **payload):
+    async def publish():
+        return await producer.publish_many("core-api", "1", (
+            {"event_type": "booking_created", "tenant_id": "default", "payload": dict(payload, booking_id=str(i))}
+            for i in range(n)
+        ))
+    return asyncio.run(publish())
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_events_flow_from_producer_to_consumer():
+    # A 60 ms ack deadline, so a busy machine does not expire leases
+    pubsub, producer, consumer = _pipeline(ack_deadline_seconds=60)
+    received = []
+    consumer.register_handler("booking_created", "1", lambda event: received.append(event["payload"]["booking_id"]))
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    message_ids = _publish(producer, 500)
+    _wait_for(lambda: pubsub.stats(SUBSCRIPTION)["acked"] == 500)
+    future.cancel()
+    consumer.close()
+
+    assert len(set(message_ids)) == 500
+    assert sorted(received, key=int) == [str(i) for i in range(500)]
+    stats = pubsub.stats(SUBSCRIPTION)
+    assert stats["delivered"] == 500 and stats["redelivered"] == 0
+    assert stats["p99_ms"] >= stats["p50_ms"] > 0
+
+
+def test_failures_are_retried_with_backoff_then_dead_lettered():
+    pubsub, producer, consumer = _pipeline()
+    attempts = {}
+    lock = threading.Lock()
+
+    def handler(event):
+        key = (event["payload"]["booking_id"], event["payload"]["poison"])
+        with lock:
+            attempts[key] = attempts.get(key, 0) + 1
+            attempt = attempts[key]
+        if event["payload"]["poison"] or attempt < 3:
+            raise RuntimeError("downstream unavailable")
+
+    consumer.register_handler("booking_created", "1", handler)
+    pubsub.create_subscription("dlq-watch", TOPIC + "-dlq")
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    _publish(producer, 10, poison=False)
+    _publish(producer, 1, poison=True)
+    _wait_for(lambda: pubsub.stats(SUBSCRIPTION)["acked"] == 10 and pubsub.stats("dlq-watch")["published"] == 1)
+    future.cancel()
+    consumer.close()
+
+    # Two failed attempts each, then success; the poison message gets all 5
+    stats = pubsub.stats(SUBSCRIPTION)
+    assert stats["nacked"] == 10 * 2 + 5
+    assert stats["dead_lettered"] == 1
+    # Backoff of 10 ms and then 20 ms before the third attempt
+    assert stats["p50_ms"] >= 30
+
+    dead = pubsub.subscriptions["dlq-watch"].ready[0][2].message
+    assert dead.attributes["CloudPubSubDeadLetterSourceDeliveryCount"] == "5"
+    assert decode_event(dead.data)["payload"]["poison"] is True
+
+
+def test_slow_handler_past_the_ack_deadline_is_not_run_twice():
+    pubsub, producer, consumer = _pipeline(ack_deadline_seconds=20)
+    calls = []
+
+    def handler(event):
+        calls.append(event["payload"]["booking_id"])
+        time.sleep(0.05)  # past the 20 ms ack deadline
+
+    consumer.register_handler("booking_created", "1", handler)
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    _publish(producer, 1)
+    _wait_for(lambda: pubsub.stats(SUBSCRIPTION)["acked"] == 1)
+    future.cancel()
+    consumer.close()
+
+    stats = pubsub.stats(SUBSCRIPTION)
+    assert stats["expired"] >= 1 and stats["delivered"] >= 2
+    assert calls == ["0"]
+
+
+def test_ordering_keys_reach_the_consumer_and_keep_each_booking_in_order():
+    pubsub = FakePubSub(time_scale=0.001, ack_deadline_seconds=60)
+    producer = EventProducer("test", publisher=FakePublisherClient(pubsub))
+    consumer = EventConsumer("test", subscriber=FakeSubscriberClient(pubsub, callback_threads=1),
+                             dedup=Deduplicator(MemoryDedupStore()))
+    applied = {}
+
+    def handler(event):
+        time.sleep(0.001)
+        applied.setdefault(event["payload"]["booking_id"], []).append(event["payload"]["seq"])
+
+    consumer.register_handler("booking_created", "1", handler)
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    async def publish():
+        return await producer.publish_many("core-api", "1", (
+            {"event_type": "booking_created", "tenant_id": "default",
+             "payload": {"booking_id": f"b{key}", "seq": seq}, "ordering_key": f"default/b{key}"}
+            for seq in range(20) for key in range(10)
+        ))
+    asyncio.run(publish())
+    _wait_for(lambda: pubsub.stats(SUBSCRIPTION)["acked"] == 200)
+    future.cancel()
+    consumer.close()
+
+    assert all(seqs == list(range(20)) for seqs in applied.values()) and len(applied) == 10
+    assert consumer.stats()["ordering"]["max_waiting"] > 0
+
+
+def test_compact_events_are_detected_by_the_consumer():
+    pubsub = FakePubSub(time_scale=0.001, ack_deadline_seconds=60)
+    json_producer = EventProducer("test", publisher=FakePublisherClient(pubsub))
+    compact_producer = EventProducer("test", publisher=FakePublisherClient(pubsub), encoding="compact")
+    consumer = EventConsumer("test", subscriber=FakeSubscriberClient(pubsub), dedup=Deduplicator(MemoryDedupStore()))
+    received = []
+    consumer.register_handler("booking_created", "1", lambda event: received.append(event["payload"]["booking_id"]))
+    pubsub.create_subscription("raw", TOPIC)
+    future = consumer.subscribe("core-api", "1", SUBSCRIPTION)
+
+    _publish(json_producer, 50)
+    _publish(compact_producer, 50)
+    _wait_for(lambda: pubsub.stats(SUBSCRIPTION)["acked"] == 100)
+    future.cancel()
+    consumer.close()
+
+    assert sorted(received, key=int) == sorted([str(i) for i in range(50)] * 2, key=int)
+    raw = [delivery.message for _, _, delivery in pubsub.subscriptions["raw"].ready]
+    assert sorted(message.attributes.get("event_encoding", "json") for message in raw) == ["compact"] * 50 + ["json"] * 50
+    assert all(message.data[:1] == b"\xc5" for message in raw if message.attributes)
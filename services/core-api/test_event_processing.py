@@ -0,0 +1,86 @@
+import base64
+
+import pytest
+
+from salon_events import (
+    DUPLICATE,
+    FAILED,
+    IN_FLIGHT,
+    INVALID,
+    NEW,
+    PROCESSED,
+    UNHANDLED,
+    Deduplicator,
+    EventProcessor,
+    MemoryDedupStore,
+    build_event,
+    encode_event,
+)
+
+
+def _message(message_id, event_type="booking_created", version="1", payload=None):
+    event = build_event(event_type, "1", "default", payload or {"booking_id": message_id})
+    event["version"] = version
+    return {"messageId": message_id, "data": base64.b64encode(encode_event(event)).decode("ascii")}
+
+
+@pytest.fixture
+def processor():
+    return EventProcessor("core-api", "1", dedup=Deduplicator(MemoryDedupStore()))
+
+
+def test_decorated_handlers_receive_upcast_events(processor):
+    seen = []
+
+    @processor.handler("booking_created", "2")
+    def booking_created(event):
+        seen.append((event["version"], event["payload"]))
+
+    @processor.upcaster("booking_created", "1", "2")
+    def add_channel(event):
+        event["payload"]["channel"] = "web"
+        return event
+
+    assert processor.process_message(_message("m1")["data"], "m1") == PROCESSED
+    assert processor.process_message(_message("m2", version="3")["data"], "m2") == UNHANDLED
+    assert seen == [("2", {"booking_id": "m1", "channel": "web"})]
+
+
+def test_batch_reports_a_result_per_message(processor):
+    processed = []
+
+    @processor.handler("booking_created", "^1")
+    def booking_created(event):
+        if event["payload"].get("fail"):
+            raise RuntimeError("downstream unavailable")
+        processed.append(event["payload"]["booking_id"])
+
+    in_flight = _message("m6")
+    processor.dedup.claim({}, "m6")  # another delivery is still processing m6
+
+    results = processor.process_batch([
+        _message("m1"),
+        {"ackId": "ack-2", "message": _message("m2")},
+        _message("m1"),
+        _message("m3", event_type="customer_deleted"),
+        _message("m4", payload={"booking_id": "m4", "fail": True}),
+        {"messageId": "m5", "data": "not base64!"},
+        in_flight,
+    ])
+
+    assert [(result["messageId"], result["ack"], result["outcome"]) for result in results] == [
+        ("m1", True, PROCESSED),
+        ("m2", True, PROCESSED),
+        ("m1", True, DUPLICATE),
+        ("m3", True, UNHANDLED),
+        ("m4", False, FAILED),
+        ("m5", False, INVALID),
+        ("m6", False, IN_FLIGHT),
+    ]
+    assert results[1]["ackId"] == "ack-2"
+    assert "downstream unavailable" in results[4]["error"]
+    assert processed == ["m1", "m2"]
+
+    # The failed message was released, so its redelivery is processed
+    assert processor.dedup.claim({}, "m4")[0] == NEW
+    assert processor.stats()["misses"] == 1
@@ -0,0 +1,188 @@
+import asyncio
+import time
+
+import pytest
+
+from app.circuit_breaker.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerOpen
+from app.circuit_breaker.fallback_cache import FallbackCache, call_signature
+
+# Tests of serving the last good results of circuit-broken calls, on a fake
+# clock shared by the breaker and the cache.
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Pricing:
+    """A dependency that can be taken down, counting its calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.down = False
+        self.price = 10
+
+    def __call__(self, service_id):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("pricing is down")
+        return {"service_id": service_id, "price": self.price}
+
+
+def _guarded(clock, dependency, sync=False, **config):
+    breaker = CircuitBreaker("pricing", minimum_calls=2, timeout=30, half_open_max_calls=1, clock=clock)
+    cache = FallbackCache("pricing", **dict(dict(max_age=100, clock=clock), **config))
+
+    def get_price_sync(service_id):
+        return dependency(service_id)
+
+    async def get_price(service_id):
+        return dependency(service_id)
+
+    return cache(breaker(get_price_sync if sync else get_price)), breaker, cache
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_closed_circuit_calls_through_and_answers_failed_calls_from_the_cache():
+    clock, pricing = _Clock(), _Pricing()
+    get_price, breaker, cache = _guarded(clock, pricing)
+
+    async def scenario():
+        assert (await get_price("cut"))["price"] == 10
+        pricing.price = 12
+        clock.now += 5
+        assert (await get_price("cut"))["price"] == 12  # not served from the cache
+        assert pricing.calls == 2
+
+        pricing.down = True
+        assert (await get_price("cut"))["price"] == 12  # the call failed
+        with pytest.raises(ConnectionError):
+            await get_price("colour")  # nothing cached
+        assert pricing.calls == 4
+
+    asyncio.run(scenario())
+    assert cache.stats() == dict(cache.stats(), calls=4, hits=0, fallbacks=1, unavailable=1)
+
+
+def test_errors_the_breaker_does_not_count_are_raised():
+    clock = _Clock()
+    breaker = CircuitBreaker("pricing", expected_exception=ConnectionError, clock=clock)
+    errors = []
+
+    @FallbackCache("pricing", clock=clock)
+    @breaker
+    def get_price(service_id):
+        if errors:
+            raise errors.pop()
+        return 10
+
+    assert get_price("cut") == 10
+    errors.append(ValueError("unknown service"))
+    with pytest.raises(ValueError):
+        get_price("cut")
+    errors.append(ConnectionError("reset"))
+    assert get_price("cut") == 10
+
+
+def test_open_circuit_serves_cached_results_until_they_are_too_old():
+    clock, pricing = _Clock(), _Pricing()
+    get_price, breaker, cache = _guarded(clock, pricing)
+
+    async def scenario():
+        await get_price("cut")
+        clock.now += 20
+        pricing.down = True
+        with pytest.raises(ConnectionError):
+            await get_price("colour")  # 1 of 2 calls failed
+        assert breaker.state == OPEN
+
+        calls = pricing.calls
+        assert (await get_price("cut"))["price"] == 10
+        with pytest.raises(CircuitBreakerOpen):
+            await get_price("colour")  # nothing cached
+        assert pricing.calls == calls  # no refresh while open
+
+        clock.now += 100
+        with pytest.raises(ConnectionError):
+            await get_price("cut")  # past max_age, so the caller makes the half-open trial
+
+    asyncio.run(scenario())
+    assert cache.stats()["hits"] == 1 and cache.stats()["unavailable"] == 3 and len(cache) == 0
+
+
+def test_refresh_is_the_half_open_trial_and_updates_the_cache_on_recovery():
+    clock, pricing = _Clock(), _Pricing()
+    get_price, breaker, cache = _guarded(clock, pricing)
+
+    async def scenario():
+        await get_price("cut")
+        clock.now += 20
+        pricing.down = True
+        with pytest.raises(ConnectionError):
+            await get_price("colour")  # 1 of 2 calls failed
+
+        clock.now += 30
+        assert breaker.state == HALF_OPEN
+        # The failed trial reopens the circuit; callers still get the cached result
+        assert (await get_price("cut"))["price"] == 10
+        assert (await get_price("cut"))["price"] == 10  # one refresh at a time
+        await _settle()
+        assert breaker.state == OPEN and cache.stats()["refresh_failures"] == 1
+
+        clock.now += 30
+        pricing.down, pricing.price = False, 15
+        assert (await get_price("cut"))["price"] == 10
+        await _settle()
+        assert breaker.state == CLOSED and cache.stats()["refreshes"] == 1
+        assert (await get_price("cut"))["price"] == 15
+
+    asyncio.run(scenario())
+
+
+def test_sync_functions_are_refreshed_on_a_thread():
+    clock, pricing = _Clock(), _Pricing()
+    get_price, breaker, cache = _guarded(clock, pricing, sync=True)
+    assert get_price("cut")["price"] == 10
+    pricing.down = True
+    with pytest.raises(ConnectionError):
+        get_price("colour")
+    clock.now += 30
+    pricing.down, pricing.price = False, 11
+    assert get_price("cut")["price"] == 10
+    deadline = time.monotonic() + 5
+    while cache.stats()["refreshes"] == 0:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+    assert breaker.state == CLOSED and cache.get(call_signature(get_price, ("cut",), {}))[0]["price"] == 11
+    assert get_price.circuit_breaker is breaker and get_price.fallback_cache is cache
+
+
+def test_memory_is_bounded_by_evicting_the_least_recently_used():
+    clock, pricing = _Clock(), _Pricing()
+    get_price, breaker, cache = _guarded(clock, pricing, sync=True, max_entries=3)
+    for service_id in ("a", "b", "c"):
+        get_price(service_id)
+    get_price("a")
+    get_price("d")
+    assert len(cache) == 3 and cache.stats()["evictions"] == 1
+    pricing.down = True
+    assert get_price("a")["service_id"] == "a"
+    with pytest.raises(ConnectionError):
+        get_price("b")  # only "b" was evicted
+
+
+def test_call_signatures_tell_arguments_apart():
+    def lookup(*args, **kwargs):
+        pass
+
+    assert call_signature(lookup, ("a",), {"x": 1}) == call_signature(lookup, ("a",), {"x": 1})
+    assert call_signature(lookup, ("a",), {"x": 1}) != call_signature(lookup, ("a",), {"x": 2})
+    assert call_signature(lookup, ([1, 2],), {}) != call_signature(lookup, ([1, 3],), {})  # unhashable
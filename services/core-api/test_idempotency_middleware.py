@@ -0,0 +1,232 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.idempotency.lru_store import LRUIdempotencyStore
+from app.idempotency.memory_store import InMemoryIdempotencyStore
+from app.idempotency.middleware import IdempotencyMiddleware, scoped_key
+from app.idempotency.shared_memory_store import SharedMemoryIdempotencyStore
+from app.idempotency.sqlite_store import SQLiteIdempotencyStore
+
+# Tests for the idempotency middleware. The single-flight tests fire N
+# identical requests in parallel: the handler must run exactly once and all
+# of them must get the same response.
+
+PARALLEL_REQUESTS = 50
+
+
+def build_app(handler_delay: float = 0.0, wait_timeout_seconds: float = 5.0, store=None):
+    app = FastAPI()
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=store if store is not None else InMemoryIdempotencyStore(cleanup_interval_seconds=0),
+        ttl_seconds=60,
+        wait_timeout_seconds=wait_timeout_seconds,
+    )
+    app.state.calls = 0
+
+    @app.post("/bookings")
+    async def create_booking(request: Request):
+        app.state.calls += 1
+        await asyncio.sleep(handler_delay)
+        return JSONResponse(content={"booking_id": str(uuid.uuid4()), "request": (await request.body()).decode()},
+                            status_code=201)
+
+    @app.post("/exports")
+    async def export_bookings():
+        app.state.calls += 1
+
+        async def rows():
+            for i in range(3):
+                yield f"row-{i}-{uuid.uuid4()}\n".encode()
+
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    @app.post("/failing")
+    async def failing():
+        app.state.calls += 1
+        return JSONResponse(content={"error": "boom"}, status_code=503)
+
+    return app
+
+
+async def fire(app, n, idempotency_key, path="/bookings", json=None):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*(
+            client.post(path, headers={"Idempotency-Key": idempotency_key}, json=json)
+            for _ in range(n)
+        ))
+
+
+def test_parallel_duplicates_run_handler_once():
+    app = build_app(handler_delay=0.1)
+    responses = asyncio.run(fire(app, PARALLEL_REQUESTS, str(uuid.uuid4())))
+
+    assert app.state.calls == 1
+    assert {r.status_code for r in responses} == {201}
+    assert len({r.json()["booking_id"] for r in responses}) == 1
+
+
+def _slow_gets(store_class):
+    """``store_class`` whose ``get`` answers 100 ms after it looked the key up"""
+
+    class SlowGets(store_class):
+        async def get(self, key):
+            stored = await super().get(key)
+            await asyncio.sleep(0.1)
+            return stored
+
+    return SlowGets
+
+
+@pytest.mark.parametrize("store_class", [InMemoryIdempotencyStore, LRUIdempotencyStore, SQLiteIdempotencyStore])
+def test_a_duplicate_whose_get_missed_before_the_leader_finished_does_not_run_the_handler(store_class, tmp_path):
+    options = {"path": str(tmp_path / "idempotency.sqlite3")} if store_class is SQLiteIdempotencyStore else {}
+    store = _slow_gets(store_class)(cleanup_interval_seconds=0, **options)
+    app = build_app(handler_delay=0.05, store=store)
+    idempotency_key = str(uuid.uuid4())
+
+    async def duplicate():
+        # Looks the key up while the leader runs, and gets the miss after the
+        # leader has stored its response and left the single-flight registry
+        await asyncio.sleep(0.12)
+        [response] = await fire(app, 1, idempotency_key)
+        return response
+
+    async def run():
+        return await asyncio.gather(fire(app, 1, idempotency_key), duplicate())
+
+    [first], second = asyncio.run(run())
+    assert app.state.calls == 1
+    assert first.status_code == second.status_code == 201
+    assert first.json() == second.json()
+
+
+def test_distinct_keys_are_not_coalesced():
+    app = build_app(handler_delay=0.01)
+
+    async def run():
+        return await asyncio.gather(*(fire(app, 1, str(uuid.uuid4())) for _ in range(5)))
+
+    asyncio.run(run())
+    assert app.state.calls == 5
+
+
+def test_waiter_gets_409_when_wait_times_out():
+    app = build_app(handler_delay=0.5, wait_timeout_seconds=0.05)
+    responses = asyncio.run(fire(app, 5, str(uuid.uuid4())))
+
+    assert app.state.calls == 1
+    assert sorted(r.status_code for r in responses) == [201, 409, 409, 409, 409]
+
+
+def test_streamed_response_is_captured_and_replayed():
+    app = build_app()
+    key = str(uuid.uuid4())
+
+    async def run():
+        first = await fire(app, 1, key, "/exports")
+        second = await fire(app, 1, key, "/exports")
+        return first[0], second[0]
+
+    first, second = asyncio.run(run())
+    assert app.state.calls == 1
+    assert second.content == first.content
+    assert second.headers["content-type"] == first.headers["content-type"]
+    assert second.headers["content-length"] == str(len(first.content))
+
+
+def test_keys_are_scoped_to_the_endpoint_and_the_request_body():
+    app = build_app()
+    key = str(uuid.uuid4())
+
+    async def run():
+        booked = (await fire(app, 1, key, json={"service": "cut"}))[0]
+        exported = (await fire(app, 1, key, "/exports"))[0]
+        replayed = (await fire(app, 1, key, json={"service": "cut"}))[0]
+        reused = (await fire(app, 1, key, json={"service": "colour"}))[0]
+        return booked, exported, replayed, reused
+
+    booked, exported, replayed, reused = asyncio.run(run())
+    # The same key on another route is another request
+    assert app.state.calls == 2 and exported.headers["content-type"].startswith("text/csv")
+    assert replayed.json() == booked.json() and booked.json()["request"] == '{"service":"cut"}'
+    assert "idempotency-request-fingerprint" not in replayed.headers
+    assert reused.status_code == 422 and reused.json()["status"] == "key_reused"
+
+
+def test_a_duplicate_with_another_body_is_refused_while_the_first_runs():
+    app = build_app(handler_delay=0.1)
+    key = str(uuid.uuid4())
+
+    async def run():
+        return await asyncio.gather(fire(app, 1, key, json={"service": "cut"}),
+                                    fire(app, 1, key, json={"service": "colour"}))
+
+    (first,), (second,) = asyncio.run(run())
+    assert app.state.calls == 1
+    assert sorted((first.status_code, second.status_code)) == [201, 422]
+
+
+def test_server_errors_are_not_stored():
+    app = build_app()
+    key = str(uuid.uuid4())
+
+    async def run():
+        await fire(app, 1, key, "/failing")
+        await fire(app, 1, key, "/failing")
+
+    asyncio.run(run())
+    assert app.state.calls == 2
+
+
+def test_requests_without_key_pass_through():
+    app = build_app()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.post("/bookings") for _ in range(3)]
+
+    responses = asyncio.run(run())
+    assert app.state.calls == 3
+    assert len({r.json()["booking_id"] for r in responses}) == 3
+
+
+def test_a_disconnected_duplicate_leaves_the_other_workers_response_alone(tmp_path):
+    # A store shared between workers, so the claim can be held elsewhere
+    store = SharedMemoryIdempotencyStore(path=str(tmp_path / "idempotency.shm"), slots=64, slot_size=256,
+                                         stripes=4)
+    app = build_app()
+    middleware = IdempotencyMiddleware(app, store=store, ttl_seconds=60, wait_timeout_seconds=5)
+    client_key = str(uuid.uuid4())
+    key = scoped_key("POST", "/bookings", client_key)
+    scope = {"type": "http", "method": "POST", "path": "/bookings", "raw_path": b"/bookings",
+             "query_string": b"", "headers": [(b"idempotency-key", client_key.encode())]}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def run():
+        # Another worker holds the claim and stores its response meanwhile
+        assert await store.claim(key, 30)
+        asyncio.get_running_loop().call_later(0.02, lambda: asyncio.ensure_future(
+            store.set(key, 201, b'{"booking_id": "b1"}', 60)))
+        try:
+            await middleware(scope, receive, send)
+        except OSError:
+            pass
+        return await store.get(key)
+
+    stored = asyncio.run(run())
+    store.close()
+    assert stored is not None and stored.response_body == b'{"booking_id": "b1"}'
+    assert app.state.calls == 0
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import random
+import tempfile
+
+from app.idempotency.shared_memory_store import SharedMemoryIdempotencyStore
+
+# Multi-process stress test for the shared-memory idempotency table: worker
+# processes race to claim the same keys, and every key must be claimed by
+# exactly one of them and read back identically by all of them.
+
+PROCESSES = 8
+KEYS = 2000
+
+
+def _worker(path, seed, results):
+    store = SharedMemoryIdempotencyStore(path=path, slots=8192, slot_size=256, stripes=64)
+    keys = [f"key-{i}" for i in range(KEYS)]
+    random.Random(seed).shuffle(keys)
+
+    claimed = []
+    for key in keys:
+        if store.claim_sync(key, ttl_seconds=60):
+            claimed.append(key)
+            store.set_sync(key, 201, f"{os.getpid()}:{key}".encode(), 60,
+                           ((b"content-type", b"text/plain"),))
+
+    seen = {}
+    for key in keys:
+        record = store.get_sync(key)
+        seen[key] = None if record is None else record.response_body
+    store.close()
+    results.put((claimed, seen))
+
+
+def test_each_key_is_claimed_by_exactly_one_process():
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "idempotency")
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_worker, args=(path, seed, results)) for seed in range(PROCESSES)]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=10)
+            assert worker.exitcode == 0
+
+    claimed = [key for keys, _ in outcomes for key in keys]
+    assert len(claimed) == KEYS
+    assert len(set(claimed)) == KEYS
+
+    # Every process reads the winner's response for every key
+    first_seen = outcomes[0][1]
+    assert all(body is not None for body in first_seen.values())
+    for _, seen in outcomes[1:]:
+        assert seen == first_seen
+
+
+def test_claim_is_released_by_delete_and_replaced_by_set():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SharedMemoryIdempotencyStore(path=os.path.join(tmp, "idempotency"), slots=64, stripes=4)
+        assert store.claim_sync("k", ttl_seconds=60)
+        assert not store.claim_sync("k", ttl_seconds=60)
+        assert store.get_sync("k") is None
+
+        assert store.delete_sync("k")
+        assert store.claim_sync("k", ttl_seconds=60)
+        assert store.set_sync("k", 201, b'{"ok":true}', 60)
+        assert store.get_sync("k").response_body == b'{"ok":true}'
+        assert not store.claim_sync("k", ttl_seconds=60)
+
+        # Expired slots can be claimed again
+        assert store.set_sync("old", 201, b"", -1)
+        assert store.claim_sync("old", ttl_seconds=60)
+        store.close()
@@ -0,0 +1,117 @@
+import asyncio
+
+from app.idempotency.lru_store import LRUIdempotencyStore, record_size
+from app.idempotency.memory_store import InMemoryIdempotencyStore
+from app.idempotency.sqlite_store import SQLiteIdempotencyStore
+
+# Tests of the in-memory, bounded in-memory (LRU) and SQLite idempotency backends.
+
+HEADERS = ((b"content-type", b"application/json"), (b"location", b"/bookings/b1"))
+
+
+def _lru(**config):
+    return LRUIdempotencyStore(**dict(dict(stripes=1, cleanup_interval_seconds=0), **config))
+
+
+def test_lru_evicts_least_recently_used_keys_to_stay_within_max_bytes():
+    store = _lru(max_bytes=3 * (200 + 2 + 100))
+
+    async def scenario():
+        for key in ("k1", "k2", "k3"):
+            assert await store.set(key, 201, b"x" * 100, 60)
+        assert await store.get("k1") is not None  # k2 is now the least recently used
+        assert await store.set("k4", 201, b"x" * 100, 60)
+        return [key for key in ("k1", "k2", "k3", "k4") if await store.get(key) is not None]
+
+    assert asyncio.run(scenario()) == ["k1", "k3", "k4"]
+    stats = store.stats()
+    assert stats["entries"] == 3 and stats["evictions"] == 1
+    assert stats["bytes"] == 3 * record_size(store._stripes[0].entries["k1"]) <= stats["max_bytes"]
+    assert stats["hits"] == 4 and stats["misses"] == 1
+
+
+def test_lru_byte_accounting_follows_overwrites_deletes_and_max_entries():
+    store = _lru(max_bytes=1024 * 1024, max_entries=2)
+
+    async def scenario():
+        await store.set("a", 201, b"x" * 10, 60, HEADERS)
+        await store.set("a", 201, b"x" * 500, 60, HEADERS)
+        assert store.nbytes == record_size(await store.get("a"))
+        await store.set("b", 201, b"y", 60)
+        await store.set("c", 201, b"z", 60)
+        assert len(store) == 2 and await store.get("a") is None
+        assert await store.delete("b") and await store.delete("c")
+
+    asyncio.run(scenario())
+    assert store.nbytes == 0 and store.stats()["evictions"] == 1
+
+
+def test_lru_rejects_responses_larger_than_a_stripe():
+    store = _lru(max_bytes=1000)
+
+    async def scenario():
+        assert not await store.set("huge", 201, b"x" * 2000, 60)
+        return await store.get("huge")
+
+    assert asyncio.run(scenario()) is None
+    assert store.stats()["rejections"] == 1 and store.nbytes == 0
+
+
+def test_lru_expiry_heap_stays_bounded_under_eviction():
+    store = _lru(max_bytes=64 * 1024, stripes=4)
+
+    async def scenario():
+        for i in range(20000):
+            await store.set(f"k{i}", 201, b"x" * 100, 60)
+        await store.set("short", 201, b"x", -1)
+        assert await store.purge_expired() == 1
+
+    asyncio.run(scenario())
+    live = len(store)
+    assert live < 300
+    assert sum(len(stripe.expiry_heap) for stripe in store._stripes) <= max(2 * live, 4 * 65)
+
+
+def test_sqlite_round_trips_responses_and_survives_reopening(tmp_path):
+    path = str(tmp_path / "idempotency.sqlite3")
+    store = SQLiteIdempotencyStore(path, cleanup_interval_seconds=0)
+
+    async def write():
+        assert await store.set("k1", 201, b'{"booking_id": "b1"}', 60, HEADERS)
+        assert await store.set("gone", 201, b"{}", -1)
+        assert await store.set("deleted", 201, b"{}", 60)
+        assert await store.delete("deleted") and not await store.delete("deleted")
+        assert await store.get("gone") is None
+        assert await store.purge_expired() == 1
+
+    asyncio.run(write())
+    store.close()
+
+    reopened = SQLiteIdempotencyStore(path, cleanup_interval_seconds=0)
+
+    async def read():
+        return await reopened.get("k1"), await reopened.get("deleted")
+
+    stored, deleted = asyncio.run(read())
+    assert deleted is None
+    assert stored.response_code == 201 and stored.response_body == b'{"booking_id": "b1"}'
+    assert stored.response_headers == HEADERS and stored.expires_at - stored.created_at == 60
+    assert reopened.stats() == {"entries": 1, "hits": 1, "misses": 1}
+    reopened.close()
+
+
+def test_claims_are_insert_if_absent_and_invisible_to_get(tmp_path):
+    stores = [InMemoryIdempotencyStore(cleanup_interval_seconds=0), _lru(max_bytes=1024 * 1024),
+              SQLiteIdempotencyStore(str(tmp_path / "idempotency.sqlite3"), cleanup_interval_seconds=0)]
+
+    async def scenario(store):
+        assert await store.claim("k1", 60) and not await store.claim("k1", 60)
+        assert await store.get("k1") is None
+        assert await store.set("k1", 201, b"{}", 60)
+        assert not await store.claim("k1", 60)  # a stored response is present too
+        assert (await store.get("k1")).response_code == 201
+        assert await store.claim("k2", -1) and await store.claim("k2", 60)  # the first claim expired
+        assert await store.delete("k2") and await store.claim("k2", 60)
+
+    for store in stores:
+        asyncio.run(scenario(store))
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from salon_events import decode_event
+from app.bookings.models import BookingRequest, BookingResponse
+from app.bookings import repository as repository_module
+from app.bookings.repository import InMemoryBookingRepository, SQLiteBookingRepository
+from app.bookings.service import BookingService
+from app.outbox.relay import OutboxRelay
+from app.outbox.store import InMemoryOutboxStore, OutboxEvent, SQLiteOutboxStore
+
+# Tests of the transactional outbox: bookings and their events are committed
+# together, and OutboxRelay publishes them in batches, in order per key,
+# retrying failed publishes with backoff.
+
+
+class FakeProducer:
+    """Records publishes; fails the first ``failures[key]`` publishes of a key"""
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.published = []
+
+    async def publish_encoded(self, domain, version, data, ordering_key=None):
+        await asyncio.sleep(0)
+        key = data.decode()
+        if self.failures.get(key.split(":")[0], 0) > 0:
+            self.failures[key.split(":")[0]] -= 1
+            raise RuntimeError("Pub/Sub unavailable")
+        self.published.append(key)
+        return str(len(self.published))
+
+
+def _booking(booking_id="b1"):
+    return BookingResponse(booking_id=booking_id, service_id="haircut", customer_name="Ana",
+                           date="2024-05-01", time="10:00", status="confirmed")
+
+
+def _events(key, n):
+    return [OutboxEvent("core-api", "1", key, f"{key}:{i}".encode()) for i in range(n)]
+
+
+def _stores():
+    path = os.path.join(tempfile.mkdtemp(), "outbox.sqlite3")
+    return [InMemoryOutboxStore(), SQLiteOutboxStore(path)]
+
+
+def test_sqlite_booking_and_events_commit_together():
+    path = os.path.join(tempfile.mkdtemp(), "bookings.sqlite3")
+    repository = SQLiteBookingRepository(path)
+
+    async def scenario():
+        await repository.add(_booking("b1"), _events("b1", 2))
+        # A duplicate booking ID fails the insert, and takes its events with it
+        with pytest.raises(Exception):
+            await repository.add(_booking("b1"), _events("dup", 3))
+        return await repository.get("b1")
+
+    assert asyncio.run(scenario()) is not None
+    assert repository.outbox.stats()["pending"] == 2
+    assert [record.ordering_key for record in repository.outbox.claim(10, 60)] == ["b1", "b1"]
+    repository.close()
+
+
+def test_bookings_and_their_outbox_survive_a_restart_by_default(monkeypatch):
+    monkeypatch.setattr(repository_module, "BOOKING_SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "b.sqlite3"))
+    repository = repository_module.create_booking_repository()
+    asyncio.run(repository.add(_booking("b1"), _events("b1", 1)))
+    repository.close()
+
+    restarted = repository_module.create_booking_repository()
+    assert isinstance(restarted, SQLiteBookingRepository)
+    assert asyncio.run(restarted.get("b1")) is not None and restarted.outbox.stats()["pending"] == 1
+    restarted.close()
+
+
+def test_service_writes_the_event_to_the_outbox_not_pubsub():
+    repository = InMemoryBookingRepository()
+    service = BookingService(repository)
+    request = BookingRequest(service_id="haircut", customer_name="Ana", date="2024-05-01", time="10:00")
+
+    created = asyncio.run(service.create_booking(request))
+
+    [record] = repository.outbox.claim(10, 60)
+    event = decode_event(record.data)
+    assert event["type"] == "booking_created"
+    assert event["payload"]["booking_id"] == created.booking_id
+    assert record.ordering_key == f"default/{created.booking_id}"
+
+
+@pytest.mark.parametrize("store", _stores())
+def test_relay_publishes_in_batches(store):
+    for key in range(50):
+        store.append(_events(f"k{key}", 3))
+    producer = FakeProducer()
+    relay = OutboxRelay(store, producer, batch_size=100)
+
+    async def drain():
+        rounds = 0
+        while await relay.run_once():
+            rounds += 1
+        return rounds
+
+    # A round claims 100 events and publishes the keys among them concurrently
+    assert asyncio.run(drain()) == 2
+    assert len(producer.published) == 150
+    assert store.stats()["pending"] == 0 and store.stats()["published"] == 150
+    for key in range(50):
+        assert [p for p in producer.published if p.startswith(f"k{key}:")] == [f"k{key}:{i}" for i in range(3)]
+
+
+@pytest.mark.parametrize("store", _stores())
+def test_failed_publish_holds_its_key_and_retries_in_order(store):
+    store.append(_events("a", 3) + _events("b", 3))
+    producer = FakeProducer(failures={"a": 2})
+    relay = OutboxRelay(store, producer, min_backoff=0.01, max_backoff=0.02, poll_interval=0.005)
+
+    async def run():
+        relay.start()
+        while store.stats()["pending"]:
+            await asyncio.sleep(0.005)
+        await relay.stop(timeout=1)
+
+    asyncio.run(run())
+
+    # "b" is not held up by "a", and "a" is published in order once it recovers
+    assert [p for p in producer.published if p.startswith("a")] == ["a:0", "a:1", "a:2"]
+    assert [p for p in producer.published if p.startswith("b")] == ["b:0", "b:1", "b:2"]
+    assert producer.published.index("b:2") < producer.published.index("a:0")
+    assert relay.failed == 2 and relay.published == 6
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+
+from app.circuit_breaker.circuit_breaker import OPEN, CircuitBreakerOpen, with_circuit_breaker
+from app.circuit_breaker.retry import RetryBudget, RetryPolicy, decorrelated_jitter
+
+# Tests of retries drawn from a per-dependency budget, and of hedged requests.
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _policy(budget=None, **config):
+    budget = budget or RetryBudget("test", ratio=0.1, min_per_second=10, max_tokens=100)
+    return RetryPolicy("test", **dict(dict(base_delay=0.001, max_delay=0.002, budget=budget), **config))
+
+
+def test_decorrelated_jitter_stays_between_the_base_and_three_times_the_last_delay():
+    delay = 0.05
+    for _ in range(1000):
+        previous, delay = delay, decorrelated_jitter(delay, base=0.05, cap=2.0)
+        assert 0.05 <= delay <= min(2.0, previous * 3)
+    assert decorrelated_jitter(1.0, base=0.05, cap=2.0, uniform=max) == 2.0
+
+
+def test_budget_allows_retries_in_proportion_to_calls():
+    clock = _Clock()
+    budget = RetryBudget("test", ratio=0.2, min_per_second=1, max_tokens=10, clock=clock)
+    assert budget.withdraw() and not budget.withdraw()  # the reserve, one per second
+    for _ in range(20):
+        budget.deposit()
+    assert sum(budget.withdraw() for _ in range(10)) == 4
+    clock.now += 100
+    assert sum(budget.withdraw() for _ in range(20)) == 10  # at most max_tokens saved up
+    assert budget.stats()["retries_denied"] == 1 + 6 + 10
+
+
+def test_failed_attempts_are_retried_until_one_succeeds():
+    failures = [ConnectionError("reset"), TimeoutError("slow")]
+    attempts = []
+
+    @_policy()
+    async def lookup(service_id):
+        attempts.append(service_id)
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert asyncio.run(lookup("cut")) == "ok"
+    assert attempts == ["cut"] * 3
+    assert lookup.retry_policy.budget.stats()["retries"] == 2
+
+
+def test_an_outage_costs_a_share_of_the_traffic_not_a_multiple():
+    budget = RetryBudget("test", ratio=0.1, min_per_second=0, max_tokens=100)
+    attempts = [0]
+
+    @_policy(budget, max_attempts=3, retry_on=ConnectionError)
+    def book():
+        attempts[0] += 1
+        raise ConnectionError("down")
+
+    for _ in range(200):
+        with pytest.raises(ConnectionError):
+            book()
+    # 200 calls, 20 tokens deposited; naive retries would make 600 attempts
+    assert attempts[0] <= 200 + 20
+    assert budget.retries <= 20 and budget.retries_denied > 0
+
+    @_policy(budget, retry_on=ConnectionError)
+    def validate():
+        attempts[0] += 1
+        raise ValueError("bad request")
+
+    before = attempts[0]
+    with pytest.raises(ValueError):
+        validate()
+    assert attempts[0] == before + 1
+
+
+def test_retries_stop_once_the_circuit_opens():
+    attempts = [0]
+
+    @with_circuit_breaker("test-retry-pricing", retry=_policy(max_attempts=10), minimum_calls=3)
+    async def get_price():
+        attempts[0] += 1
+        raise ConnectionError("down")
+
+    with pytest.raises(CircuitBreakerOpen):
+        asyncio.run(get_price())
+    assert attempts[0] == 3 and get_price.circuit_breaker.state == OPEN
+
+
+def test_hedged_requests_answer_with_the_first_success_and_cancel_the_rest():
+    delays = [0.5, 0.001]
+    cancelled = []
+
+    @_policy(hedge_after=0.02)
+    async def get_catalog():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    start = time.monotonic()
+    assert asyncio.run(get_catalog()) == 0.001
+    assert time.monotonic() - start < 0.3
+    assert cancelled == [0.5]
+    stats = get_catalog.retry_policy.budget.stats()
+    assert stats["hedges"] == 1 and stats["hedges_won"] == 1
+
+
+def test_hedges_draw_on_the_budget_and_need_async_functions():
+    budget = RetryBudget("test", ratio=0, min_per_second=0, max_tokens=0)
+
+    @_policy(budget, hedge_after=0.001)
+    async def get_catalog():
+        await asyncio.sleep(0.02)
+        return "catalog"
+
+    assert asyncio.run(get_catalog()) == "catalog"
+    assert budget.hedges == 0 and budget.retries_denied == 1
+
+    with pytest.raises(ValueError):
+        _policy(hedge_after=0.01)(lambda: None)